@@ -0,0 +1,221 @@
+from uuid import UUID, uuid4
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError
+from . import database
+from .database import PromocodeDB, PromocodeCategoryDB, async_db_session
+from .models import Promocode, PromocodeStatus
+from .promocode_repo import PROMOCODE_REPO_BACKEND, PromocodeRepo, create_promocode_repo
+from .promocode_sql_repo import (
+    CODE_LOOKUP_CHUNK, SqlPromocodeRepo, active_promocodes_page_statement, active_promocodes_statement, apply_update,
+    consume_usage_statement, expire_due_statement, prefix_search_statement, user_promocodes_page_statement
+)
+
+
+def create_async_promocode_repo(backend: str = PROMOCODE_REPO_BACKEND, memory_repo=None):
+    if backend == "sql":
+        return AsyncSqlPromocodeRepo()
+    if backend in ("memory", "compact", "shared"):
+        # Общий репозиторий с синхронным сервисом, чтобы данные не расходились
+        return AsyncPromocodeRepo(memory_repo or create_promocode_repo(backend))
+    raise ValueError(f"Неизвестный тип репозитория промокодов: {backend}")
+
+
+class AsyncSqlPromocodeRepo:
+    """Асинхронный репозиторий поверх PromocodeDB: запросы не занимают потоки пула"""
+
+    async def init(self):
+        await database.init_async_db()
+
+    async def get_by_code(self, code: str) -> Optional[Promocode]:
+        async with async_db_session() as db:
+            row = (await db.scalars(select(PromocodeDB).where(PromocodeDB.code == code))).one_or_none()
+            return self._to_model(row) if row else None
+
+    async def get_many_by_codes(self, codes: Iterable[str]) -> Dict[str, Promocode]:
+        codes = list(codes)
+        if not codes:
+            return {}
+        async with async_db_session() as db:
+            rows = await db.scalars(select(PromocodeDB).where(PromocodeDB.code.in_(codes)))
+            return {row.code: self._to_model(row) for row in rows}
+
+    async def get_user_promocodes(self, user_id: UUID) -> List[Promocode]:
+        async with async_db_session() as db:
+            rows = await db.scalars(
+                select(PromocodeDB).where(PromocodeDB.user_id == user_id).order_by(PromocodeDB.created_at)
+            )
+            return [self._to_model(row) for row in rows]
+
+    async def get_user_promocodes_page(self, user_id: UUID, after: Optional[str] = None,
+                                       limit: int = 100) -> List[Promocode]:
+        async with async_db_session() as db:
+            rows = await db.scalars(user_promocodes_page_statement(user_id, after, limit))
+            return [self._to_model(row) for row in rows]
+
+    async def add_promocode(self, promocode: Promocode) -> Promocode:
+        async with async_db_session() as db:
+            db.add(self._to_row(promocode))
+            await db.commit()
+        return promocode
+
+    async def add_promocodes(self, promocodes: Iterable[Promocode]) -> List[Promocode]:
+        """Пакетная вставка как в SqlPromocodeRepo.add_promocodes: существующие коды пропускаются"""
+        promocodes = list(promocodes)
+        async with async_db_session() as db:
+            while True:
+                codes = [p.code for p in promocodes]
+                existing = set()
+                for start in range(0, len(codes), CODE_LOOKUP_CHUNK):
+                    chunk = codes[start:start + CODE_LOOKUP_CHUNK]
+                    existing.update(await db.scalars(select(PromocodeDB.code).where(PromocodeDB.code.in_(chunk))))
+                fresh = [p for p in promocodes if p.code not in existing]
+                if not fresh:
+                    return []
+                try:
+                    await db.execute(insert(PromocodeDB), [self._to_values(p) for p in fresh])
+                    categories = [
+                        {"promocode_id": p.id, "category": category}
+                        for p in fresh for category in sorted(set(p.applicable_categories))
+                    ]
+                    if categories:
+                        await db.execute(insert(PromocodeCategoryDB), categories)
+                    await db.commit()
+                    return fresh
+                except IntegrityError:
+                    await db.rollback()
+
+    async def create_promocode(self, promocode_data: dict) -> Promocode:
+        promocode = Promocode(
+            id=uuid4(),
+            usage_count=0,
+            status=PromocodeStatus.ACTIVE,
+            created_at=datetime.now(),
+            **promocode_data
+        )
+        return await self.add_promocode(promocode)
+
+    async def update_promocode(self, promocode: Promocode) -> Promocode:
+        async with async_db_session() as db:
+            row = (await db.scalars(select(PromocodeDB).where(PromocodeDB.code == promocode.code))).one()
+            apply_update(row, promocode)
+            await db.commit()
+        return promocode
+
+    async def consume_usage(self, code: str, now: Optional[datetime] = None) -> Optional[Promocode]:
+        async with async_db_session() as db:
+            row = (await db.scalars(consume_usage_statement(code, now or datetime.now()))).one_or_none()
+            if row is None:
+                await db.commit()
+                return None
+            # Категории не входят в RETURNING: догружаем их до фиксации
+            await db.refresh(row, ["categories"])
+            result = self._to_model(row)
+            await db.commit()
+            return result
+
+    async def get_active_promocodes(self) -> List[Promocode]:
+        async with async_db_session() as db:
+            rows = await db.scalars(active_promocodes_statement(datetime.now()))
+            return [self._to_model(row) for row in rows]
+
+    async def get_active_promocodes_page(self, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        async with async_db_session() as db:
+            rows = await db.scalars(active_promocodes_page_statement(datetime.now(), after, limit))
+            return [self._to_model(row) for row in rows]
+
+    async def search_by_prefix(self, prefix: str, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        async with async_db_session() as db:
+            rows = await db.scalars(prefix_search_statement(prefix, after, limit))
+            return [self._to_model(row) for row in rows]
+
+    async def expire_due(self, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> List[str]:
+        async with async_db_session() as db:
+            expired = (await db.scalars(expire_due_statement(now or datetime.now(), batch_size))).all()
+            await db.commit()
+            return list(expired)
+
+    async def count(self) -> int:
+        async with async_db_session() as db:
+            return await db.scalar(select(func.count()).select_from(PromocodeDB))
+
+    async def iter_codes(self, chunk_size: int = 10000) -> AsyncIterator[str]:
+        async with async_db_session() as db:
+            result = await db.stream_scalars(select(PromocodeDB.code).execution_options(yield_per=chunk_size))
+            async for code in result:
+                yield code
+
+    code_mark = SqlPromocodeRepo.code_mark
+
+    async def iter_codes_since(self, mark: datetime, chunk_size: int = 10000) -> AsyncIterator[str]:
+        statement = select(PromocodeDB.code).where(PromocodeDB.updated_at > mark)
+        async with async_db_session() as db:
+            result = await db.stream_scalars(statement.execution_options(yield_per=chunk_size))
+            async for code in result:
+                yield code
+
+    _to_model = staticmethod(SqlPromocodeRepo._to_model)
+    _to_row = staticmethod(SqlPromocodeRepo._to_row)
+    _to_values = staticmethod(SqlPromocodeRepo._to_values)
+
+
+class AsyncPromocodeRepo:
+    """Асинхронный интерфейс к репозиторию в памяти.
+
+    Операции в памяти не делают ввода-вывода и выполняются за микросекунды,
+    поэтому вызываются прямо в цикле событий, без пула потоков.
+    """
+
+    def __init__(self, repo: PromocodeRepo):
+        self.repo = repo
+
+    async def init(self):
+        pass
+
+    async def get_by_code(self, code: str) -> Optional[Promocode]:
+        return self.repo.get_by_code(code)
+
+    async def get_many_by_codes(self, codes: Iterable[str]) -> Dict[str, Promocode]:
+        return self.repo.get_many_by_codes(codes)
+
+    async def get_user_promocodes(self, user_id: UUID) -> List[Promocode]:
+        return self.repo.get_user_promocodes(user_id)
+
+    async def get_user_promocodes_page(self, user_id: UUID, after: Optional[str] = None,
+                                       limit: int = 100) -> List[Promocode]:
+        return self.repo.get_user_promocodes_page(user_id, after, limit)
+
+    async def add_promocode(self, promocode: Promocode) -> Promocode:
+        return self.repo.add_promocode(promocode)
+
+    async def add_promocodes(self, promocodes: Iterable[Promocode]) -> List[Promocode]:
+        return self.repo.add_promocodes(promocodes)
+
+    async def create_promocode(self, promocode_data: dict) -> Promocode:
+        return self.repo.create_promocode(promocode_data)
+
+    async def update_promocode(self, promocode: Promocode) -> Promocode:
+        return self.repo.update_promocode(promocode)
+
+    async def consume_usage(self, code: str, now: Optional[datetime] = None) -> Optional[Promocode]:
+        return self.repo.consume_usage(code, now)
+
+    async def get_active_promocodes(self) -> List[Promocode]:
+        return self.repo.get_active_promocodes()
+
+    async def get_active_promocodes_page(self, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        return self.repo.get_active_promocodes_page(after, limit)
+
+    async def search_by_prefix(self, prefix: str, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        return self.repo.search_by_prefix(prefix, after, limit)
+
+    async def expire_due(self, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> List[str]:
+        return self.repo.expire_due(now, batch_size)
+
+    async def count(self) -> int:
+        return self.repo.count()
+
+    async def iter_codes(self) -> AsyncIterator[str]:
+        for code in self.repo.iter_codes():
+            yield code
@@ -0,0 +1,151 @@
+import json
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Dict, Optional
+from uuid import UUID
+from .models import (
+    CreatePromocodeRequest, ValidatePromocodeRequest, ValidatePromocodeBatchRequest, ApplyPromocodeRequest,
+    BestPromocodeRequest
+)
+from .async_promocode_repo import create_async_promocode_repo
+from .async_promocode_service import AsyncPromocodeService
+from .promocode_compact_repo import CompactPromocodeRepo
+from .promocode_metrics import PROMOCODE_METRICS, ValidationMetrics, registry
+from .promocode_repo import PromocodeRepo
+from .promocode_shared_repo import SharedPromocodeRepo
+from .promocode_router import ListingFormat, PageLimit, promocode_service as sync_promocode_service
+from .promocode_service import PROMOCODE_BLOOM_FILTER, PROMOCODE_PAGE_SIZE
+from .promocode_write_behind import WriteBehindPromocodeRepo
+
+# Асинхронные обработчики основного пути запроса; остальные маршруты
+# обслуживает синхронный роутер, подключенный следом
+router = APIRouter(prefix="/api/v1/promocodes", tags=["promocodes"])
+
+if isinstance(sync_promocode_service.repo, WriteBehindPromocodeRepo):
+    # Асинхронный SQL-репозиторий списывал бы применения мимо счетчиков в памяти
+    raise RuntimeError("PROMOCODE_WRITE_BEHIND не поддерживается вместе с PROMOCODE_ASYNC")
+
+# Хранилище в памяти процесса - общее с синхронным роутером, вместе с ним и фильтр Блума
+shared_repo = isinstance(sync_promocode_service.repo, (PromocodeRepo, CompactPromocodeRepo, SharedPromocodeRepo))
+
+promocode_service = AsyncPromocodeService(
+    repo=create_async_promocode_repo(memory_repo=sync_promocode_service.repo if shared_repo else None),
+    use_code_filter=PROMOCODE_BLOOM_FILTER,
+    filter_owner=sync_promocode_service if shared_repo else None,
+    metrics=ValidationMetrics(registry) if PROMOCODE_METRICS else None,
+    # Одна статистика с синхронным роутером: /{promo_code}/stats обслуживает он
+    usage_stats=sync_promocode_service.usage_stats
+)
+
+
+def ndjson_response(rows: AsyncIterator[Dict]) -> StreamingResponse:
+    """Построчная выдача из асинхронного генератора"""
+    async def lines():
+        async for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+@router.post("/validate")
+async def validate_promocode(request: ValidatePromocodeRequest):
+    """Валидация промокода"""
+    try:
+        return await promocode_service.validate_promocode(request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при валидации промокода: {str(e)}")
+
+
+@router.post("/validate/batch")
+async def validate_promocodes_batch(request: ValidatePromocodeBatchRequest):
+    """Пакетная валидация промокодов для корзины и предпросмотра заказа"""
+    try:
+        return {"results": await promocode_service.validate_promocodes(request.items)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при валидации промокодов: {str(e)}")
+
+
+@router.post("/best")
+async def find_best_promocodes(request: BestPromocodeRequest):
+    """Самые выгодные промокоды пользователя для корзины, по убыванию скидки"""
+    try:
+        return await promocode_service.find_best_promocodes(request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при подборе промокода: {str(e)}")
+
+
+@router.post("/apply")
+async def apply_promocode(request: ApplyPromocodeRequest):
+    """Применение промокода к заказу"""
+    try:
+        return await promocode_service.apply_promocode(request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при применении промокода: {str(e)}")
+
+
+@router.post("/")
+async def create_promocode(request: CreatePromocodeRequest):
+    """Создание нового промокода"""
+    try:
+        return await promocode_service.create_promocode(request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при создании промокода: {str(e)}")
+
+
+@router.get("/user/{user_id}")
+async def get_user_promocodes(user_id: UUID, limit: Optional[int] = PageLimit, cursor: Optional[str] = None,
+                              format: str = ListingFormat):
+    """Получение промокодов пользователя"""
+    try:
+        if format == "ndjson":
+            return ndjson_response(promocode_service.iter_user_promocodes(user_id))
+        if limit is not None or cursor is not None:
+            return await promocode_service.get_user_promocodes_page(user_id, cursor, limit or PROMOCODE_PAGE_SIZE)
+        return await promocode_service.get_user_promocodes(user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении промокодов: {str(e)}")
+
+
+@router.get("/active")
+async def get_active_promocodes(limit: Optional[int] = PageLimit, cursor: Optional[str] = None,
+                                format: str = ListingFormat):
+    """Получение всех активных промокодов"""
+    try:
+        if format == "ndjson":
+            return ndjson_response(promocode_service.iter_active_promocodes())
+        if limit is not None or cursor is not None:
+            return await promocode_service.get_active_promocodes_page(cursor, limit or PROMOCODE_PAGE_SIZE)
+        return await promocode_service.get_all_active_promocodes()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении активных промокодов: {str(e)}")
+
+
+@router.get("/search")
+async def search_promocodes(prefix: str = Query(..., min_length=1, max_length=64), limit: Optional[int] = PageLimit,
+                            cursor: Optional[str] = None):
+    """Поиск промокодов по началу кода; объявлен здесь, иначе путь занял бы /{promo_code}"""
+    try:
+        return await promocode_service.search_promocodes(prefix, cursor, limit or PROMOCODE_PAGE_SIZE)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при поиске промокодов: {str(e)}")
+
+
+@router.get("/{promo_code}")
+async def get_promocode_info(promo_code: str):
+    """Получение информации о промокоде"""
+    try:
+        promocode_info = await promocode_service.get_promocode_info(promo_code)
+        if not promocode_info:
+            raise HTTPException(status_code=404, detail="Промокод не найден")
+
+        return promocode_info
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении информации о промокоде: {str(e)}")
\ No newline at end of file
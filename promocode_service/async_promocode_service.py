@@ -0,0 +1,261 @@
+import asyncio
+import time
+from uuid import UUID, uuid4
+from typing import AsyncIterator, Dict, List, Optional, Set
+from .models import (
+    Promocode, CreatePromocodeRequest, ValidatePromocodeRequest, ApplyPromocodeRequest, BestPromocodeRequest
+)
+from .promocode_idempotency import IdempotencyStore
+from .promocode_metrics import ValidationMetrics
+from .promocode_bulk import RESERVED_PREFIX
+from .promocode_signed import SIGNED_COUNTER_OWNER, UNLIMITED_USAGES
+from .promocode_usage_stats import UsageStats
+from .async_promocode_repo import create_async_promocode_repo
+from .bloom_filter import BloomFilter
+from .promocode_service import (
+    PROMOCODE_BLOOM_ERROR_RATE, PROMOCODE_PAGE_SIZE, PROMOCODE_STREAM_CHUNK, PromocodeService, decode_cursor
+)
+
+BLOOM_REBUILD_CHUNK = 10000
+
+
+class AsyncPromocodeService(PromocodeService):
+    """Асинхронная версия сервиса: те же проверки, репозиторий с await.
+
+    Проверки условий и расчет скидки работают только в памяти и
+    наследуются от PromocodeService без изменений.
+    """
+
+    def __init__(self, repo=None, use_code_filter: bool = False, applied_orders: Optional[IdempotencyStore] = None,
+                 metrics: Optional[ValidationMetrics] = None, usage_stats: Optional[UsageStats] = None,
+                 filter_owner: Optional[PromocodeService] = None):
+        # Синхронный сервис с тем же хранилищем: фильтр Блума один на двоих,
+        # иначе коды из его маршрутов (/generate, /import) здесь были бы "не найдены"
+        self.filter_owner = filter_owner
+        super().__init__(
+            repo=repo if repo is not None else create_async_promocode_repo(), use_code_filter=False,
+            applied_orders=applied_orders, metrics=metrics, usage_stats=usage_stats
+        )
+        self.use_code_filter = use_code_filter and filter_owner is None
+        self._background_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def code_filter(self) -> Optional[BloomFilter]:
+        if self.filter_owner is not None:
+            return self.filter_owner.code_filter
+        return self._code_filter
+
+    @code_filter.setter
+    def code_filter(self, value: Optional[BloomFilter]):
+        self._code_filter = value
+
+    async def start(self):
+        """Создание таблиц и сборка фильтра Блума при старте приложения"""
+        await self.repo.init()
+        if self.use_code_filter:
+            await self.rebuild_code_filter()
+
+    async def rebuild_code_filter(self):
+        if self.filter_owner is not None:
+            await asyncio.to_thread(self.filter_owner.rebuild_code_filter)
+            return
+        if not self._begin_filter_rebuild():
+            return
+        try:
+            mark = self._code_mark()
+            fresh = BloomFilter(self._filter_capacity(await self.repo.count()), PROMOCODE_BLOOM_ERROR_RATE)
+            chunk: List[str] = []
+            async for code in self.repo.iter_codes():
+                chunk.append(code)
+                if len(chunk) >= BLOOM_REBUILD_CHUNK:
+                    fresh.update(chunk)
+                    chunk = []
+            fresh.update(chunk)
+        except Exception:
+            self._finish_filter_rebuild(None)
+            raise
+        self._finish_filter_rebuild(fresh, mark)
+
+    async def refresh_code_filter(self):
+        if self.filter_owner is not None:
+            await asyncio.to_thread(self.filter_owner.refresh_code_filter)
+            return
+        if self.code_filter is None:
+            return
+        if self._filter_mark is None:
+            await self.rebuild_code_filter()
+            return
+        mark = self._code_mark()
+        codes = [code async for code in self.repo.iter_codes_since(self._filter_mark)]
+        if self._remember_codes(codes):
+            await self.rebuild_code_filter()
+            return
+        self._filter_mark = mark
+
+    def _remember_codes(self, codes: List[str]) -> bool:
+        if self.filter_owner is not None:
+            # Блокировка и коды на время пересборки - владельца фильтра
+            return self.filter_owner._remember_codes(codes)
+        return super()._remember_codes(codes)
+
+    async def get_promocode(self, code: str) -> Optional[Promocode]:
+        if self.code_filter is not None and code not in self.code_filter:
+            return None
+        return await self.repo.get_by_code(code)
+
+    async def _signed_promocode(self, code: str, user_id: Optional[UUID]) -> Optional[Promocode]:
+        promocode = self.signed_codes.decode(code, user_id)
+        if promocode is None or promocode.max_usages == UNLIMITED_USAGES:
+            return promocode
+        return self._with_counter(promocode, await self.repo.get_by_code(code))
+
+    async def get_promocode_info(self, code: str) -> Optional[Dict]:
+        if self._is_signed(code):
+            promocode = await self._signed_promocode(code, None)
+        else:
+            promocode = await self.get_promocode(code)
+        return self._promocode_info_view(promocode) if promocode else None
+
+    async def validate_promocode(self, request: ValidatePromocodeRequest) -> Dict:
+        metrics = self.metrics
+        if metrics is not None and next(metrics.samples):
+            return self._counted(await self._validate_timed(request), request.promo_code)
+        if self._is_signed(request.promo_code):
+            result = self._validate_loaded(await self._signed_promocode(request.promo_code, request.user_id), request)
+        else:
+            result = self._validate_loaded(await self.get_promocode(request.promo_code), request)
+        if not result["valid"]:
+            self._counted(result, request.promo_code)
+        return result
+
+    async def _validate_timed(self, request: ValidatePromocodeRequest) -> Dict:
+        marks = [time.perf_counter()]
+        if self._is_signed(request.promo_code):
+            promocode = await self._signed_promocode(request.promo_code, request.user_id)
+        else:
+            promocode = await self.get_promocode(request.promo_code)
+        marks.append(time.perf_counter())
+        return self._validate_loaded_timed(promocode, request, marks)
+
+    async def validate_promocodes(self, requests: List[ValidatePromocodeRequest]) -> List[Dict]:
+        codes = {r.promo_code for r in requests if not self._is_signed(r.promo_code)}
+        if self.code_filter is not None:
+            codes = {code for code in codes if code in self.code_filter}
+        codes |= {r.promo_code for r in requests if self._is_signed(r.promo_code)}
+        promocodes = await self.repo.get_many_by_codes(codes) if codes else {}
+        results = [self._validate_loaded(self._loaded_for(r, promocodes), r) for r in requests]
+        if self.metrics is not None or self.usage_stats is not None:
+            for request, result in zip(requests, results):
+                self._counted(result, request.promo_code)
+        return results
+
+    async def find_best_promocodes(self, request: BestPromocodeRequest) -> Dict:
+        return self._rank_promocodes(await self.repo.get_user_promocodes(request.user_id), request)
+
+    async def apply_promocode(self, request: ApplyPromocodeRequest) -> Dict:
+        # Пользователь в ключе: чужой запрос с тем же заказом не получает записанный результат
+        key = (request.promo_code, request.user_id, request.order_id)
+        async with self.applied_orders.async_lock(key):
+            recorded = await self._applied_order(self.applied_orders.get, key)
+            if recorded is None:
+                recorded = await self._applied_order(self.applied_orders.claim, key)
+            if recorded is not None:
+                return recorded
+            try:
+                result = await self._apply(request)
+            except BaseException:
+                await self._applied_order(self.applied_orders.release, key)
+                raise
+            if result.get("status") == "applied":
+                await self._applied_order(self.applied_orders.put, key, result)
+                self._record_applied(request.promo_code)
+            else:
+                await self._applied_order(self.applied_orders.release, key)
+            return result
+
+    async def _applied_order(self, method, *args):
+        # Постоянное хранилище результатов синхронное: обращение к нему уходит в поток
+        if self.applied_orders.backing is None:
+            return method(*args)
+        return await asyncio.to_thread(method, *args)
+
+    async def _apply(self, request: ApplyPromocodeRequest) -> Dict:
+        validation_result = await self.validate_promocode(self._apply_validation_request(request))
+        if not validation_result["valid"]:
+            return validation_result
+
+        if self._is_signed(request.promo_code):
+            promocode = self.signed_codes.decode(request.promo_code, request.user_id)
+            if promocode.max_usages == UNLIMITED_USAGES:
+                return self._applied_response(promocode, validation_result, request)
+            counter = promocode.model_copy(update={"id": uuid4(), "user_id": SIGNED_COUNTER_OWNER})
+            await self.repo.add_promocodes([counter])
+
+        promocode = await self.repo.consume_usage(request.promo_code)
+        return self._applied_response(promocode, validation_result, request)
+
+    async def create_promocode(self, request: CreatePromocodeRequest) -> Dict:
+        if request.code.startswith(self.signed_prefix):
+            return {"status": "error", "message": RESERVED_PREFIX.format(self.signed_prefix)}
+        existing_promocode = await self.get_promocode(request.code)
+        if existing_promocode:
+            return {"status": "error", "message": "Промокод с таким кодом уже существует"}
+
+        promocode = await self.repo.create_promocode(request.dict())
+        if self._remember_code(promocode.code):
+            await self.rebuild_code_filter()
+        return self._created_response(promocode)
+
+    async def get_user_promocodes(self, user_id: UUID) -> List[Dict]:
+        promocodes = await self.repo.get_user_promocodes(user_id)
+        return [self._user_promocode_view(promocode) for promocode in promocodes]
+
+    async def get_all_active_promocodes(self) -> List[Dict]:
+        active_promocodes = await self.repo.get_active_promocodes()
+        return [self._active_promocode_view(promocode) for promocode in self._listed(active_promocodes)]
+
+    async def get_user_promocodes_page(self, user_id: UUID, cursor: Optional[str] = None,
+                                       limit: int = PROMOCODE_PAGE_SIZE) -> Dict:
+        promocodes = await self.repo.get_user_promocodes_page(user_id, decode_cursor(cursor), limit)
+        return self._page([self._user_promocode_view(p) for p in promocodes], promocodes, limit)
+
+    async def get_active_promocodes_page(self, cursor: Optional[str] = None, limit: int = PROMOCODE_PAGE_SIZE) -> Dict:
+        promocodes = await self.repo.get_active_promocodes_page(decode_cursor(cursor), limit)
+        return self._page([self._active_promocode_view(p) for p in self._listed(promocodes)], promocodes, limit)
+
+    async def search_promocodes(self, prefix: str, cursor: Optional[str] = None,
+                                limit: int = PROMOCODE_PAGE_SIZE) -> Dict:
+        promocodes = await self.repo.search_by_prefix(prefix, decode_cursor(cursor), limit)
+        return self._page([self._search_view(p) for p in self._listed(promocodes)], promocodes, limit)
+
+    async def iter_user_promocodes(self, user_id: UUID) -> AsyncIterator[Dict]:
+        after = None
+        while True:
+            promocodes = await self.repo.get_user_promocodes_page(user_id, after, PROMOCODE_STREAM_CHUNK)
+            for promocode in promocodes:
+                yield self._user_promocode_view(promocode)
+            if len(promocodes) < PROMOCODE_STREAM_CHUNK:
+                return
+            after = promocodes[-1].code
+
+    async def iter_active_promocodes(self) -> AsyncIterator[Dict]:
+        after = None
+        while True:
+            promocodes = await self.repo.get_active_promocodes_page(after, PROMOCODE_STREAM_CHUNK)
+            for promocode in self._listed(promocodes):
+                yield self._active_promocode_view(promocode)
+            if len(promocodes) < PROMOCODE_STREAM_CHUNK:
+                return
+            after = promocodes[-1].code
+
+    async def drain(self):
+        """Ожидание фоновых записей статусов (для тестов и остановки приложения)"""
+        if self._background_tasks:
+            await asyncio.gather(*self._background_tasks, return_exceptions=True)
+
+    def _persist_status(self, promocode: Promocode):
+        # Проверки синхронные, поэтому смена статуса (EXPIRED/USED) пишется
+        # фоновой задачей; результат валидации от нее не зависит
+        task = asyncio.get_running_loop().create_task(self.repo.update_promocode(promocode))
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
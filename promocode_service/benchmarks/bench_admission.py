@@ -0,0 +1,78 @@
+"""Распродажа: списки активных кодов против checkout в одном пуле потоков.
+
+Роутер с синтетическим хранилищем вызывается через ASGI-транспорт httpx без
+сети; LISTING_CLIENTS клиентов без пауз запрашивают /active (получив 503,
+ждут 50 мс), CHECKOUT_CLIENTS клиентов валидируют коды. Сравниваются
+задержки /validate без контроля допуска и с ним. Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_admission [секунд]
+"""
+import asyncio
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI
+
+from promocode_service import promocode_router
+from promocode_service.benchmarks.datasets import build_repo, validate_requests
+from promocode_service.promocode_admission import CRITICAL, LOW, NORMAL, AdmissionMiddleware, Lane
+from promocode_service.promocode_service import PromocodeService
+
+SECONDS = float(sys.argv[1]) if len(sys.argv) > 1 else 10.0
+CODES = 20_000
+LISTING_CLIENTS = 16
+CHECKOUT_CLIENTS = 16
+
+
+async def flash_sale(app, requests):
+    statuses = {"validate": [], "active": []}
+    latencies = []
+    deadline = time.perf_counter() + SECONDS
+
+    async def checkout(http, offset):
+        i = offset
+        while time.perf_counter() < deadline:
+            request = requests[i % len(requests)]
+            start = time.perf_counter()
+            response = await http.post("/api/v1/promocodes/validate", json=request.model_dump(mode="json"),
+                                       headers={"x-user-id": str(request.user_id)})
+            latencies.append(time.perf_counter() - start)
+            statuses["validate"].append(response.status_code)
+            i += CHECKOUT_CLIENTS
+
+    async def listing(http):
+        while time.perf_counter() < deadline:
+            response = await http.get("/api/v1/promocodes/active")
+            statuses["active"].append(response.status_code)
+            if response.status_code == 503:
+                await asyncio.sleep(0.05)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as http:
+        await asyncio.gather(*(checkout(http, i) for i in range(CHECKOUT_CLIENTS)),
+                             *(listing(http) for _ in range(LISTING_CLIENTS)))
+    latencies.sort()
+    at = lambda q: latencies[int(len(latencies) * q)] * 1000
+    served = statuses["active"].count(200)
+    print(f"  validate: {len(latencies) / SECONDS:8.0f} /с, p50 {at(0.5):7.1f} ms, p99 {at(0.99):7.1f} ms; "
+          f"/active: {served / SECONDS:5.1f} /с, 503: {len(statuses['active']) - served}")
+
+
+def run():
+    repo = build_repo("memory", CODES)
+    promocode_router.promocode_service = PromocodeService(repo=repo)
+    requests = validate_requests(repo, CODES, 5_000)
+    print(f"{CODES} кодов, {LISTING_CLIENTS} клиентов /active, {CHECKOUT_CLIENTS} клиентов /validate, {SECONDS} с")
+    for name, admission in (("без контроля допуска", False), ("с контролем допуска", True)):
+        app = FastAPI()
+        app.include_router(promocode_router.router)
+        if admission:
+            app.add_middleware(AdmissionMiddleware, lanes={
+                CRITICAL: Lane(CRITICAL), NORMAL: Lane(NORMAL, 32, 64, 128), LOW: Lane(LOW, 1, 2, 64),
+            })
+        print(name)
+        asyncio.run(flash_sale(app, requests))
+
+
+if __name__ == "__main__":
+    run()
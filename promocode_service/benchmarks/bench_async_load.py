@@ -0,0 +1,130 @@
+"""Нагрузочный тест: синхронные и асинхронные обработчики validate/apply.
+
+500 одновременных клиентов через ASGI-транспорт httpx, без сети. Оба
+варианта работают с одним файлом SQLite; сетевая задержка базы имитируется
+паузой BENCH_DB_LATENCY_MS на каждый SQL-запрос в потоке драйвера, как
+ожидание ответа от Postgres. Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_async_load [клиентов]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from promocode_service import async_promocode_router, database, promocode_router
+from promocode_service.async_promocode_repo import AsyncSqlPromocodeRepo
+from promocode_service.async_promocode_service import AsyncPromocodeService
+from promocode_service.benchmarks.bench_sql_repo import CODES, seed
+from promocode_service.promocode_service import PromocodeService
+from promocode_service.promocode_sql_repo import SqlPromocodeRepo
+
+CLIENTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+REQUESTS_PER_CLIENT = 10
+POOL_SIZE = int(os.getenv("BENCH_POOL_SIZE", "100"))
+DB_LATENCY = float(os.getenv("BENCH_DB_LATENCY_MS", "20")) / 1000
+# Доля apply: SQLite допускает одного писателя, и при заметной доле записей
+# тест меряет ожидание блокировки файла, а не обработчики
+APPLY_SHARE = float(os.getenv("BENCH_APPLY_SHARE", "0"))
+latency = [0.0]
+
+
+def prepare_connection(sqlite_connection):
+    # WAL: читатели не блокируют запись, конкурируют только сами apply
+    sqlite_connection.execute("PRAGMA journal_mode=WAL")
+    # Вызывается в потоке, выполняющем запрос: у sync это поток пула FastAPI,
+    # у aiosqlite - собственный поток соединения, цикл событий не блокируется
+    # (включается после загрузки данных, иначе пауза придется на каждую строку)
+    sqlite_connection.set_trace_callback(lambda statement: time.sleep(latency[0]))
+
+
+def make_engines(directory):
+    pool = {"pool_size": POOL_SIZE, "max_overflow": 0, "pool_timeout": 120}
+    sync_engine = create_engine(
+        f"sqlite:///{directory}/bench_promocodes.db?timeout=120", connect_args={"check_same_thread": False},
+        poolclass=QueuePool, **pool
+    )
+    async_engine = create_async_engine(
+        f"sqlite+aiosqlite:///{directory}/bench_promocodes.db?timeout=120", poolclass=AsyncAdaptedQueuePool, **pool
+    )
+    event.listen(sync_engine, "connect", lambda connection, record: prepare_connection(connection))
+    event.listen(
+        async_engine.sync_engine, "connect", lambda connection, record: prepare_connection(connection._connection._conn)
+    )
+    return sync_engine, async_engine
+
+
+async def client_loop(client, user_id, timings, errors):
+    for _ in range(REQUESTS_PER_CLIENT):
+        code = f"BENCH{random.randrange(CODES):08d}"
+        if random.random() >= APPLY_SHARE:
+            path, body = "/api/v1/promocodes/validate", {
+                "promo_code": code, "user_id": str(user_id), "order_amount": 1000, "categories": []
+            }
+        else:
+            path, body = "/api/v1/promocodes/apply", {
+                "promo_code": code, "user_id": str(user_id), "order_id": str(uuid4()),
+                "order_amount": 1000, "final_amount": 900
+            }
+        start = time.perf_counter()
+        response = await client.post(path, json=body)
+        timings.append(time.perf_counter() - start)
+        if response.status_code != 200:
+            errors.append(response.text)
+
+
+async def load(app, user_id):
+    timings, errors = [], []
+    limits = httpx.Limits(max_connections=None)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client, user_id, timings, errors) for _ in range(CLIENTS)))
+        elapsed = time.perf_counter() - start
+    return len(timings) / elapsed, timings, errors
+
+
+def report(name, rps, timings, errors):
+    timings = sorted(timings)
+    p50 = timings[len(timings) // 2] * 1000
+    p99 = timings[int(len(timings) * 0.99)] * 1000
+    print(f"{name:>6}: {rps:8.0f} запросов/с, p50 {p50:.1f} ms, p99 {p99:.1f} ms, ошибок {len(errors)}")
+    if errors:
+        print(f"        первая ошибка: {errors[0][:200]}")
+
+
+async def run():
+    database.engine, database.async_engine = make_engines(tempfile.mkdtemp())
+    database.SessionLocal.configure(bind=database.engine)
+    database.AsyncSessionLocal.configure(bind=database.async_engine)
+
+    promocode_router.promocode_service = PromocodeService(repo=SqlPromocodeRepo())
+    user_id = uuid4()
+    seed(user_id)
+    latency[0] = DB_LATENCY
+    async_promocode_router.promocode_service = AsyncPromocodeService(repo=AsyncSqlPromocodeRepo())
+    await async_promocode_router.promocode_service.start()
+
+    sync_app = FastAPI()
+    sync_app.include_router(promocode_router.router)
+    async_app = FastAPI()
+    async_app.include_router(async_promocode_router.router)
+
+    print(
+        f"sqlite + {DB_LATENCY * 1000:g} ms на запрос, {CODES} кодов, "
+        f"{CLIENTS} клиентов x {REQUESTS_PER_CLIENT} запросов, apply {APPLY_SHARE:.0%}"
+    )
+    report("sync", *await load(sync_app, user_id))
+    report("async", *await load(async_app, user_id))
+    await async_promocode_router.promocode_service.drain()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
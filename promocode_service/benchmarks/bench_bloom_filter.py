@@ -0,0 +1,32 @@
+"""Доля ложных срабатываний и память фильтра Блума для 10M кодов.
+
+Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_bloom_filter [число_кодов]
+"""
+import sys
+import time
+
+from promocode_service.bloom_filter import BloomFilter
+
+CODES = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000_000
+PROBES = 1_000_000
+ERROR_RATE = 0.01
+
+
+def run():
+    start = time.perf_counter()
+    bloom = BloomFilter.from_codes((f"PROMO{i:010d}" for i in range(CODES)), CODES, ERROR_RATE)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    false_positives = sum(f"GUESS{i:010d}" in bloom for i in range(PROBES))
+    probe_ns = (time.perf_counter() - start) / PROBES * 1e9
+
+    print(f"коды: {CODES}, k={bloom.hash_count}, бит: {bloom.size}")
+    print(f"память: {bloom.memory_bytes / 2 ** 20:.1f} MiB ({bloom.memory_bytes * 8 / CODES:.2f} бит на код)")
+    print(f"ложные срабатывания: {false_positives / PROBES:.4%} (ожидается {bloom.expected_error_rate():.4%})")
+    print(f"построение: {build_seconds:.1f} с, проверка: {probe_ns:.0f} нс")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,48 @@
+"""Время генерации 1M уникальных промокодов по шаблону.
+
+Репозиторий в памяти и файл SQLite (для Postgres задайте BENCH_DATABASE_URL).
+Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_bulk_generate [число_кодов]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from promocode_service import database
+from promocode_service.models import DiscountType, GeneratePromocodesRequest
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_service import PromocodeService
+from promocode_service.promocode_sql_repo import SqlPromocodeRepo
+
+CODES = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+
+
+def generate(name, service):
+    request = GeneratePromocodesRequest(
+        prefix="CAMP-",
+        count=CODES,
+        user_id=uuid4(),
+        discount_type=DiscountType.PERCENTAGE,
+        discount_value=10,
+        expires_at=datetime.now() + timedelta(days=30),
+    )
+    start = time.perf_counter()
+    result = service.generate_promocodes(request)
+    elapsed = time.perf_counter() - start
+    assert len(set(result["codes"])) == CODES
+    print(f"{name:>7}: {CODES} кодов за {elapsed:.1f} с ({CODES / elapsed:,.0f} кодов/с)")
+
+
+def run():
+    generate("memory", PromocodeService(repo=PromocodeRepo(promocodes=[])))
+
+    url = os.getenv("BENCH_DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp()}/bench_promocodes.db"
+    database.configure_engine(url)
+    generate(url.split(":")[0], PromocodeService(repo=SqlPromocodeRepo()))
+
+
+if __name__ == "__main__":
+    run()
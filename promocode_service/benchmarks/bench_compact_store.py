@@ -0,0 +1,85 @@
+"""Байты на код: PromocodeRepo (объекты Pydantic) и CompactPromocodeRepo (колонки).
+
+Память считается tracemalloc как прирост выделений после загрузки кодов,
+вместе с самими объектами Promocode у репозитория в памяти; время загрузки
+завышено трассировкой. Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_compact_store [число_кодов]
+"""
+import gc
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from promocode_service.models import DiscountType, Promocode, PromocodeStatus
+from promocode_service.promocode_compact_repo import CompactPromocodeRepo
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_bulk import generate_codes
+
+CODES = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+CODES_PER_USER = 10
+LOOKUPS = 100_000
+CATEGORIES = ["dairy", "bakery", "beverages", "meat", "fruits", "vegetables", "frozen", "snacks"]
+
+
+def promocodes():
+    random.seed(1)
+    now = datetime.now()
+    user_id = uuid4()
+    for i, code in enumerate(generate_codes("CAMP-", 10, CODES)):
+        if i % CODES_PER_USER == 0:
+            user_id = uuid4()
+        yield Promocode(
+            id=uuid4(),
+            code=code,
+            user_id=user_id,
+            discount_type=DiscountType.PERCENTAGE,
+            discount_value=random.choice([5, 10, 15]),
+            min_order_amount=500.0,
+            max_discount=random.choice([None, 300.0]),
+            expires_at=now + timedelta(days=random.randint(1, 60), seconds=random.randint(0, 86400)),
+            usage_count=0,
+            max_usages=1,
+            status=PromocodeStatus.ACTIVE,
+            applicable_categories=random.sample(CATEGORIES, random.randint(0, 3)),
+            created_at=now,
+        )
+
+
+def measure(name, build):
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    repo = build(promocodes())
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print(f"{name:>8}: {allocated / CODES:6.0f} байт на код, {allocated / 2 ** 20:7.1f} MiB, загрузка {elapsed:.1f} с")
+    return repo
+
+
+def measure_lookup(name, repo):
+    codes = random.sample(list(repo.iter_codes()), min(LOOKUPS, CODES))
+    start = time.perf_counter()
+    for code in codes:
+        repo.get_by_code(code)
+    print(f"{name:>8}: get_by_code {(time.perf_counter() - start) / len(codes) * 1e6:.2f} мкс")
+
+
+def run():
+    print(f"{CODES} кодов, по {CODES_PER_USER} на пользователя")
+    repo = measure("pydantic", lambda items: PromocodeRepo(promocodes=items))
+    measure_lookup("pydantic", repo)
+    del repo
+    compact = measure("compact", CompactPromocodeRepo)
+    measure_lookup("compact", compact)
+    compact.get_active_promocodes_page(limit=1)
+    compact.expire_due()
+    print(f"буферы compact после сортировки индексов: {compact.memory_bytes() / CODES:.0f} байт на код")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,145 @@
+"""Цена метрик: валидация в сервисе и запрос через ASGI с метриками и без.
+
+Сервис: промокоды в памяти, 80% запросов проходят проверку, остальные
+отклоняются по разным причинам; этапы замеряются у каждого
+PROMOCODE_STAGE_SAMPLE_EVERY-го запроса. ASGI: POST /validate вызывается
+напрямую, без сети, в приложении с MetricsMiddleware и без него. Запуск
+из корня репозитория:
+    python -m promocode_service.benchmarks.bench_metrics [валидаций]
+"""
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from fastapi import FastAPI
+from promocode_service.models import DiscountType, ValidatePromocodeRequest
+from promocode_service.promocode_metrics import (
+    PROMOCODE_STAGE_SAMPLE_EVERY, MetricsMiddleware, MetricsRegistry, ValidationMetrics
+)
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_router import promocode_service as router_service, router
+from promocode_service.promocode_service import PromocodeService
+
+VALIDATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+REQUESTS = VALIDATIONS // 20
+PROMOCODES = 10_000
+
+
+def workload(repo):
+    random.seed(1)
+    requests = []
+    for i in range(PROMOCODES):
+        user_id = uuid4()
+        repo.create_promocode({
+            "code": f"METRIC{i:06d}", "user_id": user_id, "discount_type": DiscountType.PERCENTAGE,
+            "discount_value": 10, "min_order_amount": 500, "max_discount": 300,
+            "expires_at": datetime.now() + timedelta(days=30), "max_usages": 1, "applicable_categories": [],
+        })
+        roll = random.random()
+        code = f"METRIC{i:06d}" if roll < 0.9 else f"MISSING{i:06d}"
+        requests.append(ValidatePromocodeRequest(
+            promo_code=code, user_id=user_id if roll < 0.85 else uuid4(),
+            order_amount=1000 if roll < 0.8 or roll >= 0.85 else 100,
+        ))
+    return requests
+
+
+def measure_service(service, requests):
+    validate = service.validate_promocode
+    start = time.perf_counter()
+    for request in requests:
+        validate(request)
+    return time.perf_counter() - start
+
+
+def asgi_scope(body: bytes):
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST", "scheme": "http",
+        "path": "/api/v1/promocodes/validate", "raw_path": b"/api/v1/promocodes/validate", "query_string": b"",
+        "root_path": "", "client": ("127.0.0.1", 50000), "server": ("127.0.0.1", 8001),
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    }
+
+
+async def measure_asgi(app, bodies):
+    async def send(message):
+        pass
+
+    start = time.perf_counter()
+    for body in bodies:
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            return messages.pop() if messages else {"type": "http.disconnect"}
+
+        await app(asgi_scope(body), receive, send)
+    return time.perf_counter() - start
+
+
+def compare(measure, parts):
+    """Пары прогонов подряд в чередующемся порядке; медиана отношения времен
+    устойчива к шуму соседей по машине, который задевает оба прогона пары"""
+    ratios, best = [], {"без метрик": float("inf"), "с метриками": float("inf")}
+    for index, part in enumerate(parts):
+        order = ["без метрик", "с метриками"] if index % 2 else ["с метриками", "без метрик"]
+        elapsed = {name: measure(name, part) for name in order}
+        ratios.append(elapsed["с метриками"] / elapsed["без метрик"])
+        for name in best:
+            best[name] = min(best[name], elapsed[name] / len(part))
+    for name, seconds in best.items():
+        print(f"{name:>12}: {1 / seconds:12,.0f} /с, {seconds * 1e6:.2f} мкс")
+    print(f"{'накладные':>12}: {(statistics.median(ratios) - 1) * 100:+.2f}% (медиана {len(ratios)} пар)")
+
+
+def run():
+    repo = PromocodeRepo(promocodes=[])
+    requests = workload(repo)
+    plain = PromocodeService(repo=repo)
+    metered = PromocodeService(repo=repo, metrics=ValidationMetrics(MetricsRegistry()))
+    for request in requests:
+        assert plain.validate_promocode(request) == metered.validate_promocode(request)
+    print(f"{PROMOCODES} промокодов, выборка этапов 1/{PROMOCODE_STAGE_SAMPLE_EVERY}")
+
+    services = {"без метрик": plain, "с метриками": metered}
+    chunk = 1000
+    print(f"сервис, {VALIDATIONS} валидаций в одном потоке:")
+    compare(lambda name, part: measure_service(services[name], part), [
+        [requests[(start + i) % len(requests)] for i in range(chunk)]
+        for start in range(0, VALIDATIONS // 2, chunk)
+    ])
+
+    # Оба приложения обслуживает один роутер и его сервис: без метрик
+    # отключаются и middleware, и метрики сервиса
+    router_service.repo = repo
+    plain_app, metered_app = FastAPI(), FastAPI()
+    plain_app.include_router(router)
+    metered_app.include_router(router)
+    metered_app.add_middleware(MetricsMiddleware, registry=MetricsRegistry())
+    apps = {"без метрик": (plain_app, None), "с метриками": (metered_app, metered.metrics)}
+
+    # Один цикл событий на все прогоны: пул потоков для синхронных обработчиков уже прогрет
+    loop = asyncio.new_event_loop()
+
+    def measure_app(name, part):
+        app, router_service.metrics = apps[name]
+        return loop.run_until_complete(measure_asgi(app, part))
+
+    bodies = [
+        json.dumps({"promo_code": r.promo_code, "user_id": str(r.user_id), "order_amount": r.order_amount}).encode()
+        for r in requests
+    ]
+    chunk = 100
+    print(f"ASGI, {REQUESTS} запросов POST /validate подряд:")
+    compare(measure_app, [
+        [bodies[(start + i) % len(bodies)] for i in range(chunk)] for start in range(0, REQUESTS // 2, chunk)
+    ])
+    loop.close()
+
+
+if __name__ == "__main__":
+    run()
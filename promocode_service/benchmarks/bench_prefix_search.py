@@ -0,0 +1,59 @@
+"""Поиск кодов по префиксу: индекс SortedCodeIndex против полного прохода по кодам.
+
+Хранилище (memory или compact) заполняется синтетическими кодами
+(datasets.py) и кодами кампании SUMMER*; затем меряется страница поиска
+при разной длине префикса и поиск вперемешку с созданием кодов - каждый
+новый код попадает в хвост индекса, а не заставляет пересортировывать все.
+Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_prefix_search [кодов] [memory|compact]
+"""
+import statistics
+import sys
+import time
+
+from promocode_service.benchmarks.datasets import build_repo, generate_promocodes
+
+SIZE = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+BACKEND = sys.argv[2] if len(sys.argv) > 2 else "compact"
+CAMPAIGN = 5_000
+PREFIXES = ["SUMMER", "SUMMER01", "SUMMER0123", "SYN0012", "SYN00123456"]
+SEARCHES = 200
+PAGE = 50
+
+
+def median_us(func, repeats: int = SEARCHES) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1e6
+
+
+def run():
+    start = time.perf_counter()
+    repo = build_repo(BACKEND, SIZE)
+    repo.add_promocodes(p.model_copy(update={"code": f"SUMMER{i:04d}"}) for i, p in
+                        enumerate(generate_promocodes(CAMPAIGN, seed=9)))
+    print(f"{SIZE + CAMPAIGN:,} кодов ({BACKEND}) за {time.perf_counter() - start:.1f} с")
+    # Первый поиск вливает все загруженные коды в индекс
+    start = time.perf_counter()
+    repo.search_by_prefix("SUMMER", None, PAGE)
+    print(f"первое построение индекса: {(time.perf_counter() - start) * 1000:.0f} мс")
+
+    for prefix in PREFIXES:
+        found = len(repo.search_by_prefix(prefix, None, PAGE))
+        print(f"  {prefix:<12} страница {found:>3}: {median_us(lambda: repo.search_by_prefix(prefix, None, PAGE)):8.1f} мкс")
+    scan = median_us(lambda: [code for code in repo.iter_codes() if code.startswith("SUMMER01")][:PAGE], 3)
+    print(f"  полный проход по кодам: {scan / 1000:8.1f} мс")
+
+    created = iter(generate_promocodes(SEARCHES, seed=11))
+    start = time.perf_counter()
+    for i, promocode in enumerate(created):
+        repo.add_promocode(promocode.model_copy(update={"code": f"SUMMER9{i:05d}"}))
+        repo.search_by_prefix("SUMMER9", None, PAGE)
+    print(f"создание + поиск: {(time.perf_counter() - start) / SEARCHES * 1e6:.1f} мкс на пару")
+
+
+if __name__ == "__main__":
+    run()
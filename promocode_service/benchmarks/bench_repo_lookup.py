@@ -0,0 +1,64 @@
+"""Бенчмарк поиска промокодов в PromocodeRepo при росте числа кодов.
+
+Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_repo_lookup
+"""
+import random
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from promocode_service.models import Promocode, PromocodeStatus, DiscountType
+from promocode_service.promocode_repo import PromocodeRepo
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+LOOKUPS = 100_000
+USERS = 10_000
+
+
+def build_repo(size: int) -> PromocodeRepo:
+    now = datetime.now()
+    users = [uuid4() for _ in range(USERS)]
+    repo = PromocodeRepo(promocodes=[])
+    for i in range(size):
+        # model_construct без валидации, чтобы быстрее наполнить репозиторий
+        repo.add_promocode(Promocode.model_construct(
+            id=uuid4(),
+            code=f"BENCH{i:08d}",
+            user_id=users[i % USERS],
+            discount_type=DiscountType.PERCENTAGE,
+            discount_value=10,
+            min_order_amount=0.0,
+            max_discount=None,
+            expires_at=now + timedelta(days=30),
+            usage_count=0,
+            max_usages=1,
+            status=PromocodeStatus.ACTIVE,
+            applicable_categories=[],
+            created_at=now,
+        ))
+    return repo
+
+
+def measure_ns(func, args) -> float:
+    start = time.perf_counter_ns()
+    for arg in args:
+        func(arg)
+    return (time.perf_counter_ns() - start) / len(args)
+
+
+def run():
+    print(f"{'codes':>10} {'get_by_code, ns':>16} {'miss, ns':>10} {'user, ns':>10}")
+    for size in SIZES:
+        repo = build_repo(size)
+        hits = [f"BENCH{random.randrange(size):08d}" for _ in range(LOOKUPS)]
+        misses = [f"MISS{i:08d}" for i in range(LOOKUPS)]
+        users = [p.user_id for p in map(repo.get_by_code, hits[:1_000])]
+
+        print(f"{size:>10} {measure_ns(repo.get_by_code, hits):>16.0f} "
+              f"{measure_ns(repo.get_by_code, misses):>10.0f} "
+              f"{measure_ns(repo.get_user_promocodes, users):>10.0f}")
+
+
+if __name__ == "__main__":
+    run()
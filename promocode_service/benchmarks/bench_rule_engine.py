@@ -0,0 +1,116 @@
+"""Валидаций в секунду на одно ядро: скомпилированные правила и прежние проверки.
+
+Промокоды уже загружены (без похода в репозиторий), у половины есть
+ограничение по категориям; сценарии различаются числом категорий. Прежний
+_validate_loaded воспроизведен ниже для сравнения. Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_rule_engine [валидаций]
+"""
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from promocode_service.models import DiscountType, Promocode, PromocodeStatus, ValidatePromocodeRequest
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_service import PromocodeService
+
+VALIDATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+PROMOCODES = 10_000
+REPEATS = 5
+# (категорий у промокода, максимум категорий в заказе): обычная витрина и широкий каталог
+SCENARIOS = [(3, 4), (30, 10)]
+CATEGORIES = [f"category-{i}" for i in range(100)]
+
+
+class InterpretedPromocodeService(PromocodeService):
+    """Прежний _validate_loaded: отдельные вызовы проверок и any() по спискам"""
+
+    def _validate_loaded(self, promocode, request):
+        if not promocode:
+            return {"valid": False, "message": "Промокод не найден"}
+        if promocode.user_id != request.user_id:
+            return {"valid": False, "message": "Промокод не доступен для данного пользователя"}
+        if not self._check_promocode_status(promocode):
+            return {"valid": False, "message": "Промокод не активен"}
+        if not self._check_order_requirements(promocode, request.order_amount, request.categories):
+            return {"valid": False, "message": "Заказ не соответствует требованиям промокода"}
+        return {
+            "valid": True,
+            "promo_code": promocode.code,
+            "discount_amount": self._calculate_discount(promocode, request.order_amount),
+            "discount_percent": promocode.discount_value if promocode.discount_type == DiscountType.PERCENTAGE else None,
+            "min_order_amount": promocode.min_order_amount,
+            "max_discount": promocode.max_discount,
+            "expires_at": promocode.expires_at.isoformat(),
+            "applicable_categories": promocode.applicable_categories
+        }
+
+    def _check_order_requirements(self, promocode, order_amount, categories):
+        if order_amount < promocode.min_order_amount:
+            return False
+        if promocode.applicable_categories and categories and not any(cat in promocode.applicable_categories for cat in categories):
+            return False
+        return True
+
+    def _calculate_discount(self, promocode, order_amount):
+        if promocode.discount_type == DiscountType.PERCENTAGE:
+            discount = order_amount * (promocode.discount_value / 100)
+            if promocode.max_discount:
+                discount = min(discount, promocode.max_discount)
+            return round(discount, 2)
+        return promocode.discount_value
+
+
+def workload(promocode_categories, order_categories):
+    random.seed(1)
+    now = datetime.now()
+    pairs = []
+    for i in range(PROMOCODES):
+        user_id = uuid4()
+        promocode = Promocode(
+            id=uuid4(), code=f"RULE{i:06d}", user_id=user_id, discount_type=DiscountType.PERCENTAGE,
+            discount_value=random.choice([5, 10, 15]), min_order_amount=random.choice([0.0, 500.0]),
+            max_discount=random.choice([None, 300.0]), expires_at=now + timedelta(days=30), usage_count=0,
+            max_usages=1, status=PromocodeStatus.ACTIVE,
+            applicable_categories=random.sample(CATEGORIES, promocode_categories) if i % 2 else [], created_at=now,
+        )
+        request = ValidatePromocodeRequest(
+            promo_code=promocode.code, user_id=user_id, order_amount=random.choice([300, 1000, 5000]),
+            categories=random.sample(CATEGORIES, random.randint(0, order_categories)),
+        )
+        pairs.append((promocode, request))
+    return pairs
+
+
+def measure(validate, pairs):
+    rounds = max(1, VALIDATIONS // len(pairs))
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for promocode, request in pairs:
+            validate(promocode, request)
+    return rounds * len(pairs) / (time.perf_counter() - start)
+
+
+def run():
+    repo = PromocodeRepo(promocodes=[])
+    print(f"{PROMOCODES} промокодов, {VALIDATIONS} валидаций, один поток, лучший из {REPEATS} прогонов")
+    for promocode_categories, order_categories in SCENARIOS:
+        pairs = workload(promocode_categories, order_categories)
+        interpreted, compiled = InterpretedPromocodeService(repo=repo), PromocodeService(repo=repo)
+        for promocode, request in pairs:
+            assert interpreted._validate_loaded(promocode, request) == compiled._validate_loaded(promocode, request)
+
+        # Прогоны чередуются, чтобы шум соседей по машине доставался обоим вариантам
+        best = {"interpreted": 0.0, "compiled": 0.0}
+        for _ in range(REPEATS):
+            best["interpreted"] = max(best["interpreted"], measure(interpreted._validate_loaded, pairs))
+            best["compiled"] = max(best["compiled"], measure(compiled._validate_loaded, pairs))
+        print(f"категорий у промокода {promocode_categories}, в заказе до {order_categories}, "
+              f"правил скомпилировано {len(compiled.rules)}")
+        for name, rate in best.items():
+            print(f"{name:>12}: {rate:12,.0f} валидаций/с, {1e6 / rate:.2f} мкс")
+
+
+if __name__ == "__main__":
+    run()
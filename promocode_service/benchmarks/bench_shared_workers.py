@@ -0,0 +1,85 @@
+"""Масштабирование validate по процессам над общей таблицей (SharedPromocodeRepo).
+
+Таблица заполняется один раз в файле на tmpfs; каждый из 1..N процессов
+отображает ее, строит свой PromocodeService и валидирует коды SECONDS
+секунд. Затем все процессы применяют один кампанийный код: итоговый
+usage_count должен совпасть с числом успешных применений. Масштабирование
+упирается в число ядер машины (os.cpu_count()). Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_shared_workers [макс_процессов]
+"""
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from promocode_service.benchmarks.datasets import apply_requests, generate_promocodes, validate_requests
+from promocode_service.promocode_idempotency import IdempotencyStore
+from promocode_service.promocode_service import PromocodeService
+from promocode_service.promocode_shared_repo import SharedPromocodeRepo
+
+MAX_WORKERS = int(sys.argv[1]) if len(sys.argv) > 1 else max(4, os.cpu_count() or 1)
+CODES = 100_000
+SECONDS = 3.0
+APPLIES = 2_000
+
+
+def validate_worker(path, seed, start_at):
+    repo = SharedPromocodeRepo(path)
+    service = PromocodeService(repo=repo)
+    requests = validate_requests(repo, CODES, 5_000, seed=seed)
+    while time.time() < start_at:
+        time.sleep(0.001)
+    done, deadline = 0, time.perf_counter() + SECONDS
+    while time.perf_counter() < deadline:
+        for request in requests[:500]:
+            service.validate_promocode(request)
+        done += 500
+        requests = requests[500:] + requests[:500]
+    repo.close()
+    return done
+
+
+def apply_worker(path, seed):
+    repo = SharedPromocodeRepo(path)
+    service = PromocodeService(repo=repo, applied_orders=IdempotencyStore())
+    request = apply_requests(repo, CODES, 1)[0]
+    applied = 0
+    for request_for_order in apply_requests(repo, CODES, APPLIES, seed=seed):
+        result = service.apply_promocode(request_for_order.model_copy(update={"promo_code": request.promo_code,
+                                                                               "user_id": request.user_id}))
+        applied += result.get("status") == "applied"
+    repo.close()
+    return applied, request.promo_code
+
+
+def run():
+    directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    path = os.path.join(directory, f"bench-promocodes-{os.getpid()}.table")
+    try:
+        repo = SharedPromocodeRepo(path, capacity=CODES)
+        repo.add_promocodes(generate_promocodes(CODES))
+        print(f"{CODES} кодов, файл {repo.memory_bytes() / 2 ** 20:.0f} МБ, ядер: {os.cpu_count()}")
+        context = multiprocessing.get_context("spawn")
+        base = None
+        for workers in range(1, MAX_WORKERS + 1):
+            with context.Pool(workers) as pool:
+                start_at = time.time() + 1.0
+                done = pool.starmap(validate_worker, [(path, seed, start_at) for seed in range(workers)])
+            rate = sum(done) / SECONDS
+            base = base or rate
+            print(f"{workers} процесс(ов): {rate:10,.0f} валидаций/с, x{rate / base:.2f}")
+
+        with context.Pool(MAX_WORKERS) as pool:
+            results = pool.starmap(apply_worker, [(path, seed + 10) for seed in range(MAX_WORKERS)])
+        code = results[0][1]
+        applied = sum(count for count, _ in results)
+        print(f"apply {code} из {MAX_WORKERS} процессов: успешно {applied}, "
+              f"usage_count {repo.get_by_code(code).usage_count}")
+        repo.close()
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,88 @@
+"""Симуляция кампании: векторная оценка по колонкам против проверки заказов по одному.
+
+История из ORDERS заказов (по умолчанию 50M) пишется каталогом колонок во
+временный файл, затем симулируются условия с категориями и потолком скидки.
+Для сравнения те же проверки, что у сервиса (_check_order_requirements и
+_calculate_discount из bench_rule_engine), прогоняются по выборке заказов;
+отдельно меряется разбор CSV при переводе в колонки. Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_simulation [заказов]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from promocode_service.benchmarks.bench_rule_engine import InterpretedPromocodeService
+from promocode_service.promocode_simulation import (
+    OrderChunk, load_order_columns, read_order_chunks, simulate, simulation_terms, write_order_columns
+)
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000_000
+GENERATE_CHUNK = 1_000_000
+PYTHON_SAMPLE = 300_000
+CSV_SAMPLE = 300_000
+CATEGORIES = [f"category-{i}" for i in range(50)]
+TERMS = {"discount_type": "percentage", "discount_value": 15, "min_order_amount": 1000, "max_discount": 500,
+         "applicable_categories": ["category-1", "category-7", "category-20"]}
+
+
+def generate_chunks(count: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    for start in range(0, count, GENERATE_CHUNK):
+        size = min(GENERATE_CHUNK, count - start)
+        amounts = np.round(rng.lognormal(7, 0.8, size), 2)
+        per_order = rng.integers(0, 4, size)
+        offsets = np.concatenate(([0], np.cumsum(per_order)))
+        yield OrderChunk(amounts, offsets, rng.integers(0, len(CATEGORIES), int(offsets[-1]), dtype=np.int32))
+
+
+def python_replay(terms, chunk: OrderChunk) -> float:
+    """Заказы по одному через проверки сервиса; суммарная скидка"""
+    service = InterpretedPromocodeService.__new__(InterpretedPromocodeService)
+    amounts, offsets = chunk.amounts.tolist(), chunk.offsets.tolist()
+    ids = chunk.category_ids.tolist()
+    total = 0.0
+    for i, amount in enumerate(amounts):
+        categories = [CATEGORIES[j] for j in ids[offsets[i]:offsets[i + 1]]]
+        if service._check_order_requirements(terms, amount, categories):
+            total += service._calculate_discount(terms, amount)
+    return total
+
+
+def run():
+    terms = simulation_terms(TERMS)
+    vocabulary = {category: i for i, category in enumerate(CATEGORIES)}
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        write_order_columns(generate_chunks(ORDERS), vocabulary, os.path.join(directory, "cols"))
+        print(f"{ORDERS:,} заказов сгенерировано в колонки за {time.perf_counter() - start:.1f} с")
+
+        vocabulary, chunks = load_order_columns(os.path.join(directory, "cols"))
+        result = simulate(terms, chunks, vocabulary)
+        print(f"векторно: {result['seconds']:.2f} с, {ORDERS / result['seconds']:,.0f} заказов/с; "
+              f"подошло {result['eligible_orders']:,}, скидка {result['total_discount']:,.2f}")
+
+        sample = next(generate_chunks(PYTHON_SAMPLE, seed=2))
+        start = time.perf_counter()
+        python_replay(terms, sample)
+        rate = PYTHON_SAMPLE / (time.perf_counter() - start)
+        print(f"по одному: {rate:,.0f} заказов/с, {ORDERS:,} заказов - около {ORDERS / rate:.0f} с")
+
+        path = os.path.join(directory, "orders.csv")
+        sample = next(generate_chunks(CSV_SAMPLE, seed=3))
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("order_amount,categories\n")
+            for i, amount in enumerate(sample.amounts.tolist()):
+                ids = sample.category_ids[sample.offsets[i]:sample.offsets[i + 1]]
+                f.write(f"{amount},{'|'.join(CATEGORIES[j] for j in ids)}\n")
+        start = time.perf_counter()
+        for _ in read_order_chunks(path, {}):
+            pass
+        rate = CSV_SAMPLE / (time.perf_counter() - start)
+        print(f"разбор CSV (convert): {rate:,.0f} заказов/с")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,59 @@
+"""Холодный старт: загрузка колоночного хранилища из БД, из промокодов и из снимка.
+
+SQL - полное чтение таблицы SQLite во временном файле (SQL_CODES кодов),
+как при старте без снимка. Промокоды - сборка хранилища из объектов, как
+при загрузке данных в конструкторе. Снимок - запись и чтение файла с
+отображением в память, затем догрузка 1% измененных строк из той же БД.
+Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_snapshot [число_кодов]
+"""
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from promocode_service import database
+from promocode_service.benchmarks.datasets import code_at, generate_promocodes
+from promocode_service.promocode_compact_repo import CompactPromocodeRepo
+from promocode_service.promocode_snapshot import WarmupState, read_snapshot, warm_up, write_snapshot
+from promocode_service.promocode_sql_repo import SqlPromocodeRepo
+
+CODES = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+SQL_CODES = min(CODES, 100_000)
+
+
+def timed(name, func, codes):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    print(f"{name:>34}: {elapsed:8.2f} с, {elapsed / codes * 1e6:6.2f} мкс на код")
+    return result
+
+
+def run():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "promocodes.snapshot")
+        print(f"{CODES} кодов")
+        repo = timed("сборка из промокодов", lambda: CompactPromocodeRepo(generate_promocodes(CODES)), CODES)
+        timed("запись снимка", lambda: write_snapshot(repo, path, datetime.now()), CODES)
+        print(f"{'размер снимка':>34}: {os.path.getsize(path) / CODES:8.1f} байт на код")
+        loaded, _ = timed("чтение снимка (mmap)", lambda: read_snapshot(path), CODES)
+        assert loaded.get_by_code(code_at(CODES - 1)) == repo.get_by_code(code_at(CODES - 1))
+        del repo, loaded
+
+        database.configure_engine(f"sqlite:///{os.path.join(directory, 'promocodes.db')}")
+        sql_repo = SqlPromocodeRepo()
+        sql_repo.add_promocodes(generate_promocodes(SQL_CODES))
+        print(f"{SQL_CODES} кодов в SQLite")
+        sql_path = os.path.join(directory, "sql.snapshot")
+        timed("полная загрузка из БД", lambda: warm_up(sql_path, sql_repo, WarmupState()), SQL_CODES)
+        for i in range(0, SQL_CODES, 100):
+            sql_repo.update_promocode(sql_repo.get_by_code(code_at(i)).model_copy(update={"max_usages": 500}))
+        state = WarmupState()
+        timed("снимок + догрузка 1% изменений", lambda: warm_up(sql_path, sql_repo, state, overlap=0), SQL_CODES)
+        print(f"{'догружено строк':>34}: {state.caught_up_rows}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,84 @@
+"""Задержки validate/apply поверх SqlPromocodeRepo.
+
+По умолчанию используется локальный файл SQLite; для Postgres задайте
+BENCH_DATABASE_URL. Запуск из корня репозитория:
+    python -m promocode_service.benchmarks.bench_sql_repo
+"""
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from sqlalchemy import insert
+
+from promocode_service import database
+from promocode_service.database import PromocodeDB, db_session
+from promocode_service.models import ApplyPromocodeRequest, ValidatePromocodeRequest
+from promocode_service.promocode_service import PromocodeService
+from promocode_service.promocode_sql_repo import SqlPromocodeRepo
+
+CODES = 20_000
+REQUESTS = 2_000
+
+
+def seed(user_id):
+    now = datetime.now()
+    rows = [{
+        "id": uuid4(),
+        "code": f"BENCH{i:08d}",
+        "user_id": user_id,
+        "discount_type": "percentage",
+        "discount_value": 10.0,
+        "min_order_amount": 0.0,
+        "max_discount": None,
+        "expires_at": now + timedelta(days=30),
+        "usage_count": 0,
+        "max_usages": 1_000_000,
+        "status": "active",
+        "created_at": now,
+    } for i in range(CODES)]
+    with db_session() as db:
+        db.execute(insert(PromocodeDB), rows)
+        db.commit()
+
+
+def report(name, timings):
+    timings = sorted(timings)
+    p50 = timings[len(timings) // 2] * 1000
+    p99 = timings[int(len(timings) * 0.99)] * 1000
+    print(f"{name:>10}: mean {statistics.mean(timings) * 1000:.3f} ms, p50 {p50:.3f} ms, p99 {p99:.3f} ms")
+
+
+def run():
+    url = os.getenv("BENCH_DATABASE_URL") or f"sqlite:///{tempfile.mkdtemp()}/bench_promocodes.db"
+    database.configure_engine(url)
+    service = PromocodeService(repo=SqlPromocodeRepo())
+    user_id = uuid4()
+    seed(user_id)
+
+    validate_timings, apply_timings = [], []
+    for _ in range(REQUESTS):
+        code = f"BENCH{random.randrange(CODES):08d}"
+
+        start = time.perf_counter()
+        service.validate_promocode(ValidatePromocodeRequest(
+            promo_code=code, user_id=user_id, order_amount=1000, categories=[]
+        ))
+        validate_timings.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        service.apply_promocode(ApplyPromocodeRequest(
+            promo_code=code, user_id=user_id, order_id=uuid4(), order_amount=1000, final_amount=900
+        ))
+        apply_timings.append(time.perf_counter() - start)
+
+    print(f"{url.split(':')[0]}, {CODES} кодов, {REQUESTS} запросов")
+    report("validate", validate_timings)
+    report("apply", apply_timings)
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,83 @@
+"""Применения горячих кодов: списание в БД на каждое apply и отложенная запись.
+
+Несколько потоков применяют HOT_CODES кодов, как на распродаже. SQLite-файл
+(для Postgres задайте BENCH_DATABASE_URL); write-behind пишет журнал во
+временный каталог и сбрасывает пачки по USAGE_FLUSH_SIZE. Запуск из корня
+репозитория:
+    python -m promocode_service.benchmarks.bench_write_behind [применений]
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+
+from promocode_service import database
+from promocode_service.benchmarks.bench_sql_repo import seed
+from promocode_service.promocode_sql_repo import SqlPromocodeRepo
+from promocode_service.promocode_write_behind import (
+    USAGE_FLUSH_INTERVAL, USAGE_FLUSH_SIZE, WriteBehindPromocodeRepo
+)
+
+APPLIES = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+THREADS = 8
+HOT_CODES = 10
+
+
+def run_applies(consume):
+    codes = [f"BENCH{random.randrange(HOT_CODES):08d}" for _ in range(APPLIES)]
+    timings = []
+
+    def apply(code):
+        start = time.perf_counter()
+        assert consume(code) is not None
+        timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=THREADS) as pool:
+        list(pool.map(apply, codes))
+    return time.perf_counter() - start, sorted(timings)
+
+
+def report(name, elapsed, timings, transactions):
+    p50 = timings[len(timings) // 2] * 1e6
+    p99 = timings[int(len(timings) * 0.99)] * 1e6
+    print(f"{name:>13}: {APPLIES / elapsed:8.0f} apply/с, p50 {p50:7.0f} мкс, p99 {p99:7.0f} мкс, "
+          f"транзакций записи {transactions}")
+
+
+def run():
+    directory = tempfile.mkdtemp()
+    database.configure_engine(os.getenv("BENCH_DATABASE_URL") or f"sqlite:///{directory}/bench_promocodes.db")
+    sql_repo = SqlPromocodeRepo()
+    seed(uuid4())
+    print(f"{APPLIES} применений {HOT_CODES} кодов в {THREADS} потоков")
+
+    report("per-apply", *run_applies(sql_repo.consume_usage), APPLIES)
+
+    repo = WriteBehindPromocodeRepo(sql_repo, log_path=f"{directory}/usage.log")
+    stopped = threading.Event()
+
+    def flusher():
+        # Как run_usage_flusher в приложении: по порогу или раз в интервал
+        while not stopped.is_set():
+            repo.flush_requested.wait(USAGE_FLUSH_INTERVAL)
+            repo.flush()
+
+    thread = threading.Thread(target=flusher)
+    thread.start()
+    elapsed, timings = run_applies(repo.consume_usage)
+    stopped.set()
+    repo.flush_requested.set()
+    thread.join()
+    repo.close()
+    report("write-behind", elapsed, timings, repo.flushed_batches)
+    print(f"  пачка по {USAGE_FLUSH_SIZE}, usage_count в БД после обоих прогонов: "
+          f"{sum(sql_repo.get_by_code(f'BENCH{i:08d}').usage_count for i in range(HOT_CODES))}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,138 @@
+"""Синтетические данные для бенчмарков: промокоды, пользователи и корзины.
+
+Генерация детерминирована seed и идет потоком: 10M кодов не собираются в
+список, хранилище принимает итератор. Код с номером i всегда равен
+code_at(i), поэтому выборку запросов можно строить без копии данных.
+"""
+import random
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from promocode_service.models import (
+    ApplyPromocodeRequest, DiscountType, Promocode, PromocodeStatus, ValidatePromocodeRequest
+)
+
+CODE_PREFIX = "SYN"
+# Коды на пользователя в среднем; распределение перекошено: у активных
+# покупателей десятки кодов, у большинства - один-два
+CODES_PER_USER = 10
+# Смеси категорий: (все категории каталога, доля кодов с ограничением,
+# максимум категорий у кода, максимум категорий в корзине)
+CATEGORY_MIXES: Dict[str, Tuple[List[str], float, int, int]] = {
+    "none": ([], 0.0, 0, 0),
+    "grocery": (["dairy", "bakery", "beverages", "meat", "fruits", "vegetables", "frozen", "snacks"], 0.5, 3, 4),
+    "marketplace": ([f"category-{i}" for i in range(200)], 0.7, 10, 12),
+}
+
+
+def code_at(index: int) -> str:
+    return f"{CODE_PREFIX}{index:08d}"
+
+
+def make_users(count: int, seed: int = 1) -> List[UUID]:
+    rng = random.Random(seed)
+    return [UUID(int=rng.getrandbits(128), version=4) for _ in range(count)]
+
+
+def generate_promocodes(count: int, category_mix: str = "grocery", seed: int = 1,
+                        now: Optional[datetime] = None) -> Iterator[Promocode]:
+    """count промокодов: 90% активных, 5% истекших, 5% исчерпанных; у 5% лимит
+    применений почти без ограничения (кампании), на них идут apply-бенчмарки"""
+    rng = random.Random(seed)
+    now = now or datetime.now()
+    users = make_users(max(1, count // CODES_PER_USER), seed)
+    categories, restricted_share, max_code_categories, _ = CATEGORY_MIXES[category_mix]
+    for i in range(count):
+        roll = rng.random()
+        max_usages = 1_000_000 if roll < 0.05 else (1 if roll < 0.75 else rng.randint(5, 100))
+        status_roll = rng.random()
+        expires_at = now + timedelta(days=rng.randint(1, 90)) if status_roll >= 0.05 \
+            else now - timedelta(days=rng.randint(1, 30))
+        percentage = rng.random() < 0.7
+        # model_construct без валидации: при миллионах кодов она дороже самой загрузки
+        yield Promocode.model_construct(
+            id=UUID(int=rng.getrandbits(128), version=4),
+            code=code_at(i),
+            user_id=users[int(len(users) * rng.random() ** 2)],
+            discount_type=DiscountType.PERCENTAGE if percentage else DiscountType.FIXED,
+            discount_value=float(rng.choice([5, 10, 15, 20, 30]) if percentage else rng.choice([100, 200, 500])),
+            min_order_amount=rng.choice([0.0, 500.0, 1000.0]),
+            max_discount=rng.choice([None, 300.0, 1000.0]) if percentage else None,
+            expires_at=expires_at,
+            usage_count=max_usages if 0.05 <= status_roll < 0.10 else 0,
+            max_usages=max_usages,
+            status=PromocodeStatus.USED if 0.05 <= status_roll < 0.10 else PromocodeStatus.ACTIVE,
+            applicable_categories=sorted(rng.sample(categories, rng.randint(1, max_code_categories)))
+            if categories and rng.random() < restricted_share else [],
+            created_at=now,
+        )
+
+
+def build_repo(backend: str, count: int, category_mix: str = "grocery", seed: int = 1):
+    """Хранилище с count синтетическими кодами: memory, compact или sql (текущий DATABASE_URL)"""
+    promocodes = generate_promocodes(count, category_mix, seed)
+    if backend == "memory":
+        from promocode_service.promocode_repo import PromocodeRepo
+        repo = PromocodeRepo(promocodes=[])
+    elif backend == "compact":
+        from promocode_service.promocode_compact_repo import CompactPromocodeRepo
+        repo = CompactPromocodeRepo()
+    elif backend == "sql":
+        from promocode_service.promocode_sql_repo import SqlPromocodeRepo
+        repo = SqlPromocodeRepo()
+    else:
+        raise ValueError(f"Неизвестный тип репозитория: {backend}")
+    repo.add_promocodes(promocodes)
+    return repo
+
+
+def order_categories(rng: random.Random, category_mix: str) -> List[str]:
+    categories, _, _, max_order_categories = CATEGORY_MIXES[category_mix]
+    return rng.sample(categories, rng.randint(0, max_order_categories)) if categories else []
+
+
+def validate_requests(repo, size: int, count: int, category_mix: str = "grocery", seed: int = 2,
+                      miss_share: float = 0.1, foreign_share: float = 0.05) -> List[ValidatePromocodeRequest]:
+    """Запросы к существующим кодам владельцев, к чужим кодам и к несуществующим"""
+    rng = random.Random(seed)
+    owners = _owners(repo, size, rng, count)
+    requests = []
+    for _ in range(count):
+        roll = rng.random()
+        code, user_id = rng.choice(owners)
+        if roll < miss_share:
+            code = f"MISSING{rng.randrange(10 ** 8):08d}"
+        elif roll < miss_share + foreign_share:
+            user_id = UUID(int=rng.getrandbits(128), version=4)
+        requests.append(ValidatePromocodeRequest(
+            promo_code=code, user_id=user_id, order_amount=rng.choice([300, 800, 1500, 5000]),
+            categories=order_categories(rng, category_mix),
+        ))
+    return requests
+
+
+def apply_requests(repo, size: int, count: int, seed: int = 3) -> List[ApplyPromocodeRequest]:
+    """Применения кампанийных кодов (большой лимит): каждое с новым заказом проходит до списания"""
+    rng = random.Random(seed)
+    campaign = [(p.code, p.user_id) for p in _sample(repo, size, rng, min(size, 20_000))
+                if p.max_usages >= 1_000_000 and p.status == PromocodeStatus.ACTIVE and p.expires_at > datetime.now()]
+    if not campaign:
+        return []
+    requests = []
+    for _ in range(count):
+        code, user_id = rng.choice(campaign)
+        requests.append(ApplyPromocodeRequest(
+            promo_code=code, user_id=user_id, order_id=UUID(int=rng.getrandbits(128), version=4),
+            order_amount=5000, final_amount=4500,
+        ))
+    return requests
+
+
+def _owners(repo, size: int, rng: random.Random, count: int) -> List[Tuple[str, UUID]]:
+    return [(p.code, p.user_id) for p in _sample(repo, size, rng, min(count, 10_000))]
+
+
+def _sample(repo, size: int, rng: random.Random, count: int) -> List[Promocode]:
+    codes = [code_at(rng.randrange(size)) for _ in range(count)]
+    return list(repo.get_many_by_codes(codes).values())
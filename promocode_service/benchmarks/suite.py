@@ -0,0 +1,232 @@
+"""Набор бенчмарков PromocodeService с результатами в JSON.
+
+Для каждого размера синтетического хранилища (datasets.py) меряются
+get_by_code, validate_promocode, apply_promocode и get_all_active_promocodes,
+затем нагрузочный тест роутера через ASGI-транспорт httpx, без сети:
+пропускная способность и p50/p95/p99. Результаты с коммитом и окружением
+пишутся в JSON; --baseline сравнивает с файлом прошлого прогона. Запуск из
+корня репозитория:
+    python -m promocode_service.benchmarks.suite --sizes 10000,100000 --output bench.json
+    python -m promocode_service.benchmarks.suite --sizes 10000000 --backend compact --no-load
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+import httpx
+
+from promocode_service import promocode_router
+from promocode_service.benchmarks.datasets import (
+    CATEGORY_MIXES, apply_requests, build_repo, code_at, validate_requests
+)
+from promocode_service.promocode_idempotency import IdempotencyStore
+from promocode_service.promocode_service import PromocodeService
+
+# Метрика сравнения с прошлым прогоном: имя поля и направление "меньше - лучше"
+MAIN_METRICS = {"micro": ("ns_per_op", True), "load": ("p99_ms", True)}
+REGRESSION_THRESHOLD = 0.10
+
+
+def measure(func: Callable, args: Sequence, repeats: int) -> Dict:
+    """Наносекунды на вызов: медиана и лучший из repeats проходов по args"""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter_ns()
+        for arg in args:
+            func(arg)
+        timings.append((time.perf_counter_ns() - start) / len(args))
+    return {
+        "ops": len(args) * repeats,
+        "ns_per_op": round(statistics.median(timings), 1),
+        "ns_per_op_best": round(min(timings), 1),
+        "ops_per_sec": round(1e9 / statistics.median(timings)),
+    }
+
+
+def micro_benchmarks(service: PromocodeService, size: int, ops: int, repeats: int, category_mix: str) -> List[Dict]:
+    repo = service.repo
+    hits = [code_at(i * 7919 % size) for i in range(ops)]
+    misses = [f"MISSING{i:08d}" for i in range(ops)]
+    validations = validate_requests(repo, size, ops, category_mix)
+    # Каждое применение - новый заказ: повторы не попадают в хранилище идемпотентности
+    applies = apply_requests(repo, size, ops * repeats)
+    # Полный список активных кодов линеен по размеру: вызовов меньше на больших хранилищах
+    listing_calls = max(1, min(ops, 1_000_000 // size))
+
+    results = [
+        {"name": "get_by_code", **measure(repo.get_by_code, hits, repeats)},
+        {"name": "get_by_code_miss", **measure(repo.get_by_code, misses, repeats)},
+        {"name": "validate_promocode", **measure(service.validate_promocode, validations, repeats)},
+        {"name": "get_all_active_promocodes",
+         **measure(lambda _: service.get_all_active_promocodes(), range(listing_calls), repeats)},
+    ]
+    if applies:
+        batches = iter([applies[i:i + ops] for i in range(0, len(applies), ops)])
+        timings = []
+        for _ in range(repeats):
+            batch = next(batches)
+            timings.append(measure(service.apply_promocode, batch, 1)["ns_per_op"])
+        results.append({
+            "name": "apply_promocode", "ops": len(applies), "ns_per_op": round(statistics.median(timings), 1),
+            "ns_per_op_best": round(min(timings), 1), "ops_per_sec": round(1e9 / statistics.median(timings)),
+        })
+    return [{"kind": "micro", "size": size, **result} for result in results]
+
+
+async def load_test(app, service: PromocodeService, size: int, clients: int, requests: int,
+                    category_mix: str) -> Dict:
+    """Смесь запросов как у витрины: 80% validate, 15% карточка кода, 5% apply"""
+    validations = validate_requests(service.repo, size, requests, category_mix, seed=4)
+    applies = apply_requests(service.repo, size, max(1, requests // 20), seed=5)
+    plan = []
+    for i, validation in enumerate(validations):
+        # Запросы от имени пользователей, как за шлюзом: ведра контроля допуска у каждого свои
+        headers = {"x-user-id": str(validation.user_id)}
+        if i % 20 == 0 and applies:
+            apply = applies[(i // 20) % len(applies)]
+            plan.append(("apply", "POST", "/api/v1/promocodes/apply", apply.model_dump(mode="json"),
+                         {"x-user-id": str(apply.user_id)}))
+        elif i % 20 in (1, 2, 3):
+            plan.append(("info", "GET", f"/api/v1/promocodes/{validation.promo_code}", None, headers))
+        else:
+            plan.append(("validate", "POST", "/api/v1/promocodes/validate", validation.model_dump(mode="json"),
+                         headers))
+
+    timings: Dict[str, List[float]] = {"validate": [], "info": [], "apply": []}
+    errors = []
+    queue = iter(plan)
+
+    async def client_loop(client):
+        for name, method, path, body, headers in queue:
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body, headers=headers)
+            timings[name].append(time.perf_counter() - start)
+            if response.status_code >= 500:
+                errors.append(response.text)
+
+    limits = httpx.Limits(max_connections=None)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                 limits=limits) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(client_loop(client) for _ in range(clients)))
+        elapsed = time.perf_counter() - start
+
+    every = sorted(t for values in timings.values() for t in values)
+    return {
+        "kind": "load", "name": "asgi_router", "size": size, "clients": clients, "requests": len(every),
+        "rps": round(len(every) / elapsed), **_percentiles(every), "errors": len(errors),
+        "endpoints": {name: {"requests": len(values), **_percentiles(sorted(values))}
+                      for name, values in timings.items() if values},
+    }
+
+
+def _percentiles(timings: List[float]) -> Dict:
+    if not timings:
+        return {}
+    at = lambda q: round(timings[min(len(timings) - 1, int(len(timings) * q))] * 1000, 3)
+    return {"p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99)}
+
+
+def environment(args: argparse.Namespace) -> Dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "args": {key: value for key, value in vars(args).items() if key not in ("output", "baseline")},
+    }
+
+
+def compare(results: List[Dict], baseline: Dict, threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """Строки сравнения с прошлым прогоном; регрессия - ухудшение основной метрики больше threshold"""
+    previous = {(r["kind"], r["name"], r["size"]): r for r in baseline.get("results", [])}
+    lines = []
+    for result in results:
+        old = previous.get((result["kind"], result["name"], result["size"]))
+        field, lower_is_better = MAIN_METRICS[result["kind"]]
+        if old is None or not old.get(field) or field not in result:
+            continue
+        change = result[field] / old[field] - 1
+        worse = change > threshold if lower_is_better else change < -threshold
+        lines.append(f"{result['name']:>26} {result['size']:>10} {field}: {old[field]} -> {result[field]} "
+                     f"({change:+.1%}){'  РЕГРЕССИЯ' if worse else ''}")
+    return lines
+
+
+def run(argv: Optional[List[str]] = None) -> Dict:
+    parser = argparse.ArgumentParser(description="Бенчмарки PromocodeService")
+    parser.add_argument("--sizes", default="10000,100000", help="размеры хранилища через запятую, до 10000000")
+    parser.add_argument("--backend", default="memory", choices=["memory", "compact", "sql"])
+    parser.add_argument("--category-mix", default="grocery", choices=sorted(CATEGORY_MIXES))
+    parser.add_argument("--ops", type=int, default=20_000, help="вызовов на проход микробенчмарка")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--clients", type=int, default=50, help="одновременных клиентов нагрузочного теста")
+    parser.add_argument("--requests", type=int, default=5_000, help="запросов нагрузочного теста")
+    parser.add_argument("--no-load", action="store_true", help="только микробенчмарки")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args(argv)
+
+    report = {"environment": environment(args), "results": []}
+    for size in (int(size) for size in args.sizes.split(",")):
+        start = time.perf_counter()
+        repo = build_repo(args.backend, size, args.category_mix)
+        print(f"{size} кодов ({args.backend}, {args.category_mix}) загружено за {time.perf_counter() - start:.1f} с")
+        # Метрики как у сервиса роутера; отдельное хранилище идемпотентности на размер
+        service = PromocodeService(repo=repo, applied_orders=IdempotencyStore(),
+                                   metrics=promocode_router.promocode_service.metrics)
+        for result in micro_benchmarks(service, size, args.ops, args.repeats, args.category_mix):
+            report["results"].append(result)
+            print(f"  {result['name']:>26}: {result['ns_per_op']:>12,.0f} нс/вызов, "
+                  f"{result['ops_per_sec']:>10,} вызовов/с")
+        if not args.no_load:
+            result = _load_router(service, size, args)
+            report["results"].append(result)
+            print(f"  {'ASGI ' + str(args.clients) + ' клиентов':>26}: {result['rps']:>12,} запросов/с, "
+                  f"p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, p99 {result['p99_ms']} ms, "
+                  f"ошибок {result['errors']}")
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        previous_args = baseline.get("environment", {}).get("args", {})
+        differs = {key for key, value in report["environment"]["args"].items() if previous_args.get(key) != value}
+        if differs:
+            print(f"Внимание: параметры прогонов различаются ({', '.join(sorted(differs))})")
+        for line in compare(report["results"], baseline):
+            print(line)
+    return report
+
+
+def _load_router(service: PromocodeService, size: int, args: argparse.Namespace) -> Dict:
+    # Приложение main с middleware метрик; на время теста роутер обслуживает
+    # сервис с синтетическим хранилищем
+    from promocode_service.main import app
+    original, promocode_router.promocode_service = promocode_router.promocode_service, service
+    try:
+        return asyncio.run(load_test(app, service, size, args.clients, args.requests, args.category_mix))
+    finally:
+        promocode_router.promocode_service = original
+
+
+if __name__ == "__main__":
+    run(sys.argv[1:])
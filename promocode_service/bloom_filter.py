@@ -0,0 +1,87 @@
+import hashlib
+import math
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+
+def _hash_pair(code: str) -> Tuple[int, int]:
+    # Двойное хеширование: k позиций из двух 64-битных половин одного дайджеста
+    digest = int.from_bytes(hashlib.blake2b(code.encode(), digest_size=16).digest(), "little")
+    return digest & 0xFFFFFFFFFFFFFFFF, (digest >> 64) | 1
+
+
+class BloomFilter:
+    """Фильтр Блума по строковым кодам: отрицательный ответ всегда точный"""
+
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        # Запись бита - чтение-изменение-запись байта: без блокировки
+        # параллельные add могут потерять бит и дать ложный отказ
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_codes(cls, codes: Iterable[str], capacity: int, error_rate: float = 0.01) -> "BloomFilter":
+        bloom = cls(capacity, error_rate)
+        bloom.update(codes)
+        return bloom
+
+    def update(self, codes: Iterable[str]):
+        """Массовое добавление без блокировки - только для еще не опубликованного фильтра"""
+        bits, size, hash_count = self._bits, self.size, self.hash_count
+        count = 0
+        for code in codes:
+            h1, h2 = _hash_pair(code)
+            for i in range(hash_count):
+                pos = (h1 + i * h2) % size
+                bits[pos >> 3] |= 1 << (pos & 7)
+            count += 1
+        self.count += count
+
+    def _positions(self, code: str) -> List[int]:
+        h1, h2 = _hash_pair(code)
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hash_count)]
+
+    def add(self, code: str):
+        positions = self._positions(code)
+        bits = self._bits
+        with self._lock:
+            for pos in positions:
+                bits[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, code: str) -> bool:
+        h1, h2 = _hash_pair(code)
+        bits, size = self._bits, self.size
+        for i in range(self.hash_count):
+            pos = (h1 + i * h2) % size
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._bits)
+
+    def is_saturated(self) -> bool:
+        return self.count > self.capacity
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "capacity": self.capacity,
+            "bits": self.size,
+            "hash_count": self.hash_count,
+            "memory_bytes": self.memory_bytes,
+            "expected_error_rate": self.expected_error_rate(),
+        }
+
+    def expected_error_rate(self, count: Optional[int] = None) -> float:
+        count = self.count if count is None else count
+        return (1 - math.exp(-self.hash_count * count / self.size)) ** self.hash_count
@@ -0,0 +1,22 @@
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+EXPIRY_SWEEP_INTERVAL = float(os.getenv("EXPIRY_SWEEP_INTERVAL", "1.0"))
+EXPIRY_SWEEP_BATCH_SIZE = int(os.getenv("EXPIRY_SWEEP_BATCH_SIZE", "1000"))
+
+
+async def run_expiry_sweeper(repo, interval: float = EXPIRY_SWEEP_INTERVAL,
+                             batch_size: int = EXPIRY_SWEEP_BATCH_SIZE):
+    """Фоновая задача: пачками переводит истекшие промокоды в EXPIRED"""
+    while True:
+        try:
+            # Полная пачка означает, что истекших кодов может быть больше -
+            # продолжаем сразу, отдавая управление между пачками
+            while len(await asyncio.to_thread(repo.expire_due, batch_size=batch_size)) >= batch_size:
+                await asyncio.sleep(0)
+        except Exception:
+            logger.exception("Ошибка при истечении промокодов")
+        await asyncio.sleep(interval)
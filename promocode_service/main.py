@@ -1,16 +1,154 @@
+import asyncio
+import logging
+import os
+from contextlib import asynccontextmanager, suppress
+from typing import List
+
 from fastapi import FastAPI
-from promocode_router import router as promocode_router
+from fastapi.responses import JSONResponse, PlainTextResponse
+from .expiry_sweeper import run_expiry_sweeper
+from .promocode_admission import PROMOCODE_ADMISSION, AdmissionMiddleware
+from .promocode_compact_repo import CompactPromocodeRepo
+from .promocode_metrics import PROMOCODE_METRICS, MetricsMiddleware, registry
+from .promocode_repo import PROMOCODE_REPO_BACKEND
+from .promocode_router import router as promocode_router, promocode_service
+from .promocode_service import run_code_filter_refresh
+from .promocode_snapshot import (
+    PROMOCODE_SNAPSHOT_PATH, WarmupGuard, WriteThroughPromocodeRepo, readiness, run_snapshot_catch_up, warm_up,
+)
+from .promocode_write_behind import WriteBehindPromocodeRepo, run_usage_flusher
+
+logger = logging.getLogger(__name__)
+
+# Асинхронные обработчики validate/apply/create и списков с async-драйвером БД
+PROMOCODE_ASYNC = os.getenv("PROMOCODE_ASYNC", "false").lower() == "true"
+
+if PROMOCODE_ASYNC:
+    from .async_promocode_router import (
+        router as async_promocode_router, promocode_service as async_promocode_service
+    )
+
+
+if PROMOCODE_SNAPSHOT_PATH and not isinstance(promocode_service.repo, CompactPromocodeRepo):
+    # Снимок - копия таблицы в колоночном хранилище; с другим хранилищем применения шли бы мимо него
+    raise RuntimeError("PROMOCODE_SNAPSHOT_PATH требует PROMOCODE_REPO_BACKEND=compact")
+
+
+def remember_codes(codes: List[str]):
+    """Коды, догруженные из БД, в фильтры Блума сервисов"""
+    promocode_service._remember_codes(codes)
+    if PROMOCODE_ASYNC:
+        async_promocode_service._remember_codes(codes)
+
+
+def start_repo_tasks(tasks: List[asyncio.Task]):
+    # Фоновое истечение промокодов вместо проверки при каждой валидации
+    tasks.append(asyncio.create_task(run_expiry_sweeper(promocode_service.repo)))
+    if isinstance(promocode_service.repo, WriteBehindPromocodeRepo):
+        tasks.append(asyncio.create_task(run_usage_flusher(promocode_service.repo)))
+    if isinstance(promocode_service.repo, WriteThroughPromocodeRepo):
+        # Коды и списания других экземпляров иначе не видны до перезапуска
+        tasks.append(asyncio.create_task(run_snapshot_catch_up(promocode_service.repo, remember_codes)))
+    if PROMOCODE_REPO_BACKEND in ("sql", "shared"):
+        # Коды пишут и другие воркеры: без пересборки фильтр отвечал бы
+        # "не найден" на них до перезапуска
+        if promocode_service.code_filter is not None:
+            tasks.append(asyncio.create_task(run_code_filter_refresh(
+                lambda: asyncio.to_thread(promocode_service.refresh_code_filter),
+                lambda: asyncio.to_thread(promocode_service.rebuild_code_filter),
+            )))
+        if PROMOCODE_ASYNC and async_promocode_service.use_code_filter:
+            tasks.append(asyncio.create_task(run_code_filter_refresh(
+                async_promocode_service.refresh_code_filter, async_promocode_service.rebuild_code_filter
+            )))
+
+
+async def warm_up_and_start(tasks: List[asyncio.Task]):
+    """Загрузка хранилища из снимка с догрузкой из БД; до конца /health отвечает 503"""
+    from .promocode_sql_repo import SqlPromocodeRepo
+    try:
+        source = await asyncio.to_thread(SqlPromocodeRepo)
+        store = await asyncio.to_thread(warm_up, PROMOCODE_SNAPSHOT_PATH, source, readiness)
+        # Чтения из памяти, записи и списания - через БД: они переживают перезапуск
+        repo = WriteThroughPromocodeRepo(store, source, readiness.checkpoint)
+        await asyncio.to_thread(promocode_service.replace_repo, repo)
+        if PROMOCODE_ASYNC:
+            async_promocode_service.repo.repo = repo
+            if async_promocode_service.use_code_filter:
+                await async_promocode_service.rebuild_code_filter()
+    except Exception as error:
+        logger.exception("Прогрев хранилища не удался")
+        readiness.stage, readiness.error = "failed", repr(error)
+        return
+    start_repo_tasks(tasks)
+    readiness.stage = "ready"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if PROMOCODE_ASYNC:
+        await async_promocode_service.start()
+    tasks: List[asyncio.Task] = []
+    if PROMOCODE_SNAPSHOT_PATH:
+        # Прогрев в фоне: сервер сразу отвечает на /health, трафик идет после готовности
+        tasks.append(asyncio.create_task(warm_up_and_start(tasks)))
+    else:
+        start_repo_tasks(tasks)
+    yield
+    for task in tasks:
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    if PROMOCODE_ASYNC:
+        await async_promocode_service.drain()
+
 
 app = FastAPI(
     title="Promocode Service",
     description="Сервис управления промокодами для системы доставки продуктов",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+if PROMOCODE_ASYNC:
+    # Маршруты async-роутера совпадают с синхронными и имеют приоритет
+    app.include_router(async_promocode_router)
 app.include_router(promocode_router)
 
+if PROMOCODE_SNAPSHOT_PATH:
+    app.add_middleware(WarmupGuard, state=readiness)
+
+if PROMOCODE_ADMISSION:
+    # Полосы приоритетов и ведра клиентов; отказы видны в метриках
+    app.add_middleware(AdmissionMiddleware, registry=registry if PROMOCODE_METRICS else None)
+
+
+def add_metrics(app: FastAPI):
+    """Middleware длительности запросов, датчики и GET /metrics"""
+    app.add_middleware(MetricsMiddleware, registry=registry)
+    # Датчики читаются при каждом обращении к /metrics; count SQL-хранилища - один запрос
+    registry.gauge("promocode_repo_size", "Число промокодов в хранилище", lambda: promocode_service.repo.count())
+    registry.gauge("promocode_rule_cache_size", "Скомпилированные правила в кеше", lambda: len(promocode_service.rules))
+    registry.gauge("promocode_applied_orders_size", "Результаты применений в памяти",
+                   lambda: len(promocode_service.applied_orders))
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def metrics():
+        """Метрики в текстовом формате Prometheus"""
+        return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
+if PROMOCODE_METRICS:
+    add_metrics(app)
+
 @app.get("/health")
 def health_check():
+    if not readiness.ready:
+        # Проба готовности: балансировщик не направляет трафик, пока хранилище не прогрето
+        return JSONResponse(status_code=503, content={
+            "status": "starting" if readiness.stage != "failed" else "failed", "service": "promocode",
+            "warmup": readiness.as_dict(),
+        })
     return {"status": "healthy", "service": "promocode"}
 
 @app.get("/")
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List
 from uuid import UUID, uuid4
 from datetime import datetime
@@ -40,12 +40,52 @@ class CreatePromocodeRequest(BaseModel):
     max_usages: int = 1
     applicable_categories: List[str] = []
 
+class GeneratePromocodesRequest(BaseModel):
+    """Шаблон массовой генерации: общие условия, уникальные случайные коды"""
+    prefix: str = ""
+    code_length: int = Field(default=10, ge=6, le=32)
+    count: int = Field(ge=1, le=1_000_000)
+    return_codes: bool = True
+    user_id: UUID
+    discount_type: DiscountType
+    discount_value: float
+    min_order_amount: float = 0.0
+    max_discount: Optional[float] = None
+    expires_at: datetime
+    max_usages: int = 1
+    applicable_categories: List[str] = []
+
+class SignedPromocodesRequest(BaseModel):
+    """Выпуск подписанных кодов: условия зашиты в код, строки в хранилище не создаются.
+
+    Суммы хранятся в копейках в 32 битах; max_usages=0 - без лимита и без
+    счетчика применений. Ограничение по категориям не поддерживается.
+    """
+    count: int = Field(default=1, ge=1, le=1_000_000)
+    user_id: Optional[UUID] = None
+    discount_type: DiscountType
+    discount_value: float = Field(gt=0, le=1_000_000)
+    min_order_amount: float = Field(default=0.0, ge=0, le=10_000_000)
+    max_discount: Optional[float] = Field(default=None, ge=0, le=10_000_000)
+    expires_at: datetime
+    max_usages: int = Field(default=1, ge=0, le=65535)
+
 class ValidatePromocodeRequest(BaseModel):
     promo_code: str
     user_id: UUID
     order_amount: float
     categories: List[str] = []
 
+class ValidatePromocodeBatchRequest(BaseModel):
+    items: List[ValidatePromocodeRequest] = Field(min_length=1, max_length=100)
+
+class BestPromocodeRequest(BaseModel):
+    """Корзина для подбора самых выгодных промокодов пользователя"""
+    user_id: UUID
+    order_amount: float
+    categories: List[str] = []
+    limit: int = Field(default=10, ge=1, le=1000)
+
 class ApplyPromocodeRequest(BaseModel):
     promo_code: str
     user_id: UUID
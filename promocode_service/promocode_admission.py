@@ -0,0 +1,321 @@
+import asyncio
+import json
+import math
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, FrozenSet, List, Optional, Tuple
+from uuid import UUID
+from .promocode_metrics import Counter, MetricsRegistry, format_labels
+
+PROMOCODE_ADMISSION = os.getenv("PROMOCODE_ADMISSION", "true").lower() == "true"
+# Одновременные запросы и очередь ожидания по полосам; 0 - без ограничения.
+# Полоса checkout (validate, apply) не ограничивается: ее защищают лимиты остальных
+PROMOCODE_NORMAL_CONCURRENCY = int(os.getenv("PROMOCODE_NORMAL_CONCURRENCY", "32"))
+PROMOCODE_NORMAL_QUEUE = int(os.getenv("PROMOCODE_NORMAL_QUEUE", "64"))
+PROMOCODE_LOW_CONCURRENCY = int(os.getenv("PROMOCODE_LOW_CONCURRENCY", "2"))
+PROMOCODE_LOW_QUEUE = int(os.getenv("PROMOCODE_LOW_QUEUE", "8"))
+# Глубина (запросы в работе и в очередях всех полос), выше которой списки сразу
+# получают 503; обычные запросы - выше удвоенной
+PROMOCODE_SHED_DEPTH = int(os.getenv("PROMOCODE_SHED_DEPTH", "64"))
+PROMOCODE_QUEUE_TIMEOUT = float(os.getenv("PROMOCODE_QUEUE_TIMEOUT", "2.0"))
+PROMOCODE_RETRY_AFTER = int(os.getenv("PROMOCODE_RETRY_AFTER", "1"))
+# Ведро токенов на пользователя для маршрутов, которыми перебирают коды; 0 отключает.
+# Пользователь - заголовок, который ставит шлюз после аутентификации, если
+# соединение пришло с адреса из PROMOCODE_TRUSTED_PROXIES (через запятую), иначе
+# user_id из тела checkout-запроса. Адрес соединения не годится: сервис вызывают
+# другие бэкенды, и все пользователи одного пода делили бы одно ведро. Запрос
+# без пользователя (например, GET кода без доверенного шлюза) ведром не ограничен
+PROMOCODE_USER_RATE = float(os.getenv("PROMOCODE_USER_RATE", "20"))
+PROMOCODE_USER_BURST = float(os.getenv("PROMOCODE_USER_BURST", "40"))
+PROMOCODE_USER_HEADER = os.getenv("PROMOCODE_USER_HEADER", "x-user-id").lower().encode()
+PROMOCODE_TRUSTED_PROXIES = frozenset(
+    address.strip() for address in os.getenv("PROMOCODE_TRUSTED_PROXIES", "").split(",") if address.strip()
+)
+PROMOCODE_USER_BUCKETS = int(os.getenv("PROMOCODE_USER_BUCKETS", "100000"))
+
+CRITICAL, NORMAL, LOW = "critical", "normal", "low"
+ADMISSION_REJECTED = "promocode_admission_rejected_total"
+
+PREFIX = "/api/v1/promocodes"
+# (метод, путь или префикс со *, полоса, ведро клиента); остальные пути API - обычная полоса с ведром
+ROUTE_RULES: List[Tuple[str, str, str, bool]] = [
+    ("POST", f"{PREFIX}/validate", CRITICAL, True),
+    ("POST", f"{PREFIX}/validate/batch", CRITICAL, True),
+    ("POST", f"{PREFIX}/best", CRITICAL, True),
+    ("POST", f"{PREFIX}/apply", CRITICAL, True),
+    ("POST", f"{PREFIX}/", NORMAL, False),
+    ("POST", f"{PREFIX}/signed", NORMAL, False),
+    ("POST", f"{PREFIX}/generate", LOW, False),
+    ("POST", f"{PREFIX}/import", LOW, False),
+    ("GET", f"{PREFIX}/active", LOW, False),
+    ("GET", f"{PREFIX}/search", LOW, False),
+    ("GET", f"{PREFIX}/cache/stats", LOW, False),
+    ("GET", f"{PREFIX}/user/*", LOW, False),
+]
+# Маршруты с user_id в теле: None - в самом теле, иначе в каждом элементе списка
+# в этом поле; пакет платит по токену за элемент
+BODY_USER_ROUTES: Dict[Tuple[str, str], Optional[str]] = {
+    ("POST", f"{PREFIX}/validate"): None,
+    ("POST", f"{PREFIX}/validate/batch"): "items",
+    ("POST", f"{PREFIX}/best"): None,
+    ("POST", f"{PREFIX}/apply"): None,
+}
+
+
+class Lane:
+    """Полоса приоритета: limit запросов в работе и очередь не длиннее queue.
+
+    Живет в цикле событий без блокировок: счетчики меняются только между await.
+    Освободившееся место передается первому ожидающему напрямую.
+    """
+
+    def __init__(self, name: str, limit: int = 0, queue: int = 0, shed_depth: int = 0):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.shed_depth = shed_depth
+        self.active = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+    async def enter(self, timeout: float) -> bool:
+        """True, если место получено; False - очередь полна или ожидание истекло"""
+        if not self.limit or (self.active < self.limit and not self.waiters):
+            self.active += 1
+            return True
+        if len(self.waiters) >= self.queue:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return self._abandon(waiter)
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self.leave()
+            raise
+
+    def leave(self):
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def _abandon(self, waiter: asyncio.Future) -> bool:
+        """Уход из очереди; True, если место уже было передано этому ожидающему"""
+        if waiter.done():
+            return True
+        waiter.cancel()
+        self.waiters.remove(waiter)
+        return False
+
+
+class TokenBuckets:
+    """Ведра токенов по клиентам: rate запросов в секунду, запас до burst"""
+
+    def __init__(self, rate: float, burst: float, max_clients: int = PROMOCODE_USER_BUCKETS):
+        self.rate = rate
+        self.burst = burst
+        self.max_clients = max_clients
+        self._buckets: Dict[bytes, List[float]] = {}
+
+    def take(self, client: bytes, now: float, cost: float = 1) -> float:
+        """0, если токены взяты, иначе секунды до следующего токена.
+
+        Запрос дороже запаса допускается при хотя бы одном токене и уводит
+        ведро в долг: следующие запросы клиента ждут, пока долг не погасится.
+        """
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._purge(now)
+            self._buckets[client] = [self.burst - cost, now]
+            return 0.0
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - cost
+            return 0.0
+        bucket[0] = tokens
+        return (1 - tokens) / self.rate
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def _purge(self, now: float):
+        # Полное ведро ничего не помнит: его удаление не меняет решений
+        for client in [client for client, (tokens, updated) in self._buckets.items()
+                       if tokens + (now - updated) * self.rate >= self.burst]:
+            del self._buckets[client]
+        if len(self._buckets) >= self.max_clients:
+            # Все ведра расходуются: забываются самые старые клиенты
+            for client in list(self._buckets)[:len(self._buckets) // 2]:
+                del self._buckets[client]
+
+
+class AdmissionMiddleware:
+    """ASGI-middleware допуска запросов API: полосы приоритетов и ведра клиентов.
+
+    Checkout (validate, apply, best) не ограничивается, тяжелые списки и
+    выгрузки получают немного мест в пуле потоков. Когда общая глубина выше
+    порога, списки, а затем и обычные запросы сразу получают 503 с
+    Retry-After, не занимая очередь. Перебор кодов одним пользователем
+    упирается в его ведро токенов и получает 429; пакетная проверка платит
+    за каждый код пакета.
+    """
+
+    def __init__(self, app, lanes: Optional[Dict[str, Lane]] = None,
+                 buckets: Optional[TokenBuckets] = None, rules: List[Tuple[str, str, str, bool]] = ROUTE_RULES,
+                 queue_timeout: float = PROMOCODE_QUEUE_TIMEOUT, retry_after: int = PROMOCODE_RETRY_AFTER,
+                 user_header: bytes = PROMOCODE_USER_HEADER,
+                 trusted_proxies: FrozenSet[str] = PROMOCODE_TRUSTED_PROXIES,
+                 body_routes: Dict[Tuple[str, str], Optional[str]] = BODY_USER_ROUTES,
+                 registry: Optional[MetricsRegistry] = None):
+        self.app = app
+        self.lanes = lanes if lanes is not None else default_lanes()
+        self.buckets = buckets if buckets is not None else (
+            TokenBuckets(PROMOCODE_USER_RATE, PROMOCODE_USER_BURST) if PROMOCODE_USER_RATE > 0 else None
+        )
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.user_header = user_header
+        self.trusted_proxies = frozenset(trusted_proxies)
+        self.body_routes = body_routes
+        self._exact = {(method, path): (lane, throttled) for method, path, lane, throttled in rules
+                       if not path.endswith("*")}
+        self._prefixes = [(method, path[:-1], lane, throttled) for method, path, lane, throttled in rules
+                          if path.endswith("*")]
+        self.rejected: Dict[Tuple[str, str], Counter] = {}
+        if registry is not None:
+            registry.counter(ADMISSION_REJECTED, "Запросы, отклоненные контролем допуска")
+            for lane in self.lanes:
+                for reason in ("shed", "queue", "throttled"):
+                    self.rejected[(lane, reason)] = registry.counter_for(
+                        ADMISSION_REJECTED, format_labels(lane=lane, reason=reason)
+                    )
+
+    def classify(self, method: str, path: str) -> Tuple[str, bool]:
+        """Полоса маршрута и признак ведра клиента"""
+        found = self._exact.get((method, path))
+        if found is not None:
+            return found
+        for rule_method, prefix, lane, throttled in self._prefixes:
+            if method == rule_method and path.startswith(prefix):
+                return lane, throttled
+        return NORMAL, True
+
+    def depth(self) -> int:
+        return sum(lane.active + len(lane.waiters) for lane in self.lanes.values())
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(PREFIX):
+            await self.app(scope, receive, send)
+            return
+        name, throttled = self.classify(scope["method"], scope["path"])
+        if throttled and self.buckets is not None:
+            charges, receive = await self._charges(scope, receive)
+            now = time.monotonic()
+            wait = max([self.buckets.take(user, now, cost) for user, cost in charges.items()], default=0)
+            if wait:
+                await self._reject(send, name, "throttled", 429, "Слишком много запросов", math.ceil(wait))
+                return
+        lane = self.lanes[name]
+        if lane.shed_depth and self.depth() >= lane.shed_depth:
+            await self._reject(send, name, "shed", 503, "Сервис перегружен, повторите позже", self.retry_after)
+            return
+        if not await lane.enter(self.queue_timeout):
+            await self._reject(send, name, "queue", 503, "Сервис перегружен, повторите позже", self.retry_after)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.leave()
+
+    async def _charges(self, scope, receive) -> Tuple[Dict[bytes, int], object]:
+        """Токены к списанию по ведрам пользователей и receive для приложения"""
+        header_user = self._trusted_user(scope)
+        route = (scope["method"], scope["path"])
+        if route not in self.body_routes:
+            return ({header_user: 1} if header_user is not None else {}), receive
+        field = self.body_routes[route]
+        body, receive = await self._read_body(receive)
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            payload = None
+        items = payload.get(field) if field is not None and isinstance(payload, dict) else [payload]
+        if not isinstance(items, list):
+            # Неразборчивое тело отклонит валидация
+            items = [None]
+        if header_user is not None:
+            return {header_user: max(len(items), 1)}, receive
+        charges: Dict[bytes, int] = {}
+        for item in items:
+            user = self._body_user(item)
+            if user is not None:
+                charges[user] = charges.get(user, 0) + 1
+        return charges, receive
+
+    def _trusted_user(self, scope) -> Optional[bytes]:
+        client = scope.get("client")
+        if client is None or client[0] not in self.trusted_proxies:
+            return None
+        for name, value in scope["headers"]:
+            if name == self.user_header:
+                return value
+        return None
+
+    @staticmethod
+    def _body_user(item) -> Optional[bytes]:
+        # Разные записи одного UUID (регистр, дефисы) попадают в одно ведро
+        try:
+            return UUID(item["user_id"]).bytes
+        except (TypeError, KeyError, ValueError, AttributeError):
+            return None
+
+    @staticmethod
+    async def _read_body(receive):
+        """Тело запроса и receive, заново отдающий прочитанное.
+
+        Тела checkout-запросов малы (пакет ограничен сотней кодов), поэтому
+        читаются целиком.
+        """
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                # Клиент отключился: приложение увидит то же сообщение
+                pending = [message]
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                pending = [{"type": "http.request", "body": b"".join(chunks), "more_body": False}]
+                break
+
+        async def replay():
+            return pending.pop() if pending else await receive()
+
+        return b"".join(chunks), replay
+
+    async def _reject(self, send, lane: str, reason: str, status: int, detail: str, retry_after: int):
+        counter = self.rejected.get((lane, reason))
+        if counter is not None:
+            counter.inc()
+        body = json.dumps({"detail": detail}, ensure_ascii=False).encode()
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(retry_after).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def default_lanes() -> Dict[str, Lane]:
+    return {
+        CRITICAL: Lane(CRITICAL),
+        NORMAL: Lane(NORMAL, PROMOCODE_NORMAL_CONCURRENCY, PROMOCODE_NORMAL_QUEUE, PROMOCODE_SHED_DEPTH * 2),
+        LOW: Lane(LOW, PROMOCODE_LOW_CONCURRENCY, PROMOCODE_LOW_QUEUE, PROMOCODE_SHED_DEPTH),
+    }
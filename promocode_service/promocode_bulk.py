@@ -0,0 +1,121 @@
+import csv
+import json
+import os
+import secrets
+from typing import AsyncIterator, Dict, List, Optional
+from pydantic import ValidationError
+from .models import CreatePromocodeRequest
+
+# Без 0/O и 1/I: коды диктуют по телефону и печатают на листовках.
+# 32 символа - каждый случайный байт дает символ без смещения (256 % 32 == 0)
+CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"
+_BYTE_TO_CODE_CHAR = bytes(ord(CODE_ALPHABET[i % len(CODE_ALPHABET)]) for i in range(256))
+
+BULK_BATCH_SIZE = int(os.getenv("PROMOCODE_BULK_BATCH_SIZE", "10000"))
+IMPORT_MAX_REPORTED_ERRORS = 100
+IMPORT_FORMATS = ("csv", "jsonl")
+# Префикс подписанных кодов закрыт для обычных: создание, генерация и импорт отклоняются
+RESERVED_PREFIX = "Коды с префиксом {} зарезервированы за подписанными промокодами"
+
+
+def generate_codes(prefix: str, length: int, count: int) -> List[str]:
+    """count случайных кодов prefix + length символов из CODE_ALPHABET (без проверки уникальности)"""
+    chars = secrets.token_bytes(length * count).translate(_BYTE_TO_CODE_CHAR).decode("ascii")
+    return [prefix + chars[i:i + length] for i in range(0, length * count, length)]
+
+
+class ImportRowParser:
+    """Построчный разбор JSONL или CSV с заголовком в поля CreatePromocodeRequest.
+
+    В CSV категории перечисляются через "|", пустая ячейка означает значение
+    по умолчанию. Переводы строк внутри ячеек не поддерживаются.
+    """
+
+    def __init__(self, fmt: str):
+        if fmt not in IMPORT_FORMATS:
+            raise ValueError(f"Неизвестный формат импорта: {fmt}")
+        self.fmt = fmt
+        self._header: Optional[List[str]] = None
+
+    def parse(self, line: str) -> Optional[dict]:
+        line = line.strip()
+        if not line:
+            return None
+        if self.fmt == "jsonl":
+            row = json.loads(line)
+            if not isinstance(row, dict):
+                raise ValueError("Строка JSONL должна быть объектом")
+            return row
+
+        values = next(csv.reader([line]))
+        if self._header is None:
+            self._header = [name.strip() for name in values]
+            return None
+        row = {name: value for name, value in zip(self._header, values) if value != ""}
+        if "applicable_categories" in row:
+            row["applicable_categories"] = [c for c in row["applicable_categories"].split("|") if c]
+        return row
+
+
+class PromocodeImport:
+    """Состояние потокового импорта: проверка строк, накопление пачек и итоги"""
+
+    def __init__(self, fmt: str, reserved_prefix: str = ""):
+        self.parser = ImportRowParser(fmt)
+        # Префикс подписанных кодов: такие строки отклоняются как ошибочные
+        self.reserved_prefix = reserved_prefix
+        self.line_number = 0
+        self.created = 0
+        self.duplicates = 0
+        self.error_count = 0
+        self.errors: List[Dict] = []
+        # Пачка для вставки: код -> поля без кода; повторы внутри пачки отсеиваются сразу
+        self.pending: Dict[str, dict] = {}
+
+    def add_line(self, line: str) -> bool:
+        """Разбор очередной строки; True, когда накопилась полная пачка"""
+        self.line_number += 1
+        try:
+            row = self.parser.parse(line)
+            if row is None:
+                return False
+            request = CreatePromocodeRequest(**row)
+            if self.reserved_prefix and request.code.startswith(self.reserved_prefix):
+                raise ValueError(RESERVED_PREFIX.format(self.reserved_prefix))
+        except (ValueError, TypeError, ValidationError) as e:
+            self.error_count += 1
+            if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+                self.errors.append({"line": self.line_number, "message": str(e)})
+            return False
+
+        if request.code in self.pending:
+            self.duplicates += 1
+        else:
+            self.pending[request.code] = request.model_dump(exclude={"code"})
+        return len(self.pending) >= BULK_BATCH_SIZE
+
+    def take_batch(self) -> Dict[str, dict]:
+        batch, self.pending = self.pending, {}
+        return batch
+
+    def result(self) -> Dict:
+        return {
+            "status": "imported",
+            "lines": self.line_number,
+            "created": self.created,
+            "duplicates": self.duplicates,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Строки тела запроса по мере поступления, без чтения всего файла в память"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8")
+    if buffer:
+        yield buffer.decode("utf-8")
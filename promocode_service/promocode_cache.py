@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from .models import Promocode
+
+PROMOCODE_CACHE_SIZE = int(os.getenv("PROMOCODE_CACHE_SIZE", "10000"))
+PROMOCODE_CACHE_TTL = float(os.getenv("PROMOCODE_CACHE_TTL", "30"))
+PROMOCODE_CACHE_NEGATIVE_TTL = float(os.getenv("PROMOCODE_CACHE_NEGATIVE_TTL", "5"))
+
+_MISSING = object()
+
+
+class PromocodeCache:
+    """LRU-кеш промокодов с TTL на запись и кешированием отсутствующих кодов"""
+
+    def __init__(self, max_size: int = PROMOCODE_CACHE_SIZE, ttl: float = PROMOCODE_CACHE_TTL,
+                 negative_ttl: float = PROMOCODE_CACHE_NEGATIVE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries: "OrderedDict[str, Tuple[float, Optional[Promocode]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Поколения инвалидаций: загрузка, начатая до инвалидации кода,
+        # не должна положить в кеш устаревшее значение
+        self._generation = 0
+        self._invalidated: "OrderedDict[str, int]" = OrderedDict()
+        self._forgotten_generation = 0
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, code: str):
+        """Значение из кеша, None для закешированного отсутствия или _MISSING"""
+        with self._lock:
+            entry = self._entries.get(code)
+            if entry is None:
+                self.misses += 1
+                return _MISSING
+            expires_at, promocode = entry
+            if expires_at <= time.monotonic():
+                del self._entries[code]
+                self.expirations += 1
+                self.misses += 1
+                return _MISSING
+            self._entries.move_to_end(code)
+            if promocode is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return promocode
+
+    def begin_load(self) -> int:
+        return self._generation
+
+    def put(self, code: str, promocode: Optional[Promocode], load_generation: int):
+        ttl = self.ttl if promocode is not None else self.negative_ttl
+        with self._lock:
+            if load_generation < self._forgotten_generation \
+                    or self._invalidated.get(code, -1) >= load_generation:
+                return
+            self._entries[code] = (time.monotonic() + ttl, promocode)
+            self._entries.move_to_end(code)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, code: str):
+        with self._lock:
+            self._invalidated[code] = self._generation
+            self._invalidated.move_to_end(code)
+            self._generation += 1
+            if len(self._invalidated) > self.max_size:
+                _, generation = self._invalidated.popitem(last=False)
+                self._forgotten_generation = generation + 1
+            if self._entries.pop(code, None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "hit_rate": round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+        }
+
+
+class CachedPromocodeRepo:
+    """Read-through кеш перед репозиторием промокодов.
+
+    Все изменения кода проходят через методы репозитория, поэтому
+    инвалидация точная: сбрасывается только измененный код.
+    """
+
+    def __init__(self, repo, cache: Optional[PromocodeCache] = None):
+        self.repo = repo
+        self.cache = cache or PromocodeCache()
+
+    def get_by_code(self, code: str) -> Optional[Promocode]:
+        cached = self.cache.get(code)
+        if cached is not _MISSING:
+            return cached
+        generation = self.cache.begin_load()
+        promocode = self.repo.get_by_code(code)
+        self.cache.put(code, promocode, generation)
+        return promocode
+
+    def get_many_by_codes(self, codes: Iterable[str]) -> Dict[str, Promocode]:
+        found: Dict[str, Promocode] = {}
+        missing: List[str] = []
+        for code in set(codes):
+            cached = self.cache.get(code)
+            if cached is _MISSING:
+                missing.append(code)
+            elif cached is not None:
+                found[code] = cached
+        if missing:
+            generation = self.cache.begin_load()
+            loaded = self.repo.get_many_by_codes(missing)
+            for code in missing:
+                self.cache.put(code, loaded.get(code), generation)
+            found.update(loaded)
+        return found
+
+    def add_promocode(self, promocode: Promocode) -> Promocode:
+        try:
+            return self.repo.add_promocode(promocode)
+        finally:
+            self.cache.invalidate(promocode.code)
+
+    def add_promocodes(self, promocodes: Iterable[Promocode]) -> List[Promocode]:
+        promocodes = list(promocodes)
+        try:
+            return self.repo.add_promocodes(promocodes)
+        finally:
+            for promocode in promocodes:
+                self.cache.invalidate(promocode.code)
+
+    def create_promocode(self, promocode_data: dict) -> Promocode:
+        try:
+            return self.repo.create_promocode(promocode_data)
+        finally:
+            # Сбрасывает закешированное "не найдено" для нового кода
+            self.cache.invalidate(promocode_data["code"])
+
+    def update_promocode(self, promocode: Promocode) -> Promocode:
+        try:
+            return self.repo.update_promocode(promocode)
+        finally:
+            self.cache.invalidate(promocode.code)
+
+    def consume_usage(self, code: str, now: Optional[datetime] = None) -> Optional[Promocode]:
+        try:
+            return self.repo.consume_usage(code, now)
+        finally:
+            self.cache.invalidate(code)
+
+    def increment_usages(self, counts: Dict[str, int], batch_id: Optional[str] = None) -> bool:
+        try:
+            return self.repo.increment_usages(counts, batch_id)
+        finally:
+            for code in counts:
+                self.cache.invalidate(code)
+
+    def expire_due(self, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> List[str]:
+        expired = self.repo.expire_due(now, batch_size)
+        for code in expired:
+            self.cache.invalidate(code)
+        return expired
+
+    def __getattr__(self, name):
+        # Остальные методы (списки, count) идут в репозиторий напрямую
+        return getattr(self.repo, name)
@@ -0,0 +1,137 @@
+import heapq
+import math
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import filterfalse, islice
+from typing import Callable, Iterator, List, Optional, Set
+
+# Хвост новых элементов вливается в основной массив, когда он длиннее корня
+# из размера массива, но не раньше этой длины
+MIN_PENDING = 256
+
+
+class SortedCodeIndex:
+    """Элементы по возрастанию кода: упорядоченный основной массив и хвост новых.
+
+    Добавление - дописывание в хвост. Короткий хвост при чтении сортируется
+    отдельно (почти упорядоченный - за линейное время) и просматривается
+    вместе с основным массивом, длинный вливается в массив: позиции новых
+    элементов находятся бинарным поиском, массив собирается срезами. Поиск
+    по префиксу - два bisect и проход только по совпадениям, поэтому создание
+    кода между поисками не заставляет пересортировывать весь индекс.
+    Удаление симметрично: элемент попадает в множество удаленных, которое
+    чтение пропускает, и выбрасывается из массива при следующем вливании.
+
+    Элемент - сам код (key=None) или номер строки, код которой возвращает
+    key; typecode - массив array вместо списка для номеров строк. Блокировки
+    на стороне владельца: методы вызываются под его индексной блокировкой.
+    """
+
+    def __init__(self, key: Optional[Callable] = None, typecode: Optional[str] = None, items=None):
+        self.key = key
+        self.typecode = typecode
+        self._items = items if items is not None else self._empty()
+        self._pending: List = []
+        self._pending_sorted = True
+        self._removed: Set = set()
+
+    def add(self, item):
+        """Добавление элемента, которого нет в индексе"""
+        if item in self._removed:
+            # Удаленный элемент еще лежит в массиве или хвосте: достаточно снять отметку
+            self._removed.discard(item)
+            return
+        self._pending.append(item)
+        self._pending_sorted = False
+
+    def discard(self, item):
+        """Удаление элемента, который есть в индексе"""
+        self._removed.add(item)
+
+    def __len__(self) -> int:
+        return len(self._items) + len(self._pending) - len(self._removed)
+
+    def memory_bytes(self) -> int:
+        """Байты основного массива номеров и ссылок хвоста (для списка кодов - без самих строк)"""
+        itemsize = self._items.itemsize if self.typecode else 8
+        return len(self._items) * itemsize + (len(self._pending) + len(self._removed)) * 8
+
+    def items(self):
+        """Все элементы по порядку одним массивом (хвост вливается)"""
+        self._merge()
+        return self._items
+
+    def iter_from(self, start=None, inclusive: bool = False) -> Iterator:
+        """Элементы с кодом после start (или начиная с него при inclusive) по возрастанию"""
+        self._prepare()
+        stream = self._tail_of(self._items, start, inclusive)
+        if self._pending:
+            stream = heapq.merge(stream, self._tail_of(self._pending, start, inclusive), key=self.key)
+        if self._removed:
+            stream = filterfalse(self._removed.__contains__, stream)
+        return stream
+
+    def search_prefix(self, prefix, after=None, limit: int = 100) -> List:
+        """До limit элементов, чей код начинается с prefix, после кода after"""
+        key = self.key or _same
+        if after is not None and after >= prefix:
+            matches = self.iter_from(after)
+        else:
+            matches = self.iter_from(prefix, inclusive=True)
+        result = []
+        for item in islice(matches, limit):
+            if not key(item).startswith(prefix):
+                break
+            result.append(item)
+        return result
+
+    def _tail_of(self, items, start, inclusive: bool):
+        if start is None:
+            position = 0
+        else:
+            position = (bisect_left if inclusive else bisect_right)(items, start, key=self.key)
+        # islice пропускал бы начало по одному элементу; индексы начинают сразу с позиции
+        return map(items.__getitem__, range(position, len(items)))
+
+    def _prepare(self):
+        limit = max(MIN_PENDING, math.isqrt(len(self._items)))
+        if len(self._pending) > limit or len(self._removed) > limit:
+            self._merge()
+        elif not self._pending_sorted:
+            self._pending.sort(key=self.key)
+            self._pending_sorted = True
+
+    def _merge(self):
+        if self._removed:
+            removed = self._removed.__contains__
+            kept = filterfalse(removed, self._items)
+            self._items = array(self.typecode, kept) if self.typecode else list(kept)
+            self._pending = list(filterfalse(removed, self._pending))
+            self._removed = set()
+        if not self._pending:
+            return
+        items, pending = self._items, self._pending
+        pending.sort(key=self.key)
+        if len(pending) * 8 > len(items):
+            # Хвост сравним с массивом: дешевле одна сортировка двух упорядоченных отрезков
+            merged = sorted(list(items) + pending, key=self.key)
+            self._items = array(self.typecode, merged) if self.typecode else merged
+        else:
+            key = self.key or _same
+            merged, previous = self._empty(), 0
+            for item in pending:
+                position = bisect_right(items, key(item), lo=previous, key=self.key)
+                merged += items[previous:position]
+                merged.append(item)
+                previous = position
+            merged += items[previous:]
+            self._items = merged
+        self._pending = []
+        self._pending_sorted = True
+
+    def _empty(self):
+        return array(self.typecode) if self.typecode else []
+
+
+def _same(item):
+    return item
@@ -0,0 +1,550 @@
+import math
+import threading
+from array import array
+from bisect import bisect_right
+from itertools import islice
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID, uuid4
+from .models import DiscountType, Promocode, PromocodeStatus
+from .promocode_code_index import SortedCodeIndex
+
+USAGE_LOCK_STRIPES = 64
+
+# Номер строки в массивах "I": пустая ячейка хеш-таблицы и конец списка
+NO_ROW = 0xFFFFFFFF
+
+# Колонки-массивы строк, которые сохраняются в снимок как есть
+SNAPSHOT_COLUMNS = (
+    "user", "next_user_row", "user_last_row", "discount_type", "discount_value", "min_order_amount",
+    "max_discount", "expires_at", "created_at", "usage_count", "max_usages", "status", "category_set",
+)
+
+# Перечисления хранятся целочисленными кодами, даты - микросекундами от эпохи
+_STATUSES = list(PromocodeStatus)
+_STATUS_IDS = {status: i for i, status in enumerate(_STATUSES)}
+_ACTIVE = _STATUS_IDS[PromocodeStatus.ACTIVE]
+_EXPIRED = _STATUS_IDS[PromocodeStatus.EXPIRED]
+_USED = _STATUS_IDS[PromocodeStatus.USED]
+# Таблица bytes.translate: байт статуса -> 1 для активного
+_IS_ACTIVE = bytes(int(status == _ACTIVE) for status in range(256))
+_DISCOUNT_TYPES = list(DiscountType)
+_DISCOUNT_TYPE_IDS = {discount_type: i for i, discount_type in enumerate(_DISCOUNT_TYPES)}
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_epoch_us(value: datetime) -> int:
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _from_epoch_us(value: int) -> datetime:
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def _merge_expiry(keys: array, rows: array, position: int,
+                  pending_keys: array, pending_rows: array) -> Tuple[array, array]:
+    """Очередь истечения с позиции position и влитая в нее пачка новых записей.
+
+    Сортируется только пачка; места ее записей находятся бинарным поиском,
+    очередь собирается срезами, как в SortedCodeIndex._merge.
+    """
+    merged_keys, merged_rows = array("q"), array("I")
+    previous = position
+    for i in sorted(range(len(pending_keys)), key=pending_keys.__getitem__):
+        key = pending_keys[i]
+        at = bisect_right(keys, key, lo=previous)
+        merged_keys += keys[previous:at]
+        merged_rows += rows[previous:at]
+        merged_keys.append(key)
+        merged_rows.append(pending_rows[i])
+        previous = at
+    merged_keys += keys[previous:]
+    merged_rows += rows[previous:]
+    return merged_keys, merged_rows
+
+
+class StringTable:
+    """Таблица строк: байты в одном буфере, смещения и хеш-индекс в массивах.
+
+    Номер строки - порядок добавления. На строку уходят ее байты и около
+    32 байт массивов вместо объекта str, записи словаря и объекта int.
+    """
+
+    def __init__(self):
+        self._data = bytearray()
+        self._offsets = array("Q", [0])
+        self._hashes = array("q")
+        # Открытая адресация с линейным пробированием, заполнение не выше 1/2
+        self._slots = array("I", [NO_ROW]) * 16
+
+    @classmethod
+    def from_buffers(cls, data: bytearray, offsets: array) -> "StringTable":
+        """Таблица из сохраненных байтов и смещений; хеш-индекс строится заново,
+        так как hash() bytes зависит от PYTHONHASHSEED процесса"""
+        table = cls()
+        table._data, table._offsets = data, offsets
+        keys = bytes(data)
+        table._hashes = array("q", map(hash, map(keys.__getitem__, map(slice, offsets, offsets[1:]))))
+        size = 16
+        while size < len(table._hashes) * 2:
+            size *= 2
+        table._slots = table._build_slots(size)
+        return table
+
+    def buffers(self) -> Tuple[bytearray, array]:
+        """Копии байтов строк и смещений для снимка"""
+        return self._data[:], self._offsets[:]
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def __getitem__(self, index: int) -> bytes:
+        return bytes(self._data[self._offsets[index]:self._offsets[index + 1]])
+
+    def find(self, key: bytes) -> int:
+        """Номер строки или NO_ROW"""
+        return self._slots[self._probe(key, hash(key))]
+
+    def add(self, key: bytes) -> int:
+        """Номер строки; новая строка дописывается в конец таблицы"""
+        key_hash = hash(key)
+        slot = self._probe(key, key_hash)
+        if self._slots[slot] != NO_ROW:
+            return self._slots[slot]
+
+        index = len(self._hashes)
+        self._data += key
+        self._offsets.append(len(self._data))
+        self._hashes.append(key_hash)
+        self._slots[slot] = index
+        if len(self._hashes) * 2 > len(self._slots):
+            self._grow()
+        return index
+
+    def _probe(self, key: bytes, key_hash: int) -> int:
+        # Маска из длины того же массива: параллельное _grow не рассогласует их
+        slots, hashes = self._slots, self._hashes
+        mask = len(slots) - 1
+        slot = key_hash & mask
+        while True:
+            index = slots[slot]
+            if index == NO_ROW or (hashes[index] == key_hash and self[index] == key):
+                return slot
+            slot = (slot + 1) & mask
+
+    def _grow(self):
+        self._slots = self._build_slots(len(self._slots) * 2)
+
+    def _build_slots(self, size: int) -> array:
+        slots = array("I", [NO_ROW]) * size
+        mask = size - 1
+        for index, key_hash in enumerate(self._hashes):
+            slot = key_hash & mask
+            while slots[slot] != NO_ROW:
+                slot = (slot + 1) & mask
+            slots[slot] = index
+        return slots
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._data) + len(self._offsets) * 8 + len(self._hashes) * 8 + len(self._slots) * 4
+
+
+class CompactPromocodeRepo:
+    """Колоночное хранилище промокодов в памяти для кампаний на миллионы кодов.
+
+    Строка - номер кода в таблице строк, поля лежат в массивах array:
+    перечисления - байтовыми кодами, даты - int64 микросекунд, категории -
+    номером интернированного набора (битовой маски). Объекты Promocode
+    собираются только на выдаче и являются снимками: изменения сохраняются
+    через update_promocode, как у SQL-репозитория.
+    """
+
+    def __init__(self, promocodes: Iterable[Promocode] = ()):
+        self._codes = StringTable()
+        self._users = StringTable()
+        self._ids = bytearray()
+        self._user = array("I")
+        # Строки пользователя - односвязный список от последней к первой
+        self._next_user_row = array("I")
+        self._user_last_row = array("I")
+        self._discount_type = array("B")
+        self._discount_value = array("d")
+        self._min_order_amount = array("d")
+        # NaN - нет ограничения скидки
+        self._max_discount = array("d")
+        self._expires_at = array("q")
+        self._created_at = array("q")
+        self._usage_count = array("I")
+        self._max_usages = array("I")
+        self._status = array("B")
+        self._category_set = array("I")
+        self._category_ids: Dict[str, int] = {}
+        self._category_names: List[str] = []
+        self._category_set_ids: Dict[int, int] = {}
+        self._category_set_lists: List[List[str]] = []
+
+        # Порядок строк по коду для постраничных списков и поиска по префиксу
+        self._code_order = SortedCodeIndex(self._codes.__getitem__, "I")
+        # Активные строки по коду для /active; байт строки - есть ли она в индексе
+        self._active_order = SortedCodeIndex(self._codes.__getitem__, "I")
+        self._in_active_order = bytearray()
+        # Порядок строк по коду для пользователей, чьи коды уже листали постранично;
+        # собирается при первой странице и дальше пополняется новыми строками
+        self._user_orders: Dict[int, SortedCodeIndex] = {}
+        # Очередь истечения: строки по возрастанию срока и сами сроки на момент
+        # постановки; запись со сроком, отличным от текущего, устарела
+        self._expiry_rows = array("I")
+        self._expiry_keys = array("q")
+        self._expiry_position = 0
+        self._expiry_pending_rows = array("I")
+        self._expiry_pending_keys = array("q")
+
+        # Порядок захвата: _index_lock -> _expiry_lock -> полоса _usage_locks;
+        # _category_lock ничего не захватывает внутри
+        self._index_lock = threading.RLock()
+        self._expiry_lock = threading.Lock()
+        self._category_lock = threading.Lock()
+        self._usage_locks = [threading.Lock() for _ in range(USAGE_LOCK_STRIPES)]
+        for promocode in promocodes:
+            self.add_promocode(promocode)
+
+    def get_by_code(self, code: str) -> Optional[Promocode]:
+        row = self._codes.find(code.encode())
+        return self._to_model(row) if row != NO_ROW else None
+
+    def get_many_by_codes(self, codes: Iterable[str]) -> Dict[str, Promocode]:
+        found = {}
+        for code in codes:
+            row = self._codes.find(code.encode())
+            if row != NO_ROW:
+                found[code] = self._to_model(row)
+        return found
+
+    def get_user_promocodes(self, user_id: UUID) -> List[Promocode]:
+        return [self._to_model(row) for row in self._user_rows(user_id)]
+
+    def get_user_promocodes_page(self, user_id: UUID, after: Optional[str] = None,
+                                 limit: int = 100) -> List[Promocode]:
+        """Промокоды пользователя по возрастанию кода, начиная после кода after"""
+        user = self._users.find(user_id.bytes)
+        if user == NO_ROW:
+            return []
+        with self._index_lock:
+            order = self._user_orders.get(user)
+            if order is None:
+                rows = sorted(self._user_rows(user_id), key=self._codes.__getitem__)
+                order = self._user_orders[user] = SortedCodeIndex(self._codes.__getitem__, "I", array("I", rows))
+            rows = list(islice(order.iter_from(after.encode() if after is not None else None), limit))
+        return [self._to_model(row) for row in rows]
+
+    def add_promocode(self, promocode: Promocode) -> Promocode:
+        with self._index_lock:
+            row = self._codes.find(promocode.code.encode())
+            if row == NO_ROW:
+                self._append_row(promocode)
+                return promocode
+        # Как у PromocodeRepo: добавление существующего кода заменяет его целиком
+        self._write_row(row, promocode, usage_count=True)
+        return promocode
+
+    def add_promocodes(self, promocodes: Iterable[Promocode]) -> List[Promocode]:
+        """Пакетное добавление; коды, которые уже есть в хранилище, пропускаются"""
+        added: List[Promocode] = []
+        with self._index_lock:
+            for promocode in promocodes:
+                if self._codes.find(promocode.code.encode()) == NO_ROW:
+                    self._append_row(promocode)
+                    added.append(promocode)
+        return added
+
+    def create_promocode(self, promocode_data: dict) -> Promocode:
+        promocode = Promocode(
+            id=uuid4(),
+            usage_count=0,
+            status=PromocodeStatus.ACTIVE,
+            created_at=datetime.now(),
+            **promocode_data
+        )
+        return self.add_promocode(promocode)
+
+    def update_promocode(self, promocode: Promocode) -> Promocode:
+        """Запись полей снимка в строку кода.
+
+        usage_count меняется только через consume_usage (как в SQL-репозитории),
+        иначе устаревший снимок затер бы параллельные применения.
+        """
+        row = self._codes.find(promocode.code.encode())
+        if row == NO_ROW:
+            return self.add_promocode(promocode)
+        self._write_row(row, promocode, usage_count=False)
+        return promocode
+
+
+    def consume_usage(self, code: str, now: Optional[datetime] = None) -> Optional[Promocode]:
+        """Атомарная проверка лимита и увеличение usage_count; снимок после применения или None"""
+        key = code.encode()
+        row = self._codes.find(key)
+        if row == NO_ROW:
+            return None
+        now_us = _to_epoch_us(now or datetime.now())
+        with self._usage_locks[hash(key) % USAGE_LOCK_STRIPES]:
+            if self._status[row] != _ACTIVE or now_us > self._expires_at[row]:
+                return None
+            usage_count = self._usage_count[row]
+            if usage_count >= self._max_usages[row]:
+                return None
+            self._usage_count[row] = usage_count + 1
+            used_up = usage_count + 1 >= self._max_usages[row]
+            if used_up:
+                self._status[row] = _USED
+            promocode = self._to_model(row)
+        if used_up:
+            self._sync_active_order([row])
+        return promocode
+
+    def get_active_promocodes(self) -> List[Promocode]:
+        self.expire_due()
+        with self._index_lock:
+            rows = list(self._active_order.iter_from())
+        return [self._to_model(row) for row in rows]
+
+    def get_active_promocodes_page(self, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        """Страница активных промокодов по возрастанию кода, начиная после кода after"""
+        self.expire_due()
+        with self._index_lock:
+            rows = list(islice(self._active_order.iter_from(after.encode() if after is not None else None), limit))
+        return [self._to_model(row) for row in rows]
+
+    def search_by_prefix(self, prefix: str, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        """Промокоды с кодом, начинающимся с prefix, по возрастанию кода после кода after"""
+        with self._index_lock:
+            rows = self._code_order.search_prefix(prefix.encode(), after.encode() if after is not None else None, limit)
+        return [self._to_model(row) for row in rows]
+
+    def expire_due(self, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> List[str]:
+        """Перевод истекших активных промокодов в EXPIRED, не более batch_size за вызов"""
+        now_us = _to_epoch_us(now or datetime.now())
+        expired: List[str] = []
+        expired_rows: List[int] = []
+        with self._expiry_lock:
+            self._merge_expiry_pending()
+            rows, keys = self._expiry_rows, self._expiry_keys
+            position = self._expiry_position
+            while position < len(rows) and keys[position] < now_us and (
+                    batch_size is None or len(expired) < batch_size):
+                row, key = rows[position], keys[position]
+                position += 1
+                if self._expires_at[row] != key:
+                    continue
+                code = self._codes[row]
+                with self._usage_locks[hash(code) % USAGE_LOCK_STRIPES]:
+                    if self._status[row] == _ACTIVE:
+                        self._status[row] = _EXPIRED
+                        expired.append(code.decode())
+                        expired_rows.append(row)
+            self._expiry_position = position
+        # Индексная блокировка берется раньше _expiry_lock, поэтому индекс правится после нее
+        self._sync_active_order(expired_rows)
+        return expired
+
+    def count(self) -> int:
+        return len(self._codes)
+
+    def iter_codes(self) -> Iterator[str]:
+        codes = self._codes
+        return (codes[row].decode() for row in range(len(codes)))
+
+    def memory_bytes(self) -> int:
+        """Размер буферов хранилища (без объектов таблиц категорий)"""
+        arrays = [
+            self._user, self._next_user_row, self._user_last_row, self._discount_type, self._discount_value,
+            self._min_order_amount, self._max_discount, self._expires_at, self._created_at, self._usage_count,
+            self._max_usages, self._status, self._category_set, self._expiry_rows, self._expiry_keys, self._expiry_pending_rows, self._expiry_pending_keys,
+        ]
+        return (
+            sum(len(a) * a.itemsize for a in arrays) + len(self._ids)
+            + self._codes.memory_bytes + self._users.memory_bytes + self._code_order.memory_bytes()
+            + self._active_order.memory_bytes() + len(self._in_active_order)
+            + sum(order.memory_bytes() for order in self._user_orders.values())
+        )
+
+    def snapshot_columns(self) -> Tuple[Dict, Dict[str, array]]:
+        """Состояние хранилища для файла снимка: метаданные категорий и копии колонок.
+
+        Порядок строк по коду и очередь истечения сохраняются готовыми, хеш-индексы
+        таблиц строк - нет (см. StringTable.from_buffers).
+        """
+        with self._index_lock, self._expiry_lock:
+            self._merge_expiry_pending()
+            position = self._expiry_position
+            columns = {name: getattr(self, "_" + name)[:] for name in SNAPSHOT_COLUMNS}
+            for name, table in (("codes", self._codes), ("users", self._users)):
+                data, offsets = table.buffers()
+                columns[name + "_data"], columns[name + "_offsets"] = array("B", data), offsets
+            columns["ids"] = array("B", self._ids)
+            columns["sorted_rows"] = self._code_order.items()[:]
+            columns["expiry_rows"] = self._expiry_rows[position:]
+            columns["expiry_keys"] = self._expiry_keys[position:]
+            meta = {
+                "category_names": list(self._category_names),
+                "category_sets": [list(categories) for categories in self._category_set_lists],
+            }
+        return meta, columns
+
+    @classmethod
+    def from_snapshot_columns(cls, meta: Dict, columns: Dict[str, array]) -> "CompactPromocodeRepo":
+        """Хранилище из колонок snapshot_columns без разбора отдельных промокодов"""
+        repo = cls()
+        for name in SNAPSHOT_COLUMNS:
+            setattr(repo, "_" + name, columns[name])
+        repo._codes = StringTable.from_buffers(bytearray(columns["codes_data"]), columns["codes_offsets"])
+        repo._users = StringTable.from_buffers(bytearray(columns["users_data"]), columns["users_offsets"])
+        repo._ids = bytearray(columns["ids"])
+        repo._code_order = SortedCodeIndex(repo._codes.__getitem__, "I", columns["sorted_rows"])
+        repo._in_active_order = bytearray(repo._status.tobytes().translate(_IS_ACTIVE))
+        repo._active_order = SortedCodeIndex(repo._codes.__getitem__, "I", array(
+            "I", filter(repo._in_active_order.__getitem__, columns["sorted_rows"])
+        ))
+        repo._expiry_rows, repo._expiry_keys = columns["expiry_rows"], columns["expiry_keys"]
+        repo._category_names = list(meta["category_names"])
+        repo._category_ids = {name: i for i, name in enumerate(repo._category_names)}
+        repo._category_set_lists = [list(categories) for categories in meta["category_sets"]]
+        repo._category_set_ids = {
+            sum(1 << repo._category_ids[name] for name in categories): set_id
+            for set_id, categories in enumerate(repo._category_set_lists)
+        }
+        return repo
+
+    # --- вложенные функции ---
+    def _append_row(self, promocode: Promocode):
+        # Код публикуется в таблице последним: читатели без блокировки
+        # не должны найти строку раньше, чем заполнены ее колонки
+        row = len(self._codes)
+        user = self._users.add(promocode.user_id.bytes)
+        if user == len(self._user_last_row):
+            self._user_last_row.append(NO_ROW)
+        self._ids += promocode.id.bytes
+        self._user.append(user)
+        self._next_user_row.append(self._user_last_row[user])
+        self._discount_type.append(_DISCOUNT_TYPE_IDS[promocode.discount_type])
+        self._discount_value.append(promocode.discount_value)
+        self._min_order_amount.append(promocode.min_order_amount)
+        self._max_discount.append(math.nan if promocode.max_discount is None else promocode.max_discount)
+        self._expires_at.append(_to_epoch_us(promocode.expires_at))
+        self._created_at.append(_to_epoch_us(promocode.created_at))
+        self._usage_count.append(promocode.usage_count)
+        self._max_usages.append(promocode.max_usages)
+        self._status.append(_STATUS_IDS[promocode.status])
+        self._category_set.append(self._intern_categories(promocode.applicable_categories))
+        self._in_active_order.append(0)
+        self._codes.add(promocode.code.encode())
+        self._user_last_row[user] = row
+        self._code_order.add(row)
+        self._sync_active_order([row])
+        user_order = self._user_orders.get(user)
+        if user_order is not None:
+            user_order.add(row)
+        self._schedule_expiry(row)
+
+    def _write_row(self, row: int, promocode: Promocode, usage_count: bool):
+        with self._usage_locks[hash(promocode.code.encode()) % USAGE_LOCK_STRIPES]:
+            expiry_changed = self._expires_at[row] != _to_epoch_us(promocode.expires_at)
+            self._discount_type[row] = _DISCOUNT_TYPE_IDS[promocode.discount_type]
+            self._discount_value[row] = promocode.discount_value
+            self._min_order_amount[row] = promocode.min_order_amount
+            self._max_discount[row] = math.nan if promocode.max_discount is None else promocode.max_discount
+            self._expires_at[row] = _to_epoch_us(promocode.expires_at)
+            self._max_usages[row] = promocode.max_usages
+            self._status[row] = _STATUS_IDS[promocode.status]
+            self._category_set[row] = self._intern_categories(promocode.applicable_categories)
+            if usage_count:
+                self._usage_count[row] = promocode.usage_count
+        self._sync_active_order([row])
+        if expiry_changed:
+            self._schedule_expiry(row)
+
+    def _intern_categories(self, categories: List[str]) -> int:
+        mask = 0
+        for category in categories:
+            category_id = self._category_ids.get(category)
+            if category_id is None:
+                with self._category_lock:
+                    category_id = self._category_ids.setdefault(category, len(self._category_names))
+                    if category_id == len(self._category_names):
+                        self._category_names.append(category)
+            mask |= 1 << category_id
+        set_id = self._category_set_ids.get(mask)
+        if set_id is None:
+            with self._category_lock:
+                set_id = self._category_set_ids.setdefault(mask, len(self._category_set_lists))
+                if set_id == len(self._category_set_lists):
+                    # Как в SQL-репозитории: категории без повторов, по алфавиту
+                    self._category_set_lists.append(sorted(
+                        name for i, name in enumerate(self._category_names) if mask >> i & 1
+                    ))
+        return set_id
+
+    def _user_rows(self, user_id: UUID) -> List[int]:
+        user = self._users.find(user_id.bytes)
+        if user == NO_ROW:
+            return []
+        rows = []
+        row = self._user_last_row[user]
+        while row != NO_ROW:
+            rows.append(row)
+            row = self._next_user_row[row]
+        rows.reverse()
+        return rows
+
+    def _sync_active_order(self, rows: Iterable[int]):
+        """Приведение индекса активных строк к их текущему статусу.
+
+        Статус меняется под полосой _usage_locks, индекс - под _index_lock
+        после нее; сверка с байтом членства делает вызов идемпотентным, и
+        последний из параллельных вызовов видит итоговый статус.
+        """
+        with self._index_lock:
+            for row in rows:
+                active = self._status[row] == _ACTIVE
+                if active != self._in_active_order[row]:
+                    if active:
+                        self._active_order.add(row)
+                    else:
+                        self._active_order.discard(row)
+                    self._in_active_order[row] = active
+
+    def _schedule_expiry(self, row: int):
+        with self._expiry_lock:
+            self._expiry_pending_rows.append(row)
+            self._expiry_pending_keys.append(self._expires_at[row])
+
+    def _merge_expiry_pending(self):
+        if not self._expiry_pending_rows:
+            return
+        self._expiry_keys, self._expiry_rows = _merge_expiry(
+            self._expiry_keys, self._expiry_rows, self._expiry_position,
+            self._expiry_pending_keys, self._expiry_pending_rows,
+        )
+        self._expiry_position = 0
+        self._expiry_pending_rows = array("I")
+        self._expiry_pending_keys = array("q")
+
+    def _to_model(self, row: int) -> Promocode:
+        max_discount = self._max_discount[row]
+        return Promocode.model_construct(
+            id=UUID(bytes=bytes(self._ids[row * 16:row * 16 + 16])),
+            code=self._codes[row].decode(),
+            user_id=UUID(bytes=self._users[self._user[row]]),
+            discount_type=_DISCOUNT_TYPES[self._discount_type[row]],
+            discount_value=self._discount_value[row],
+            min_order_amount=self._min_order_amount[row],
+            max_discount=None if math.isnan(max_discount) else max_discount,
+            expires_at=_from_epoch_us(self._expires_at[row]),
+            usage_count=self._usage_count[row],
+            max_usages=self._max_usages[row],
+            status=_STATUSES[self._status[row]],
+            applicable_categories=list(self._category_set_lists[self._category_set[row]]),
+            created_at=_from_epoch_us(self._created_at[row]),
+        )
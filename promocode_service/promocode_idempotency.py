@@ -0,0 +1,157 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+
+PROMOCODE_IDEMPOTENCY_SIZE = int(os.getenv("PROMOCODE_IDEMPOTENCY_SIZE", "100000"))
+PROMOCODE_IDEMPOTENCY_TTL = float(os.getenv("PROMOCODE_IDEMPOTENCY_TTL", "86400"))
+# memory - только память процесса; sql - еще и таблица promocode_applications,
+# повторы узнаются после перезапуска и на других экземплярах
+PROMOCODE_IDEMPOTENCY_BACKEND = os.getenv("PROMOCODE_IDEMPOTENCY_BACKEND", "memory")
+# Срок брони ключа в постоянном хранилище: бронь упавшего экземпляра истекает,
+# и повтор заказа может применить код; должен быть больше времени одного apply
+PROMOCODE_IDEMPOTENCY_LEASE = float(os.getenv("PROMOCODE_IDEMPOTENCY_LEASE", "30"))
+# Период, с которым проигравший бронь ждет результат победителя
+RESERVATION_POLL_INTERVAL = 0.05
+# Запись брони: результат применения еще не известен
+PENDING_RESULT = {"status": "pending"}
+
+ApplyKey = Tuple[str, UUID, UUID]
+
+
+class IdempotencyStore:
+    """Результаты применений по ключу (promo_code, user_id, order_id): LRU с TTL в памяти
+    и необязательное постоянное хранилище за ним.
+
+    Повтор запроса с тем же заказом получает записанный результат без
+    повторной проверки и списания. Параллельные повторы одного ключа
+    выстраиваются в очередь блокировкой ключа: второй дожидается первого и
+    получает его результат. Между экземплярами ту же роль играет бронь -
+    строка ключа в постоянном хранилище (claim/release).
+    """
+
+    def __init__(self, max_size: int = PROMOCODE_IDEMPOTENCY_SIZE, ttl: float = PROMOCODE_IDEMPOTENCY_TTL,
+                 backing=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backing = backing
+        self._entries: "OrderedDict[ApplyKey, Tuple[float, Dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Блокировки ключей живут, пока их кто-то держит или ждет: [блокировка, число владельцев]
+        self._key_locks: Dict[ApplyKey, List] = {}
+        self._async_key_locks: Dict[ApplyKey, List] = {}
+
+        self.hits = 0
+        self.backing_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: ApplyKey) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+                self.expirations += 1
+        if self.backing is not None:
+            result = self.backing.load(key, datetime.now())
+            # Бронь другого экземпляра - еще не результат, его дожидается claim
+            if result is not None and result != PENDING_RESULT:
+                self.backing_hits += 1
+                # Остаток TTL неизвестен без лишнего столбца в выборке: запись
+                # в памяти не переживет строку больше чем на один TTL
+                self._remember(key, result)
+                return result
+        self.misses += 1
+        return None
+
+    def put(self, key: ApplyKey, result: Dict):
+        if self.backing is not None:
+            self.backing.save(key, result, datetime.now() + timedelta(seconds=self.ttl))
+        self._remember(key, result)
+
+    def claim(self, key: ApplyKey, lease: float = PROMOCODE_IDEMPOTENCY_LEASE) -> Optional[Dict]:
+        """Бронь ключа в постоянном хранилище перед списанием (вызывается под lock).
+
+        None - бронь получена, применять код можно только ее владельцу; иначе
+        результат экземпляра, выигравшего бронь, дождавшись его. Без постоянного
+        хранилища хватает блокировки ключа в процессе.
+        """
+        if self.backing is None:
+            return None
+        while True:
+            now = datetime.now()
+            if self.backing.reserve(key, PENDING_RESULT, now + timedelta(seconds=lease)):
+                return None
+            result = self.backing.load(key, now)
+            if result is not None and result != PENDING_RESULT:
+                self._remember(key, result)
+                return result
+            # Бронь снята отказом или истекает: следующий reserve ее заменит
+            time.sleep(RESERVATION_POLL_INTERVAL)
+
+    def release(self, key: ApplyKey):
+        """Снятие брони без результата: код не списан, заказ можно применить снова"""
+        if self.backing is not None:
+            self.backing.release(key)
+
+    @contextmanager
+    def lock(self, key: ApplyKey):
+        with self._lock:
+            entry = self._key_locks.get(key)
+            if entry is None:
+                entry = self._key_locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[key]
+
+    @asynccontextmanager
+    async def async_lock(self, key: ApplyKey):
+        # Корутины одного цикла событий не вытесняют друг друга между await:
+        # словарь меняется без отдельной блокировки
+        entry = self._async_key_locks.get(key)
+        if entry is None:
+            entry = self._async_key_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._async_key_locks[key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remember(self, key: ApplyKey, result: Dict):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+
+def create_idempotency_store(backend: str = PROMOCODE_IDEMPOTENCY_BACKEND) -> IdempotencyStore:
+    if backend == "memory":
+        return IdempotencyStore()
+    if backend == "sql":
+        from .promocode_sql_repo import SqlApplicationLog
+        return IdempotencyStore(backing=SqlApplicationLog())
+    raise ValueError(f"Неизвестное хранилище применений: {backend}")
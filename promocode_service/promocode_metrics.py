@@ -0,0 +1,238 @@
+import itertools
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Tuple
+
+PROMOCODE_METRICS = os.getenv("PROMOCODE_METRICS", "true").lower() == "true"
+# Этапы валидации замеряются у каждого N-го запроса: пара perf_counter на
+# этап стоит заметную долю от валидации в несколько микросекунд
+PROMOCODE_STAGE_SAMPLE_EVERY = int(os.getenv("PROMOCODE_STAGE_SAMPLE_EVERY", "1024"))
+
+REQUEST_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+STAGE_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 1e-3, 1e-2, 0.1)
+
+REQUEST_DURATION = "promocode_http_request_duration_seconds"
+STAGE_DURATION = "promocode_validation_stage_seconds"
+VALIDATION_FAILURES = "promocode_validation_failures_total"
+
+
+def format_labels(**labels) -> str:
+    """Метки в виде строки Prometheus; строка служит ключом метрики"""
+    return ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items())
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """Счетчик событий; текущее значение - свойство value.
+
+    inc() - это next() у itertools.count: атомарен под GIL и не берет
+    блокировок (с блокировкой отказы стоили бы заметную долю валидации).
+    Чтение тоже вызывает next() и потому вычитает число прошлых чтений;
+    чтения редки (выдача /metrics) и идут под блокировкой.
+    """
+    __slots__ = ("inc", "_reads", "_lock")
+
+    def __init__(self):
+        self.inc = itertools.count().__next__
+        self._reads = 0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> int:
+        with self._lock:
+            value = self.inc() - self._reads
+            self._reads += 1
+            return value
+
+
+class _Shard:
+    """Гистограммы одного потока: счетчики по корзинам, корзина +Inf и сумма значений"""
+    __slots__ = ("histograms",)
+
+    def __init__(self):
+        self.histograms: Dict[Tuple[str, str], List[float]] = {}
+
+
+class MetricsRegistry:
+    """Гистограммы, счетчики и датчики в текстовом формате Prometheus.
+
+    Гистограммы каждый поток пишет в собственный шард без блокировок;
+    выдача /metrics суммирует шарды. Счетчики - Counter с собственной
+    блокировкой; они увеличиваются только на отказах. Блокировка реестра
+    берется только при появлении нового потока или новой метки. Датчики
+    читаются функцией в момент выдачи.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        # Шарды живых потоков; шарды завершившихся сливаются в _retired
+        self._shards: List[Tuple[threading.Thread, _Shard]] = []
+        self._retired = _Shard()
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Tuple[str, Tuple[float, ...]]] = {}
+        # Корзины по имени гистограммы отдельно: observe обходится одним поиском
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._counters: Dict[str, str] = {}
+        self._counter_values: Dict[Tuple[str, str], Counter] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+
+    def histogram(self, name: str, description: str, buckets: Tuple[float, ...]):
+        self._histograms[name] = (description, tuple(buckets))
+        self._buckets[name] = tuple(buckets)
+
+    def counter(self, name: str, description: str):
+        self._counters[name] = description
+
+    def gauge(self, name: str, description: str, read: Callable[[], float]):
+        self._gauges[name] = (description, read)
+
+    def observe(self, name: str, value: float, labels: str = ""):
+        try:
+            histograms = self._local.shard.histograms
+        except AttributeError:
+            histograms = self._new_shard().histograms
+        values = histograms.get((name, labels))
+        buckets = self._buckets[name]
+        if values is None:
+            values = histograms[(name, labels)] = [0] * (len(buckets) + 2)
+        values[bisect_left(buckets, value)] += 1
+        values[-1] += value
+
+    def counter_for(self, name: str, labels: str = "") -> Counter:
+        """Счетчик с метками; событие учитывается вызовом inc()"""
+        counter = self._counter_values.get((name, labels))
+        if counter is None:
+            with self._lock:
+                counter = self._counter_values.setdefault((name, labels), Counter())
+        return counter
+
+    def render(self) -> str:
+        histograms: Dict[Tuple[str, str], List[float]] = {}
+        with self._lock:
+            for shard in [shard for _, shard in self._shards] + [self._retired]:
+                # Копия словаря: поток шарда может добавить метку во время выдачи
+                for key, values in list(shard.histograms.items()):
+                    _merge(histograms, key, values)
+
+        lines: List[str] = []
+        for name, (description, buckets) in self._histograms.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+            for (metric, labels), values in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                prefix = labels + "," if labels else ""
+                cumulative = 0
+                for bound, count in zip(buckets + (float("inf"),), values):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative}')
+                lines.append(f"{name}_sum{{{labels}}} {values[-1]}")
+                lines.append(f"{name}_count{{{labels}}} {cumulative}")
+        for name, description in self._counters.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            lines += [f"{name}{{{labels}}} {counter.value}"
+                      for (metric, labels), counter in sorted(list(self._counter_values.items()))
+                      if metric == name]
+        for name, (description, read) in self._gauges.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} gauge", f"{name} {read()}"]
+        return "\n".join(lines) + "\n"
+
+    def shard(self) -> _Shard:
+        """Шард текущего потока"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            return self._new_shard()
+
+    def _new_shard(self) -> _Shard:
+        shard = self._local.shard = _Shard()
+        with self._lock:
+            # Пул потоков может пересоздавать потоки: значения завершившихся
+            # сохраняются, а список шардов не растет
+            alive = []
+            for thread, old in self._shards:
+                if thread.is_alive():
+                    alive.append((thread, old))
+                else:
+                    for key, values in old.histograms.items():
+                        _merge(self._retired.histograms, key, values)
+            alive.append((threading.current_thread(), shard))
+            self._shards = alive
+        return shard
+
+
+def _merge(histograms: Dict[Tuple[str, str], List[float]], key: Tuple[str, str], values: List[float]):
+    total = histograms.setdefault(key, [0] * len(values))
+    for i, value in enumerate(list(values)):
+        total[i] += value
+
+
+class ValidationMetrics:
+    """Метрики валидации: этапы по выборке запросов и причины отказов.
+
+    Сервис обращается к ним на каждой валидации, поэтому выборка - атрибут
+    с next(), счетчики отказов - словарь Counter, а этапы пишутся в шард
+    потока одним вызовом.
+    """
+
+    STAGES = ("get_by_code", "check_user", "check_status", "check_order", "calculate_discount")
+
+    def __init__(self, registry: MetricsRegistry, sample_every: int = PROMOCODE_STAGE_SAMPLE_EVERY):
+        registry.histogram(STAGE_DURATION, "Время этапов валидации промокода (выборка запросов)", STAGE_BUCKETS)
+        registry.counter(VALIDATION_FAILURES, "Отказы валидации по причинам")
+        self.registry = registry
+        # Выборка без блокировки и арифметики: next() у itertools.cycle атомарен под GIL
+        self.samples = itertools.cycle([True] + [False] * (sample_every - 1))
+        self._stage_keys = [(STAGE_DURATION, format_labels(stage=stage)) for stage in self.STAGES]
+        # Счетчик отказа увеличивается прямо в сервисе: metrics.failures[message].inc()
+        self.failures: Dict[str, Counter] = {}
+
+    def register_failures(self, reasons: Iterable[str]):
+        """Причины отказа заводятся заранее: в выдаче сразу видны нулевые счетчики,
+        а горячий путь обходится обычным словарем без проверки на новую причину"""
+        for reason in reasons:
+            if reason not in self.failures:
+                self.failures[reason] = self.registry.counter_for(VALIDATION_FAILURES, format_labels(reason=reason))
+
+    def stages(self, marks: List[float]):
+        """Длительности этапов по отметкам perf_counter: начало и конец каждого пройденного этапа"""
+        histograms = self.registry.shard().histograms
+        for key, start, end in zip(self._stage_keys, marks, marks[1:]):
+            values = histograms.get(key)
+            if values is None:
+                values = histograms[key] = [0] * (len(STAGE_BUCKETS) + 2)
+            values[bisect_left(STAGE_BUCKETS, end - start)] += 1
+            values[-1] += end - start
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: гистограмма длительности запросов по методу и шаблону маршрута"""
+
+    def __init__(self, app, registry: MetricsRegistry):
+        registry.histogram(REQUEST_DURATION, "Длительность HTTP-запросов", REQUEST_BUCKETS)
+        self.app = app
+        self.registry = registry
+        self._labels: Dict[Tuple[str, str], str] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            # Шаблон пути, а не сам путь: коды промокодов не размножают метки
+            key = (scope["method"], getattr(scope.get("route"), "path", "unmatched"))
+            labels = self._labels.get(key)
+            if labels is None:
+                labels = self._labels[key] = format_labels(method=key[0], route=key[1])
+            self.registry.observe(REQUEST_DURATION, time.perf_counter() - start, labels)
+
+
+registry = MetricsRegistry()
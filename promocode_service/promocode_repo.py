@@ -1,22 +1,125 @@
+import heapq
+import os
+import threading
+from collections import defaultdict
 from uuid import UUID
 from datetime import datetime
-from typing import List, Optional
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 from .models import Promocode, PromocodeStatus, DiscountType
+from .promocode_code_index import SortedCodeIndex
+
+USAGE_LOCK_STRIPES = 64
+
+# memory - демо-данные в памяти процесса, compact - колоночное хранилище в памяти,
+# shared - колоночная таблица в общей памяти воркеров, sql - таблица PromocodeDB
+PROMOCODE_REPO_BACKEND = os.getenv("PROMOCODE_REPO_BACKEND", "memory")
+
+
+def create_promocode_repo(backend: str = PROMOCODE_REPO_BACKEND):
+    if backend == "sql":
+        from .promocode_cache import PROMOCODE_CACHE_SIZE, CachedPromocodeRepo
+        from .promocode_sql_repo import SqlPromocodeRepo
+        from .promocode_write_behind import PROMOCODE_WRITE_BEHIND, WEB_CONCURRENCY, WriteBehindPromocodeRepo
+        if PROMOCODE_WRITE_BEHIND and WEB_CONCURRENCY > 1:
+            # Каждый воркер считал бы применения в своей памяти и делил бы с соседями один журнал
+            raise RuntimeError("PROMOCODE_WRITE_BEHIND не поддерживается при WEB_CONCURRENCY > 1")
+        repo = SqlPromocodeRepo()
+        # Кеш горячих кодов снимает с БД повторные чтения; 0 отключает его
+        repo = CachedPromocodeRepo(repo) if PROMOCODE_CACHE_SIZE > 0 else repo
+        # Счетчики применений копятся в памяти и журнале и пишутся в БД пачками
+        return WriteBehindPromocodeRepo(repo) if PROMOCODE_WRITE_BEHIND else repo
+    if backend == "memory":
+        return PromocodeRepo()
+    if backend == "compact":
+        # Колоночное хранилище в памяти: в разы меньше байт на код, без демо-данных
+        from .promocode_compact_repo import CompactPromocodeRepo
+        return CompactPromocodeRepo()
+    if backend == "shared":
+        # Несколько воркеров uvicorn: одна таблица и одни счетчики на всех
+        from .promocode_shared_repo import SharedPromocodeRepo
+        return SharedPromocodeRepo()
+    raise ValueError(f"Неизвестный тип репозитория промокодов: {backend}")
 
 
 class PromocodeRepo:
-    def __init__(self):
+    def __init__(self, promocodes: Optional[Iterable[Promocode]] = None):
+        # Хеш-индекс по коду и вторичные индексы по пользователю и статусу
+        self._by_code: Dict[str, Promocode] = {}
+        self._by_user: Dict[UUID, Dict[str, Promocode]] = defaultdict(dict)
+        # Коды пользователя по возрастанию: страницы /user без сортировки всех его кодов
+        self._by_user_order: Dict[UUID, SortedCodeIndex] = defaultdict(SortedCodeIndex)
+        self._by_status: Dict[PromocodeStatus, Dict[str, Promocode]] = {status: {} for status in PromocodeStatus}
+        # Коды каждого статуса по возрастанию: страницы /active без просмотра неактивных
+        self._by_status_order: Dict[PromocodeStatus, SortedCodeIndex] = {
+            status: SortedCodeIndex() for status in PromocodeStatus
+        }
+        # Куча (expires_at, code) для истечения без полного прохода по кодам
+        self._expiry_heap: List[Tuple[datetime, str]] = []
+        self._expiry_scheduled: Dict[str, datetime] = {}
+        # Коды по возрастанию для постраничных списков и поиска по префиксу
+        self._code_index = SortedCodeIndex()
+        self._index_lock = threading.RLock()
+        # Полосатые блокировки для атомарного учета использований по коду
+        self._usage_locks = [threading.Lock() for _ in range(USAGE_LOCK_STRIPES)]
+
         # Демо-данные вместо реальной БД
-        self._promocodes: List[Promocode] = self._create_demo_promocodes()
+        if promocodes is None:
+            promocodes = self._create_demo_promocodes()
+        for promocode in promocodes:
+            self.add_promocode(promocode)
 
     def get_by_code(self, code: str) -> Optional[Promocode]:
-        for promo in self._promocodes:
-            if promo.code == code:
-                return promo
-        return None
+        return self._by_code.get(code)
+
+    def get_many_by_codes(self, codes: Iterable[str]) -> Dict[str, Promocode]:
+        by_code = self._by_code
+        return {code: by_code[code] for code in codes if code in by_code}
 
     def get_user_promocodes(self, user_id: UUID) -> List[Promocode]:
-        return [p for p in self._promocodes if p.user_id == user_id]
+        return list(self._by_user.get(user_id, {}).values())
+
+    def get_user_promocodes_page(self, user_id: UUID, after: Optional[str] = None,
+                                 limit: int = 100) -> List[Promocode]:
+        """Промокоды пользователя по возрастанию кода, начиная после кода after"""
+        with self._index_lock:
+            order = self._by_user_order.get(user_id)
+            if order is None:
+                return []
+            user_codes = self._by_user[user_id]
+            return [user_codes[code] for code in islice(order.iter_from(after), limit)]
+
+    def add_promocode(self, promocode: Promocode) -> Promocode:
+        """Добавление готового промокода с обновлением всех индексов"""
+        with self._index_lock:
+            if promocode.code not in self._by_code:
+                self._code_index.add(promocode.code)
+            self._by_code[promocode.code] = promocode
+            user_codes = self._by_user[promocode.user_id]
+            if promocode.code not in user_codes:
+                self._by_user_order[promocode.user_id].add(promocode.code)
+            user_codes[promocode.code] = promocode
+            status_codes = self._by_status[promocode.status]
+            if promocode.code not in status_codes:
+                self._by_status_order[promocode.status].add(promocode.code)
+            status_codes[promocode.code] = promocode
+            self._schedule_expiry(promocode)
+        return promocode
+
+    def add_promocodes(self, promocodes: Iterable[Promocode]) -> List[Promocode]:
+        """Пакетное добавление; коды, которые уже есть в хранилище, пропускаются.
+
+        Проверка и вставка идут под одной блокировкой, поэтому параллельные
+        пачки не перезаписывают друг друга.
+        """
+        added: List[Promocode] = []
+        with self._index_lock:
+            for promocode in promocodes:
+                if promocode.code in self._by_code:
+                    continue
+                self.add_promocode(promocode)
+                added.append(promocode)
+        return added
 
     def create_promocode(self, promocode_data: dict) -> Promocode:
         from uuid import uuid4
@@ -28,18 +131,112 @@ class PromocodeRepo:
             created_at=datetime.now(),
             **promocode_data
         )
-        self._promocodes.append(promocode)
-        return promocode
+        return self.add_promocode(promocode)
 
     def update_promocode(self, promocode: Promocode) -> Promocode:
-        return promocode
+        with self._index_lock:
+            previous = self._by_code.get(promocode.code)
+            if previous is not None and previous.user_id != promocode.user_id:
+                self._remove_from_user_index(previous)
+
+            # Статус мог измениться снаружи (например, в _check_promocode_status)
+            for status, bucket in self._by_status.items():
+                if status != promocode.status and bucket.pop(promocode.code, None) is not None:
+                    self._by_status_order[status].discard(promocode.code)
+            return self.add_promocode(promocode)
+
+    def consume_usage(self, code: str, now: Optional[datetime] = None) -> Optional[Promocode]:
+        """Атомарная проверка лимита и увеличение usage_count.
+
+        Возвращает снимок промокода после применения или None, если код
+        уже не активен, истек или лимит использований исчерпан.
+        """
+        now = now or datetime.now()
+        with self._usage_locks[hash(code) % USAGE_LOCK_STRIPES]:
+            promocode = self._by_code.get(code)
+            if promocode is None or promocode.status != PromocodeStatus.ACTIVE:
+                return None
+            if now > promocode.expires_at or promocode.usage_count >= promocode.max_usages:
+                return None
+
+            promocode.usage_count += 1
+            if promocode.usage_count >= promocode.max_usages:
+                promocode.status = PromocodeStatus.USED
+                self.update_promocode(promocode)
+            return promocode.model_copy()
 
     def get_active_promocodes(self) -> List[Promocode]:
-        now = datetime.now()
-        return [
-            p for p in self._promocodes
-            if p.status == PromocodeStatus.ACTIVE and p.expires_at > now
-        ]
+        # Основную работу делает фоновый sweeper, здесь переводятся только
+        # коды, истекшие после его последнего прохода (обычно ни одного)
+        self.expire_due()
+        return list(self._by_status[PromocodeStatus.ACTIVE].values())
+
+    def get_active_promocodes_page(self, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        """Страница активных промокодов по возрастанию кода, начиная после кода after"""
+        self.expire_due()
+        with self._index_lock:
+            active = self._by_status[PromocodeStatus.ACTIVE]
+            codes = self._by_status_order[PromocodeStatus.ACTIVE].iter_from(after)
+            return [active[code] for code in islice(codes, limit)]
+
+    def search_by_prefix(self, prefix: str, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        """Промокоды с кодом, начинающимся с prefix, по возрастанию кода после кода after"""
+        with self._index_lock:
+            codes = self._code_index.search_prefix(prefix, after, limit)
+        return [self._by_code[code] for code in codes]
+
+    def expire_due(self, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> List[str]:
+        """Перевод истекших активных промокодов в EXPIRED, не более batch_size за вызов.
+
+        Возвращает коды, статус которых был изменен.
+        """
+        now = now or datetime.now()
+        expired: List[str] = []
+        with self._index_lock:
+            heap = self._expiry_heap
+            while heap and heap[0][0] < now and (batch_size is None or len(expired) < batch_size):
+                expires_at, code = heapq.heappop(heap)
+                # Устаревшая запись: срок действия кода был изменен позже
+                if self._expiry_scheduled.get(code) != expires_at:
+                    continue
+                del self._expiry_scheduled[code]
+                promocode = self._by_code.get(code)
+                if promocode is None or promocode.status != PromocodeStatus.ACTIVE:
+                    continue
+                promocode.status = PromocodeStatus.EXPIRED
+                del self._by_status[PromocodeStatus.ACTIVE][code]
+                self._by_status_order[PromocodeStatus.ACTIVE].discard(code)
+                expired_codes = self._by_status[PromocodeStatus.EXPIRED]
+                if code not in expired_codes:
+                    self._by_status_order[PromocodeStatus.EXPIRED].add(code)
+                expired_codes[code] = promocode
+                expired.append(code)
+        return expired
+
+    def count(self) -> int:
+        return len(self._by_code)
+
+    def iter_codes(self) -> Iterator[str]:
+        return iter(list(self._by_code))
+
+    def _schedule_expiry(self, promocode: Promocode):
+        if promocode.status != PromocodeStatus.ACTIVE:
+            return
+        if self._expiry_scheduled.get(promocode.code) != promocode.expires_at:
+            self._expiry_scheduled[promocode.code] = promocode.expires_at
+            heapq.heappush(self._expiry_heap, (promocode.expires_at, promocode.code))
+
+    def _remove_from_user_index(self, promocode: Promocode):
+        user_codes = self._by_user.get(promocode.user_id)
+        if user_codes is None:
+            return
+        user_codes.pop(promocode.code, None)
+        if not user_codes:
+            del self._by_user[promocode.user_id]
+            del self._by_user_order[promocode.user_id]
+        else:
+            # Смена владельца редка: из индекса не удаляют, он собирается заново
+            self._by_user_order[promocode.user_id] = SortedCodeIndex(items=sorted(user_codes))
 
     def _create_demo_promocodes(self) -> List[Promocode]:
         from uuid import UUID
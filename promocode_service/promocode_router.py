@@ -1,12 +1,45 @@
-from fastapi import APIRouter, Depends, HTTPException
+import json
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from typing import Dict, Iterator, Optional
 from uuid import UUID
-from models import CreatePromocodeRequest, ValidatePromocodeRequest, ApplyPromocodeRequest
-from promocode_service import PromocodeService
+from .models import (
+    CreatePromocodeRequest, GeneratePromocodesRequest, ValidatePromocodeRequest, ValidatePromocodeBatchRequest,
+    ApplyPromocodeRequest, BestPromocodeRequest, SignedPromocodesRequest
+)
+from .promocode_bulk import IMPORT_FORMATS, PromocodeImport, iter_lines
+from .promocode_idempotency import PROMOCODE_IDEMPOTENCY_BACKEND
+from .promocode_metrics import PROMOCODE_METRICS, ValidationMetrics, registry
+from .promocode_repo import PROMOCODE_REPO_BACKEND
+from .promocode_service import PROMOCODE_PAGE_SIZE, PROMOCODE_PAGE_SIZE_MAX, PromocodeService
+from .promocode_usage_stats import PROMOCODE_USAGE_STATS, UsageStats
 
-router = APIRouter(prefix="/api/v1/promocodes", tags=["promocodes"])
+# С SQL-хранилищами все обращения репозиториев за запрос идут через одну сессию get_db
+router_dependencies = []
+if PROMOCODE_REPO_BACKEND == "sql" or PROMOCODE_IDEMPOTENCY_BACKEND == "sql":
+    from .database import request_db_session
+    router_dependencies.append(Depends(request_db_session))
+
+router = APIRouter(prefix="/api/v1/promocodes", tags=["promocodes"], dependencies=router_dependencies)
 
 # Создаем экземпляр сервиса
-promocode_service = PromocodeService()
+promocode_service = PromocodeService(
+    metrics=ValidationMetrics(registry) if PROMOCODE_METRICS else None,
+    usage_stats=UsageStats() if PROMOCODE_USAGE_STATS else None
+)
+
+# Параметры списков: без limit/cursor - прежний полный список,
+# с ними - страница {"items", "next_cursor"}, format=ndjson - поток строк
+PageLimit = Query(None, ge=1, le=PROMOCODE_PAGE_SIZE_MAX)
+ListingFormat = Query("json", pattern="^(json|ndjson)$")
+
+
+def ndjson_response(rows: Iterator[Dict]) -> StreamingResponse:
+    """Построчная выдача: строки сериализуются по мере чтения из хранилища"""
+    return StreamingResponse(
+        (json.dumps(row, ensure_ascii=False) + "\n" for row in rows), media_type="application/x-ndjson"
+    )
 
 
 @router.post("/validate")
@@ -18,6 +51,24 @@ def validate_promocode(request: ValidatePromocodeRequest):
         raise HTTPException(status_code=500, detail=f"Ошибка при валидации промокода: {str(e)}")
 
 
+@router.post("/validate/batch")
+def validate_promocodes_batch(request: ValidatePromocodeBatchRequest):
+    """Пакетная валидация промокодов для корзины и предпросмотра заказа"""
+    try:
+        return {"results": promocode_service.validate_promocodes(request.items)}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при валидации промокодов: {str(e)}")
+
+
+@router.post("/best")
+def find_best_promocodes(request: BestPromocodeRequest):
+    """Самые выгодные промокоды пользователя для корзины, по убыванию скидки"""
+    try:
+        return promocode_service.find_best_promocodes(request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при подборе промокода: {str(e)}")
+
+
 @router.post("/apply")
 def apply_promocode(request: ApplyPromocodeRequest):
     """Применение промокода к заказу"""
@@ -36,43 +87,121 @@ def create_promocode(request: CreatePromocodeRequest):
         raise HTTPException(status_code=500, detail=f"Ошибка при создании промокода: {str(e)}")
 
 
+@router.post("/generate")
+def generate_promocodes(request: GeneratePromocodesRequest):
+    """Массовая генерация уникальных промокодов по шаблону"""
+    try:
+        return promocode_service.generate_promocodes(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при генерации промокодов: {str(e)}")
+
+
+@router.post("/signed")
+def issue_signed_promocodes(request: SignedPromocodesRequest):
+    """Выпуск подписанных промокодов, которые проверяются без обращения к хранилищу"""
+    try:
+        return promocode_service.issue_signed_promocodes(request)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при выпуске промокодов: {str(e)}")
+
+
+@router.post("/import")
+async def import_promocodes(request: Request, format: str = "jsonl"):
+    """Импорт промокодов из CSV или JSONL в теле запроса, вставка пачками по мере чтения"""
+    if format not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Формат импорта: {', '.join(IMPORT_FORMATS)}")
+    job = PromocodeImport(format, promocode_service.signed_prefix)
+    try:
+        async for line in iter_lines(request.stream()):
+            if job.add_line(line):
+                await run_in_threadpool(promocode_service.insert_import_batch, job)
+        await run_in_threadpool(promocode_service.insert_import_batch, job)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при импорте промокодов: {str(e)}")
+    return job.result()
+
+
 @router.get("/user/{user_id}")
-def get_user_promocodes(user_id: UUID):
+def get_user_promocodes(user_id: UUID, limit: Optional[int] = PageLimit, cursor: Optional[str] = None,
+                        format: str = ListingFormat):
     """Получение промокодов пользователя"""
     try:
+        if format == "ndjson":
+            return ndjson_response(promocode_service.iter_user_promocodes(user_id))
+        if limit is not None or cursor is not None:
+            return promocode_service.get_user_promocodes_page(user_id, cursor, limit or PROMOCODE_PAGE_SIZE)
         return promocode_service.get_user_promocodes(user_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении промокодов: {str(e)}")
 
 
 @router.get("/active")
-def get_active_promocodes():
+def get_active_promocodes(limit: Optional[int] = PageLimit, cursor: Optional[str] = None,
+                          format: str = ListingFormat):
     """Получение всех активных промокодов"""
     try:
+        if format == "ndjson":
+            return ndjson_response(promocode_service.iter_active_promocodes())
+        if limit is not None or cursor is not None:
+            return promocode_service.get_active_promocodes_page(cursor, limit or PROMOCODE_PAGE_SIZE)
         return promocode_service.get_all_active_promocodes()
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при получении активных промокодов: {str(e)}")
 
 
+@router.get("/search")
+def search_promocodes(prefix: str = Query(..., min_length=1, max_length=64), limit: Optional[int] = PageLimit,
+                      cursor: Optional[str] = None):
+    """Поиск промокодов по началу кода, страницами по возрастанию кода"""
+    try:
+        return promocode_service.search_promocodes(prefix, cursor, limit or PROMOCODE_PAGE_SIZE)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при поиске промокодов: {str(e)}")
+
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """Счетчики кеша промокодов: попадания, промахи, вытеснения"""
+    return promocode_service.get_cache_stats()
+
+
+@router.get("/stats/top")
+def get_hottest_promocodes(limit: int = Query(20, ge=1, le=1000)):
+    """Самые используемые промокоды: применения и отказы валидации"""
+    return promocode_service.get_hottest_promocodes(limit)
+
+
+@router.get("/{promo_code}/stats")
+def get_promocode_stats(promo_code: str):
+    """Скорость расхода промокода: применения и отказы по минутам за час и по часам за сутки"""
+    try:
+        stats = promocode_service.get_promocode_stats(promo_code)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка при получении статистики промокода: {str(e)}")
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Промокод не найден")
+    return stats
+
+
 @router.get("/{promo_code}")
 def get_promocode_info(promo_code: str):
     """Получение информации о промокоде"""
     try:
-        promocode = promocode_service.repo.get_by_code(promo_code)
-        if not promocode:
+        promocode_info = promocode_service.get_promocode_info(promo_code)
+        if not promocode_info:
             raise HTTPException(status_code=404, detail="Промокод не найден")
 
-        return {
-            "code": promocode.code,
-            "discount_type": promocode.discount_type,
-            "discount_value": promocode.discount_value,
-            "min_order_amount": promocode.min_order_amount,
-            "max_discount": promocode.max_discount,
-            "expires_at": promocode.expires_at.isoformat(),
-            "usage_count": promocode.usage_count,
-            "max_usages": promocode.max_usages,
-            "status": promocode.status
-        }
+        return promocode_info
     except HTTPException:
         raise
     except Exception as e:
@@ -0,0 +1,123 @@
+import os
+import threading
+import weakref
+from typing import Callable, Dict, List, Optional, Tuple
+from .models import Promocode, DiscountType, ValidatePromocodeRequest
+
+PROMOCODE_RULE_CACHE_SIZE = int(os.getenv("PROMOCODE_RULE_CACHE_SIZE", "100000"))
+
+OrderPredicate = Callable[[ValidatePromocodeRequest], bool]
+DiscountFunction = Callable[[float], float]
+RuleCompiler = Callable[[Promocode], Optional[OrderPredicate]]
+
+
+class CompiledRule:
+    """Условия промокода, собранные один раз: предикат заказа и функция скидки"""
+
+    __slots__ = ("accepts", "discount", "discount_percent")
+
+    def __init__(self, accepts: OrderPredicate, discount: DiscountFunction, discount_percent: Optional[float]):
+        self.accepts = accepts
+        self.discount = discount
+        self.discount_percent = discount_percent
+
+
+# Дополнительные условия заказа в порядке проверки. Новое правило (окно по
+# времени, только первый заказ, лимит по категории) - функция от промокода,
+# возвращающая предикат запроса или None, если у промокода такого условия нет
+RULE_COMPILERS: List[RuleCompiler] = []
+
+
+def _order_predicate(promocode: Promocode, compilers: List[RuleCompiler]) -> OrderPredicate:
+    """Один плоский предикат: минимальная сумма, категории через frozenset, затем остальные правила"""
+    min_amount = promocode.min_order_amount
+    allowed = frozenset(promocode.applicable_categories)
+    if allowed:
+        # Пустой список категорий в запросе означает "без ограничений"
+        def accepts(request: ValidatePromocodeRequest) -> bool:
+            return request.order_amount >= min_amount \
+                and (not request.categories or not allowed.isdisjoint(request.categories))
+    else:
+        def accepts(request: ValidatePromocodeRequest) -> bool:
+            return request.order_amount >= min_amount
+
+    extra = [predicate for predicate in (compiler(promocode) for compiler in compilers) if predicate is not None]
+    if not extra:
+        return accepts
+    predicates = [accepts] + extra
+    return lambda request: all(predicate(request) for predicate in predicates)
+
+
+def _discount_function(promocode: Promocode) -> DiscountFunction:
+    if promocode.discount_type == DiscountType.PERCENTAGE:
+        rate = promocode.discount_value / 100
+        cap = promocode.max_discount
+        if cap:
+            return lambda order_amount: round(min(order_amount * rate, cap), 2)
+        return lambda order_amount: round(order_amount * rate, 2)
+    value = promocode.discount_value
+    return lambda order_amount: value
+
+
+def compile_rule(promocode: Promocode, compilers: Optional[List[RuleCompiler]] = None) -> CompiledRule:
+    return CompiledRule(
+        accepts=_order_predicate(promocode, RULE_COMPILERS if compilers is None else compilers),
+        discount=_discount_function(promocode),
+        discount_percent=promocode.discount_value if promocode.discount_type == DiscountType.PERCENTAGE else None,
+    )
+
+
+def rule_signature(promocode: Promocode) -> Tuple:
+    """Поля, от которых зависит скомпилированное правило.
+
+    Владелец, статус и счетчики проверяются сервисом отдельно, поэтому одно
+    правило обслуживает коды кампании у разных пользователей.
+    """
+    return (
+        promocode.discount_type == DiscountType.PERCENTAGE, promocode.discount_value, promocode.min_order_amount,
+        promocode.max_discount, tuple(promocode.applicable_categories),
+    )
+
+
+class RuleCache:
+    """Скомпилированные правила промокодов.
+
+    По коду хранится правило, условия, из которых оно собрано, и слабая
+    ссылка на объект промокода. Тот же объект (репозиторий в памяти) отдает
+    правило сразу: условия на месте не меняются, меняются только статус и
+    счетчики. Для свежих снимков (SQL, compact) условия сравниваются
+    кортежем, так что изменение условий замечается без явной инвалидации.
+    Коды с одинаковыми условиями (кампания) делят одно правило.
+    """
+
+    def __init__(self, max_size: int = PROMOCODE_RULE_CACHE_SIZE):
+        self.max_size = max_size
+        self._by_code: Dict[str, Tuple[weakref.ref, Tuple, CompiledRule]] = {}
+        self._shared: Dict[Tuple, CompiledRule] = {}
+        self._lock = threading.Lock()
+        self.compilations = 0
+
+    def get(self, promocode: Promocode) -> CompiledRule:
+        entry = self._by_code.get(promocode.code)
+        if entry is not None and entry[0]() is promocode:
+            return entry[2]
+        signature = rule_signature(promocode)
+        if entry is not None and entry[1] == signature:
+            rule = entry[2]
+        else:
+            with self._lock:
+                rule = self._shared.get(signature)
+                if rule is None:
+                    rule = compile_rule(promocode)
+                    self.compilations += 1
+                    if len(self._shared) >= self.max_size:
+                        self._shared.clear()
+                    self._shared[signature] = rule
+        with self._lock:
+            if len(self._by_code) >= self.max_size:
+                self._by_code.clear()
+            self._by_code[promocode.code] = (weakref.ref(promocode), signature, rule)
+        return rule
+
+    def __len__(self) -> int:
+        return len(self._shared)
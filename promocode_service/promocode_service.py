@@ -1,38 +1,277 @@
-from uuid import UUID
+import asyncio
+import base64
+import binascii
+import logging
+import os
+import threading
+import time
+from uuid import UUID, uuid4
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List, Optional
 from .models import (
-    Promocode, PromocodeStatus, DiscountType,
-    CreatePromocodeRequest, ValidatePromocodeRequest, ApplyPromocodeRequest
+    Promocode, PromocodeStatus,
+    CreatePromocodeRequest, GeneratePromocodesRequest, ValidatePromocodeRequest, ApplyPromocodeRequest,
+    BestPromocodeRequest, SignedPromocodesRequest
 )
-from .promocode_repo import PromocodeRepo
+from .promocode_repo import create_promocode_repo
+from .promocode_bulk import BULK_BATCH_SIZE, RESERVED_PREFIX, PromocodeImport, generate_codes
+from .promocode_idempotency import IdempotencyStore, create_idempotency_store
+from .promocode_metrics import ValidationMetrics
+from .promocode_rules import CompiledRule, RuleCache
+from .promocode_signed import (
+    PROMOCODE_SIGNED_PREFIX, PROMOCODE_SIGNING_KEY, SIGNED_COUNTER_OWNER, UNLIMITED_USAGES, SignedCodeCodec
+)
+from .promocode_usage_stats import APPLIED, UsageStats
+from .bloom_filter import BloomFilter
+
+logger = logging.getLogger(__name__)
+
+PROMOCODE_BLOOM_FILTER = os.getenv("PROMOCODE_BLOOM_FILTER", "false").lower() == "true"
+PROMOCODE_BLOOM_MIN_CAPACITY = int(os.getenv("PROMOCODE_BLOOM_MIN_CAPACITY", "1000000"))
+PROMOCODE_BLOOM_ERROR_RATE = float(os.getenv("PROMOCODE_BLOOM_ERROR_RATE", "0.01"))
+# Фильтр у каждого процесса свой: коды, созданные другими воркерами в общем
+# хранилище или БД, догружаются раз в этот интервал - только записанные после
+# прошлой догрузки. Полная пересборка (ее время растет с таблицей) - реже
+PROMOCODE_BLOOM_REFRESH_INTERVAL = float(os.getenv("PROMOCODE_BLOOM_REFRESH_INTERVAL", "10"))
+PROMOCODE_BLOOM_FULL_REBUILD_INTERVAL = float(os.getenv("PROMOCODE_BLOOM_FULL_REBUILD_INTERVAL", "3600"))
+# Постраничные списки: размер страницы по умолчанию, максимум и размер
+# пачки, которой читается хранилище при потоковой выдаче NDJSON
+PROMOCODE_PAGE_SIZE = int(os.getenv("PROMOCODE_PAGE_SIZE", "100"))
+PROMOCODE_PAGE_SIZE_MAX = int(os.getenv("PROMOCODE_PAGE_SIZE_MAX", "1000"))
+PROMOCODE_STREAM_CHUNK = int(os.getenv("PROMOCODE_STREAM_CHUNK", "1000"))
+
+# Причины отказа валидации; по ним же считаются метрики отказов
+NOT_FOUND = "Промокод не найден"
+NOT_USERS = "Промокод не доступен для данного пользователя"
+NOT_ACTIVE = "Промокод не активен"
+ORDER_MISMATCH = "Заказ не соответствует требованиям промокода"
+FAILURE_REASONS = (NOT_FOUND, NOT_USERS, NOT_ACTIVE, ORDER_MISMATCH)
+# События статистики кода по причинам отказа; несуществующие коды не учитываются
+USAGE_FAILURE_EVENTS = {NOT_USERS: "not_users", NOT_ACTIVE: "not_active", ORDER_MISMATCH: "order_mismatch"}
+
+
+def encode_cursor(code: str) -> str:
+    return base64.urlsafe_b64encode(code.encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[str]:
+    """Код, после которого начинается страница; ValueError для испорченного курсора"""
+    if cursor is None:
+        return None
+    try:
+        return base64.b64decode(cursor.encode(), altchars=b"-_", validate=True).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Некорректный курсор")
 
 
 class PromocodeService:
-    def __init__(self):
-        self.repo = PromocodeRepo()
+    def __init__(self, repo=None, use_code_filter: bool = PROMOCODE_BLOOM_FILTER,
+                 signing_key: str = PROMOCODE_SIGNING_KEY, applied_orders: Optional[IdempotencyStore] = None,
+                 metrics: Optional[ValidationMetrics] = None, usage_stats: Optional[UsageStats] = None):
+        self.repo = repo if repo is not None else create_promocode_repo()
+        # Результаты применений по (код, заказ): повтор apply не списывает код второй раз
+        self.applied_orders = applied_orders if applied_orders is not None else create_idempotency_store()
+        # Этапы валидации по выборке запросов и причины отказов; None - без метрик
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.register_failures(FAILURE_REASONS)
+        # Скорость расхода по кодам: окна применений и отказов; None - без статистики
+        self.usage_stats = usage_stats
+        # Подписанные коды проверяются без хранилища; без ключа не выпускаются и не принимаются
+        self.signed_codes: Optional[SignedCodeCodec] = SignedCodeCodec(signing_key) if signing_key else None
+        # Префикс закрыт для обычных кодов и без ключа: иначе после его появления
+        # такие коды уходили бы в проверку подписи и стали бы "не найдены"
+        self.signed_prefix = self.signed_codes.prefix if self.signed_codes is not None else PROMOCODE_SIGNED_PREFIX
+        # Фильтр Блума отсекает несуществующие коды (перебор ботами) до похода в репозиторий
+        self.code_filter: Optional[BloomFilter] = None
+        # Условия промокодов компилируются один раз при создании или первой загрузке
+        self.rules = RuleCache()
+        self._filter_lock = threading.Lock()
+        self._codes_during_rebuild: Optional[List[str]] = None
+        # Отметка хранилища, с которой фильтр догружается (code_mark/iter_codes_since)
+        self._filter_mark = None
+        if use_code_filter:
+            self.rebuild_code_filter()
+
+    def rebuild_code_filter(self):
+        """Пересборка фильтра по всем кодам хранилища с запасом емкости"""
+        if not self._begin_filter_rebuild():
+            return
+        try:
+            mark = self._code_mark()
+            fresh = BloomFilter.from_codes(
+                self.repo.iter_codes(), self._filter_capacity(self.repo.count()), PROMOCODE_BLOOM_ERROR_RATE
+            )
+        except Exception:
+            self._finish_filter_rebuild(None)
+            raise
+        self._finish_filter_rebuild(fresh, mark)
+
+    def refresh_code_filter(self):
+        """Догрузка в фильтр кодов, записанных в хранилище после прошлой сборки или догрузки"""
+        if self.code_filter is None:
+            return
+        if self._filter_mark is None:
+            # Хранилище без отметок изменений: остается только полная пересборка
+            self.rebuild_code_filter()
+            return
+        mark = self._code_mark()
+        if self._remember_codes(list(self.repo.iter_codes_since(self._filter_mark))):
+            self.rebuild_code_filter()
+            return
+        self._filter_mark = mark
+
+    def replace_repo(self, repo):
+        """Подмена хранилища прогретым при старте; фильтр Блума пересобирается по новому"""
+        self.repo = repo
+        if self.code_filter is not None:
+            self.rebuild_code_filter()
+
+    def get_promocode(self, code: str) -> Optional[Promocode]:
+        if self.code_filter is not None and code not in self.code_filter:
+            return None
+        return self.repo.get_by_code(code)
+
+    def get_promocode_info(self, code: str) -> Optional[Dict]:
+        if self._is_signed(code):
+            promocode = self._signed_promocode(code, None)
+        else:
+            promocode = self.get_promocode(code)
+        return self._promocode_info_view(promocode) if promocode else None
 
     def validate_promocode(self, request: ValidatePromocodeRequest) -> Dict:
-        promocode = self.repo.get_by_code(request.promo_code)
+        metrics = self.metrics
+        if metrics is not None and next(metrics.samples):
+            return self._counted(self._validate_timed(request), request.promo_code)
+        if self._is_signed(request.promo_code):
+            result = self._validate_loaded(self._signed_promocode(request.promo_code, request.user_id), request)
+        else:
+            result = self._validate_loaded(self.get_promocode(request.promo_code), request)
+        if not result["valid"]:
+            self._counted(result, request.promo_code)
+        return result
+
+    def _validate_timed(self, request: ValidatePromocodeRequest) -> Dict:
+        marks = [time.perf_counter()]
+        if self._is_signed(request.promo_code):
+            promocode = self._signed_promocode(request.promo_code, request.user_id)
+        else:
+            promocode = self.get_promocode(request.promo_code)
+        marks.append(time.perf_counter())
+        return self._validate_loaded_timed(promocode, request, marks)
+
+    def _counted(self, result: Dict, code: str) -> Dict:
+        """Отказ в метрики и в статистику кода"""
+        if not result["valid"]:
+            if self.metrics is not None:
+                self.metrics.failures[result["message"]].inc()
+            event = USAGE_FAILURE_EVENTS.get(result["message"]) if self.usage_stats is not None else None
+            if event is not None:
+                self.usage_stats.record(code, event)
+        return result
+
+    def validate_promocodes(self, requests: List[ValidatePromocodeRequest]) -> List[Dict]:
+        """Пакетная валидация: все коды загружаются из репозитория одним запросом"""
+        codes = {r.promo_code for r in requests if not self._is_signed(r.promo_code)}
+        if self.code_filter is not None:
+            codes = {code for code in codes if code in self.code_filter}
+        # Строки счетчиков подписанных кодов читаются тем же запросом, мимо фильтра
+        codes |= {r.promo_code for r in requests if self._is_signed(r.promo_code)}
+        promocodes = self.repo.get_many_by_codes(codes) if codes else {}
+        results = [self._validate_loaded(self._loaded_for(r, promocodes), r) for r in requests]
+        if self.metrics is not None or self.usage_stats is not None:
+            for request, result in zip(requests, results):
+                self._counted(result, request.promo_code)
+        return results
+
+    def _loaded_for(self, request: ValidatePromocodeRequest, promocodes: Dict[str, Promocode]) -> Optional[Promocode]:
+        if self._is_signed(request.promo_code):
+            promocode = self.signed_codes.decode(request.promo_code, request.user_id)
+            return self._with_counter(promocode, promocodes.get(request.promo_code))
+        return promocodes.get(request.promo_code)
+
+    def _signed_promocode(self, code: str, user_id: Optional[UUID]) -> Optional[Promocode]:
+        """Промокод из подписанного кода; у кода с лимитом - счетчик и статус из его строки"""
+        promocode = self.signed_codes.decode(code, user_id)
+        if promocode is None or promocode.max_usages == UNLIMITED_USAGES:
+            return promocode
+        # Строки счетчиков не попадают в фильтр Блума: чтение мимо него
+        return self._with_counter(promocode, self.repo.get_by_code(code))
+
+    @staticmethod
+    def _with_counter(promocode: Optional[Promocode], counter: Optional[Promocode]) -> Optional[Promocode]:
+        # Строка создается при первом применении; до него счетчик нулевой
+        if promocode is not None and counter is not None:
+            promocode.usage_count = counter.usage_count
+            promocode.status = counter.status
+        return promocode
+
+    def find_best_promocodes(self, request: BestPromocodeRequest) -> Dict:
+        """Все коды пользователя проверяются за один проход вместо N вызовов /validate"""
+        return self._rank_promocodes(self.repo.get_user_promocodes(request.user_id), request)
+
+    def _rank_promocodes(self, promocodes: List[Promocode], request: BestPromocodeRequest) -> Dict:
+        # У BestPromocodeRequest те же поля user_id/order_amount/categories, что читает _validate_loaded
+        results = [result for result in (self._validate_loaded(p, request) for p in promocodes) if result["valid"]]
+        results.sort(key=lambda result: (-result["discount_amount"], result["promo_code"]))
+        return {
+            "best": results[0] if results else None,
+            "results": results[:request.limit],
+            "eligible": len(results),
+            "evaluated": len(promocodes),
+        }
+
+    def _validate_loaded(self, promocode: Optional[Promocode], request: ValidatePromocodeRequest) -> Dict:
         if not promocode:
-            return {"valid": False, "message": "Промокод не найден"}
+            return {"valid": False, "message": NOT_FOUND}
 
-        if not self._check_user_eligibility(promocode, request.user_id):
-            return {"valid": False, "message": "Промокод не доступен для данного пользователя"}
+        if promocode.user_id != request.user_id:
+            return {"valid": False, "message": NOT_USERS}
 
         if not self._check_promocode_status(promocode):
-            return {"valid": False, "message": "Промокод не активен"}
+            return {"valid": False, "message": NOT_ACTIVE}
+
+        rule = self.rules.get(promocode)
+        if not rule.accepts(request):
+            return {"valid": False, "message": ORDER_MISMATCH}
+
+        return self._valid_response(promocode, rule, request)
+
+    def _validate_loaded_timed(self, promocode: Optional[Promocode], request: ValidatePromocodeRequest,
+                               marks: List[float]) -> Dict:
+        """_validate_loaded с отметками времени после каждого этапа; marks уже содержит загрузку кода"""
+        try:
+            if not promocode:
+                return {"valid": False, "message": NOT_FOUND}
+
+            owner_matches = promocode.user_id == request.user_id
+            marks.append(time.perf_counter())
+            if not owner_matches:
+                return {"valid": False, "message": NOT_USERS}
 
-        if not self._check_order_requirements(promocode, request.order_amount, request.categories):
-            return {"valid": False, "message": "Заказ не соответствует требованиям промокода"}
+            active = self._check_promocode_status(promocode)
+            marks.append(time.perf_counter())
+            if not active:
+                return {"valid": False, "message": NOT_ACTIVE}
 
-        discount_amount = self._calculate_discount(promocode, request.order_amount)
+            rule = self.rules.get(promocode)
+            accepted = rule.accepts(request)
+            marks.append(time.perf_counter())
+            if not accepted:
+                return {"valid": False, "message": ORDER_MISMATCH}
 
+            result = self._valid_response(promocode, rule, request)
+            marks.append(time.perf_counter())
+            return result
+        finally:
+            self.metrics.stages(marks)
+
+    def _valid_response(self, promocode: Promocode, rule: CompiledRule, request: ValidatePromocodeRequest) -> Dict:
         return {
             "valid": True,
             "promo_code": promocode.code,
-            "discount_amount": discount_amount,
-            "discount_percent": promocode.discount_value if promocode.discount_type == DiscountType.PERCENTAGE else None,
+            "discount_amount": rule.discount(request.order_amount),
+            "discount_percent": rule.discount_percent,
             "min_order_amount": promocode.min_order_amount,
             "max_discount": promocode.max_discount,
             "expires_at": promocode.expires_at.isoformat(),
@@ -40,21 +279,60 @@ class PromocodeService:
         }
 
     def apply_promocode(self, request: ApplyPromocodeRequest) -> Dict:
-        validation_result = self.validate_promocode(ValidatePromocodeRequest(
+        # Пользователь в ключе: чужой запрос с тем же заказом не получает записанный результат
+        key = (request.promo_code, request.user_id, request.order_id)
+        # Параллельный повтор того же заказа ждет первое применение и получает его результат
+        with self.applied_orders.lock(key):
+            recorded = self.applied_orders.get(key)
+            if recorded is None:
+                # Повтор на другом экземпляре: списывает только тот, кто забронировал ключ
+                recorded = self.applied_orders.claim(key)
+            if recorded is not None:
+                return recorded
+            try:
+                result = self._apply(request)
+            except BaseException:
+                self.applied_orders.release(key)
+                raise
+            # Отказ не записывается: ничего не списано, а исправленный заказ можно применить снова
+            if result.get("status") == "applied":
+                self.applied_orders.put(key, result)
+                self._record_applied(request.promo_code)
+            else:
+                self.applied_orders.release(key)
+            return result
+
+    def _apply(self, request: ApplyPromocodeRequest) -> Dict:
+        validation_result = self.validate_promocode(self._apply_validation_request(request))
+        if not validation_result["valid"]:
+            return validation_result
+
+        if self._is_signed(request.promo_code):
+            promocode = self.signed_codes.decode(request.promo_code, request.user_id)
+            if promocode.max_usages == UNLIMITED_USAGES:
+                return self._applied_response(promocode, validation_result, request)
+            # Счетчику лимитированного кода нужна строка: создается при первом
+            # применении, уже существующую add_promocodes пропустит
+            counter = promocode.model_copy(update={"id": uuid4(), "user_id": SIGNED_COUNTER_OWNER})
+            self.repo.add_promocodes([counter])
+
+        # Проверка лимита и инкремент выполняются репозиторием атомарно:
+        # параллельные применения не могут превысить max_usages
+        promocode = self.repo.consume_usage(request.promo_code)
+        return self._applied_response(promocode, validation_result, request)
+
+    def _apply_validation_request(self, request: ApplyPromocodeRequest) -> ValidatePromocodeRequest:
+        return ValidatePromocodeRequest(
             promo_code=request.promo_code,
             user_id=request.user_id,
             order_amount=request.order_amount,
             categories=[]
-        ))
-        if not validation_result["valid"]:
-            return validation_result
+        )
 
-        promocode = self.repo.get_by_code(request.promo_code)
-        promocode.usage_count += 1
-        if promocode.usage_count >= promocode.max_usages:
-            promocode.status = PromocodeStatus.USED
-
-        self.repo.update_promocode(promocode)
+    def _applied_response(self, promocode: Optional[Promocode], validation_result: Dict,
+                          request: ApplyPromocodeRequest) -> Dict:
+        if promocode is None:
+            return {"valid": False, "message": NOT_ACTIVE}
 
         return {
             "status": "applied",
@@ -67,13 +345,84 @@ class PromocodeService:
         }
 
     def create_promocode(self, request: CreatePromocodeRequest) -> Dict:
-        existing_promocode = self.repo.get_by_code(request.code)
+        if request.code.startswith(self.signed_prefix):
+            return {"status": "error", "message": RESERVED_PREFIX.format(self.signed_prefix)}
+        existing_promocode = self.get_promocode(request.code)
         if existing_promocode:
             return {"status": "error", "message": "Промокод с таким кодом уже существует"}
 
         promocode_data = request.dict()
         promocode = self.repo.create_promocode(promocode_data)
+        self.rules.get(promocode)
+        if self._remember_code(promocode.code):
+            self.rebuild_code_filter()
+        return self._created_response(promocode)
+
+    def issue_signed_promocodes(self, request: SignedPromocodesRequest) -> Dict:
+        """Подписанные коды кампании: в хранилище ничего не записывается"""
+        if self.signed_codes is None:
+            raise ValueError("Подписанные промокоды отключены: не задан PROMOCODE_SIGNING_KEY")
+        codes = self.signed_codes.issue(request)
+        return {"status": "created", "count": len(codes), "codes": codes}
 
+    def generate_promocodes(self, request: GeneratePromocodesRequest) -> Dict:
+        """Генерация count уникальных кодов по шаблону, вставка пачками по BULK_BATCH_SIZE"""
+        if request.prefix.startswith(self.signed_prefix):
+            raise ValueError(RESERVED_PREFIX.format(self.signed_prefix))
+        template = Promocode(
+            id=uuid4(), code="", usage_count=0, status=PromocodeStatus.ACTIVE, created_at=datetime.now(),
+            **request.model_dump(exclude={"prefix", "code_length", "count", "return_codes"})
+        )
+        # Коды кампании делят одно правило: компилируем его один раз по шаблону
+        self.rules.get(template)
+        created: List[str] = []
+        while len(created) < request.count:
+            size = min(request.count - len(created), BULK_BATCH_SIZE)
+            # Копия шаблона в разы дешевле конструктора модели на миллионе кодов.
+            # Совпавшие с существующими коды репозиторий пропускает, недостачу добираем следующей пачкой
+            codes = dict.fromkeys(code for code in generate_codes(request.prefix, request.code_length, size)
+                                  if not code.startswith(self.signed_prefix))
+            created.extend(self._insert_new_codes([
+                template.model_copy(update={"id": uuid4(), "code": code}) for code in codes
+            ]))
+
+        response = {"status": "created", "count": len(created)}
+        if request.return_codes:
+            response["codes"] = created
+        return response
+
+    def import_promocodes(self, lines: Iterable[str], fmt: str) -> Dict:
+        """Импорт CSV/JSONL построчно; для потоковой загрузки см. insert_import_batch"""
+        job = PromocodeImport(fmt, self.signed_prefix)
+        for line in lines:
+            if job.add_line(line):
+                self.insert_import_batch(job)
+        self.insert_import_batch(job)
+        return job.result()
+
+    def insert_import_batch(self, job: PromocodeImport):
+        batch = job.take_batch()
+        now = datetime.now()
+        # Поля уже проверены моделью CreatePromocodeRequest при разборе строки
+        inserted = self._insert_new_codes([
+            Promocode.model_construct(
+                id=uuid4(), code=code, usage_count=0, status=PromocodeStatus.ACTIVE, created_at=now, **data
+            )
+            for code, data in batch.items()
+        ])
+        job.created += len(inserted)
+        job.duplicates += len(batch) - len(inserted)
+
+    def _insert_new_codes(self, promocodes: List[Promocode]) -> List[str]:
+        """Пакетная вставка; возвращает коды, которых еще не было в хранилище"""
+        if not promocodes:
+            return []
+        inserted = [promocode.code for promocode in self.repo.add_promocodes(promocodes)]
+        if self._remember_codes(inserted):
+            self.rebuild_code_filter()
+        return inserted
+
+    def _created_response(self, promocode: Promocode) -> Dict:
         return {
             "status": "created",
             "promo_code": promocode.code,
@@ -83,66 +432,206 @@ class PromocodeService:
 
     def get_user_promocodes(self, user_id: UUID) -> List[Dict]:
         promocodes = self.repo.get_user_promocodes(user_id)
-        result = []
-        for promocode in promocodes:
-            result.append({
-                "code": promocode.code,
-                "discount_type": promocode.discount_type,
-                "discount_value": promocode.discount_value,
-                "min_order_amount": promocode.min_order_amount,
-                "max_discount": promocode.max_discount,
-                "expires_at": promocode.expires_at.isoformat(),
-                "usage_count": promocode.usage_count,
-                "max_usages": promocode.max_usages,
-                "status": promocode.status,
-                "applicable_categories": promocode.applicable_categories
-            })
-        return result
+        return [self._user_promocode_view(promocode) for promocode in promocodes]
 
     def get_all_active_promocodes(self) -> List[Dict]:
         active_promocodes = self.repo.get_active_promocodes()
-        result = []
-        for promocode in active_promocodes:
-            result.append({
-                "code": promocode.code,
-                "discount_type": promocode.discount_type,
-                "discount_value": promocode.discount_value,
-                "min_order_amount": promocode.min_order_amount,
-                "expires_at": promocode.expires_at.isoformat(),
-                "usage_count": promocode.usage_count,
-                "max_usages": promocode.max_usages
-            })
-        return result
+        return [self._active_promocode_view(promocode) for promocode in self._listed(active_promocodes)]
+
+    def get_user_promocodes_page(self, user_id: UUID, cursor: Optional[str] = None,
+                                 limit: int = PROMOCODE_PAGE_SIZE) -> Dict:
+        promocodes = self.repo.get_user_promocodes_page(user_id, decode_cursor(cursor), limit)
+        return self._page([self._user_promocode_view(p) for p in promocodes], promocodes, limit)
+
+    def get_active_promocodes_page(self, cursor: Optional[str] = None, limit: int = PROMOCODE_PAGE_SIZE) -> Dict:
+        promocodes = self.repo.get_active_promocodes_page(decode_cursor(cursor), limit)
+        return self._page([self._active_promocode_view(p) for p in self._listed(promocodes)], promocodes, limit)
+
+    def search_promocodes(self, prefix: str, cursor: Optional[str] = None,
+                          limit: int = PROMOCODE_PAGE_SIZE) -> Dict:
+        """Промокоды с кодом, начинающимся с prefix, страницами по возрастанию кода"""
+        promocodes = self.repo.search_by_prefix(prefix, decode_cursor(cursor), limit)
+        return self._page([self._search_view(p) for p in self._listed(promocodes)], promocodes, limit)
+
+    def iter_user_promocodes(self, user_id: UUID) -> Iterator[Dict]:
+        """Все промокоды пользователя пачками по PROMOCODE_STREAM_CHUNK: память не растет с объемом"""
+        after = None
+        while True:
+            promocodes = self.repo.get_user_promocodes_page(user_id, after, PROMOCODE_STREAM_CHUNK)
+            for promocode in promocodes:
+                yield self._user_promocode_view(promocode)
+            if len(promocodes) < PROMOCODE_STREAM_CHUNK:
+                return
+            after = promocodes[-1].code
+
+    def iter_active_promocodes(self) -> Iterator[Dict]:
+        after = None
+        while True:
+            promocodes = self.repo.get_active_promocodes_page(after, PROMOCODE_STREAM_CHUNK)
+            for promocode in self._listed(promocodes):
+                yield self._active_promocode_view(promocode)
+            if len(promocodes) < PROMOCODE_STREAM_CHUNK:
+                return
+            after = promocodes[-1].code
+
+    @staticmethod
+    def _listed(promocodes: List[Promocode]) -> List[Promocode]:
+        """Без строк счетчиков подписанных кодов: это служебные записи, а не промокоды"""
+        return [p for p in promocodes if p.user_id != SIGNED_COUNTER_OWNER]
+
+    @staticmethod
+    def _page(items: List[Dict], promocodes: List[Promocode], limit: int) -> Dict:
+        # Полная страница - возможно, есть следующая; курсор указывает на последний код
+        # (по строкам хранилища: отфильтрованные строки не обрывают выдачу)
+        next_cursor = encode_cursor(promocodes[-1].code) if len(promocodes) == limit else None
+        return {"items": items, "next_cursor": next_cursor}
+
+    @staticmethod
+    def _user_promocode_view(promocode: Promocode) -> Dict:
+        return {
+            "code": promocode.code,
+            "discount_type": promocode.discount_type,
+            "discount_value": promocode.discount_value,
+            "min_order_amount": promocode.min_order_amount,
+            "max_discount": promocode.max_discount,
+            "expires_at": promocode.expires_at.isoformat(),
+            "usage_count": promocode.usage_count,
+            "max_usages": promocode.max_usages,
+            "status": promocode.status,
+            "applicable_categories": promocode.applicable_categories
+        }
+
+    @staticmethod
+    def _search_view(promocode: Promocode) -> Dict:
+        return {**PromocodeService._user_promocode_view(promocode), "user_id": str(promocode.user_id)}
+
+    @staticmethod
+    def _promocode_info_view(promocode: Promocode) -> Dict:
+        return {
+            "code": promocode.code,
+            "discount_type": promocode.discount_type,
+            "discount_value": promocode.discount_value,
+            "min_order_amount": promocode.min_order_amount,
+            "max_discount": promocode.max_discount,
+            "expires_at": promocode.expires_at.isoformat(),
+            "usage_count": promocode.usage_count,
+            "max_usages": promocode.max_usages,
+            "status": promocode.status
+        }
+
+    @staticmethod
+    def _active_promocode_view(promocode: Promocode) -> Dict:
+        return {
+            "code": promocode.code,
+            "discount_type": promocode.discount_type,
+            "discount_value": promocode.discount_value,
+            "min_order_amount": promocode.min_order_amount,
+            "expires_at": promocode.expires_at.isoformat(),
+            "usage_count": promocode.usage_count,
+            "max_usages": promocode.max_usages
+        }
+
+    def get_promocode_stats(self, code: str) -> Optional[Dict]:
+        """Скорость расхода кода по окнам статистики и остаток применений; None - код неизвестен"""
+        promocode = self.get_promocode(code)
+        stats = self.usage_stats.code_stats(code) if self.usage_stats is not None else None
+        if promocode is None and stats is None:
+            return None
+        view = {"promo_code": code, "enabled": self.usage_stats is not None, "tracked": stats is not None}
+        if promocode is not None:
+            view.update(usage_count=promocode.usage_count, max_usages=promocode.max_usages,
+                        remaining=max(0, promocode.max_usages - promocode.usage_count), status=promocode.status)
+        return {**view, **(stats or {})}
+
+    def get_hottest_promocodes(self, limit: Optional[int] = None) -> Dict:
+        """Самые используемые коды по скетчу space-saving: счетчик и его возможное завышение"""
+        if self.usage_stats is None:
+            return {"enabled": False}
+        return {"enabled": True, "k": self.usage_stats.top.k, "codes": self.usage_stats.hottest(limit)}
+
+    def get_cache_stats(self) -> Dict:
+        cache = getattr(self.repo, "cache", None)
+        if cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **cache.stats()}
 
     # --- вложенные функции ---
-    def _check_user_eligibility(self, promocode: Promocode, user_id: UUID) -> bool:
-        return promocode.user_id == user_id
+    def _remember_code(self, code: str) -> bool:
+        return self._remember_codes([code])
+
+    def _remember_codes(self, codes: List[str]) -> bool:
+        """Добавление кодов в фильтр; True, если фильтр переполнен и его пора пересобрать"""
+        with self._filter_lock:
+            if self.code_filter is not None:
+                for code in codes:
+                    self.code_filter.add(code)
+            if self._codes_during_rebuild is not None:
+                self._codes_during_rebuild.extend(codes)
+            return self.code_filter is not None and self.code_filter.is_saturated()
+
+    @staticmethod
+    def _filter_capacity(codes_count: int) -> int:
+        return max(PROMOCODE_BLOOM_MIN_CAPACITY, codes_count * 2)
+
+    def _begin_filter_rebuild(self) -> bool:
+        with self._filter_lock:
+            if self._codes_during_rebuild is not None:
+                return False
+            self._codes_during_rebuild = []
+            return True
+
+    def _finish_filter_rebuild(self, fresh: Optional[BloomFilter], mark=None):
+        with self._filter_lock:
+            if fresh is not None:
+                # Коды, созданные во время чтения хранилища, могли не попасть в выборку
+                fresh.update(self._codes_during_rebuild)
+                self.code_filter = fresh
+                self._filter_mark = mark
+            self._codes_during_rebuild = None
+
+    def _code_mark(self):
+        code_mark = getattr(self.repo, "code_mark", None)
+        return code_mark() if code_mark is not None else None
+
+    def _record_applied(self, code: str):
+        if self.usage_stats is not None:
+            self.usage_stats.record(code, APPLIED)
+
+    def _is_signed(self, code: str) -> bool:
+        return self.signed_codes is not None and self.signed_codes.is_signed(code)
 
     def _check_promocode_status(self, promocode: Promocode) -> bool:
         if promocode.status != PromocodeStatus.ACTIVE:
             return False
         if datetime.now() > promocode.expires_at:
             promocode.status = PromocodeStatus.EXPIRED
-            self.repo.update_promocode(promocode)
-            return False
-        if promocode.usage_count >= promocode.max_usages:
+        elif promocode.usage_count >= promocode.max_usages:
             promocode.status = PromocodeStatus.USED
-            self.repo.update_promocode(promocode)
-            return False
-        return True
-
-    def _check_order_requirements(self, promocode: Promocode, order_amount: float, categories: List[str]) -> bool:
-        if order_amount < promocode.min_order_amount:
-            return False
-        if promocode.applicable_categories and categories and not any(cat in promocode.applicable_categories for cat in categories):
-            return False
-        return True
-
-    def _calculate_discount(self, promocode: Promocode, order_amount: float) -> float:
-        if promocode.discount_type == DiscountType.PERCENTAGE:
-            discount = order_amount * (promocode.discount_value / 100)
-            if promocode.max_discount:
-                discount = min(discount, promocode.max_discount)
-            return round(discount, 2)
         else:
-            return promocode.discount_value
\ No newline at end of file
+            return True
+        # Снимок подписанного кода собран из самого кода: записывать нечего,
+        # а строку счетчика он затер бы нулевым usage_count
+        if not self._is_signed(promocode.code):
+            self._persist_status(promocode)
+        return False
+
+    def _persist_status(self, promocode: Promocode):
+        self.repo.update_promocode(promocode)
+
+
+async def run_code_filter_refresh(refresh, rebuild, interval: float = PROMOCODE_BLOOM_REFRESH_INTERVAL,
+                                  full_rebuild_interval: float = PROMOCODE_BLOOM_FULL_REBUILD_INTERVAL):
+    """Фоновая задача для хранилищ, в которые пишут и другие процессы: догрузка
+    новых кодов в фильтр Блума раз в interval и полная пересборка раз в
+    full_rebuild_interval (refresh и rebuild - корутины)"""
+    last_rebuild = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if time.monotonic() - last_rebuild >= full_rebuild_interval:
+                last_rebuild = time.monotonic()
+                await rebuild()
+            else:
+                await refresh()
+        except Exception:
+            logger.exception("Ошибка при обновлении фильтра промокодов")
@@ -0,0 +1,488 @@
+import fcntl
+import math
+import mmap
+import os
+import threading
+import zlib
+from array import array
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID, uuid4
+from .models import Promocode, PromocodeStatus
+from .promocode_code_index import SortedCodeIndex
+from .promocode_compact_repo import (
+    _ACTIVE, _DISCOUNT_TYPE_IDS, _DISCOUNT_TYPES, _EXPIRED, _STATUS_IDS, _STATUSES, _USED,
+    _from_epoch_us, _merge_expiry, _to_epoch_us,
+)
+
+# Файл общей таблицы: tmpfs, чтобы страницы жили в памяти; все воркеры отображают его
+PROMOCODE_SHARED_PATH = os.getenv("PROMOCODE_SHARED_PATH", "/dev/shm/promocodes.table")
+# Емкость задается при создании файла; страницы tmpfs выделяются по мере записи
+PROMOCODE_SHARED_CAPACITY = int(os.getenv("PROMOCODE_SHARED_CAPACITY", "1000000"))
+# Байт строковой области на строку: код и категории
+SHARED_ARENA_PER_ROW = 64
+
+USAGE_LOCK_STRIPES = 64
+SHARED_MAGIC = int.from_bytes(b"PCSHRD01", "little")
+SHARED_VERSION = 1
+_HEADER_SIZE = 4096
+# Поля заголовка (uint64); _REACTIVATIONS - сколько раз строка снова становилась активной
+_MAGIC, _VERSION, _CAPACITY, _ARENA_SIZE, _ROWS, _ARENA_USED, _REACTIVATIONS = range(7)
+# Байт файла под блокировку fcntl: 0 - добавление строк, далее полосы счетчиков
+_APPEND_LOCK_BYTE = 0
+_CATEGORY_SEPARATOR = b"\x1f"
+
+# Колонки: (имя, тип array, элементов на строку). Номера строк в хеш-таблицах
+# и списках хранятся со сдвигом на 1: нулевые страницы файла - пустые ячейки
+_COLUMNS = (
+    ("ids", "B", 16), ("user_ids", "B", 16), ("discount_type", "B", 1), ("discount_value", "d", 1),
+    ("min_order_amount", "d", 1), ("max_discount", "d", 1), ("expires_at", "q", 1), ("created_at", "q", 1),
+    ("usage_count", "I", 1), ("max_usages", "I", 1), ("status", "B", 1), ("next_user_row", "I", 1),
+    ("code_start", "Q", 1), ("code_length", "H", 1), ("categories_start", "Q", 1), ("categories_length", "H", 1),
+)
+
+
+def _table_size(capacity: int) -> int:
+    size = 16
+    while size < capacity * 2:
+        size *= 2
+    return size
+
+
+def _layout(capacity: int) -> Tuple[Dict[str, Tuple[int, str, int]], int]:
+    """Смещение, тип и число элементов каждой области файла; размер файла"""
+    regions: Dict[str, Tuple[int, str, int]] = {}
+    offset = _HEADER_SIZE
+    table_size = _table_size(capacity)
+    specs = [(name, typecode, capacity * per_row) for name, typecode, per_row in _COLUMNS]
+    specs += [("code_slots", "I", table_size), ("user_slots", "I", table_size),
+              ("arena", "B", capacity * SHARED_ARENA_PER_ROW)]
+    for name, typecode, count in specs:
+        regions[name] = (offset, typecode, count)
+        offset += (count * array(typecode).itemsize + 63) // 64 * 64
+    return regions, offset
+
+
+class SharedPromocodeRepo:
+    """Таблица промокодов в общей памяти для нескольких процессов-воркеров.
+
+    Колонки, как у CompactPromocodeRepo, лежат в файле на tmpfs фиксированной
+    емкости; каждый процесс отображает его и читает поля без копий и
+    блокировок. Хеш-индексы кодов и пользователей - открытая адресация в том
+    же файле с crc32 вместо hash(): он одинаков во всех процессах. Счетчик и
+    статус меняются под полосой блокировок: threading.Lock внутри процесса и
+    fcntl.lockf на байт полосы между процессами. Строки добавляются под
+    блокировкой файла и публикуются записью в хеш-индекс последней.
+    """
+
+    def __init__(self, path: str = PROMOCODE_SHARED_PATH, capacity: int = PROMOCODE_SHARED_CAPACITY):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Файл создает первый процесс; остальные ждут его блокировку и берут емкость из заголовка
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, _APPEND_LOCK_BYTE)
+            try:
+                if os.fstat(self._fd).st_size == 0:
+                    os.ftruncate(self._fd, _layout(capacity)[1])
+                    self._mmap = mmap.mmap(self._fd, 0)
+                    with memoryview(self._mmap)[:_HEADER_SIZE].cast("Q") as header:
+                        header[_VERSION], header[_CAPACITY] = SHARED_VERSION, capacity
+                        header[_ARENA_SIZE] = capacity * SHARED_ARENA_PER_ROW
+                        header[_MAGIC] = SHARED_MAGIC
+                else:
+                    self._mmap = mmap.mmap(self._fd, 0)
+                self._map()
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _APPEND_LOCK_BYTE)
+        except Exception:
+            os.close(self._fd)
+            raise
+
+        self._append_lock = threading.Lock()
+        self._usage_locks = [threading.Lock() for _ in range(USAGE_LOCK_STRIPES)]
+        # Кеши процесса: разобранные наборы категорий, порядок строк по коду, очередь истечения
+        self._category_starts: Dict[bytes, int] = {}
+        self._category_lists: Dict[Tuple[int, int], List[str]] = {}
+        self._index_lock = threading.Lock()
+        self._code_order = SortedCodeIndex(self._code_of)
+        self._sorted_upto = 0
+        # Активные строки по коду: вышедшие из ACTIVE отбрасываются при чтении,
+        # вернувшиеся в ACTIVE видны по счетчику в заголовке - тогда индекс собирается заново
+        self._active_order = SortedCodeIndex(self._code_of, "I")
+        self._active_upto = 0
+        self._active_reactivations = 0
+        # Порядок строк пользователей, чьи коды листали постранично, и последняя
+        # учтенная строка каждого: новые строки берутся из начала его списка
+        self._user_orders: Dict[bytes, Tuple[SortedCodeIndex, int]] = {}
+        self._expiry_lock = threading.Lock()
+        self._expiry_rows = array("I")
+        self._expiry_keys = array("q")
+        self._expiry_position = 0
+        self._expiry_upto = 0
+        self._expiry_pending: List[int] = []
+
+    def _map(self):
+        view = memoryview(self._mmap)
+        self._header = view[:_HEADER_SIZE].cast("Q")
+        if self._header[_MAGIC] != SHARED_MAGIC or self._header[_VERSION] != SHARED_VERSION:
+            raise ValueError(f"{self.path} не является общей таблицей промокодов этой версии")
+        self.capacity = self._header[_CAPACITY]
+        regions, size = _layout(self.capacity)
+        if size != len(self._mmap):
+            raise ValueError(f"Размер общей таблицы {self.path} не соответствует емкости")
+        for name, (offset, typecode, count) in regions.items():
+            setattr(self, "_" + name, view[offset:offset + count * array(typecode).itemsize].cast(typecode))
+        self._mask = len(self._code_slots) - 1
+
+    def close(self):
+        """Освобождение отображения; сам файл остается для других процессов"""
+        for name in [name for name, _, _ in _COLUMNS] + ["code_slots", "user_slots", "arena", "header"]:
+            getattr(self, "_" + name).release()
+        self._mmap.close()
+        os.close(self._fd)
+
+    def get_by_code(self, code: str) -> Optional[Promocode]:
+        row = self._find(code.encode())
+        return self._to_model(row) if row >= 0 else None
+
+    def get_many_by_codes(self, codes: Iterable[str]) -> Dict[str, Promocode]:
+        found = {}
+        for code in codes:
+            row = self._find(code.encode())
+            if row >= 0:
+                found[code] = self._to_model(row)
+        return found
+
+    def get_user_promocodes(self, user_id: UUID) -> List[Promocode]:
+        return [self._to_model(row) for row in self._user_rows(user_id)]
+
+    def get_user_promocodes_page(self, user_id: UUID, after: Optional[str] = None,
+                                 limit: int = 100) -> List[Promocode]:
+        """Промокоды пользователя по возрастанию кода, начиная после кода after"""
+        with self._index_lock:
+            order = self._user_order(user_id.bytes)
+            rows = list(islice(order.iter_from(after.encode() if after is not None else None), limit))
+        return [self._to_model(row) for row in rows]
+
+    def add_promocode(self, promocode: Promocode) -> Promocode:
+        with self._appending():
+            row = self._find(promocode.code.encode())
+            if row < 0:
+                self._append_row(promocode)
+            else:
+                # Как у PromocodeRepo: добавление существующего кода заменяет его целиком
+                self._write_row(row, promocode, usage_count=True)
+        return promocode
+
+    def add_promocodes(self, promocodes: Iterable[Promocode]) -> List[Promocode]:
+        """Пакетное добавление под одной блокировкой; существующие коды пропускаются"""
+        added: List[Promocode] = []
+        with self._appending():
+            for promocode in promocodes:
+                if self._find(promocode.code.encode()) < 0:
+                    self._append_row(promocode)
+                    added.append(promocode)
+        return added
+
+    def create_promocode(self, promocode_data: dict) -> Promocode:
+        promocode = Promocode(
+            id=uuid4(),
+            usage_count=0,
+            status=PromocodeStatus.ACTIVE,
+            created_at=datetime.now(),
+            **promocode_data
+        )
+        return self.add_promocode(promocode)
+
+    def update_promocode(self, promocode: Promocode) -> Promocode:
+        """Запись условий и статуса снимка; usage_count меняется только через consume_usage"""
+        with self._appending():
+            row = self._find(promocode.code.encode())
+            if row < 0:
+                self._append_row(promocode)
+            else:
+                self._write_row(row, promocode, usage_count=False)
+        return promocode
+
+    def consume_usage(self, code: str, now: Optional[datetime] = None) -> Optional[Promocode]:
+        """Атомарная для всех процессов проверка лимита и увеличение usage_count"""
+        row = self._find(code.encode())
+        if row < 0:
+            return None
+        now_us = _to_epoch_us(now or datetime.now())
+        with self._usage_lock(row):
+            if self._status[row] != _ACTIVE or now_us > self._expires_at[row]:
+                return None
+            usage_count = self._usage_count[row]
+            if usage_count >= self._max_usages[row]:
+                return None
+            self._usage_count[row] = usage_count + 1
+            if usage_count + 1 >= self._max_usages[row]:
+                self._status[row] = _USED
+        return self._to_model(row)
+
+    def get_active_promocodes(self) -> List[Promocode]:
+        self.expire_due()
+        return [self._to_model(row) for row in self._active_rows()]
+
+    def get_active_promocodes_page(self, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        """Страница активных промокодов по возрастанию кода, начиная после кода after"""
+        self.expire_due()
+        return [self._to_model(row) for row in self._active_rows(after.encode() if after is not None else None, limit)]
+
+    def search_by_prefix(self, prefix: str, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        """Промокоды с кодом, начинающимся с prefix, по возрастанию кода после кода after"""
+        with self._index_lock:
+            rows = self._ordered_rows().search_prefix(
+                prefix.encode(), after.encode() if after is not None else None, limit
+            )
+        return [self._to_model(row) for row in rows]
+
+    def expire_due(self, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> List[str]:
+        """Перевод истекших активных промокодов в EXPIRED.
+
+        Очередь истечения у каждого процесса своя; перевод идемпотентен, так
+        что код, истекший в очереди соседнего воркера, просто пропускается.
+        """
+        now_us = _to_epoch_us(now or datetime.now())
+        expired: List[str] = []
+        with self._expiry_lock:
+            self._merge_expiry_pending()
+            rows, keys = self._expiry_rows, self._expiry_keys
+            position = self._expiry_position
+            while position < len(rows) and keys[position] < now_us and (
+                    batch_size is None or len(expired) < batch_size):
+                row, key = rows[position], keys[position]
+                position += 1
+                if self._expires_at[row] != key:
+                    continue
+                with self._usage_lock(row):
+                    if self._status[row] == _ACTIVE:
+                        self._status[row] = _EXPIRED
+                        expired.append(self._code_of(row).decode())
+            self._expiry_position = position
+        return expired
+
+    def count(self) -> int:
+        return self._header[_ROWS]
+
+    def iter_codes(self) -> Iterator[str]:
+        return (self._code_of(row).decode() for row in range(self.count()))
+
+    def code_mark(self) -> int:
+        """Отметка для iter_codes_since: строки только дописываются, отметка - их число"""
+        return self.count()
+
+    def iter_codes_since(self, mark: int) -> Iterator[str]:
+        return (self._code_of(row).decode() for row in range(mark, self.count()))
+
+    def memory_bytes(self) -> int:
+        """Размер файла таблицы; страницы tmpfs выделяются только под записанные строки"""
+        return len(self._mmap)
+
+    # --- вложенные функции ---
+    @contextmanager
+    def _appending(self):
+        with self._append_lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, _APPEND_LOCK_BYTE)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _APPEND_LOCK_BYTE)
+
+    @contextmanager
+    def _usage_lock(self, row: int):
+        stripe = row % USAGE_LOCK_STRIPES
+        with self._usage_locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 1 + stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 1 + stripe)
+
+    def _find(self, key: bytes) -> int:
+        """Номер строки кода или -1"""
+        slots, mask, arena = self._code_slots, self._mask, self._arena
+        slot = zlib.crc32(key) & mask
+        while True:
+            value = slots[slot]
+            if not value:
+                return -1
+            start = self._code_start[value - 1]
+            if arena[start:start + self._code_length[value - 1]] == key:
+                return value - 1
+            slot = (slot + 1) & mask
+
+    def _free_code_slot(self, key: bytes) -> int:
+        slots, mask = self._code_slots, self._mask
+        slot = zlib.crc32(key) & mask
+        while slots[slot]:
+            slot = (slot + 1) & mask
+        return slot
+
+    def _user_slot(self, user: bytes) -> int:
+        """Ячейка пользователя: с его последней строкой или первая пустая"""
+        slots, mask, user_ids = self._user_slots, self._mask, self._user_ids
+        slot = zlib.crc32(user) & mask
+        while True:
+            value = slots[slot]
+            if not value or user_ids[(value - 1) * 16:value * 16] == user:
+                return slot
+            slot = (slot + 1) & mask
+
+    def _user_rows(self, user_id: UUID) -> List[int]:
+        rows = []
+        value = self._user_slots[self._user_slot(user_id.bytes)]
+        while value:
+            rows.append(value - 1)
+            value = self._next_user_row[value - 1]
+        rows.reverse()
+        return rows
+
+    def _append_row(self, promocode: Promocode):
+        row = self._header[_ROWS]
+        if row >= self.capacity:
+            raise RuntimeError(f"Емкость общей таблицы промокодов исчерпана: {self.capacity}")
+        code = promocode.code.encode()
+        self._ids[row * 16:row * 16 + 16] = promocode.id.bytes
+        self._user_ids[row * 16:row * 16 + 16] = promocode.user_id.bytes
+        self._created_at[row] = _to_epoch_us(promocode.created_at)
+        self._code_start[row] = self._store(code)
+        self._code_length[row] = len(code)
+        self._write_row(row, promocode, usage_count=True)
+        user_slot = self._user_slot(promocode.user_id.bytes)
+        self._next_user_row[row] = self._user_slots[user_slot]
+        self._user_slots[user_slot] = row + 1
+        # Код публикуется последним: читатели других процессов не найдут строку раньше полей
+        self._code_slots[self._free_code_slot(code)] = row + 1
+        self._header[_ROWS] = row + 1
+
+    def _write_row(self, row: int, promocode: Promocode, usage_count: bool):
+        categories = _CATEGORY_SEPARATOR.join(sorted({c.encode() for c in promocode.applicable_categories}))
+        start = self._category_starts.get(categories)
+        if start is None:
+            start = self._category_starts[categories] = self._store(categories)
+        with self._usage_lock(row):
+            expiry_changed = self._expires_at[row] != _to_epoch_us(promocode.expires_at)
+            reactivated = self._status[row] != _ACTIVE and promocode.status == PromocodeStatus.ACTIVE
+            self._discount_type[row] = _DISCOUNT_TYPE_IDS[promocode.discount_type]
+            self._discount_value[row] = promocode.discount_value
+            self._min_order_amount[row] = promocode.min_order_amount
+            self._max_discount[row] = math.nan if promocode.max_discount is None else promocode.max_discount
+            self._expires_at[row] = _to_epoch_us(promocode.expires_at)
+            self._max_usages[row] = promocode.max_usages
+            self._status[row] = _STATUS_IDS[promocode.status]
+            if reactivated:
+                # После записи статуса и под блокировкой добавления: счетчик меняет один процесс,
+                # а пересобравший индекс по новому значению уже видит строку активной
+                self._header[_REACTIVATIONS] += 1
+            self._categories_start[row] = start
+            self._categories_length[row] = len(categories)
+            if usage_count:
+                self._usage_count[row] = promocode.usage_count
+        if expiry_changed and row < self._expiry_upto:
+            with self._expiry_lock:
+                self._expiry_pending.append(row)
+
+    def _store(self, data: bytes) -> int:
+        """Строка в строковой области (только под блокировкой добавления)"""
+        used = self._header[_ARENA_USED]
+        if len(data) > 0xFFFF or used + len(data) > self._header[_ARENA_SIZE]:
+            raise RuntimeError("Строковая область общей таблицы промокодов исчерпана")
+        self._arena[used:used + len(data)] = data
+        self._header[_ARENA_USED] = used + len(data)
+        return used
+
+    def _code_of(self, row: int) -> bytes:
+        start = self._code_start[row]
+        return bytes(self._arena[start:start + self._code_length[row]])
+
+    def _categories_of(self, row: int) -> List[str]:
+        key = (self._categories_start[row], self._categories_length[row])
+        categories = self._category_lists.get(key)
+        if categories is None:
+            data = bytes(self._arena[key[0]:key[0] + key[1]])
+            categories = self._category_lists[key] = [c.decode() for c in data.split(_CATEGORY_SEPARATOR)] \
+                if data else []
+        return list(categories)
+
+    def _ordered_rows(self) -> SortedCodeIndex:
+        # Строки, дописанные любым процессом после прошлого чтения, попадают в хвост индекса
+        rows = self.count()
+        for row in range(self._sorted_upto, rows):
+            self._code_order.add(row)
+        self._sorted_upto = rows
+        return self._code_order
+
+    def _active_rows(self, after: Optional[bytes] = None, limit: Optional[int] = None) -> List[int]:
+        """До limit активных строк после кода after; попутно выбрасывает из индекса
+        строки, которые любой процесс перевел из ACTIVE"""
+        status = self._status
+        rows: List[int] = []
+        stale: List[int] = []
+        with self._index_lock:
+            reactivations = self._header[_REACTIVATIONS]
+            if reactivations != self._active_reactivations:
+                ordered = self._ordered_rows().iter_from()
+                self._active_order = SortedCodeIndex(self._code_of, "I", array(
+                    "I", (row for row in ordered if status[row] == _ACTIVE)
+                ))
+                self._active_upto = self._sorted_upto
+                self._active_reactivations = reactivations
+            count = self.count()
+            for row in range(self._active_upto, count):
+                if status[row] == _ACTIVE:
+                    self._active_order.add(row)
+            self._active_upto = count
+
+            for row in self._active_order.iter_from(after):
+                if limit is not None and len(rows) >= limit:
+                    break
+                (rows if status[row] == _ACTIVE else stale).append(row)
+            for row in stale:
+                self._active_order.discard(row)
+        return rows
+
+    def _user_order(self, user: bytes) -> SortedCodeIndex:
+        # Строки, дописанные пользователю любым процессом, стоят в его списке до учтенной
+        last = self._user_slots[self._user_slot(user)]
+        order, seen = self._user_orders.get(user) or (SortedCodeIndex(self._code_of, "I"), 0)
+        value = last
+        while value and value != seen:
+            order.add(value - 1)
+            value = self._next_user_row[value - 1]
+        self._user_orders[user] = (order, last)
+        return order
+
+    def _merge_expiry_pending(self):
+        rows = self.count()
+        pending = self._expiry_pending + list(range(self._expiry_upto, rows))
+        if not pending:
+            return
+        self._expiry_keys, self._expiry_rows = _merge_expiry(
+            self._expiry_keys, self._expiry_rows, self._expiry_position,
+            array("q", (self._expires_at[row] for row in pending)), array("I", pending),
+        )
+        self._expiry_position = 0
+        self._expiry_upto = rows
+        self._expiry_pending = []
+
+    def _to_model(self, row: int) -> Promocode:
+        max_discount = self._max_discount[row]
+        return Promocode.model_construct(
+            id=UUID(bytes=bytes(self._ids[row * 16:row * 16 + 16])),
+            code=self._code_of(row).decode(),
+            user_id=UUID(bytes=bytes(self._user_ids[row * 16:row * 16 + 16])),
+            discount_type=_DISCOUNT_TYPES[self._discount_type[row]],
+            discount_value=self._discount_value[row],
+            min_order_amount=self._min_order_amount[row],
+            max_discount=None if math.isnan(max_discount) else max_discount,
+            expires_at=_from_epoch_us(self._expires_at[row]),
+            usage_count=self._usage_count[row],
+            max_usages=self._max_usages[row],
+            status=_STATUSES[self._status[row]],
+            applicable_categories=self._categories_of(row),
+            created_at=_from_epoch_us(self._created_at[row]),
+        )
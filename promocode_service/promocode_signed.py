@@ -0,0 +1,122 @@
+import base64
+import hmac
+import os
+import re
+import secrets
+import struct
+from datetime import datetime
+from typing import List, Optional
+from uuid import UUID
+from .models import DiscountType, Promocode, PromocodeStatus, SignedPromocodesRequest
+from .promocode_bulk import CODE_ALPHABET
+
+# Ключ подписи задается так же, как JWT_SECRET в recommendation_service;
+# пустой ключ отключает подписанные коды
+PROMOCODE_SIGNING_KEY = os.getenv("PROMOCODE_SIGNING_KEY", "")
+PROMOCODE_SIGNED_PREFIX = os.getenv("PROMOCODE_SIGNED_PREFIX", "SG-")
+
+# Условия в фиксированном порядке: флаги, скидка, минимальная сумма и
+# потолок скидки в копейках, срок в секундах Unix, лимит применений
+# (0 - без ограничений), случайный номер кода; для именных кодов следом UUID
+_TERMS = struct.Struct(">BIIIIHI")
+_FIXED = 1
+_USER_BOUND = 2
+_TAG_SIZE = 10
+# Лимит, при котором счетчик применений не ведется и хранилище не нужно
+UNLIMITED_USAGES = 2 ** 31 - 1
+_EPOCH_CREATED_AT = datetime.fromtimestamp(0)
+# Идентификатор строки выдается только при записи счетчика применений
+SIGNED_PROMOCODE_ID = UUID(int=0)
+# Владелец строки счетчика: не пользователь, иначе код попал бы в его /user и /best
+SIGNED_COUNTER_OWNER = UUID(int=0)
+
+# Код - base32 по CODE_ALPHABET без выравнивания. Разбор через int(..., 32)
+# работает в C, в отличие от base64.b32decode; алфавит проверяется заранее,
+# иначе int принял бы строчные буквы, "_" и пробелы как другие записи того же кода
+_TO_CODE_ALPHABET = bytes.maketrans(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ234567", CODE_ALPHABET.encode())
+_TO_INT_DIGITS = str.maketrans(CODE_ALPHABET, "0123456789abcdefghijklmnopqrstuv")
+_CODE_BODY = re.compile(f"[{CODE_ALPHABET}]+")
+
+
+def _cents(value: float) -> int:
+    return int(round(value * 100))
+
+
+class SignedCodeCodec:
+    """Промокоды без строки в хранилище: условия и HMAC-SHA256 внутри самого кода.
+
+    Проверка подписи и разбор условий выполняются в памяти, репозиторий
+    нужен только для счетчика применений кодов с лимитом.
+    """
+
+    def __init__(self, key: str, prefix: str = PROMOCODE_SIGNED_PREFIX):
+        if not key:
+            raise ValueError("Не задан ключ подписи промокодов")
+        self._key = key.encode()
+        self.prefix = prefix
+
+    def is_signed(self, code: str) -> bool:
+        return code.startswith(self.prefix)
+
+    def issue(self, request: SignedPromocodesRequest) -> List[str]:
+        flags = (_FIXED if request.discount_type == DiscountType.FIXED else 0) \
+            | (_USER_BOUND if request.user_id is not None else 0)
+        user = request.user_id.bytes if request.user_id is not None else b""
+        terms = (
+            flags, _cents(request.discount_value), _cents(request.min_order_amount),
+            _cents(request.max_discount or 0), int(request.expires_at.timestamp()), request.max_usages,
+        )
+        serials = secrets.token_bytes(4 * request.count)
+        return [
+            self._encode(_TERMS.pack(*terms, int.from_bytes(serials[i:i + 4], "big")) + user)
+            for i in range(0, 4 * request.count, 4)
+        ]
+
+    def decode(self, code: str, user_id: UUID) -> Optional[Promocode]:
+        """Промокод из подписанного кода или None для чужой или испорченной подписи.
+
+        Код без привязки к пользователю доступен любому: владельцем
+        считается user_id из запроса.
+        """
+        body = code[len(self.prefix):]
+        if not _CODE_BODY.fullmatch(body):
+            return None
+        size, padding = len(body) * 5 // 8, len(body) * 5 % 8
+        value = int(body.translate(_TO_INT_DIGITS), 32)
+        # Ненулевые биты выравнивания дали бы другую строку для той же подписи
+        # и обход лимита применений, который считается по строке кода
+        if value & ((1 << padding) - 1):
+            return None
+        raw = (value >> padding).to_bytes(size, "big")
+        payload, tag = raw[:-_TAG_SIZE], raw[-_TAG_SIZE:]
+        if len(payload) not in (_TERMS.size, _TERMS.size + 16) or not hmac.compare_digest(tag, self._sign(payload)):
+            return None
+
+        flags, discount, min_amount, max_discount, expires_at, max_usages, _ = _TERMS.unpack_from(payload)
+        if flags & _USER_BOUND:
+            if len(payload) != _TERMS.size + 16:
+                return None
+            user_id = UUID(bytes=payload[_TERMS.size:])
+        # Подпись уже проверена: поля не валидируются повторно
+        return Promocode.model_construct(
+            id=SIGNED_PROMOCODE_ID,
+            code=code,
+            user_id=user_id,
+            discount_type=DiscountType.FIXED if flags & _FIXED else DiscountType.PERCENTAGE,
+            discount_value=discount / 100,
+            min_order_amount=min_amount / 100,
+            max_discount=max_discount / 100 if max_discount else None,
+            expires_at=datetime.fromtimestamp(expires_at),
+            usage_count=0,
+            max_usages=max_usages or UNLIMITED_USAGES,
+            status=PromocodeStatus.ACTIVE,
+            applicable_categories=[],
+            created_at=_EPOCH_CREATED_AT,
+        )
+
+    def _encode(self, payload: bytes) -> str:
+        raw = payload + self._sign(payload)
+        return self.prefix + base64.b32encode(raw).rstrip(b"=").translate(_TO_CODE_ALPHABET).decode("ascii")
+
+    def _sign(self, payload: bytes) -> bytes:
+        return hmac.digest(self._key, payload, "sha256")[:_TAG_SIZE]
@@ -0,0 +1,267 @@
+"""Симуляция стоимости кампании на истории заказов до запуска промокода.
+
+Условия (поля CreatePromocodeRequest) проверяются по всем заказам
+векторно, пачками по PROMOCODE_SIMULATION_CHUNK: минимальная сумма,
+категории, скидка с потолком - те же правила, что у _validate_loaded
+(promocode_rules). Владелец, срок и статус кода не проверяются: считается,
+что код получил каждый покупатель.
+
+История - JSONL ({"order_amount": ..., "categories": [...]}) или CSV с
+заголовком (категории через "|", как в импорте). Текст разбирается
+построчно, поэтому для многих прогонов по одной истории ее один раз
+переводят в колонки (convert), а симуляция читает их отображением в память:
+    python -m promocode_service.promocode_simulation convert orders.csv orders.cols
+    python -m promocode_service.promocode_simulation simulate orders.cols terms.json
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from array import array
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional
+from uuid import UUID
+
+import numpy as np
+
+from .models import CreatePromocodeRequest, DiscountType
+
+PROMOCODE_SIMULATION_CHUNK = int(os.getenv("PROMOCODE_SIMULATION_CHUNK", "1000000"))
+
+ORDER_FORMATS = ("csv", "jsonl")
+COLUMNS_META = "meta.json"
+COLUMNS_VERSION = 1
+# Файлы колонок: сумма заказа, начало категорий заказа (rows + 1 значений), номера категорий
+_COLUMN_FILES = {"amounts": ("amounts.f8", np.float64), "offsets": ("offsets.i8", np.int64),
+                 "category_ids": ("category_ids.i4", np.int32)}
+
+
+class OrderChunk:
+    """Пачка заказов колонками; категории заказа i - category_ids[offsets[i]:offsets[i + 1]]"""
+
+    __slots__ = ("amounts", "offsets", "category_ids")
+
+    def __init__(self, amounts: np.ndarray, offsets: np.ndarray, category_ids: np.ndarray):
+        self.amounts = amounts
+        self.offsets = offsets
+        self.category_ids = category_ids
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+
+def simulation_terms(terms: Dict) -> CreatePromocodeRequest:
+    """Условия из JSON; код, владелец и срок для симуляции не нужны и подставляются"""
+    return CreatePromocodeRequest(**{"code": "SIMULATION", "user_id": UUID(int=0), "expires_at": datetime.max,
+                                     **terms})
+
+
+def read_order_chunks(path: str, vocabulary: Dict[str, int], fmt: Optional[str] = None,
+                      chunk_size: int = PROMOCODE_SIMULATION_CHUNK) -> Iterator[OrderChunk]:
+    """Пачки заказов из JSONL или CSV; новые категории дописываются в vocabulary"""
+    fmt = fmt or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in ORDER_FORMATS:
+        raise ValueError(f"Неизвестный формат истории заказов: {fmt}")
+    amounts, offsets, category_ids = array("d"), array("q", [0]), array("i")
+    with open(path, encoding="utf-8", newline="") as f:
+        if fmt == "csv":
+            reader = csv.reader(f)
+            header = [name.strip() for name in next(reader, [])]
+            if "order_amount" not in header:
+                raise ValueError("В заголовке CSV нет колонки order_amount")
+            amount_at = header.index("order_amount")
+            categories_at = header.index("categories") if "categories" in header else None
+            rows = ((row[amount_at], row[categories_at].split("|") if categories_at is not None else ())
+                    for row in reader if row)
+        else:
+            rows = ((order["order_amount"], order.get("categories") or ())
+                    for order in (json.loads(line) for line in f if line.strip()))
+        for line_number, (amount, categories) in enumerate(rows, 1):
+            try:
+                amounts.append(float(amount))
+            except (TypeError, ValueError):
+                raise ValueError(f"Строка {line_number}: неверная сумма заказа {amount!r}") from None
+            for category in categories:
+                if category:
+                    category_ids.append(vocabulary.setdefault(category, len(vocabulary)))
+            offsets.append(len(category_ids))
+            if len(amounts) >= chunk_size:
+                yield _chunk(amounts, offsets, category_ids)
+                amounts, offsets, category_ids = array("d"), array("q", [0]), array("i")
+    if amounts:
+        yield _chunk(amounts, offsets, category_ids)
+
+
+def _chunk(amounts: array, offsets: array, category_ids: array) -> OrderChunk:
+    return OrderChunk(np.frombuffer(amounts, dtype=np.float64), np.frombuffer(offsets, dtype=np.int64),
+                      np.frombuffer(category_ids, dtype=np.int32))
+
+
+def write_order_columns(chunks: Iterable[OrderChunk], vocabulary: Dict[str, int], directory: str) -> int:
+    """Пачки в каталог колонок; число заказов. Смещения категорий становятся сквозными"""
+    os.makedirs(directory, exist_ok=True)
+    files = {name: open(os.path.join(directory, filename), "wb") for name, (filename, _) in _COLUMN_FILES.items()}
+    rows = categories = 0
+    try:
+        files["offsets"].write(np.zeros(1, dtype=np.int64).tobytes())
+        for chunk in chunks:
+            files["amounts"].write(chunk.amounts.astype(np.float64, copy=False).tobytes())
+            files["offsets"].write((chunk.offsets[1:] + categories).astype(np.int64, copy=False).tobytes())
+            files["category_ids"].write(chunk.category_ids.astype(np.int32, copy=False).tobytes())
+            rows += len(chunk)
+            categories += len(chunk.category_ids)
+    finally:
+        for f in files.values():
+            f.close()
+    # Метаданные пишутся последними: каталог без них не читается
+    with open(os.path.join(directory, COLUMNS_META), "w", encoding="utf-8") as f:
+        json.dump({"version": COLUMNS_VERSION, "rows": rows, "byteorder": sys.byteorder,
+                   "categories": sorted(vocabulary, key=vocabulary.get)}, f, ensure_ascii=False)
+    return rows
+
+
+def load_order_columns(directory: str, chunk_size: int = PROMOCODE_SIMULATION_CHUNK):
+    """Словарь категорий и пачки заказов из каталога колонок (отображение в память, без копии)"""
+    with open(os.path.join(directory, COLUMNS_META), encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("version") != COLUMNS_VERSION or meta.get("byteorder") != sys.byteorder:
+        raise ValueError("Колонки записаны другой версией или на другой платформе")
+    rows = meta["rows"]
+    columns = {}
+    for name, (filename, dtype) in _COLUMN_FILES.items():
+        path = os.path.join(directory, filename)
+        # Пустой файл не отображается в память
+        columns[name] = np.memmap(path, dtype=dtype, mode="r") if os.path.getsize(path) else np.zeros(0, dtype)
+    if len(columns["amounts"]) != rows or len(columns["offsets"]) != rows + 1:
+        raise ValueError("Колонки заказов повреждены")
+    vocabulary = {category: i for i, category in enumerate(meta["categories"])}
+
+    def chunks() -> Iterator[OrderChunk]:
+        offsets = columns["offsets"]
+        for start in range(0, rows, chunk_size):
+            stop = min(rows, start + chunk_size)
+            first, last = offsets[start], offsets[stop]
+            yield OrderChunk(columns["amounts"][start:stop], offsets[start:stop + 1] - first,
+                             columns["category_ids"][first:last])
+
+    return vocabulary, chunks()
+
+
+def evaluate_chunk(terms: CreatePromocodeRequest, chunk: OrderChunk, allowed_ids: np.ndarray):
+    """Маска подходящих заказов, маска подходящих по сумме и скидка каждого заказа (0 для неподходящих).
+
+    allowed_ids - номера applicable_categories в словаре истории; пустой
+    список категорий у кода или у заказа означает "без ограничений".
+    """
+    amounts = np.asarray(chunk.amounts, dtype=np.float64)
+    amount_ok = amounts >= terms.min_order_amount
+    eligible = amount_ok
+    if terms.applicable_categories:
+        # Совпадения категорий считаются по заказам через накопленную сумму по границам
+        hits = np.concatenate(([0], np.cumsum(np.isin(chunk.category_ids, allowed_ids), dtype=np.int64)))
+        has_categories = chunk.offsets[1:] > chunk.offsets[:-1]
+        matched = hits[chunk.offsets[1:]] > hits[chunk.offsets[:-1]]
+        eligible = amount_ok & (~has_categories | matched)
+
+    if terms.discount_type == DiscountType.PERCENTAGE:
+        discounts = amounts * (terms.discount_value / 100)
+        if terms.max_discount:
+            np.minimum(discounts, terms.max_discount, out=discounts)
+        # Округление до копеек; половинные значения могут отличаться от round() на копейку
+        discounts = np.round(discounts, 2)
+    else:
+        discounts = np.full(len(amounts), terms.discount_value)
+    discounts[~eligible] = 0.0
+    return eligible, amount_ok, discounts
+
+
+def simulate(terms: CreatePromocodeRequest, chunks: Iterable[OrderChunk], vocabulary: Dict[str, int],
+             limit_usages: bool = False) -> Dict:
+    """Итоги кампании по истории: сколько заказов подошло и во что обошлась скидка.
+
+    С limit_usages код один на всех: после max_usages применений (в порядке
+    истории) остальные подходящие заказы скидку не получают.
+    """
+    started = time.perf_counter()
+    # Категории кода заносятся в словарь до чтения истории: пачки текста читаются
+    # лениво и дописывают словарь, номера нужны раньше первой пачки
+    allowed_ids = np.array([vocabulary.setdefault(c, len(vocabulary)) for c in terms.applicable_categories],
+                           dtype=np.int32)
+    orders = eligible_orders = below_min = category_mismatch = capped = 0
+    revenue = eligible_revenue = total_discount = 0.0
+    max_discount = 0.0
+    for chunk in chunks:
+        eligible, amount_ok, discounts = evaluate_chunk(terms, chunk, allowed_ids)
+        if limit_usages:
+            left = max(0, terms.max_usages - eligible_orders)
+            over = eligible & (np.cumsum(eligible) > left)
+            capped += int(over.sum())
+            eligible = eligible & ~over
+            discounts[over] = 0.0
+        amounts = np.asarray(chunk.amounts, dtype=np.float64)
+        count = int(eligible.sum())
+        orders += len(chunk)
+        eligible_orders += count
+        below_min += int((~amount_ok).sum())
+        category_mismatch += int((amount_ok & ~eligible).sum())
+        revenue += float(amounts.sum())
+        eligible_revenue += float(amounts[eligible].sum())
+        total_discount += float(discounts.sum())
+        if count:
+            max_discount = max(max_discount, float(discounts.max()))
+    if limit_usages:
+        # Заказы сверх лимита подошли по условиям, но не получили скидку
+        category_mismatch -= capped
+    return {
+        "orders": orders,
+        "eligible_orders": eligible_orders,
+        "eligible_share": round(eligible_orders / orders, 6) if orders else 0.0,
+        "rejected_min_order_amount": below_min,
+        "rejected_categories": category_mismatch,
+        "rejected_max_usages": capped,
+        "revenue": round(revenue, 2),
+        "eligible_revenue": round(eligible_revenue, 2),
+        "total_discount": round(total_discount, 2),
+        "average_discount": round(total_discount / eligible_orders, 2) if eligible_orders else 0.0,
+        "max_discount": round(max_discount, 2),
+        "discount_share_of_eligible_revenue": round(total_discount / eligible_revenue, 6) if eligible_revenue else 0.0,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def _open_history(path: str, vocabulary: Dict[str, int], chunk_size: int):
+    if os.path.isdir(path):
+        return load_order_columns(path, chunk_size)
+    return vocabulary, read_order_chunks(path, vocabulary, chunk_size=chunk_size)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Симуляция стоимости промокода на истории заказов")
+    commands = parser.add_subparsers(dest="command", required=True)
+    convert = commands.add_parser("convert", help="JSONL или CSV в каталог колонок")
+    convert.add_argument("orders")
+    convert.add_argument("directory")
+    run = commands.add_parser("simulate", help="итоги условий промокода на истории")
+    run.add_argument("orders", help="JSONL, CSV или каталог колонок")
+    run.add_argument("terms", help="JSON с полями CreatePromocodeRequest")
+    run.add_argument("--limit-usages", action="store_true", help="учитывать max_usages одного кода")
+    for command in (convert, run):
+        command.add_argument("--chunk-size", type=int, default=PROMOCODE_SIMULATION_CHUNK)
+    args = parser.parse_args(argv)
+
+    if args.command == "convert":
+        vocabulary: Dict[str, int] = {}
+        rows = write_order_columns(read_order_chunks(args.orders, vocabulary, chunk_size=args.chunk_size),
+                                   vocabulary, args.directory)
+        print(f"{rows} заказов, {len(vocabulary)} категорий -> {args.directory}")
+        return
+    with open(args.terms, encoding="utf-8") as f:
+        terms = simulation_terms(json.load(f))
+    vocabulary, chunks = _open_history(args.orders, {}, args.chunk_size)
+    print(json.dumps(simulate(terms, chunks, vocabulary, args.limit_usages), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
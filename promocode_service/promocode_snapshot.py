@@ -0,0 +1,255 @@
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from .models import Promocode
+from .promocode_compact_repo import USAGE_LOCK_STRIPES, CompactPromocodeRepo
+
+logger = logging.getLogger(__name__)
+
+# Файл снимка колоночного хранилища; пустая строка - прогрев при старте отключен
+PROMOCODE_SNAPSHOT_PATH = os.getenv("PROMOCODE_SNAPSHOT_PATH", "")
+# Запас при догрузке изменений: строки, закоммиченные после снимка с более ранним
+# updated_at (долгие транзакции, расхождение часов экземпляров), читаются повторно
+PROMOCODE_SNAPSHOT_OVERLAP = float(os.getenv("PROMOCODE_SNAPSHOT_OVERLAP", "60"))
+# После прогрева хранилище догружает из БД изменения других экземпляров раз в интервал
+PROMOCODE_SNAPSHOT_CATCH_UP_INTERVAL = float(os.getenv("PROMOCODE_SNAPSHOT_CATCH_UP_INTERVAL", "5"))
+
+SNAPSHOT_MAGIC = b"PCSNAP01"
+SNAPSHOT_VERSION = 1
+# Колонки выравниваются по 8 байт от начала данных
+_ALIGN = 8
+_PREFIX = struct.Struct("<8sQ")
+
+
+def _aligned(size: int) -> int:
+    return (size + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_snapshot(repo: CompactPromocodeRepo, path: str, taken_at: datetime):
+    """Запись снимка: заголовок JSON и колонки подряд; файл заменяется атомарно"""
+    meta, columns = repo.snapshot_columns()
+    layout: Dict[str, list] = {}
+    offset = 0
+    for name, column in columns.items():
+        size = len(column) * column.itemsize
+        layout[name] = [column.typecode, column.itemsize, offset, size]
+        offset += _aligned(size)
+    header = json.dumps({
+        "version": SNAPSHOT_VERSION, "taken_at": taken_at.isoformat(), "byteorder": sys.byteorder,
+        "rows": repo.count(), "columns": layout, **meta,
+    }, ensure_ascii=False).encode()
+
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(_PREFIX.pack(SNAPSHOT_MAGIC, len(header)))
+        f.write(header)
+        f.write(b"\0" * (_aligned(_PREFIX.size + len(header)) - _PREFIX.size - len(header)))
+        for name, column in columns.items():
+            f.write(column)
+            f.write(b"\0" * (_aligned(layout[name][3]) - layout[name][3]))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+def read_snapshot(path: str) -> Tuple[CompactPromocodeRepo, datetime]:
+    """Хранилище из снимка и время, на которое он снят; ValueError для чужого или испорченного файла.
+
+    Файл отображается в память, колонки копируются в массивы хранилища
+    целиком (frombytes) - без разбора промокодов по одному. Копия нужна:
+    хранилище дописывает строки в свои массивы.
+    """
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if len(mapped) < _PREFIX.size:
+            raise ValueError("Файл снимка обрезан")
+        magic, header_size = _PREFIX.unpack_from(mapped)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("Файл не является снимком промокодов")
+        header = json.loads(mapped[_PREFIX.size:_PREFIX.size + header_size])
+        if header["version"] != SNAPSHOT_VERSION or header["byteorder"] != sys.byteorder:
+            raise ValueError("Снимок записан другой версией или на другой платформе")
+        start = _aligned(_PREFIX.size + header_size)
+        columns: Dict[str, array] = {}
+        with memoryview(mapped) as view:
+            for name, (typecode, itemsize, offset, size) in header["columns"].items():
+                column = array(typecode)
+                if column.itemsize != itemsize or start + offset + size > len(mapped):
+                    raise ValueError(f"Колонка {name} снимка повреждена")
+                column.frombytes(view[start + offset:start + offset + size])
+                columns[name] = column
+    return CompactPromocodeRepo.from_snapshot_columns(header, columns), datetime.fromisoformat(header["taken_at"])
+
+
+class WarmupState:
+    """Готовность к трафику для /health: этап прогрева и его итоги"""
+
+    def __init__(self, ready: bool = False):
+        self.stage = "ready" if ready else "starting"
+        self.error: Optional[str] = None
+        self.snapshot_rows = 0
+        self.caught_up_rows = 0
+        self.seconds: Optional[float] = None
+        # Момент, с которого изменения БД еще не догружены
+        self.checkpoint: Optional[datetime] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.stage == "ready"
+
+    def as_dict(self) -> Dict:
+        return {
+            "stage": self.stage, "error": self.error, "snapshot_rows": self.snapshot_rows,
+            "caught_up_rows": self.caught_up_rows, "seconds": self.seconds,
+        }
+
+
+def warm_up(path: str, source, state: WarmupState,
+            overlap: float = PROMOCODE_SNAPSHOT_OVERLAP) -> CompactPromocodeRepo:
+    """Хранилище из снимка path и изменений source (SqlPromocodeRepo) после него.
+
+    Без снимка или с негодным снимком source читается целиком. После догрузки
+    снимок переписывается, чтобы следующий старт догружал меньше.
+    """
+    started = time.perf_counter()
+    state.stage = "loading_snapshot"
+    repo, since = CompactPromocodeRepo(), None
+    if os.path.exists(path):
+        try:
+            repo, taken_at = read_snapshot(path)
+            since = taken_at - timedelta(seconds=overlap)
+        except (OSError, ValueError):
+            logger.exception("Снимок %s не прочитан, полная загрузка из БД", path)
+    state.snapshot_rows = repo.count()
+
+    state.stage = "catching_up"
+    # Отметка берется до чтения: изменения во время догрузки попадут в следующую
+    checkpoint = datetime.now()
+    for promocode in source.iter_changed_since(since):
+        # Существующий код заменяется целиком, вместе со счетчиком применений
+        repo.add_promocode(promocode)
+        state.caught_up_rows += 1
+
+    if since is None or state.caught_up_rows:
+        state.stage = "writing_snapshot"
+        write_snapshot(repo, path, checkpoint)
+    state.checkpoint = checkpoint
+    state.seconds = round(time.perf_counter() - started, 3)
+    return repo
+
+
+class WriteThroughPromocodeRepo:
+    """Прогретое колоночное хранилище как кеш чтения поверх SQL.
+
+    Чтения обслуживает store (CompactPromocodeRepo из снимка). Создание,
+    изменения и списания сначала выполняет source (SqlPromocodeRepo), затем
+    результат записывается в store: применения не теряются при перезапуске
+    и попадают в следующий прогрев. Записи других экземпляров store
+    догружает в catch_up.
+    """
+
+    def __init__(self, store: CompactPromocodeRepo, source, checkpoint: Optional[datetime] = None):
+        self.store = store
+        self.source = source
+        self.checkpoint = checkpoint
+        # Ответы БД по одному коду пишутся в store в порядке списаний
+        self._usage_locks = [threading.Lock() for _ in range(USAGE_LOCK_STRIPES)]
+
+    def add_promocode(self, promocode: Promocode) -> Promocode:
+        self.source.add_promocode(promocode)
+        return self.store.add_promocode(promocode)
+
+    def add_promocodes(self, promocodes: Iterable[Promocode]) -> List[Promocode]:
+        added = self.source.add_promocodes(promocodes)
+        self.store.add_promocodes(added)
+        return added
+
+    def create_promocode(self, promocode_data: dict) -> Promocode:
+        return self.store.add_promocode(self.source.create_promocode(promocode_data))
+
+    def update_promocode(self, promocode: Promocode) -> Promocode:
+        self.source.update_promocode(promocode)
+        return self.store.update_promocode(promocode)
+
+    def consume_usage(self, code: str, now: Optional[datetime] = None) -> Optional[Promocode]:
+        """Лимит проверяет БД; строка в store заменяется ее ответом вместе со счетчиком"""
+        with self._usage_locks[hash(code) % USAGE_LOCK_STRIPES]:
+            promocode = self.source.consume_usage(code, now)
+            # Отказ: строку могли исчерпать другие экземпляры, store догоняет БД
+            current = promocode if promocode is not None else self.source.get_by_code(code)
+            if current is not None:
+                self.store.add_promocode(current)
+            return promocode
+
+    def expire_due(self, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> List[str]:
+        expired = self.store.expire_due(now, batch_size)
+        self.source.expire_due(now, batch_size)
+        return expired
+
+    def catch_up(self, overlap: float = PROMOCODE_SNAPSHOT_OVERLAP) -> List[str]:
+        """Догрузка строк, измененных в БД после прошлой отметки; коды догруженных строк.
+
+        Строка, прочитанная до собственного списания, может ненадолго вернуть
+        в store меньший счетчик: ее updated_at попадает в запас overlap, и
+        следующая догрузка перечитает ее. Лимит при этом проверяет БД.
+        """
+        checkpoint = datetime.now()
+        since = self.checkpoint - timedelta(seconds=overlap) if self.checkpoint is not None else None
+        codes = []
+        for promocode in self.source.iter_changed_since(since):
+            with self._usage_locks[hash(promocode.code) % USAGE_LOCK_STRIPES]:
+                self.store.add_promocode(promocode)
+            codes.append(promocode.code)
+        self.checkpoint = checkpoint
+        return codes
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+async def run_snapshot_catch_up(repo: WriteThroughPromocodeRepo,
+                                on_codes: Optional[Callable[[List[str]], object]] = None,
+                                interval: float = PROMOCODE_SNAPSHOT_CATCH_UP_INTERVAL):
+    """Фоновая задача: догрузка изменений БД в прогретое хранилище раз в interval;
+    on_codes получает догруженные коды (например, для фильтра Блума)"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            codes = await asyncio.to_thread(repo.catch_up)
+            if codes and on_codes is not None:
+                on_codes(codes)
+        except Exception:
+            logger.exception("Ошибка при догрузке изменений промокодов из БД")
+
+
+class WarmupGuard:
+    """ASGI-middleware: пока хранилище не прогрето, запросы API получают 503"""
+
+    def __init__(self, app, state: WarmupState, prefix: str = "/api/", retry_after: int = 1):
+        self.app = app
+        self.state = state
+        self.prefix = prefix
+        self.retry_after = retry_after
+
+    async def __call__(self, scope, receive, send):
+        if self.state.ready or scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+        body = json.dumps({"detail": "Сервис прогревается", "stage": self.state.stage}, ensure_ascii=False).encode()
+        await send({"type": "http.response.start", "status": 503, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+            (b"retry-after", str(self.retry_after).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+
+# Без снимка сервис готов сразу: хранилище создается при импорте роутера
+readiness = WarmupState(ready=not PROMOCODE_SNAPSHOT_PATH)
@@ -0,0 +1,424 @@
+import os
+from uuid import UUID, uuid4
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+from sqlalchemy import bindparam, case, delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from . import database
+from .database import PromocodeDB, PromocodeCategoryDB, PromocodeApplicationDB, PromocodeUsageFlushDB, db_session
+from .models import Promocode, PromocodeStatus
+
+# Размер IN-списка при проверке существующих кодов (лимит параметров SQLite - 32766)
+CODE_LOOKUP_CHUNK = 5000
+# Запас при чтении изменений по updated_at: строки долгих транзакций и других
+# экземпляров с отстающими часами закоммичены с более ранней отметкой
+PROMOCODE_CHANGE_OVERLAP = timedelta(seconds=float(os.getenv("PROMOCODE_CHANGE_OVERLAP", "60")))
+# Истекшие результаты применений удаляются раз в столько записей
+APPLICATION_PURGE_EVERY = 1000
+
+
+def consume_usage_statement(code: str, now: datetime):
+    return (
+        update(PromocodeDB)
+        .where(
+            PromocodeDB.code == code,
+            PromocodeDB.status == PromocodeStatus.ACTIVE.value,
+            PromocodeDB.expires_at >= now,
+            PromocodeDB.usage_count < PromocodeDB.max_usages,
+        )
+        .values(
+            usage_count=PromocodeDB.usage_count + 1,
+            status=case(
+                (PromocodeDB.usage_count + 1 >= PromocodeDB.max_usages, PromocodeStatus.USED.value),
+                else_=PromocodeDB.status,
+            ),
+        )
+        .returning(PromocodeDB)
+    )
+
+
+def active_promocodes_statement(now: datetime):
+    return select(PromocodeDB).where(
+        PromocodeDB.status == PromocodeStatus.ACTIVE.value,
+        PromocodeDB.expires_at > now,
+    )
+
+
+def active_promocodes_page_statement(now: datetime, after: Optional[str], limit: int):
+    statement = active_promocodes_statement(now).order_by(PromocodeDB.code).limit(limit)
+    if after is not None:
+        statement = statement.where(PromocodeDB.code > after)
+    return statement
+
+
+def user_promocodes_page_statement(user_id: UUID, after: Optional[str], limit: int):
+    statement = select(PromocodeDB).where(PromocodeDB.user_id == user_id).order_by(PromocodeDB.code).limit(limit)
+    if after is not None:
+        statement = statement.where(PromocodeDB.code > after)
+    return statement
+
+
+def prefix_search_statement(prefix: str, after: Optional[str], limit: int):
+    """Коды с префиксом диапазоном по уникальному индексу code: LIKE 'x%' индекс
+    использует не везде (SQLite без case_sensitive_like, PostgreSQL без
+    text_pattern_ops); LIKE остается проверкой внутри диапазона"""
+    statement = select(PromocodeDB).where(PromocodeDB.code.startswith(prefix, autoescape=True))
+    statement = statement.where(PromocodeDB.code > after if after is not None and after >= prefix
+                                else PromocodeDB.code >= prefix)
+    upper = prefix_upper_bound(prefix)
+    if upper is not None:
+        statement = statement.where(PromocodeDB.code < upper)
+    return statement.order_by(PromocodeDB.code).limit(limit)
+
+
+def prefix_upper_bound(prefix: str) -> Optional[str]:
+    """Наименьшая строка больше всех строк с префиксом prefix; None - такой нет"""
+    prefix = prefix.rstrip(chr(0x10FFFF))
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1) if prefix else None
+
+
+def expire_due_statement(now: datetime, batch_size: Optional[int]):
+    due = select(PromocodeDB.id).where(
+        PromocodeDB.status == PromocodeStatus.ACTIVE.value,
+        PromocodeDB.expires_at < now,
+    )
+    if batch_size is not None:
+        due = due.limit(batch_size)
+    return (
+        update(PromocodeDB)
+        .where(PromocodeDB.id.in_(due.scalar_subquery()))
+        .values(status=PromocodeStatus.EXPIRED.value)
+        .returning(PromocodeDB.code)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def increment_usages_statement():
+    """Прибавка пачки применений к счетчику кода; исчерпанный лимит переводит код в USED"""
+    table = PromocodeDB.__table__
+    new_count = table.c.usage_count + bindparam("increment")
+    return (
+        update(table)
+        .where(table.c.code == bindparam("target_code"))
+        .values(
+            usage_count=new_count,
+            status=case(
+                (
+                    (new_count >= table.c.max_usages) & (table.c.status == PromocodeStatus.ACTIVE.value),
+                    PromocodeStatus.USED.value,
+                ),
+                else_=table.c.status,
+            ),
+        )
+    )
+
+
+def apply_update(row: PromocodeDB, promocode: Promocode):
+    # usage_count меняется только через consume_usage: запись устаревшего
+    # значения из прочитанной ранее модели затерла бы параллельные применения
+    row.user_id = promocode.user_id
+    row.discount_type = promocode.discount_type.value
+    row.discount_value = promocode.discount_value
+    row.min_order_amount = promocode.min_order_amount
+    row.max_discount = promocode.max_discount
+    row.expires_at = promocode.expires_at
+    row.max_usages = promocode.max_usages
+    row.status = promocode.status.value
+    categories = sorted(set(promocode.applicable_categories))
+    if [c.category for c in row.categories] != categories:
+        row.categories = [PromocodeCategoryDB(category=c) for c in categories]
+        # Смена одних категорий не обновляет строку промокода, а догрузка снимка ищет по updated_at
+        row.updated_at = datetime.now()
+
+
+class SqlPromocodeRepo:
+    """Репозиторий промокодов поверх таблицы PromocodeDB"""
+
+    def __init__(self):
+        database.init_db()
+
+    def get_by_code(self, code: str) -> Optional[Promocode]:
+        with db_session() as db:
+            row = db.scalars(select(PromocodeDB).where(PromocodeDB.code == code)).one_or_none()
+            return self._to_model(row) if row else None
+
+    def get_many_by_codes(self, codes: Iterable[str]) -> Dict[str, Promocode]:
+        codes = list(codes)
+        if not codes:
+            return {}
+        with db_session() as db:
+            rows = db.scalars(select(PromocodeDB).where(PromocodeDB.code.in_(codes)))
+            return {row.code: self._to_model(row) for row in rows}
+
+    def get_user_promocodes(self, user_id: UUID) -> List[Promocode]:
+        with db_session() as db:
+            rows = db.scalars(
+                select(PromocodeDB).where(PromocodeDB.user_id == user_id).order_by(PromocodeDB.created_at)
+            )
+            return [self._to_model(row) for row in rows]
+
+    def get_user_promocodes_page(self, user_id: UUID, after: Optional[str] = None,
+                                 limit: int = 100) -> List[Promocode]:
+        """Промокоды пользователя по возрастанию кода, начиная после кода after"""
+        with db_session() as db:
+            rows = db.scalars(user_promocodes_page_statement(user_id, after, limit))
+            return [self._to_model(row) for row in rows]
+
+    def add_promocode(self, promocode: Promocode) -> Promocode:
+        with db_session() as db:
+            db.add(self._to_row(promocode))
+            db.commit()
+        return promocode
+
+    def add_promocodes(self, promocodes: Iterable[Promocode]) -> List[Promocode]:
+        """Пакетная вставка INSERT ... VALUES пачкой; существующие коды пропускаются"""
+        promocodes = list(promocodes)
+        with db_session() as db:
+            while True:
+                existing = self._existing_codes(db, [p.code for p in promocodes])
+                fresh = [p for p in promocodes if p.code not in existing]
+                if not fresh:
+                    return []
+                try:
+                    db.execute(insert(PromocodeDB), [self._to_values(p) for p in fresh])
+                    categories = [
+                        {"promocode_id": p.id, "category": category}
+                        for p in fresh for category in sorted(set(p.applicable_categories))
+                    ]
+                    if categories:
+                        db.execute(insert(PromocodeCategoryDB), categories)
+                    db.commit()
+                    return fresh
+                except IntegrityError:
+                    # Часть кодов успела вставить параллельная пачка: перепроверяем
+                    db.rollback()
+
+    def create_promocode(self, promocode_data: dict) -> Promocode:
+        promocode = Promocode(
+            id=uuid4(),
+            usage_count=0,
+            status=PromocodeStatus.ACTIVE,
+            created_at=datetime.now(),
+            **promocode_data
+        )
+        return self.add_promocode(promocode)
+
+    def update_promocode(self, promocode: Promocode) -> Promocode:
+        with db_session() as db:
+            row = db.scalars(select(PromocodeDB).where(PromocodeDB.code == promocode.code)).one()
+            apply_update(row, promocode)
+            db.commit()
+        return promocode
+
+    def consume_usage(self, code: str, now: Optional[datetime] = None) -> Optional[Promocode]:
+        """Атомарный инкремент одним условным UPDATE: лимит проверяет сама БД"""
+        with db_session() as db:
+            row = db.scalars(consume_usage_statement(code, now or datetime.now())).one_or_none()
+            result = self._to_model(row) if row else None
+            db.commit()
+            return result
+
+    def increment_usages(self, counts: Dict[str, int], batch_id: Optional[str] = None) -> bool:
+        """Одна транзакция на пачку счетчиков; False, если пачка batch_id уже записана"""
+        if not counts:
+            return True
+        with db_session() as db:
+            try:
+                if batch_id is not None:
+                    db.execute(insert(PromocodeUsageFlushDB).values(batch_id=batch_id, flushed_at=datetime.now()))
+                # Строки блокируются в порядке кодов: параллельные пачки не ждут друг друга по кругу
+                db.execute(increment_usages_statement(), [
+                    {"target_code": code, "increment": counts[code]} for code in sorted(counts)
+                ])
+                db.commit()
+                return True
+            except IntegrityError:
+                db.rollback()
+                return False
+
+    def get_active_promocodes(self) -> List[Promocode]:
+        with db_session() as db:
+            rows = db.scalars(active_promocodes_statement(datetime.now()))
+            return [self._to_model(row) for row in rows]
+
+    def get_active_promocodes_page(self, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        """Страница активных промокодов по индексу (status, code), начиная после кода after"""
+        with db_session() as db:
+            rows = db.scalars(active_promocodes_page_statement(datetime.now(), after, limit))
+            return [self._to_model(row) for row in rows]
+
+    def search_by_prefix(self, prefix: str, after: Optional[str] = None, limit: int = 100) -> List[Promocode]:
+        """Промокоды с кодом, начинающимся с prefix, по возрастанию кода после кода after"""
+        with db_session() as db:
+            rows = db.scalars(prefix_search_statement(prefix, after, limit))
+            return [self._to_model(row) for row in rows]
+
+    def expire_due(self, now: Optional[datetime] = None, batch_size: Optional[int] = None) -> List[str]:
+        """Перевод истекших активных промокодов в EXPIRED пачкой по индексу (status, expires_at)"""
+        with db_session() as db:
+            expired = db.scalars(expire_due_statement(now or datetime.now(), batch_size)).all()
+            db.commit()
+            return list(expired)
+
+    def count(self) -> int:
+        with db_session() as db:
+            return db.scalar(select(func.count()).select_from(PromocodeDB))
+
+    def iter_codes(self, chunk_size: int = 10000) -> Iterator[str]:
+        """Потоковое чтение всех кодов, например для пересборки фильтра Блума"""
+        with db_session() as db:
+            yield from db.scalars(select(PromocodeDB.code).execution_options(yield_per=chunk_size))
+
+    def code_mark(self) -> datetime:
+        """Отметка для iter_codes_since: коды, записанные после нее (с запасом), будут прочитаны"""
+        return datetime.now() - PROMOCODE_CHANGE_OVERLAP
+
+    def iter_codes_since(self, mark: datetime, chunk_size: int = 10000) -> Iterator[str]:
+        """Коды строк, измененных после mark, по индексу updated_at"""
+        statement = select(PromocodeDB.code).where(PromocodeDB.updated_at > mark)
+        with db_session() as db:
+            yield from db.scalars(statement.execution_options(yield_per=chunk_size))
+
+    def iter_changed_since(self, since: Optional[datetime], chunk_size: int = 10000) -> Iterator[Promocode]:
+        """Потоковое чтение промокодов, измененных после since (всех при None), по индексу updated_at"""
+        statement = select(PromocodeDB).execution_options(yield_per=chunk_size)
+        if since is not None:
+            statement = statement.where(PromocodeDB.updated_at > since)
+        with db_session() as db:
+            for row in db.scalars(statement):
+                yield self._to_model(row)
+
+    @staticmethod
+    def _existing_codes(db, codes: List[str]) -> Set[str]:
+        existing = set()
+        for start in range(0, len(codes), CODE_LOOKUP_CHUNK):
+            chunk = codes[start:start + CODE_LOOKUP_CHUNK]
+            existing.update(db.scalars(select(PromocodeDB.code).where(PromocodeDB.code.in_(chunk))))
+        return existing
+
+    @staticmethod
+    def _to_model(row: PromocodeDB) -> Promocode:
+        return Promocode(
+            id=row.id,
+            code=row.code,
+            user_id=row.user_id,
+            discount_type=row.discount_type,
+            discount_value=row.discount_value,
+            min_order_amount=row.min_order_amount,
+            max_discount=row.max_discount,
+            expires_at=row.expires_at,
+            usage_count=row.usage_count,
+            max_usages=row.max_usages,
+            status=row.status,
+            applicable_categories=[c.category for c in row.categories],
+            created_at=row.created_at,
+        )
+
+    @staticmethod
+    def _to_values(promocode: Promocode) -> dict:
+        return {
+            "id": promocode.id,
+            "code": promocode.code,
+            "user_id": promocode.user_id,
+            "discount_type": promocode.discount_type.value,
+            "discount_value": promocode.discount_value,
+            "min_order_amount": promocode.min_order_amount,
+            "max_discount": promocode.max_discount,
+            "expires_at": promocode.expires_at,
+            "usage_count": promocode.usage_count,
+            "max_usages": promocode.max_usages,
+            "status": promocode.status.value,
+            "created_at": promocode.created_at,
+        }
+
+    @staticmethod
+    def _to_row(promocode: Promocode) -> PromocodeDB:
+        return PromocodeDB(
+            id=promocode.id,
+            code=promocode.code,
+            user_id=promocode.user_id,
+            discount_type=promocode.discount_type.value,
+            discount_value=promocode.discount_value,
+            min_order_amount=promocode.min_order_amount,
+            max_discount=promocode.max_discount,
+            expires_at=promocode.expires_at,
+            usage_count=promocode.usage_count,
+            max_usages=promocode.max_usages,
+            status=promocode.status.value,
+            categories=[PromocodeCategoryDB(category=c) for c in sorted(set(promocode.applicable_categories))],
+            created_at=promocode.created_at,
+        )
+
+
+class SqlApplicationLog:
+    """Результаты применений в таблице promocode_applications"""
+
+    def __init__(self):
+        self._saves = 0
+
+    def load(self, key: Tuple[str, UUID, UUID], now: datetime) -> Optional[Dict]:
+        with db_session() as db:
+            return db.scalar(
+                select(PromocodeApplicationDB.result).where(
+                    *self._matches(key), PromocodeApplicationDB.expires_at > now,
+                )
+            )
+
+    def reserve(self, key: Tuple[str, UUID, UUID], result: Dict, expires_at: datetime) -> bool:
+        """Вставка строки-брони; False, если ключ уже занят другим экземпляром.
+
+        Первичный ключ (promo_code, user_id, order_id) пропускает только одну вставку,
+        поэтому списывает код только ее победитель.
+        """
+        with db_session() as db:
+            try:
+                # Истекшая бронь или запись того же заказа заменяется
+                db.execute(delete(PromocodeApplicationDB).where(
+                    *self._matches(key), PromocodeApplicationDB.expires_at <= datetime.now(),
+                ))
+                db.execute(insert(PromocodeApplicationDB).values(
+                    promo_code=key[0], user_id=key[1], order_id=key[2], result=result, expires_at=expires_at
+                ))
+                db.commit()
+                return True
+            except IntegrityError:
+                db.rollback()
+                return False
+
+    def release(self, key: Tuple[str, UUID, UUID]):
+        with db_session() as db:
+            db.execute(delete(PromocodeApplicationDB).where(*self._matches(key)))
+            db.commit()
+
+    def save(self, key: Tuple[str, UUID, UUID], result: Dict, expires_at: datetime):
+        """Результат на место брони; без брони (истекла и удалена) - новой строкой"""
+        with db_session() as db:
+            try:
+                saved = db.execute(update(PromocodeApplicationDB).where(*self._matches(key)).values(
+                    result=result, expires_at=expires_at
+                ))
+                if not saved.rowcount:
+                    db.execute(insert(PromocodeApplicationDB).values(
+                        promo_code=key[0], user_id=key[1], order_id=key[2], result=result, expires_at=expires_at
+                    ))
+                db.commit()
+            except IntegrityError:
+                # Строку того же заказа одновременно вставил другой экземпляр
+                db.rollback()
+        self._saves += 1
+        if self._saves % APPLICATION_PURGE_EVERY == 0:
+            self.purge_expired(datetime.now())
+
+    def purge_expired(self, now: datetime) -> int:
+        with db_session() as db:
+            deleted = db.execute(delete(PromocodeApplicationDB).where(PromocodeApplicationDB.expires_at <= now))
+            db.commit()
+            return deleted.rowcount
+
+    @staticmethod
+    def _matches(key: Tuple[str, UUID, UUID]) -> Tuple:
+        return (
+            PromocodeApplicationDB.promo_code == key[0],
+            PromocodeApplicationDB.user_id == key[1],
+            PromocodeApplicationDB.order_id == key[2],
+        )
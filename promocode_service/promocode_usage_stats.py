@@ -0,0 +1,175 @@
+import heapq
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+PROMOCODE_USAGE_STATS = os.getenv("PROMOCODE_USAGE_STATS", "true").lower() == "true"
+# Коды со счетчиками; сверх лимита забываются давно не использованные.
+# Окна кода занимают около 2,9 КБ
+PROMOCODE_USAGE_STATS_CODES = int(os.getenv("PROMOCODE_USAGE_STATS_CODES", "10000"))
+# Размер скетча самых горячих кодов
+PROMOCODE_USAGE_TOP_K = int(os.getenv("PROMOCODE_USAGE_TOP_K", "100"))
+
+APPLIED = "applied"
+# События по коду: применения и отказы валидации по причинам
+USAGE_EVENTS = (APPLIED, "not_users", "not_active", "order_mismatch")
+# (ширина корзины в секундах, число корзин): последний час по минутам и сутки по часам
+MINUTE_WINDOW = (60, 60)
+HOUR_WINDOW = (3600, 24)
+
+
+class RingWindow:
+    """Счетчики событий по корзинам времени в кольце фиксированного размера.
+
+    Корзина определяется номером интервала; ячейка кольца, оставшаяся от
+    прошлого круга, обнуляется при первой записи. Запись и чтение не зависят
+    от числа событий.
+    """
+
+    __slots__ = ("width", "size", "events", "counts", "stamps")
+
+    def __init__(self, width: int, size: int, events: int):
+        self.width = width
+        self.size = size
+        self.events = events
+        self.counts = array("I", bytes(4 * size * events))
+        self.stamps = array("q", [-1]) * size
+
+    def add(self, event: int, now: float):
+        bucket = int(now // self.width)
+        slot = bucket % self.size
+        if self.stamps[slot] != bucket:
+            self.stamps[slot] = bucket
+            start = slot * self.events
+            self.counts[start:start + self.events] = array("I", bytes(4 * self.events))
+        self.counts[slot * self.events + event] += 1
+
+    def series(self, now: float) -> List[List[int]]:
+        """По событию: счетчики корзин от самой старой к текущей"""
+        current = int(now // self.width)
+        result = [[0] * self.size for _ in range(self.events)]
+        for age in range(self.size):
+            bucket = current - self.size + 1 + age
+            slot = bucket % self.size
+            if self.stamps[slot] == bucket:
+                start = slot * self.events
+                for event in range(self.events):
+                    result[event][age] = self.counts[start + event]
+        return result
+
+
+class CodeUsage:
+    """Окна одного кода и итоги с начала наблюдения"""
+
+    __slots__ = ("minutes", "hours", "totals", "since")
+
+    def __init__(self, now: float, events: int):
+        self.minutes = RingWindow(*MINUTE_WINDOW, events)
+        self.hours = RingWindow(*HOUR_WINDOW, events)
+        self.totals = [0] * events
+        self.since = now
+
+
+class SpaceSaving:
+    """Самые частые ключи потока в k счетчиках (space-saving).
+
+    Новый ключ при заполненном скетче вытесняет ключ с минимальным счетчиком
+    и наследует его значение как погрешность: оценка завышена не больше чем
+    на error. Минимум ищется в куче с ленивым обновлением: у каждого ключа
+    одна запись не больше его счетчика, устаревшая перекладывается при выборе.
+    """
+
+    def __init__(self, k: int = PROMOCODE_USAGE_TOP_K):
+        self.k = k
+        self.counts: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self._heap: List[Tuple[int, str]] = []
+
+    def add(self, key: str):
+        count = self.counts.get(key)
+        if count is not None:
+            self.counts[key] = count + 1
+            return
+        error = 0
+        if len(self.counts) >= self.k:
+            error = self._evict_min()
+        self.counts[key] = error + 1
+        self.errors[key] = error
+        heapq.heappush(self._heap, (error + 1, key))
+
+    def top(self, limit: Optional[int] = None) -> List[Dict]:
+        ranked = sorted(self.counts.items(), key=lambda item: (-item[1], item[0]))[:limit]
+        return [{"promo_code": key, "count": count, "error": self.errors[key]} for key, count in ranked]
+
+    def _evict_min(self) -> int:
+        while True:
+            count, key = heapq.heappop(self._heap)
+            actual = self.counts[key]
+            if actual == count:
+                del self.counts[key]
+                del self.errors[key]
+                return count
+            heapq.heappush(self._heap, (actual, key))
+
+
+class UsageStats:
+    """Скорость расхода кодов: окна по минутам и часам на код и самые горячие коды.
+
+    Сервис записывает применения и отказы валидации (несуществующие коды не
+    учитываются - их перебор не должен вытеснять настоящие). Запись - O(1)
+    под одной блокировкой, чтение кода - только его окна.
+    """
+
+    def __init__(self, max_codes: int = PROMOCODE_USAGE_STATS_CODES, top_k: int = PROMOCODE_USAGE_TOP_K,
+                 events: Sequence[str] = USAGE_EVENTS):
+        self.max_codes = max_codes
+        self.events = tuple(events)
+        self._index = {event: i for i, event in enumerate(self.events)}
+        self._codes: "OrderedDict[str, CodeUsage]" = OrderedDict()
+        self.top = SpaceSaving(top_k)
+        self._lock = threading.Lock()
+
+    def record(self, code: str, event: str, now: Optional[float] = None):
+        index = self._index[event]
+        now = time.time() if now is None else now
+        with self._lock:
+            usage = self._codes.get(code)
+            if usage is None:
+                if len(self._codes) >= self.max_codes:
+                    self._codes.popitem(last=False)
+                usage = self._codes[code] = CodeUsage(now, len(self.events))
+            else:
+                self._codes.move_to_end(code)
+            usage.minutes.add(index, now)
+            usage.hours.add(index, now)
+            usage.totals[index] += 1
+            self.top.add(code)
+
+    def code_stats(self, code: str, now: Optional[float] = None) -> Optional[Dict]:
+        """Окна кода: ряды по минутам за час и по часам за сутки, суммы по окнам; None - код не наблюдался"""
+        now = time.time() if now is None else now
+        with self._lock:
+            usage = self._codes.get(code)
+            if usage is None:
+                return None
+            minutes, hours = usage.minutes.series(now), usage.hours.series(now)
+            totals, since = list(usage.totals), usage.since
+        return {
+            "since": datetime.fromtimestamp(since).isoformat(timespec="seconds"),
+            "totals": dict(zip(self.events, totals)),
+            "last_hour": {event: sum(series) for event, series in zip(self.events, minutes)},
+            "last_day": {event: sum(series) for event, series in zip(self.events, hours)},
+            "minutes": dict(zip(self.events, minutes)),
+            "hours": dict(zip(self.events, hours)),
+        }
+
+    def hottest(self, limit: Optional[int] = None) -> List[Dict]:
+        with self._lock:
+            return self.top.top(limit)
+
+    def __len__(self) -> int:
+        return len(self._codes)
@@ -0,0 +1,253 @@
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+from uuid import uuid4
+from .models import Promocode, PromocodeStatus
+
+logger = logging.getLogger(__name__)
+
+PROMOCODE_WRITE_BEHIND = os.getenv("PROMOCODE_WRITE_BEHIND", "false").lower() == "true"
+# Журнал одного процесса: счетчики в памяти верны, только пока коды применяет он один,
+# поэтому с несколькими воркерами (WEB_CONCURRENCY > 1) write-behind не запускается
+PROMOCODE_USAGE_LOG = os.getenv("PROMOCODE_USAGE_LOG", "promocode_usage.log")
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+# fsync на каждое применение переживает и отключение питания, но стоит
+# миллисекунды; без него журнал переживает падение процесса
+PROMOCODE_USAGE_LOG_FSYNC = os.getenv("PROMOCODE_USAGE_LOG_FSYNC", "false").lower() == "true"
+USAGE_FLUSH_INTERVAL = float(os.getenv("USAGE_FLUSH_INTERVAL", "1.0"))
+USAGE_FLUSH_SIZE = int(os.getenv("USAGE_FLUSH_SIZE", "1000"))
+USAGE_LOCK_STRIPES = 64
+
+
+class UsageLog:
+    """Журнал применений только на дозапись: строка JSON с кодом на применение.
+
+    Перед записью пачки в хранилище текущий файл запечатывается в сегмент
+    path.<batch_id> и удаляется после записи. Сегменты, оставшиеся после
+    сбоя, и текущий файл при старте повторяются под своими batch_id.
+    Журнал принадлежит одному процессу: его держит блокировка path.lock,
+    второй процесс с тем же путем (воркер uvicorn, соседний контейнер на
+    общем томе) запечатал бы и повторил чужие сегменты.
+    """
+
+    def __init__(self, path: str, fsync: bool = PROMOCODE_USAGE_LOG_FSYNC):
+        self.path = path
+        self.fsync = fsync
+        self._lock_fd = os.open(f"{path}.lock", os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(self._lock_fd)
+            raise RuntimeError(f"Журнал применений {path} уже открыт другим процессом: "
+                               "write-behind работает в одном воркере") from None
+        self._fd = self._open()
+
+    def append(self, code: str):
+        os.write(self._fd, (json.dumps(code) + "\n").encode())
+        if self.fsync:
+            os.fsync(self._fd)
+
+    def seal(self) -> str:
+        """Запечатывание текущего файла; возвращает batch_id сегмента"""
+        batch_id = uuid4().hex
+        os.close(self._fd)
+        os.replace(self.path, f"{self.path}.{batch_id}")
+        self._fd = self._open()
+        return batch_id
+
+    def discard(self, batch_id: str):
+        os.remove(f"{self.path}.{batch_id}")
+
+    def pending_segments(self) -> List[Tuple[str, Dict[str, int]]]:
+        """Незаписанные сегменты (batch_id, счетчики); текущий файл запечатывается"""
+        if os.path.getsize(self.path):
+            self.seal()
+        segments = []
+        for segment in glob.glob(glob.escape(self.path) + "." + "[0-9a-f]" * 32):
+            segments.append((segment.rsplit(".", 1)[1], self.read_counts(segment)))
+        return segments
+
+    @staticmethod
+    def read_counts(path: str) -> Dict[str, int]:
+        counts: Dict[str, int] = defaultdict(int)
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    counts[json.loads(line)] += 1
+                except ValueError:
+                    # Оборванная последняя строка: процесс упал посреди записи,
+                    # ответ на это применение клиент не получил
+                    continue
+        return dict(counts)
+
+    def close(self):
+        os.close(self._fd)
+        os.close(self._lock_fd)
+
+    def _open(self) -> int:
+        return os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+
+class _Counter:
+    __slots__ = ("promocode", "used", "unflushed")
+
+    def __init__(self, promocode: Promocode):
+        self.promocode = promocode
+        self.used = promocode.usage_count
+        self.unflushed = 0
+
+
+class WriteBehindPromocodeRepo:
+    """Отложенная запись счетчиков применений перед SQL-репозиторием.
+
+    consume_usage проверяет и резервирует применение в памяти и пишет строку
+    в локальный журнал; накопленные прибавки сливаются по кодам и пишутся
+    одной транзакцией increment_usages по таймеру или по числу применений.
+    Горячий код дает одну запись на пачку вместо блокировки строки на каждое
+    применение.
+
+    Счетчик в памяти верен, пока этот процесс - единственный, кто применяет
+    данные коды (один экземпляр или шардирование по коду).
+    """
+
+    def __init__(self, repo, log_path: str = PROMOCODE_USAGE_LOG, flush_size: int = USAGE_FLUSH_SIZE,
+                 fsync: bool = PROMOCODE_USAGE_LOG_FSYNC):
+        self.repo = repo
+        self.flush_size = flush_size
+        self.log = UsageLog(log_path, fsync)
+        self._counters: Dict[str, _Counter] = {}
+        self._usage_locks = [threading.Lock() for _ in range(USAGE_LOCK_STRIPES)]
+        # Прибавки текущего сегмента журнала; меняются вместе с журналом под одной блокировкой
+        self._pending: Dict[str, int] = defaultdict(int)
+        self._pending_total = 0
+        self._log_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Запечатанные, но еще не записанные пачки; после ошибки повторяются с тем же batch_id
+        self._sealed: List[Tuple[str, Dict[str, int]]] = []
+        self.flush_requested = threading.Event()
+        self.flushed_batches = 0
+        self.replayed_batches = 0
+        self.replay()
+
+    def replay(self):
+        """Дозапись сегментов журнала, оставшихся после сбоя"""
+        for batch_id, counts in self.log.pending_segments():
+            if self.repo.increment_usages(counts, batch_id):
+                self.replayed_batches += 1
+            self.log.discard(batch_id)
+
+    def consume_usage(self, code: str, now: Optional[datetime] = None) -> Optional[Promocode]:
+        now = now or datetime.now()
+        with self._usage_locks[hash(code) % USAGE_LOCK_STRIPES]:
+            counter = self._counters.get(code)
+            if counter is None:
+                promocode = self.repo.get_by_code(code)
+                if promocode is None:
+                    return None
+                counter = self._counters[code] = _Counter(promocode)
+            promocode = counter.promocode
+            if promocode.status != PromocodeStatus.ACTIVE or now > promocode.expires_at \
+                    or counter.used >= promocode.max_usages:
+                return None
+
+            counter.used += 1
+            counter.unflushed += 1
+            with self._log_lock:
+                self.log.append(code)
+                self._pending[code] += 1
+                self._pending_total += 1
+                if self._pending_total >= self.flush_size:
+                    self.flush_requested.set()
+            return self._with_usage(promocode, counter.used)
+
+    def flush(self) -> int:
+        """Запись накопленных прибавок; возвращает число записанных применений"""
+        with self._flush_lock:
+            with self._log_lock:
+                if self._pending:
+                    self._sealed.append((self.log.seal(), self._pending))
+                    self._pending, self._pending_total = defaultdict(int), 0
+                self.flush_requested.clear()
+            written = 0
+            while self._sealed:
+                batch_id, counts = self._sealed[0]
+                # При ошибке пачка остается в очереди и в журнале до следующей попытки
+                self.repo.increment_usages(counts, batch_id)
+                self._sealed.pop(0)
+                self.log.discard(batch_id)
+                self._forget_flushed(counts)
+                self.flushed_batches += 1
+                written += sum(counts.values())
+            return written
+
+    def close(self):
+        self.flush()
+        self.log.close()
+
+    def get_by_code(self, code: str) -> Optional[Promocode]:
+        return self._overlay(self.repo.get_by_code(code))
+
+    def get_many_by_codes(self, codes: Iterable[str]) -> Dict[str, Promocode]:
+        return {code: self._overlay(promocode) for code, promocode in self.repo.get_many_by_codes(codes).items()}
+
+    def update_promocode(self, promocode: Promocode) -> Promocode:
+        with self._usage_locks[hash(promocode.code) % USAGE_LOCK_STRIPES]:
+            result = self.repo.update_promocode(promocode)
+            counter = self._counters.get(promocode.code)
+            if counter is not None:
+                # Условия и статус берутся из обновления, счетчик остается своим
+                counter.promocode = promocode.model_copy(update={"usage_count": counter.used})
+            return result
+
+    def __getattr__(self, name):
+        # Списки и создание идут в репозиторий напрямую; usage_count в списках
+        # может отставать от памяти на один интервал записи
+        return getattr(self.repo, name)
+
+    def _overlay(self, promocode: Optional[Promocode]) -> Optional[Promocode]:
+        if promocode is None:
+            return None
+        counter = self._counters.get(promocode.code)
+        if counter is None or counter.used == promocode.usage_count:
+            return promocode
+        return self._with_usage(promocode, counter.used)
+
+    @staticmethod
+    def _with_usage(promocode: Promocode, used: int) -> Promocode:
+        status = promocode.status
+        if used >= promocode.max_usages and status == PromocodeStatus.ACTIVE:
+            status = PromocodeStatus.USED
+        return promocode.model_copy(update={"usage_count": used, "status": status})
+
+    def _forget_flushed(self, counts: Dict[str, int]):
+        # Записанные счетчики без новых применений больше не нужны в памяти:
+        # следующее применение перечитает код из хранилища
+        for code, count in counts.items():
+            with self._usage_locks[hash(code) % USAGE_LOCK_STRIPES]:
+                counter = self._counters.get(code)
+                if counter is None:
+                    continue
+                counter.unflushed -= count
+                if counter.unflushed == 0:
+                    del self._counters[code]
+
+
+async def run_usage_flusher(repo: WriteBehindPromocodeRepo, interval: float = USAGE_FLUSH_INTERVAL):
+    """Фоновая задача: запись счетчиков раз в interval или по заполнении пачки"""
+    try:
+        while True:
+            await asyncio.to_thread(repo.flush_requested.wait, interval)
+            try:
+                await asyncio.to_thread(repo.flush)
+            except Exception:
+                logger.exception("Ошибка при записи счетчиков применений")
+    finally:
+        # Остановка приложения: недописанное уходит в хранилище, иначе останется в журнале
+        await asyncio.to_thread(repo.flush)
@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+import pytest_asyncio
+from uuid import uuid4
+from datetime import datetime, timedelta
+from promocode_service import database
+from promocode_service.async_promocode_repo import AsyncPromocodeRepo, AsyncSqlPromocodeRepo
+from promocode_service.async_promocode_service import AsyncPromocodeService
+from promocode_service.models import (
+    ApplyPromocodeRequest, BestPromocodeRequest, CreatePromocodeRequest, DiscountType, Promocode, PromocodeStatus,
+    ValidatePromocodeRequest
+)
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_service import PromocodeService
+
+USER_ID = uuid4()
+
+
+@pytest_asyncio.fixture
+async def async_service(tmp_path):
+    # 100 параллельных apply ждут единственного писателя SQLite дольше 5 с по умолчанию
+    database.configure_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'promocodes.db'}?timeout=60")
+    service = AsyncPromocodeService(repo=AsyncSqlPromocodeRepo(), use_code_filter=True)
+    await service.start()
+    yield service
+    await service.drain()
+    await database.async_engine.dispose()
+
+
+def create_request(code, max_usages=1, expires_delta_days=1):
+    return CreatePromocodeRequest(
+        code=code,
+        user_id=USER_ID,
+        discount_type=DiscountType.PERCENTAGE,
+        discount_value=10,
+        min_order_amount=100,
+        max_discount=200,
+        expires_at=datetime.now() + timedelta(days=expires_delta_days),
+        max_usages=max_usages,
+        applicable_categories=["dairy"],
+    )
+
+
+def apply_request(code):
+    return ApplyPromocodeRequest(
+        promo_code=code, user_id=USER_ID, order_id=uuid4(), order_amount=500, final_amount=450
+    )
+
+
+@pytest.mark.asyncio
+async def test_create_validate_apply(async_service):
+    assert (await async_service.create_promocode(create_request("ASYNC10")))["status"] == "created"
+    assert (await async_service.create_promocode(create_request("ASYNC10")))["status"] == "error"
+
+    validation = await async_service.validate_promocode(ValidatePromocodeRequest(
+        promo_code="ASYNC10", user_id=USER_ID, order_amount=500, categories=["dairy"]
+    ))
+    applied = await async_service.apply_promocode(apply_request("ASYNC10"))
+    repeated = await async_service.apply_promocode(apply_request("ASYNC10"))
+
+    assert validation["valid"] is True
+    assert validation["discount_amount"] == 50
+    assert applied["status"] == "applied"
+    assert repeated["valid"] is False
+    assert (await async_service.get_promocode_info("ASYNC10"))["status"] == PromocodeStatus.USED
+
+
+@pytest.mark.asyncio
+async def test_expired_status_written_in_background(async_service):
+    await async_service.create_promocode(create_request("LATE", expires_delta_days=-1))
+
+    result = await async_service.validate_promocode(ValidatePromocodeRequest(
+        promo_code="LATE", user_id=USER_ID, order_amount=500, categories=[]
+    ))
+    await async_service.drain()
+
+    assert result["message"] == "Промокод не активен"
+    assert (await async_service.repo.get_by_code("LATE")).status == PromocodeStatus.EXPIRED
+
+
+@pytest.mark.asyncio
+async def test_concurrent_applies_respect_max_usages(async_service):
+    await async_service.create_promocode(create_request("SUMMER25", max_usages=20))
+
+    results = await asyncio.gather(*(async_service.apply_promocode(apply_request("SUMMER25")) for _ in range(100)))
+
+    assert sum(r.get("status") == "applied" for r in results) == 20
+    assert (await async_service.repo.get_by_code("SUMMER25")).usage_count == 20
+
+
+@pytest.mark.asyncio
+async def test_listings_and_batch(async_service):
+    await async_service.create_promocode(create_request("LIST1"))
+    await async_service.create_promocode(create_request("LIST2"))
+
+    user_codes = [p["code"] for p in await async_service.get_user_promocodes(USER_ID)]
+    active_codes = [p["code"] for p in await async_service.get_all_active_promocodes()]
+    batch = await async_service.validate_promocodes([
+        ValidatePromocodeRequest(promo_code=code, user_id=USER_ID, order_amount=500)
+        for code in ["LIST1", "NOPE"]
+    ])
+    best = await async_service.find_best_promocodes(BestPromocodeRequest(user_id=USER_ID, order_amount=500))
+
+    assert user_codes == ["LIST1", "LIST2"]
+    assert sorted(active_codes) == ["LIST1", "LIST2"]
+    assert [r["valid"] for r in batch] == [True, False]
+    assert [r["promo_code"] for r in best["results"]] == ["LIST1", "LIST2"]
+
+
+@pytest.mark.asyncio
+async def test_memory_repo_is_shared_with_sync_service():
+    repo = PromocodeRepo(promocodes=[])
+    service = AsyncPromocodeService(repo=AsyncPromocodeRepo(repo))
+
+    await service.create_promocode(create_request("SHARED"))
+
+    assert repo.get_by_code("SHARED").code == "SHARED"
+
+
+@pytest.mark.asyncio
+async def test_code_filter_is_shared_with_sync_service():
+    repo = PromocodeRepo(promocodes=[])
+    sync_service = PromocodeService(repo=repo, use_code_filter=True)
+    service = AsyncPromocodeService(repo=AsyncPromocodeRepo(repo), use_code_filter=True, filter_owner=sync_service)
+    await service.start()
+
+    # Синхронный маршрут (/generate, /import) пополняет фильтр, который видит и async
+    sync_service._insert_new_codes([Promocode(
+        id=uuid4(), usage_count=0, status=PromocodeStatus.ACTIVE, created_at=datetime.now(),
+        **create_request("FROMSYNC").dict()
+    )])
+    await service.create_promocode(create_request("FROMASYNC"))
+
+    assert (await service.get_promocode("FROMSYNC")).code == "FROMSYNC"
+    assert sync_service.get_promocode("FROMASYNC").code == "FROMASYNC"
+    assert await service.get_promocode("MISSING") is None
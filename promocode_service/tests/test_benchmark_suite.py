@@ -0,0 +1,29 @@
+import json
+from promocode_service.benchmarks import suite
+from promocode_service.benchmarks.datasets import code_at, generate_promocodes
+
+
+def test_dataset_is_deterministic():
+    first = [p.model_dump() for p in generate_promocodes(50, "marketplace", seed=7)]
+    second = [p.model_dump() for p in generate_promocodes(50, "marketplace", seed=7)]
+
+    assert [p["id"] for p in first] == [p["id"] for p in second]
+    assert first[10]["code"] == code_at(10)
+
+
+def test_suite_writes_results_and_compares(tmp_path, capsys):
+    output = tmp_path / "bench.json"
+    args = ["--sizes", "500", "--ops", "50", "--repeats", "2", "--clients", "4", "--requests", "60",
+            "--output", str(output)]
+    report = suite.run(args)
+
+    saved = json.loads(output.read_text(encoding="utf-8"))
+    names = {r["name"] for r in saved["results"]}
+    assert saved["environment"]["args"]["sizes"] == "500"
+    assert {"get_by_code", "validate_promocode", "apply_promocode", "get_all_active_promocodes",
+            "asgi_router"} <= names
+    load = next(r for r in saved["results"] if r["kind"] == "load")
+    assert load["errors"] == 0 and load["requests"] == 60 and load["p50_ms"] <= load["p99_ms"]
+
+    slower = {"results": [dict(r, ns_per_op=r["ns_per_op"] / 2) for r in report["results"] if r["kind"] == "micro"]}
+    assert any("РЕГРЕССИЯ" in line for line in suite.compare(report["results"], slower))
@@ -0,0 +1,115 @@
+import asyncio
+from uuid import uuid4
+from datetime import datetime, timedelta
+from promocode_service import database
+from promocode_service.bloom_filter import BloomFilter
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.models import CreatePromocodeRequest, DiscountType, ValidatePromocodeRequest
+from promocode_service.promocode_service import PromocodeService, run_code_filter_refresh
+from promocode_service.promocode_shared_repo import SharedPromocodeRepo
+from promocode_service.promocode_sql_repo import SqlPromocodeRepo
+
+
+class CountingRepo(PromocodeRepo):
+    def __init__(self):
+        super().__init__(promocodes=[])
+        self.lookups = 0
+
+    def get_by_code(self, code):
+        self.lookups += 1
+        return super().get_by_code(code)
+
+
+def create_request(code):
+    return CreatePromocodeRequest(
+        code=code,
+        user_id=uuid4(),
+        discount_type=DiscountType.FIXED,
+        discount_value=100,
+        expires_at=datetime.now() + timedelta(days=10),
+    )
+
+
+def test_no_false_negatives_and_low_false_positive_rate():
+    codes = [f"CODE{i}" for i in range(10_000)]
+    bloom = BloomFilter.from_codes(codes, capacity=10_000, error_rate=0.01)
+
+    assert all(code in bloom for code in codes)
+    false_positives = sum(f"GUESS{i}" in bloom for i in range(10_000))
+    assert false_positives / 10_000 < 0.02
+
+
+def test_service_rejects_unknown_codes_before_repo():
+    repo = CountingRepo()
+    service = PromocodeService(repo=repo, use_code_filter=True)
+
+    result = service.validate_promocode(ValidatePromocodeRequest(
+        promo_code="BRUTEFORCE", user_id=uuid4(), order_amount=100, categories=[]
+    ))
+
+    assert result == {"valid": False, "message": "Промокод не найден"}
+    assert repo.lookups == 0
+
+
+def test_created_codes_pass_the_filter():
+    repo = CountingRepo()
+    service = PromocodeService(repo=repo, use_code_filter=True)
+
+    service.create_promocode(create_request("FRESH"))
+
+    assert service.get_promocode("FRESH").code == "FRESH"
+    assert "FRESH" in service.code_filter
+
+
+def test_rebuild_from_storage():
+    repo = CountingRepo()
+    service = PromocodeService(repo=repo, use_code_filter=True)
+    repo.create_promocode(create_request("IMPORTED").dict())
+
+    assert service.get_promocode("IMPORTED") is None
+    service.rebuild_code_filter()
+
+    assert service.get_promocode("IMPORTED").code == "IMPORTED"
+
+
+class CountingSqlRepo(SqlPromocodeRepo):
+    full_scans = 0
+
+    def iter_codes(self, chunk_size: int = 10000):
+        self.full_scans += 1
+        return super().iter_codes(chunk_size)
+
+
+def test_refresh_picks_up_codes_written_by_other_processes(tmp_path):
+    database.configure_engine(f"sqlite:///{tmp_path / 'promocodes.db'}")
+    repo = CountingSqlRepo()
+    service = PromocodeService(repo=repo, use_code_filter=True)
+    other_worker = SqlPromocodeRepo()
+
+    async def refresh_for_a_while():
+        task = asyncio.create_task(run_code_filter_refresh(
+            lambda: asyncio.to_thread(service.refresh_code_filter),
+            lambda: asyncio.to_thread(service.rebuild_code_filter),
+            interval=0.01,
+        ))
+        # Код записан мимо сервиса - другим воркером в общую БД
+        other_worker.create_promocode(create_request("ELSEWHERE").dict())
+        await asyncio.sleep(0.1)
+        task.cancel()
+
+    asyncio.run(refresh_for_a_while())
+
+    assert service.get_promocode("ELSEWHERE").code == "ELSEWHERE"
+    # Догружались только новые строки: таблица целиком читалась лишь при старте
+    assert repo.full_scans == 1
+
+
+def test_shared_repo_refresh_reads_appended_rows_only(tmp_path):
+    repo = SharedPromocodeRepo(str(tmp_path / "promocodes.table"), capacity=100)
+    repo.create_promocode(create_request("FIRST").model_dump())
+    mark = repo.code_mark()
+    SharedPromocodeRepo(str(tmp_path / "promocodes.table"), capacity=100).create_promocode(
+        create_request("SECOND").model_dump()
+    )
+
+    assert list(repo.iter_codes_since(mark)) == ["SECOND"]
@@ -0,0 +1,167 @@
+import asyncio
+from collections import Counter
+from uuid import uuid4
+import httpx
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from promocode_service import main
+from promocode_service.promocode_admission import (
+    CRITICAL, LOW, NORMAL, AdmissionMiddleware, Lane, TokenBuckets
+)
+from promocode_service.promocode_metrics import MetricsRegistry
+
+PREFIX = "/api/v1/promocodes"
+
+
+def make_app(lanes, buckets=None, queue_timeout=1.0, registry=None, trusted_proxies=frozenset()):
+    """Приложение, обработчики которого ждут release: так запросы держат места полос"""
+    app = FastAPI()
+    release = asyncio.Event()
+
+    async def held():
+        await release.wait()
+        return {"ok": True}
+
+    async def batch(request: Request):
+        # Тело, прочитанное middleware для подсчета кодов, доходит до обработчика
+        return {"items": len((await request.json())["items"])}
+
+    app.post(f"{PREFIX}/validate")(held)
+    app.post(f"{PREFIX}/validate/batch")(batch)
+    app.get(f"{PREFIX}/active")(held)
+    app.get(f"{PREFIX}/{{promo_code}}")(held)
+    app.add_middleware(AdmissionMiddleware, lanes=lanes, buckets=buckets, queue_timeout=queue_timeout,
+                       trusted_proxies=trusted_proxies, registry=registry)
+    return app, release
+
+
+def client(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+
+def test_routes_are_classified_by_priority():
+    middleware = AdmissionMiddleware(None, buckets=None)
+
+    assert middleware.classify("POST", f"{PREFIX}/apply") == (CRITICAL, True)
+    assert middleware.classify("GET", f"{PREFIX}/active") == (LOW, False)
+    assert middleware.classify("GET", f"{PREFIX}/user/123") == (LOW, False)
+    assert middleware.classify("GET", f"{PREFIX}/SUMMER10") == (NORMAL, True)
+
+
+@pytest.mark.asyncio
+async def test_low_priority_is_shed_while_checkout_is_served():
+    registry = MetricsRegistry()
+    app, release = make_app({CRITICAL: Lane(CRITICAL), NORMAL: Lane(NORMAL),
+                             LOW: Lane(LOW, limit=1, queue=0, shed_depth=3)}, registry=registry)
+    async with client(app) as http:
+        listing = asyncio.create_task(http.get(f"{PREFIX}/active"))
+        await asyncio.sleep(0.05)
+        # Место полосы занято, очереди нет: сразу 503
+        full = await http.get(f"{PREFIX}/active")
+        checkouts = [asyncio.create_task(http.post(f"{PREFIX}/validate")) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        # Глубина достигла порога: список отклоняется, не дожидаясь места
+        shed = await http.get(f"{PREFIX}/active")
+        release.set()
+        responses = await asyncio.gather(listing, *checkouts)
+
+    assert full.status_code == 503 and full.headers["retry-after"] == "1"
+    assert shed.status_code == 503
+    assert [r.status_code for r in responses] == [200, 200, 200]
+    assert 'promocode_admission_rejected_total{lane="low",reason="queue"} 1' in registry.render()
+    assert 'promocode_admission_rejected_total{lane="low",reason="shed"} 1' in registry.render()
+
+
+@pytest.mark.asyncio
+async def test_waiting_request_takes_released_slot():
+    lane = Lane(LOW, limit=1, queue=1)
+    assert await lane.enter(1.0)
+    waiting = asyncio.create_task(lane.enter(1.0))
+    await asyncio.sleep(0)
+    assert not await lane.enter(1.0)
+
+    lane.leave()
+    assert await waiting and lane.active == 1
+    assert not await lane.enter(0.01) and not lane.waiters
+    lane.leave()
+    assert lane.active == 0
+
+
+@pytest.mark.asyncio
+async def test_code_guessing_client_is_throttled():
+    # Запросы идут через шлюз: его адресу доверяется заголовок пользователя
+    app, release = make_app({CRITICAL: Lane(CRITICAL), NORMAL: Lane(NORMAL), LOW: Lane(LOW)},
+                            buckets=TokenBuckets(rate=0.5, burst=3), trusted_proxies={"127.0.0.1"})
+    release.set()
+    async with client(app) as http:
+        guesses = [await http.get(f"{PREFIX}/GUESS{i}", headers={"x-user-id": "bot"}) for i in range(4)]
+        other = await http.post(f"{PREFIX}/validate", headers={"x-user-id": "shopper"})
+        listing = await http.get(f"{PREFIX}/active", headers={"x-user-id": "bot"})
+
+    assert [r.status_code for r in guesses] == [200, 200, 200, 429]
+    assert guesses[-1].headers["retry-after"] == "2"
+    assert other.status_code == 200 and listing.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_checkout_bucket_is_keyed_on_body_user():
+    app, release = make_app({CRITICAL: Lane(CRITICAL), NORMAL: Lane(NORMAL), LOW: Lane(LOW)},
+                            buckets=TokenBuckets(rate=0.5, burst=3))
+    release.set()
+    bot, shopper = str(uuid4()), str(uuid4())
+    async with client(app) as http:
+        # Без доверенного шлюза заголовок не учитывается: сменой его ведро не сбросить
+        guesses = [await http.post(f"{PREFIX}/validate", json={"user_id": bot, "promo_code": f"GUESS{i}"},
+                                   headers={"x-user-id": f"fake{i}"}) for i in range(4)]
+        # Тот же пользователь в другой записи UUID
+        upper = await http.post(f"{PREFIX}/validate", json={"user_id": bot.upper()})
+        other = await http.post(f"{PREFIX}/validate", json={"user_id": shopper})
+
+    assert [r.status_code for r in guesses] == [200, 200, 200, 429]
+    assert upper.status_code == 429 and other.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_batch_validation_pays_per_code():
+    app, release = make_app({CRITICAL: Lane(CRITICAL), NORMAL: Lane(NORMAL), LOW: Lane(LOW)},
+                            buckets=TokenBuckets(rate=1, burst=10))
+    release.set()
+    user_id = str(uuid4())
+    batch = {"items": [{"user_id": user_id, "promo_code": f"GUESS{i}"} for i in range(10)]}
+    async with client(app) as http:
+        first = await http.post(f"{PREFIX}/validate/batch", json=batch)
+        second = await http.post(f"{PREFIX}/validate/batch", json=batch)
+        single = await http.post(f"{PREFIX}/validate", json={"user_id": user_id})
+
+    assert first.json() == {"items": 10}
+    assert second.status_code == 429 and single.status_code == 429
+
+
+def test_default_app_serves_many_users_behind_one_peer():
+    # Другой бэкенд проксирует checkout всех своих пользователей с одного адреса
+    http = TestClient(main.app)
+    statuses = Counter(
+        http.post(f"{PREFIX}/validate", json={"promo_code": "NOPE", "user_id": str(uuid4()),
+                                             "order_amount": 100}).status_code
+        for _ in range(60)
+    )
+    assert statuses == {200: 60}
+
+    one_user = str(uuid4())
+    statuses = Counter(
+        http.post(f"{PREFIX}/validate", json={"promo_code": "NOPE", "user_id": one_user,
+                                             "order_amount": 100}).status_code
+        for _ in range(60)
+    )
+    assert statuses[429] > 0
+
+
+def test_token_buckets_are_bounded():
+    buckets = TokenBuckets(rate=1, burst=2, max_clients=4)
+    for i in range(4):
+        buckets.take(f"user{i}".encode(), now=0.0)
+    buckets.take(b"late", now=10.0)
+
+    # Ведра, успевшие наполниться, забыты без потери решений
+    assert len(buckets) == 1
@@ -0,0 +1,133 @@
+import time
+import pytest
+from uuid import uuid4
+from datetime import datetime, timedelta
+from promocode_service.promocode_cache import CachedPromocodeRepo, PromocodeCache
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.models import DiscountType, PromocodeStatus, ApplyPromocodeRequest, ValidatePromocodeRequest
+from promocode_service.promocode_service import PromocodeService
+
+
+class CountingRepo(PromocodeRepo):
+    """Репозиторий, считающий обращения за кодами"""
+
+    def __init__(self):
+        super().__init__(promocodes=[])
+        self.lookups = 0
+
+    def get_by_code(self, code):
+        self.lookups += 1
+        return super().get_by_code(code)
+
+    def get_by_code_uncached(self, code):
+        return super().get_by_code(code)
+
+
+@pytest.fixture
+def inner():
+    return CountingRepo()
+
+
+@pytest.fixture
+def cached(inner):
+    return CachedPromocodeRepo(inner, PromocodeCache(max_size=2, ttl=60, negative_ttl=60))
+
+
+def make_promocode_data(code, user_id=None, max_usages=1):
+    return {
+        "code": code,
+        "user_id": user_id or uuid4(),
+        "discount_type": DiscountType.FIXED,
+        "discount_value": 100,
+        "min_order_amount": 0,
+        "max_discount": None,
+        "expires_at": datetime.now() + timedelta(days=1),
+        "max_usages": max_usages,
+        "applicable_categories": [],
+    }
+
+
+def test_read_through_hits_repo_once(cached, inner):
+    cached.create_promocode(make_promocode_data("HOT"))
+
+    for _ in range(5):
+        assert cached.get_by_code("HOT").code == "HOT"
+
+    assert inner.lookups == 1
+    assert cached.cache.stats()["hits"] == 4
+
+
+def test_negative_entry_dropped_on_create(cached, inner):
+    assert cached.get_by_code("NEW") is None
+    assert cached.get_by_code("NEW") is None
+    assert cached.cache.stats()["negative_hits"] == 1
+
+    cached.create_promocode(make_promocode_data("NEW"))
+
+    assert cached.get_by_code("NEW").code == "NEW"
+    assert inner.lookups == 2
+
+
+def test_lru_eviction(cached):
+    for code in ["A", "B", "C"]:
+        cached.create_promocode(make_promocode_data(code))
+        cached.get_by_code(code)
+
+    stats = cached.cache.stats()
+    assert stats["size"] == 2
+    assert stats["evictions"] == 1
+
+
+def test_ttl_expiration(inner):
+    cached = CachedPromocodeRepo(inner, PromocodeCache(max_size=10, ttl=0.01, negative_ttl=0.01))
+    cached.create_promocode(make_promocode_data("SHORT"))
+
+    cached.get_by_code("SHORT")
+    time.sleep(0.02)
+    cached.get_by_code("SHORT")
+
+    assert inner.lookups == 2
+    assert cached.cache.stats()["expirations"] == 1
+
+
+def test_apply_invalidates_exact_code(cached, inner):
+    user_id = uuid4()
+    cached.create_promocode(make_promocode_data("ONCE", user_id=user_id))
+    cached.create_promocode(make_promocode_data("OTHER"))
+    cached.get_by_code("OTHER")
+    service = PromocodeService(repo=cached)
+
+    service.apply_promocode(ApplyPromocodeRequest(
+        promo_code="ONCE", user_id=user_id, order_id=uuid4(), order_amount=500, final_amount=400
+    ))
+    lookups = inner.lookups
+    cached.get_by_code("OTHER")
+
+    assert inner.lookups == lookups
+    assert cached.get_by_code("ONCE").status == PromocodeStatus.USED
+    assert inner.lookups == lookups + 1
+
+
+def test_stale_load_is_not_cached_after_invalidation(cached, inner):
+    cached.create_promocode(make_promocode_data("RACE"))
+    generation = cached.cache.begin_load()
+    stale = inner.get_by_code_uncached("RACE").model_copy()
+
+    cached.consume_usage("RACE")
+    cached.cache.put("RACE", stale, generation)
+
+    assert cached.get_by_code("RACE").usage_count == 1
+
+
+def test_expire_due_invalidates_expired_codes(cached):
+    user_id = uuid4()
+    cached.create_promocode(make_promocode_data("SOON", user_id=user_id))
+    cached.get_by_code("SOON")
+
+    cached.expire_due(now=datetime.now() + timedelta(days=2))
+
+    assert cached.get_by_code("SOON").status == PromocodeStatus.EXPIRED
+    result = PromocodeService(repo=cached).validate_promocode(ValidatePromocodeRequest(
+        promo_code="SOON", user_id=user_id, order_amount=500, categories=[]
+    ))
+    assert result["valid"] is False
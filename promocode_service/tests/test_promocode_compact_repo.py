@@ -0,0 +1,175 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from datetime import datetime, timedelta
+from promocode_service.models import (
+    ApplyPromocodeRequest, CreatePromocodeRequest, DiscountType, Promocode, PromocodeStatus, ValidatePromocodeRequest
+)
+from promocode_service.promocode_compact_repo import CompactPromocodeRepo, StringTable
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_service import PromocodeService
+
+NOW = datetime.now()
+USER_ID, OTHER_USER_ID = uuid4(), uuid4()
+
+
+def make_promocode(code, user_id, expires_delta_days=1, max_usages=1, max_discount=200.0, categories=None):
+    return Promocode(
+        id=uuid4(),
+        code=code,
+        user_id=user_id,
+        discount_type=DiscountType.PERCENTAGE,
+        discount_value=10,
+        min_order_amount=100,
+        max_discount=max_discount,
+        expires_at=NOW + timedelta(days=expires_delta_days),
+        usage_count=0,
+        max_usages=max_usages,
+        status=PromocodeStatus.ACTIVE,
+        applicable_categories=categories or [],
+        created_at=NOW,
+    )
+
+
+def run_scenario(repo):
+    """Одинаковая последовательность вызовов сервиса поверх разных репозиториев"""
+    service = PromocodeService(repo=repo, use_code_filter=False)
+    user_id = USER_ID
+    expires_at = NOW + timedelta(days=3)
+    # Категории по алфавиту: колоночное хранилище, как и SQL, отдает их упорядоченными
+    for promocode in [
+        make_promocode("DAIRY", user_id, categories=["bakery", "dairy"]),
+        make_promocode("TWICE", user_id, max_usages=2, max_discount=None),
+        make_promocode("OLD", user_id, expires_delta_days=-1),
+        make_promocode("FOREIGN", OTHER_USER_ID),
+    ]:
+        # Снимок, чтобы живой объект репозитория в памяти не отличался от колоночного
+        repo.add_promocode(promocode.model_copy(deep=True))
+
+    def validate(code, amount=500, categories=()):
+        return service.validate_promocode(ValidatePromocodeRequest(
+            promo_code=code, user_id=user_id, order_amount=amount, categories=list(categories)
+        ))
+
+    def apply(code):
+        result = service.apply_promocode(ApplyPromocodeRequest(
+            promo_code=code, user_id=user_id, order_id=uuid4(), order_amount=500, final_amount=450
+        ))
+        result.pop("order_id", None)
+        return result
+
+    results = [
+        validate("DAIRY", categories=["dairy"]),
+        validate("DAIRY", categories=["meat"]),
+        validate("DAIRY", amount=50),
+        validate("FOREIGN"),
+        validate("OLD"),
+        validate("MISSING"),
+        apply("TWICE"), apply("TWICE"), apply("TWICE"),
+        service.get_promocode_info("TWICE"),
+        service.create_promocode(CreatePromocodeRequest(
+            code="DAIRY", user_id=user_id, discount_type=DiscountType.FIXED, discount_value=1, expires_at=expires_at
+        )),
+        service.create_promocode(CreatePromocodeRequest(
+            code="NEW", user_id=user_id, discount_type=DiscountType.FIXED, discount_value=1, expires_at=expires_at
+        ))["status"],
+        service.validate_promocodes([
+            ValidatePromocodeRequest(promo_code=code, user_id=user_id, order_amount=500) for code in ["NEW", "OLD"]
+        ]),
+        sorted(p["code"] for p in service.get_user_promocodes(user_id)),
+        sorted(p["code"] for p in service.get_all_active_promocodes()),
+        service.get_active_promocodes_page(limit=2),
+        [p["code"] for p in service.iter_user_promocodes(user_id)],
+    ]
+    return results
+
+
+def test_service_behaves_the_same_on_compact_repo():
+    assert run_scenario(CompactPromocodeRepo()) == run_scenario(PromocodeRepo(promocodes=[]))
+
+
+def test_round_trip_keeps_fields():
+    user_id = uuid4()
+    original = make_promocode("ROUND", user_id, max_discount=None, categories=["meat", "dairy", "meat"])
+    repo = CompactPromocodeRepo([original])
+
+    restored = repo.get_by_code("ROUND")
+
+    assert restored.model_dump(exclude={"applicable_categories"}) == original.model_dump(
+        exclude={"applicable_categories"}
+    )
+    assert restored.applicable_categories == ["dairy", "meat"]
+    assert repo.get_by_code("ROUNDX") is None
+
+
+def test_update_keeps_usage_count_and_reschedules_expiry():
+    user_id = uuid4()
+    repo = CompactPromocodeRepo([make_promocode("LATER", user_id, max_usages=5)])
+    stale = repo.get_by_code("LATER")
+    repo.consume_usage("LATER")
+
+    stale.expires_at = datetime.now() - timedelta(minutes=1)
+    repo.update_promocode(stale)
+
+    assert repo.get_by_code("LATER").usage_count == 1
+    assert repo.expire_due() == ["LATER"]
+    assert repo.get_by_code("LATER").status == PromocodeStatus.EXPIRED
+
+
+def test_expiry_queue_merges_batches_added_between_sweeps():
+    rng = random.Random(4)
+    repo = CompactPromocodeRepo()
+    now = datetime.now()
+    expected = []
+    for batch in range(5):
+        offsets = [rng.randint(-600, 600) for _ in range(200)]
+        codes = [f"B{batch}_{i}" for i in range(200)]
+        repo.add_promocodes([
+            make_promocode(code, uuid4()).model_copy(update={"expires_at": now + timedelta(seconds=offset)})
+            for code, offset in zip(codes, offsets)
+        ])
+        expected += [(offset, code) for code, offset in zip(codes, offsets) if offset < 0]
+        # Часть уже истекших кодов остается в очереди до следующей пачки
+        repo.expire_due(now, batch_size=50)
+
+    repo.expire_due(now)
+
+    assert list(repo._expiry_keys[repo._expiry_position:]) == sorted(repo._expiry_keys[repo._expiry_position:])
+    assert {code for _, code in expected} == {
+        code for code in repo.iter_codes() if repo.get_by_code(code).status == PromocodeStatus.EXPIRED
+    }
+
+
+def test_concurrent_consume_respects_max_usages():
+    repo = CompactPromocodeRepo([make_promocode("RUSH", uuid4(), max_usages=20)])
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(lambda _: repo.consume_usage("RUSH"), range(200)))
+
+    assert sum(r is not None for r in results) == 20
+    assert repo.get_by_code("RUSH").status == PromocodeStatus.USED
+    assert repo.get_active_promocodes() == []
+
+
+def test_active_list_follows_status_changes():
+    repo = CompactPromocodeRepo([make_promocode(f"C{i:02d}", uuid4()) for i in range(30)])
+    for i in range(0, 30, 3):
+        repo.consume_usage(f"C{i:02d}")
+    late = repo.get_by_code("C01").model_copy(update={"expires_at": datetime.now() - timedelta(minutes=1)})
+    repo.update_promocode(late)
+
+    assert [p.code for p in repo.get_active_promocodes()] == [
+        f"C{i:02d}" for i in range(30) if i % 3 and i != 1
+    ]
+
+
+def test_string_table_grows_and_finds_every_key():
+    table = StringTable()
+    keys = [f"KEY{i}".encode() for i in range(5000)]
+
+    indexes = [table.add(key) for key in keys]
+
+    assert indexes == list(range(5000))
+    assert table.add(b"KEY42") == 42
+    assert all(table.find(key) == i for i, key in enumerate(keys))
+    assert table[4999] == b"KEY4999"
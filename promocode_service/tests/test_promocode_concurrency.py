@@ -0,0 +1,54 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from promocode_service.models import ApplyPromocodeRequest, DiscountType, PromocodeStatus
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_service import PromocodeService
+
+APPLIES = 5000
+MAX_USAGES = 1000
+WORKERS = 32
+
+
+def test_concurrent_applies_never_exceed_max_usages():
+    user_id = uuid4()
+    repo = PromocodeRepo(promocodes=[])
+    repo.create_promocode({
+        "code": "SUMMER25",
+        "user_id": user_id,
+        "discount_type": DiscountType.PERCENTAGE,
+        "discount_value": 25,
+        "min_order_amount": 0,
+        "max_discount": 500.0,
+        "expires_at": datetime.now() + timedelta(days=1),
+        "max_usages": MAX_USAGES,
+        "applicable_categories": [],
+    })
+    service = PromocodeService()
+    service.repo = repo
+
+    def apply(_):
+        return service.apply_promocode(ApplyPromocodeRequest(
+            promo_code="SUMMER25",
+            user_id=user_id,
+            order_id=uuid4(),
+            order_amount=1000,
+            final_amount=750
+        ))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+        results = list(pool.map(apply, range(APPLIES)))
+    elapsed = time.perf_counter() - start
+
+    applied = [r for r in results if r.get("status") == "applied"]
+    promocode = repo.get_by_code("SUMMER25")
+
+    assert len(applied) == MAX_USAGES
+    assert sorted(r["usage_count"] for r in applied) == list(range(1, MAX_USAGES + 1))
+    assert promocode.usage_count == MAX_USAGES
+    assert promocode.status == PromocodeStatus.USED
+
+    print(f"✓ {APPLIES} параллельных применений: {APPLIES / elapsed:.0f} запросов/с")
@@ -0,0 +1,153 @@
+import asyncio
+import time
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from promocode_service import database
+from promocode_service.async_promocode_repo import AsyncPromocodeRepo
+from promocode_service.async_promocode_service import AsyncPromocodeService
+from promocode_service.models import ApplyPromocodeRequest
+from promocode_service.promocode_idempotency import IdempotencyStore
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_service import PromocodeService
+from promocode_service.promocode_sql_repo import SqlApplicationLog, SqlPromocodeRepo
+from promocode_service.tests.test_promocode_sql_repo import make_promocode_data
+
+
+def apply_request(data, order_id):
+    return ApplyPromocodeRequest(
+        promo_code=data["code"], user_id=data["user_id"], order_id=order_id, order_amount=500, final_amount=450
+    )
+
+
+def test_repeated_order_returns_recorded_result():
+    service = PromocodeService(repo=PromocodeRepo(promocodes=[]), applied_orders=IdempotencyStore())
+    data = make_promocode_data(code="RETRY", max_usages=5)
+    service.repo.create_promocode(data)
+    order_id = uuid4()
+
+    first = service.apply_promocode(apply_request(data, order_id))
+    repeated = service.apply_promocode(apply_request(data, order_id))
+    other = service.apply_promocode(apply_request(data, uuid4()))
+
+    assert first["status"] == "applied" and repeated == first
+    assert other["usage_count"] == 2
+    assert service.repo.get_by_code("RETRY").usage_count == 2
+    assert service.applied_orders.hits == 1
+
+
+def test_concurrent_duplicates_consume_once():
+    service = PromocodeService(repo=PromocodeRepo(promocodes=[]), applied_orders=IdempotencyStore())
+    data = make_promocode_data(code="DOUBLECLICK", max_usages=5)
+    service.repo.create_promocode(data)
+    request = apply_request(data, uuid4())
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: service.apply_promocode(request), range(20)))
+
+    assert all(r == results[0] and r["status"] == "applied" for r in results)
+    assert service.repo.get_by_code("DOUBLECLICK").usage_count == 1
+
+
+def test_rejection_is_not_recorded():
+    service = PromocodeService(repo=PromocodeRepo(promocodes=[]), applied_orders=IdempotencyStore())
+    data = make_promocode_data(code="LATER")
+    order_id = uuid4()
+
+    assert service.apply_promocode(apply_request(data, order_id))["valid"] is False
+    service.repo.create_promocode(data)
+    assert service.apply_promocode(apply_request(data, order_id))["status"] == "applied"
+
+
+def test_store_is_bounded_and_expires():
+    store = IdempotencyStore(max_size=2, ttl=0.05)
+    keys = [("CODE", uuid4(), uuid4()) for _ in range(3)]
+    for key in keys:
+        store.put(key, {"status": "applied"})
+
+    assert store.get(keys[0]) is None
+    assert store.evictions == 1
+    time.sleep(0.06)
+    assert store.get(keys[2]) is None
+    assert store.expirations == 1 and len(store) == 1
+
+
+def test_sql_backing_survives_restart(tmp_path):
+    database.configure_engine(f"sqlite:///{tmp_path / 'promocodes.db'}")
+    repo = SqlPromocodeRepo()
+    data = make_promocode_data(code="RESTART", max_usages=5)
+    repo.create_promocode(data)
+    request = apply_request(data, uuid4())
+
+    first = PromocodeService(repo=repo, applied_orders=IdempotencyStore(backing=SqlApplicationLog()))
+    applied = first.apply_promocode(request)
+    restarted = PromocodeService(repo=repo, applied_orders=IdempotencyStore(backing=SqlApplicationLog()))
+
+    assert restarted.apply_promocode(request) == applied
+    assert restarted.applied_orders.backing_hits == 1
+    assert repo.get_by_code("RESTART").usage_count == 1
+
+
+@pytest.mark.asyncio
+async def test_async_concurrent_duplicates_consume_once():
+    service = AsyncPromocodeService(repo=AsyncPromocodeRepo(PromocodeRepo(promocodes=[])),
+                                    applied_orders=IdempotencyStore())
+    data = make_promocode_data(code="ASYNCRETRY", max_usages=5)
+    service.repo.repo.create_promocode(data)
+    request = apply_request(data, uuid4())
+
+    results = await asyncio.gather(*(service.apply_promocode(request) for _ in range(10)))
+
+    assert all(r == results[0] and r["status"] == "applied" for r in results)
+    assert service.repo.repo.get_by_code("ASYNCRETRY").usage_count == 1
+
+
+def test_sql_reservation_consumes_once_across_instances(tmp_path):
+    database.configure_engine(f"sqlite:///{tmp_path / 'promocodes.db'}?timeout=60")
+    database.init_db()
+    repo = PromocodeRepo(promocodes=[])
+    data = make_promocode_data(code="TWOWORKERS", max_usages=5)
+    repo.create_promocode(data)
+    request = apply_request(data, uuid4())
+    # Свой IdempotencyStore у каждого "воркера": блокировки ключа в памяти не общие
+    workers = [PromocodeService(repo=repo, applied_orders=IdempotencyStore(backing=SqlApplicationLog()))
+               for _ in range(4)]
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda worker: worker.apply_promocode(request), workers))
+
+    assert all(r == results[0] and r["status"] == "applied" for r in results)
+    assert repo.get_by_code("TWOWORKERS").usage_count == 1
+
+
+def test_sql_reservation_is_released_on_rejection(tmp_path):
+    database.configure_engine(f"sqlite:///{tmp_path / 'promocodes.db'}")
+    database.init_db()
+    repo = PromocodeRepo(promocodes=[])
+    data = make_promocode_data(code="FIXEDORDER")
+    service = PromocodeService(repo=repo, applied_orders=IdempotencyStore(backing=SqlApplicationLog()))
+    order_id = uuid4()
+
+    assert service.apply_promocode(apply_request(data, order_id))["valid"] is False
+    repo.create_promocode(data)
+    other = PromocodeService(repo=repo, applied_orders=IdempotencyStore(backing=SqlApplicationLog()))
+    assert other.apply_promocode(apply_request(data, order_id))["status"] == "applied"
+
+
+def test_other_user_with_same_order_does_not_get_recorded_result(tmp_path):
+    database.configure_engine(f"sqlite:///{tmp_path / 'promocodes.db'}")
+    database.init_db()
+    repo = PromocodeRepo(promocodes=[])
+    data = make_promocode_data(code="MINE", max_usages=5)
+    repo.create_promocode(data)
+    order_id = uuid4()
+    service = PromocodeService(repo=repo, applied_orders=IdempotencyStore(backing=SqlApplicationLog()))
+    applied = service.apply_promocode(apply_request(data, order_id))
+
+    stranger = apply_request({**data, "user_id": uuid4()}, order_id)
+    restarted = PromocodeService(repo=repo, applied_orders=IdempotencyStore(backing=SqlApplicationLog()))
+
+    for worker in (service, restarted):
+        assert worker.apply_promocode(stranger)["valid"] is False
+    assert restarted.apply_promocode(apply_request(data, order_id)) == applied
+    assert repo.get_by_code("MINE").usage_count == 1
@@ -0,0 +1,96 @@
+import threading
+from uuid import uuid4
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from promocode_service import promocode_router
+from promocode_service.main import add_metrics
+from promocode_service.models import ValidatePromocodeRequest
+from promocode_service.promocode_metrics import Counter, MetricsRegistry, ValidationMetrics, format_labels, registry
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_service import FAILURE_REASONS, PromocodeService
+from promocode_service.tests.test_promocode_router import USER_ID, create_promocode, repo  # noqa: F401
+from promocode_service.tests.test_promocode_sql_repo import make_promocode_data
+
+
+def test_histogram_shards_are_summed_across_threads():
+    registry = MetricsRegistry()
+    registry.histogram("latency_seconds", "Задержка", (0.1, 1.0))
+
+    def observe():
+        for value in (0.05, 0.5, 5.0):
+            registry.observe("latency_seconds", value, format_labels(route="/x"))
+
+    threads = [threading.Thread(target=observe) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    observe()
+    text = registry.render()
+
+    assert 'latency_seconds_bucket{route="/x",le="0.1"} 5' in text
+    assert 'latency_seconds_bucket{route="/x",le="1.0"} 10' in text
+    assert 'latency_seconds_bucket{route="/x",le="+Inf"} 15' in text
+    assert 'latency_seconds_count{route="/x"} 15' in text
+
+
+def test_service_counts_failures_and_samples_stages():
+    repo = PromocodeRepo(promocodes=[])
+    data = make_promocode_data(code="STAGES", categories=["dairy"])
+    repo.create_promocode(data)
+    registry = MetricsRegistry()
+    service = PromocodeService(repo=repo, metrics=ValidationMetrics(registry, sample_every=1))
+    plain = PromocodeService(repo=repo)
+    requests = [
+        ValidatePromocodeRequest(promo_code="STAGES", user_id=data["user_id"], order_amount=500),
+        ValidatePromocodeRequest(promo_code="STAGES", user_id=data["user_id"], order_amount=50),
+        ValidatePromocodeRequest(promo_code="STAGES", user_id=uuid4(), order_amount=500),
+        ValidatePromocodeRequest(promo_code="MISSING", user_id=data["user_id"], order_amount=500),
+    ]
+
+    assert [service.validate_promocode(r) for r in requests] == [plain.validate_promocode(r) for r in requests]
+    text = registry.render()
+
+    assert 'promocode_validation_stage_seconds_count{stage="get_by_code"} 4' in text
+    assert 'promocode_validation_stage_seconds_count{stage="check_order"} 2' in text
+    assert 'promocode_validation_stage_seconds_count{stage="calculate_discount"} 1' in text
+    assert 'promocode_validation_failures_total{reason="Промокод не найден"} 1' in text
+    assert 'promocode_validation_failures_total{reason="Заказ не соответствует требованиям промокода"} 1' in text
+
+
+def test_metrics_endpoint(repo, monkeypatch):
+    # PROMOCODE_METRICS выключен по умолчанию: приложение собирается с метриками явно
+    metrics = ValidationMetrics(registry)
+    monkeypatch.setattr(promocode_router.promocode_service, "metrics", metrics)
+    metrics.register_failures(FAILURE_REASONS)
+    app = FastAPI()
+    app.include_router(promocode_router.router)
+    add_metrics(app)
+    create_promocode(repo, "SCRAPE")
+    with TestClient(app) as client:
+        client.post("/api/v1/promocodes/validate", json={
+            "promo_code": "NOSUCHCODE", "user_id": str(USER_ID), "order_amount": 100
+        })
+        response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'route="/api/v1/promocodes/validate"' in response.text
+    assert 'promocode_validation_failures_total{reason="Промокод не найден"}' in response.text
+    assert "promocode_repo_size 1" in response.text
+
+
+def test_counter_value_is_exact_across_threads():
+    counter = Counter()
+
+    def count():
+        for _ in range(10_000):
+            counter.inc()
+
+    threads = [threading.Thread(target=count) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.value == 40_000
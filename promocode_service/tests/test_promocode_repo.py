@@ -0,0 +1,123 @@
+import asyncio
+import pytest
+from uuid import uuid4
+from datetime import datetime, timedelta
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.models import DiscountType, PromocodeStatus, ValidatePromocodeRequest
+from promocode_service.promocode_service import PromocodeService
+from promocode_service.expiry_sweeper import run_expiry_sweeper
+
+
+@pytest.fixture
+def repo():
+    return PromocodeRepo(promocodes=[])
+
+
+def make_promocode_data(code="INDEX10", user_id=None, expires_delta_days=1, max_usages=1):
+    return {
+        "code": code,
+        "user_id": user_id or uuid4(),
+        "discount_type": DiscountType.PERCENTAGE,
+        "discount_value": 10,
+        "min_order_amount": 0,
+        "max_discount": None,
+        "expires_at": datetime.now() + timedelta(days=expires_delta_days),
+        "max_usages": max_usages,
+        "applicable_categories": [],
+    }
+
+
+def test_demo_promocodes_are_indexed():
+    repo = PromocodeRepo()
+
+    assert repo.count() == 3
+    assert repo.get_by_code("SUMMER25").code == "SUMMER25"
+    assert repo.get_by_code("UNKNOWN") is None
+
+
+def test_create_promocode_updates_indexes(repo):
+    user_id = uuid4()
+    repo.create_promocode(make_promocode_data(code="A1", user_id=user_id))
+    repo.create_promocode(make_promocode_data(code="A2", user_id=user_id))
+    repo.create_promocode(make_promocode_data(code="B1"))
+
+    assert repo.get_by_code("A2").user_id == user_id
+    assert [p.code for p in repo.get_user_promocodes(user_id)] == ["A1", "A2"]
+    assert {p.code for p in repo.get_active_promocodes()} == {"A1", "A2", "B1"}
+
+
+def test_update_promocode_moves_status_index(repo):
+    promocode = repo.create_promocode(make_promocode_data(code="MOVE"))
+
+    promocode.status = PromocodeStatus.USED
+    repo.update_promocode(promocode)
+
+    assert repo.get_active_promocodes() == []
+    assert repo.get_by_code("MOVE").status == PromocodeStatus.USED
+
+
+def test_update_promocode_moves_user_index(repo):
+    old_user, new_user = uuid4(), uuid4()
+    promocode = repo.create_promocode(make_promocode_data(code="OWNER", user_id=old_user))
+    repo.create_promocode(make_promocode_data(code="KEPT", user_id=old_user))
+
+    repo.update_promocode(promocode.model_copy(update={"user_id": new_user}))
+
+    assert [p.code for p in repo.get_user_promocodes(old_user)] == ["KEPT"]
+    assert [p.code for p in repo.get_user_promocodes_page(old_user)] == ["KEPT"]
+    assert [p.code for p in repo.get_user_promocodes(new_user)] == ["OWNER"]
+    assert [p.code for p in repo.get_user_promocodes_page(new_user)] == ["OWNER"]
+
+
+def test_status_check_keeps_indexes_consistent(repo):
+    user_id = uuid4()
+    repo.create_promocode(make_promocode_data(code="LATE", user_id=user_id, expires_delta_days=-1))
+    service = PromocodeService()
+    service.repo = repo
+
+    result = service.validate_promocode(ValidatePromocodeRequest(
+        promo_code="LATE",
+        user_id=user_id,
+        order_amount=100,
+        categories=[]
+    ))
+
+    assert result["valid"] is False
+    assert repo.get_by_code("LATE").status == PromocodeStatus.EXPIRED
+    assert repo.get_active_promocodes() == []
+
+
+def test_expire_due_moves_codes_in_batches(repo):
+    for i in range(5):
+        repo.create_promocode(make_promocode_data(code=f"OLD{i}", expires_delta_days=-1))
+    repo.create_promocode(make_promocode_data(code="FRESH"))
+
+    assert repo.expire_due(batch_size=3) == ["OLD0", "OLD1", "OLD2"]
+    assert repo.expire_due(batch_size=3) == ["OLD3", "OLD4"]
+    assert repo.expire_due(batch_size=3) == []
+    assert repo.get_by_code("OLD0").status == PromocodeStatus.EXPIRED
+    assert [p.code for p in repo.get_active_promocodes()] == ["FRESH"]
+
+
+def test_expire_due_skips_rescheduled_and_inactive_codes(repo):
+    moved = repo.create_promocode(make_promocode_data(code="MOVED", expires_delta_days=-1))
+    used = repo.create_promocode(make_promocode_data(code="USED", expires_delta_days=-1))
+
+    repo.update_promocode(moved.model_copy(update={"expires_at": datetime.now() + timedelta(days=1)}))
+    used.status = PromocodeStatus.USED
+    repo.update_promocode(used)
+
+    assert repo.expire_due() == []
+    assert repo.get_by_code("MOVED").status == PromocodeStatus.ACTIVE
+    assert repo.get_by_code("USED").status == PromocodeStatus.USED
+
+
+@pytest.mark.asyncio
+async def test_expiry_sweeper_expires_in_background(repo):
+    repo.create_promocode(make_promocode_data(code="SWEEP", expires_delta_days=-1))
+
+    sweeper = asyncio.create_task(run_expiry_sweeper(repo, interval=0.01, batch_size=10))
+    await asyncio.sleep(0.1)
+    sweeper.cancel()
+
+    assert repo.get_by_code("SWEEP").status == PromocodeStatus.EXPIRED
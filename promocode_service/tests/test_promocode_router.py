@@ -0,0 +1,181 @@
+import json
+import pytest
+from uuid import uuid4
+from datetime import datetime, timedelta
+from fastapi.testclient import TestClient
+from promocode_service import promocode_router
+from promocode_service.main import app
+from promocode_service.models import DiscountType
+from promocode_service.promocode_repo import PromocodeRepo
+
+USER_ID = uuid4()
+
+
+@pytest.fixture
+def repo(monkeypatch):
+    repo = PromocodeRepo(promocodes=[])
+    monkeypatch.setattr(promocode_router.promocode_service, "repo", repo)
+    return repo
+
+
+@pytest.fixture
+def client(repo):
+    with TestClient(app) as client:
+        yield client
+
+
+def create_promocode(repo, code, min_order_amount=0.0, expires_delta_days=1):
+    return repo.create_promocode({
+        "code": code,
+        "user_id": USER_ID,
+        "discount_type": DiscountType.PERCENTAGE,
+        "discount_value": 10,
+        "min_order_amount": min_order_amount,
+        "max_discount": None,
+        "expires_at": datetime.now() + timedelta(days=expires_delta_days),
+        "max_usages": 1,
+        "applicable_categories": ["dairy"],
+    })
+
+
+def test_validate_batch(client, repo):
+    create_promocode(repo, "CART10")
+    create_promocode(repo, "CART500", min_order_amount=500)
+
+    response = client.post("/api/v1/promocodes/validate/batch", json={"items": [
+        {"promo_code": "CART10", "user_id": str(USER_ID), "order_amount": 300, "categories": ["dairy"]},
+        {"promo_code": "CART500", "user_id": str(USER_ID), "order_amount": 300},
+        {"promo_code": "UNKNOWN", "user_id": str(USER_ID), "order_amount": 300},
+    ]})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [r["valid"] for r in results] == [True, False, False]
+    assert results[0]["discount_amount"] == 30
+    assert results[2]["message"] == "Промокод не найден"
+
+
+def test_validate_batch_rejects_empty_list(client):
+    response = client.post("/api/v1/promocodes/validate/batch", json={"items": []})
+
+    assert response.status_code == 422
+
+
+def test_best_promocodes_ranks_user_codes(client, repo):
+    create_promocode(repo, "TEN1")
+    create_promocode(repo, "BIG500", min_order_amount=500)
+    create_promocode(repo, "OLD", expires_delta_days=-1)
+    repo.create_promocode({
+        "code": "FIX50", "user_id": USER_ID, "discount_type": DiscountType.FIXED, "discount_value": 50,
+        "min_order_amount": 0.0, "expires_at": datetime.now() + timedelta(days=1), "max_usages": 1,
+        "applicable_categories": [],
+    })
+
+    response = client.post("/api/v1/promocodes/best", json={
+        "user_id": str(USER_ID), "order_amount": 300, "categories": ["dairy"]
+    })
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [r["promo_code"] for r in body["results"]] == ["FIX50", "TEN1"]
+    assert body["best"]["discount_amount"] == 50
+    assert (body["eligible"], body["evaluated"]) == (2, 4)
+
+
+def test_signed_promocodes_require_key(client, monkeypatch):
+    monkeypatch.setattr(promocode_router.promocode_service, "signed_codes", None)
+
+    response = client.post("/api/v1/promocodes/signed", json={
+        "discount_type": "percentage", "discount_value": 10,
+        "expires_at": (datetime.now() + timedelta(days=30)).isoformat(),
+    })
+
+    assert response.status_code == 400
+
+
+def test_generate_promocodes(client, repo):
+    response = client.post("/api/v1/promocodes/generate", json={
+        "prefix": "SPRING-",
+        "count": 500,
+        "user_id": str(USER_ID),
+        "discount_type": "fixed",
+        "discount_value": 100,
+        "expires_at": (datetime.now() + timedelta(days=30)).isoformat(),
+    })
+
+    assert response.status_code == 200
+    codes = response.json()["codes"]
+    assert len(set(codes)) == 500
+    assert all(code.startswith("SPRING-") and len(code) == 17 for code in codes)
+    assert repo.count() == 500
+    assert repo.get_by_code(codes[0]).max_usages == 1
+
+
+def test_import_jsonl_skips_duplicates_and_reports_errors(client, repo):
+    create_promocode(repo, "TAKEN")
+    expires_at = (datetime.now() + timedelta(days=30)).isoformat()
+    row = '{"code": "%s", "user_id": "%s", "discount_type": "percentage", "discount_value": 5, "expires_at": "%s"}'
+    body = "\n".join([
+        row % ("NEW1", USER_ID, expires_at),
+        row % ("TAKEN", USER_ID, expires_at),
+        row % ("NEW1", USER_ID, expires_at),
+        '{"code": "BROKEN"}',
+        "not json",
+        row % ("NEW2", USER_ID, expires_at),
+    ])
+
+    response = client.post("/api/v1/promocodes/import?format=jsonl", content=body)
+
+    result = response.json()
+    assert result["created"] == 2
+    assert result["duplicates"] == 2
+    assert [e["line"] for e in result["errors"]] == [4, 5]
+    assert repo.get_by_code("NEW2").discount_value == 5
+
+
+def test_import_csv(client, repo):
+    expires_at = (datetime.now() + timedelta(days=30)).isoformat()
+    body = (
+        "code,user_id,discount_type,discount_value,max_discount,expires_at,applicable_categories\n"
+        f"CSV1,{USER_ID},percentage,15,,{expires_at},dairy|bakery\n"
+        f"CSV2,{USER_ID},fixed,50,,{expires_at},\n"
+    )
+
+    response = client.post("/api/v1/promocodes/import?format=csv", content=body)
+
+    assert response.json()["created"] == 2
+    assert repo.get_by_code("CSV1").applicable_categories == ["dairy", "bakery"]
+    assert repo.get_by_code("CSV2").max_discount is None
+
+
+def test_active_promocodes_cursor_pagination(client, repo):
+    for code in ["C", "A", "E", "B", "D"]:
+        create_promocode(repo, code)
+    create_promocode(repo, "AA_EXPIRED", expires_delta_days=-1)
+
+    pages, cursor = [], None
+    while True:
+        params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+        page = client.get("/api/v1/promocodes/active", params=params).json()
+        pages.append([p["code"] for p in page["items"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+
+    assert pages == [["A", "B"], ["C", "D"], ["E"]]
+
+
+def test_user_promocodes_ndjson_stream(client, repo, monkeypatch):
+    monkeypatch.setattr("promocode_service.promocode_service.PROMOCODE_STREAM_CHUNK", 2)
+    for code in ["U3", "U1", "U2"]:
+        create_promocode(repo, code)
+
+    response = client.get(f"/api/v1/promocodes/user/{USER_ID}", params={"format": "ndjson"})
+
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert [json.loads(line)["code"] for line in response.text.splitlines()] == ["U1", "U2", "U3"]
+
+
+def test_listing_rejects_bad_cursor_and_limit(client):
+    assert client.get("/api/v1/promocodes/active", params={"cursor": "%%%"}).status_code == 400
+    assert client.get("/api/v1/promocodes/active", params={"limit": 100000}).status_code == 422
@@ -0,0 +1,69 @@
+from uuid import uuid4
+from datetime import datetime, timedelta
+from promocode_service.models import DiscountType, Promocode, PromocodeStatus, ValidatePromocodeRequest
+from promocode_service.promocode_rules import RuleCache, compile_rule
+
+
+def make_promocode(code="RULE10", discount_type=DiscountType.PERCENTAGE, discount_value=10,
+                   min_order_amount=100, max_discount=None, applicable_categories=None):
+    return Promocode(
+        id=uuid4(),
+        code=code,
+        user_id=uuid4(),
+        discount_type=discount_type,
+        discount_value=discount_value,
+        min_order_amount=min_order_amount,
+        max_discount=max_discount,
+        expires_at=datetime.now() + timedelta(days=1),
+        usage_count=0,
+        max_usages=1,
+        status=PromocodeStatus.ACTIVE,
+        applicable_categories=applicable_categories or [],
+        created_at=datetime.now(),
+    )
+
+
+def order(amount=500, categories=None):
+    return ValidatePromocodeRequest(promo_code="RULE10", user_id=uuid4(), order_amount=amount,
+                                    categories=categories or [])
+
+
+def test_order_predicate():
+    rule = compile_rule(make_promocode(applicable_categories=["dairy", "bakery"]))
+
+    assert rule.accepts(order(100))
+    assert not rule.accepts(order(99.99))
+    assert rule.accepts(order(categories=["meat", "bakery"]))
+    assert not rule.accepts(order(categories=["meat"]))
+    # Без категорий в заказе ограничение по категориям не действует
+    assert rule.accepts(order(categories=[]))
+
+
+def test_discount_functions():
+    assert compile_rule(make_promocode(discount_value=15)).discount(333.33) == 50.0
+    assert compile_rule(make_promocode(discount_value=50, max_discount=200)).discount(1000) == 200
+    fixed = compile_rule(make_promocode(discount_type=DiscountType.FIXED, discount_value=300))
+    assert fixed.discount(1000) == 300
+    assert fixed.discount_percent is None
+
+
+def test_rule_cache_shares_rules_and_recompiles_changed_conditions():
+    cache = RuleCache()
+    first, second = make_promocode("CAMP1"), make_promocode("CAMP2")
+
+    assert cache.get(first) is cache.get(second)
+    assert cache.compilations == 1
+
+    # Обновленный снимок того же кода из хранилища
+    second = second.model_copy(update={"min_order_amount": 1000})
+    assert not cache.get(second).accepts(order(500))
+    assert cache.get(first).accepts(order(500))
+    assert cache.compilations == 2
+
+
+def test_extra_rule_compiler():
+    first_order_only = [lambda promocode: lambda request: False]
+    without_condition = [lambda promocode: None]
+
+    assert not compile_rule(make_promocode(), compilers=first_order_only).accepts(order())
+    assert compile_rule(make_promocode(), compilers=without_condition).accepts(order())
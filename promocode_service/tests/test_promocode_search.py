@@ -0,0 +1,160 @@
+import random
+from uuid import uuid4
+
+import pytest
+
+from promocode_service import promocode_code_index
+from promocode_service.models import PromocodeStatus
+from promocode_service.promocode_code_index import SortedCodeIndex
+from promocode_service.promocode_compact_repo import CompactPromocodeRepo
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_shared_repo import SharedPromocodeRepo
+from promocode_service.promocode_sql_repo import prefix_upper_bound
+from promocode_service.tests.test_promocode_compact_repo import USER_ID, make_promocode
+from promocode_service.tests.test_promocode_router import client, create_promocode, repo  # noqa: F401
+from promocode_service.tests.test_promocode_sql_repo import sql_repo  # noqa: F401
+
+CAMPAIGN_CODES = [f"SUMMER{i:03d}" for i in range(40)] + ["SUMMIT", "SUM", "WINTER1", "AUTUMN5", "SUMMER_X"]
+
+
+def test_index_matches_sorted_scan_while_growing(monkeypatch):
+    monkeypatch.setattr(promocode_code_index, "MIN_PENDING", 8)
+    rng = random.Random(3)
+    by_code = SortedCodeIndex()
+    codes = []
+    rows = SortedCodeIndex(key=codes.__getitem__, typecode="I")
+    for step in range(2000):
+        code = "".join(rng.choice("ABC") for _ in range(rng.randint(1, 6))) + str(step)
+        codes.append(code)
+        by_code.add(code)
+        rows.add(step)
+        if step % 97 == 0:
+            prefix = code[:rng.randint(1, 3)]
+            expected = sorted(c for c in codes if c.startswith(prefix))
+            after = expected[len(expected) // 2] if rng.random() < 0.5 else None
+            if after is not None:
+                expected = [c for c in expected if c > after]
+            assert by_code.search_prefix(prefix, after, 10) == expected[:10]
+            assert [codes[row] for row in rows.search_prefix(prefix, after, 10)] == expected[:10]
+            assert list(by_code.iter_from(after)) == sorted(c for c in codes if after is None or c > after)
+    assert list(by_code.items()) == sorted(codes) == [codes[row] for row in rows.items()]
+
+
+def test_index_discards_and_readds(monkeypatch):
+    monkeypatch.setattr(promocode_code_index, "MIN_PENDING", 8)
+    rng = random.Random(5)
+    index, live = SortedCodeIndex(), set()
+    for step in range(3000):
+        code = f"C{rng.randrange(400):03d}"
+        if code in live:
+            index.discard(code)
+            live.discard(code)
+        else:
+            index.add(code)
+            live.add(code)
+        if step % 89 == 0:
+            after = f"C{rng.randrange(400):03d}"
+            assert list(index.iter_from(after)) == sorted(c for c in live if c > after)
+            assert len(index) == len(live)
+    assert list(index.items()) == sorted(live)
+
+
+def test_prefix_upper_bound():
+    assert prefix_upper_bound("SUMMER") == "SUMMES"
+    assert prefix_upper_bound("A" + chr(0x10FFFF)) == "B"
+    assert prefix_upper_bound(chr(0x10FFFF)) is None
+
+
+def memory_repo(tmp_path):
+    return PromocodeRepo(promocodes=[])
+
+
+def shared_repo(tmp_path):
+    return SharedPromocodeRepo(str(tmp_path / "promocodes.table"), capacity=1000)
+
+
+@pytest.mark.parametrize("make_repo", [memory_repo, lambda tmp_path: CompactPromocodeRepo(), shared_repo, "sql"])
+def test_repos_page_through_prefix_matches(make_repo, tmp_path, request):
+    repo = request.getfixturevalue("sql_repo") if make_repo == "sql" else make_repo(tmp_path)
+    shuffled = CAMPAIGN_CODES[:]
+    random.Random(1).shuffle(shuffled)
+    repo.add_promocodes([make_promocode(code, USER_ID) for code in shuffled[:30]])
+    # Коды, созданные после первого поиска, видны следующему
+    assert [p.code for p in repo.search_by_prefix("SUMM", None, 5)] == \
+        sorted(c for c in shuffled[:30] if c.startswith("SUMM"))[:5]
+    for code in shuffled[30:]:
+        repo.create_promocode(make_promocode(code, USER_ID).model_dump(exclude={"id", "usage_count", "status",
+                                                                               "created_at"}))
+
+    found, after = [], None
+    while True:
+        page = repo.search_by_prefix("SUMMER", after, 7)
+        found.extend(p.code for p in page)
+        if len(page) < 7:
+            break
+        after = page[-1].code
+    assert found == sorted(c for c in CAMPAIGN_CODES if c.startswith("SUMMER"))
+    assert repo.search_by_prefix("SUMMER_", None, 10)[0].code == "SUMMER_X"
+    assert repo.search_by_prefix("NOPE", None, 10) == []
+
+
+@pytest.mark.parametrize("make_repo", [memory_repo, lambda tmp_path: CompactPromocodeRepo(), shared_repo])
+def test_user_pages_see_codes_added_between_pages(make_repo, tmp_path):
+    repo = make_repo(tmp_path)
+    # Для общей таблицы вторая половина кодов дописывается "другим воркером"
+    writer = shared_repo(tmp_path) if isinstance(repo, SharedPromocodeRepo) else repo
+    other_user = uuid4()
+    shuffled = CAMPAIGN_CODES[:]
+    random.Random(2).shuffle(shuffled)
+    repo.add_promocodes([make_promocode(code, USER_ID) for code in shuffled[:20]])
+    repo.add_promocodes([make_promocode(code + "_B", other_user) for code in shuffled[:5]])
+    assert [p.code for p in repo.get_user_promocodes_page(USER_ID, None, 5)] == sorted(shuffled[:20])[:5]
+
+    writer.add_promocodes([make_promocode(code, USER_ID) for code in shuffled[20:]])
+    found, after = [], None
+    while True:
+        page = repo.get_user_promocodes_page(USER_ID, after, 7)
+        found.extend(p.code for p in page)
+        if len(page) < 7:
+            break
+        after = page[-1].code
+    assert found == sorted(CAMPAIGN_CODES)
+    assert repo.get_user_promocodes_page(uuid4(), None, 5) == []
+
+
+@pytest.mark.parametrize("make_repo", [memory_repo, lambda tmp_path: CompactPromocodeRepo(), shared_repo])
+def test_active_pages_follow_status_changes(make_repo, tmp_path):
+    repo = make_repo(tmp_path)
+    # Для общей таблицы статусы меняет "другой воркер"
+    writer = shared_repo(tmp_path) if isinstance(repo, SharedPromocodeRepo) else repo
+    repo.add_promocodes([make_promocode(code, USER_ID) for code in CAMPAIGN_CODES])
+    assert [p.code for p in repo.get_active_promocodes_page(None, 5)] == sorted(CAMPAIGN_CODES)[:5]
+
+    used = sorted(CAMPAIGN_CODES)[1:30]
+    for code in used:
+        assert writer.consume_usage(code) is not None
+    expired = writer.get_by_code("WINTER1").model_copy(update={"status": PromocodeStatus.EXPIRED})
+    writer.update_promocode(expired)
+    active = sorted(set(CAMPAIGN_CODES) - set(used) - {"WINTER1"})
+    assert [p.code for p in repo.get_active_promocodes_page(None, 3)] == active[:3]
+    assert [p.code for p in repo.get_active_promocodes_page(active[0], 100)] == active[1:]
+
+    revived = writer.get_by_code(used[0]).model_copy(update={"status": PromocodeStatus.ACTIVE, "max_usages": 2})
+    writer.update_promocode(revived)
+    writer.add_promocode(make_promocode("AAA", USER_ID))
+    active = sorted(active + [used[0], "AAA"])
+    assert [p.code for p in repo.get_active_promocodes_page(None, 100)] == active
+    assert sorted(p.code for p in repo.get_active_promocodes()) == active
+
+
+def test_search_endpoint_paginates(client, repo):
+    for code in ("SUMMER1", "SUMMER2", "SUMMER3", "SUNNY", "WINTER"):
+        create_promocode(repo, code)
+
+    first = client.get("/api/v1/promocodes/search", params={"prefix": "SUMMER", "limit": 2}).json()
+    assert [item["code"] for item in first["items"]] == ["SUMMER1", "SUMMER2"]
+    second = client.get("/api/v1/promocodes/search",
+                        params={"prefix": "SUMMER", "limit": 2, "cursor": first["next_cursor"]}).json()
+    assert [item["code"] for item in second["items"]] == ["SUMMER3"]
+    assert second["next_cursor"] is None
+    assert client.get("/api/v1/promocodes/search").status_code == 422
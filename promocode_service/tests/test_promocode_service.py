@@ -10,9 +10,7 @@ from promocode_service.promocode_service import PromocodeService
 @pytest.fixture
 def mock_repo(monkeypatch):
 
-    repo = PromocodeRepo()
-
-    repo._promocodes = []
+    repo = PromocodeRepo(promocodes=[])
     return repo
 
 
@@ -57,7 +55,7 @@ def create_test_promocode(
 def test_validate_promocode_success(service, mock_repo):
     user_id = uuid4()
     promo = create_test_promocode(user_id=user_id)
-    mock_repo._promocodes.append(promo)
+    mock_repo.add_promocode(promo)
 
     request = ValidatePromocodeRequest(
         promo_code=promo.code,
@@ -86,7 +84,7 @@ def test_validate_promocode_not_found(service):
 
 def test_validate_promocode_wrong_user(service, mock_repo):
     promo = create_test_promocode(user_id=uuid4())
-    mock_repo._promocodes.append(promo)
+    mock_repo.add_promocode(promo)
 
     request = ValidatePromocodeRequest(
         promo_code=promo.code,
@@ -103,7 +101,7 @@ def test_validate_promocode_wrong_user(service, mock_repo):
 def test_validate_promocode_expired(service, mock_repo):
     user_id = uuid4()
     promo = create_test_promocode(user_id=user_id, expires_delta_days=-1)
-    mock_repo._promocodes.append(promo)
+    mock_repo.add_promocode(promo)
 
     request = ValidatePromocodeRequest(
         promo_code=promo.code,
@@ -120,7 +118,7 @@ def test_validate_promocode_expired(service, mock_repo):
 def test_validate_promocode_min_amount_fail(service, mock_repo):
     user_id = uuid4()
     promo = create_test_promocode(user_id=user_id, min_order_amount=500)
-    mock_repo._promocodes.append(promo)
+    mock_repo.add_promocode(promo)
 
     request = ValidatePromocodeRequest(
         promo_code=promo.code,
@@ -139,7 +137,7 @@ def test_validate_promocode_min_amount_fail(service, mock_repo):
 def test_apply_promocode_success(service, mock_repo):
     user_id = uuid4()
     promo = create_test_promocode(user_id=user_id)
-    mock_repo._promocodes.append(promo)
+    mock_repo.add_promocode(promo)
 
     req = ApplyPromocodeRequest(
         promo_code=promo.code,
@@ -160,7 +158,7 @@ def test_apply_promocode_success(service, mock_repo):
 def test_apply_promocode_turns_status_used(service, mock_repo):
     user_id = uuid4()
     promo = create_test_promocode(user_id=user_id, usage_count=0, max_usages=1)
-    mock_repo._promocodes.append(promo)
+    mock_repo.add_promocode(promo)
 
     req = ApplyPromocodeRequest(
         promo_code=promo.code,
@@ -193,7 +191,7 @@ def test_create_promocode_success(service, mock_repo):
 
 def test_create_promocode_duplicate(service, mock_repo):
     p = create_test_promocode(code="DUPL")
-    mock_repo._promocodes.append(p)
+    mock_repo.add_promocode(p)
 
     data = CreatePromocodeRequest(
         code="DUPL",
@@ -212,11 +210,12 @@ def test_create_promocode_duplicate(service, mock_repo):
 def test_get_user_promocodes(service, mock_repo):
     uid = uuid4()
 
-    mock_repo._promocodes += [
-        create_test_promocode(user_id=uid),
-        create_test_promocode(user_id=uid),
-        create_test_promocode(user_id=uuid4())
-    ]
+    for promo in [
+        create_test_promocode(user_id=uid, code="USER1"),
+        create_test_promocode(user_id=uid, code="USER2"),
+        create_test_promocode(user_id=uuid4(), code="OTHER")
+    ]:
+        mock_repo.add_promocode(promo)
 
     result = service.get_user_promocodes(uid)
     assert len(result) == 2
@@ -225,11 +224,27 @@ def test_get_user_promocodes(service, mock_repo):
 
 
 def test_get_active_promocodes(service, mock_repo):
-    mock_repo._promocodes += [
-        create_test_promocode(expires_delta_days=1),      # active
-        create_test_promocode(expires_delta_days=-1),     # expired
-        create_test_promocode(expires_delta_days=5)       # active
-    ]
+    for promo in [
+        create_test_promocode(code="ACTIVE1", expires_delta_days=1),     # active
+        create_test_promocode(code="EXPIRED", expires_delta_days=-1),    # expired
+        create_test_promocode(code="ACTIVE5", expires_delta_days=5)      # active
+    ]:
+        mock_repo.add_promocode(promo)
 
     result = service.get_all_active_promocodes()
-    assert len(result) == 2
\ No newline at end of file
+    assert len(result) == 2
+
+def test_validate_promocodes_batch_matches_single(service, mock_repo):
+    user_id = uuid4()
+    mock_repo.add_promocode(create_test_promocode(user_id=user_id, code="OK10"))
+    mock_repo.add_promocode(create_test_promocode(user_id=user_id, code="BIG", min_order_amount=500))
+
+    requests = [
+        ValidatePromocodeRequest(promo_code=code, user_id=user_id, order_amount=200, categories=[])
+        for code in ["OK10", "BIG", "NOPE", "OK10"]
+    ]
+
+    results = service.validate_promocodes(requests)
+
+    assert results == [service.validate_promocode(r) for r in requests]
+    assert [r["valid"] for r in results] == [True, False, False, True]
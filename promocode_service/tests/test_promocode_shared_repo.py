@@ -0,0 +1,61 @@
+import multiprocessing
+import pytest
+from promocode_service.promocode_compact_repo import CompactPromocodeRepo
+from promocode_service.promocode_shared_repo import SharedPromocodeRepo
+from promocode_service.tests.test_promocode_compact_repo import USER_ID, make_promocode, run_scenario
+
+
+def consume_many(path, code, times):
+    repo = SharedPromocodeRepo(path)
+    consumed = sum(repo.consume_usage(code) is not None for _ in range(times))
+    repo.close()
+    return consumed
+
+
+def test_service_behaves_the_same_on_shared_repo(tmp_path):
+    repo = SharedPromocodeRepo(str(tmp_path / "promocodes.table"), capacity=100)
+    assert run_scenario(repo) == run_scenario(CompactPromocodeRepo())
+    repo.close()
+
+
+def test_mappings_see_each_others_writes(tmp_path):
+    path = str(tmp_path / "promocodes.table")
+    first = SharedPromocodeRepo(path, capacity=100)
+    # Емкость уже записана в файл: второй процесс берет ее из заголовка
+    second = SharedPromocodeRepo(path, capacity=5)
+
+    first.add_promocode(make_promocode("SHARED", USER_ID, max_usages=2, categories=["dairy"]))
+    assert second.get_by_code("SHARED").applicable_categories == ["dairy"]
+    assert second.consume_usage("SHARED").usage_count == 1
+    assert first.consume_usage("SHARED").status.value == "used"
+    assert second.consume_usage("SHARED") is None
+    assert [p.code for p in second.get_user_promocodes(USER_ID)] == ["SHARED"]
+    assert second.capacity == 100
+    first.close()
+    second.close()
+
+
+def test_workers_consume_exactly_the_limit(tmp_path):
+    path = str(tmp_path / "promocodes.table")
+    repo = SharedPromocodeRepo(path, capacity=100)
+    repo.add_promocode(make_promocode("FLASH", USER_ID, max_usages=50))
+
+    with multiprocessing.get_context("spawn").Pool(4) as pool:
+        consumed = pool.starmap(consume_many, [(path, "FLASH", 30)] * 4)
+
+    assert sum(consumed) == 50
+    assert repo.get_by_code("FLASH").usage_count == 50
+    repo.close()
+
+
+def test_full_table_and_foreign_file_are_rejected(tmp_path):
+    repo = SharedPromocodeRepo(str(tmp_path / "promocodes.table"), capacity=1)
+    repo.add_promocode(make_promocode("ONLY", USER_ID))
+    with pytest.raises(RuntimeError):
+        repo.add_promocode(make_promocode("EXTRA", USER_ID))
+    repo.close()
+
+    foreign = tmp_path / "foreign.table"
+    foreign.write_bytes(b"\1" * 8192)
+    with pytest.raises(ValueError):
+        SharedPromocodeRepo(str(foreign))
@@ -0,0 +1,142 @@
+import json
+import pytest
+from uuid import uuid4
+from datetime import datetime, timedelta
+from promocode_service.models import (
+    ApplyPromocodeRequest, BestPromocodeRequest, CreatePromocodeRequest, DiscountType, GeneratePromocodesRequest,
+    SignedPromocodesRequest, ValidatePromocodeRequest,
+)
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_service import PromocodeService
+
+USER_ID = uuid4()
+
+
+@pytest.fixture
+def service():
+    return PromocodeService(repo=PromocodeRepo(promocodes=[]), signing_key="test-key")
+
+
+def issue(service, **terms):
+    request = SignedPromocodesRequest(**{
+        "discount_type": DiscountType.PERCENTAGE,
+        "discount_value": 15,
+        "min_order_amount": 500,
+        "max_discount": 300,
+        "expires_at": datetime.now() + timedelta(days=1),
+        **terms,
+    })
+    return service.issue_signed_promocodes(request)["codes"]
+
+
+def validate(service, code, user_id=USER_ID, order_amount=1000):
+    return service.validate_promocode(
+        ValidatePromocodeRequest(promo_code=code, user_id=user_id, order_amount=order_amount)
+    )
+
+
+def apply(service, code):
+    return service.apply_promocode(ApplyPromocodeRequest(
+        promo_code=code, user_id=USER_ID, order_id=uuid4(), order_amount=1000, final_amount=850
+    ))
+
+
+def test_signed_code_validates_without_repo(service):
+    codes = issue(service, count=3)
+
+    results = [validate(service, code) for code in codes]
+
+    assert len(set(codes)) == 3
+    assert all(r["valid"] and r["discount_amount"] == 150 for r in results)
+    assert validate(service, codes[0], order_amount=400)["message"] == "Заказ не соответствует требованиям промокода"
+    assert service.repo.count() == 0
+
+
+def test_tampered_or_foreign_code_is_rejected(service):
+    code = issue(service)[0]
+    tampered = code[:-1] + ("A" if code[-1] != "A" else "B")
+    foreign = issue(PromocodeService(repo=PromocodeRepo(promocodes=[]), signing_key="other-key"))[0]
+
+    assert validate(service, tampered)["message"] == "Промокод не найден"
+    assert validate(service, foreign)["message"] == "Промокод не найден"
+    assert validate(service, code + "!")["message"] == "Промокод не найден"
+
+
+def test_user_bound_code(service):
+    code = issue(service, user_id=USER_ID)[0]
+
+    assert validate(service, code)["valid"]
+    assert validate(service, code, user_id=uuid4())["message"] == "Промокод не доступен для данного пользователя"
+
+
+def test_limited_code_counts_usages_in_repo(service):
+    code = issue(service, max_usages=2)[0]
+
+    results = [apply(service, code) for _ in range(3)]
+
+    assert [r.get("status") for r in results] == ["applied", "applied", None]
+    assert service.repo.get_by_code(code).usage_count == 2
+    # Исчерпанный код не проходит и валидацию, одиночную и пакетную
+    assert validate(service, code)["message"] == "Промокод не активен"
+    assert service.validate_promocodes([
+        ValidatePromocodeRequest(promo_code=code, user_id=USER_ID, order_amount=1000)
+    ])[0]["message"] == "Промокод не активен"
+    assert service.get_promocode_info(code)["usage_count"] == 2
+
+
+def test_counter_row_stays_out_of_user_listings(service):
+    code = issue(service, max_usages=5)[0]
+
+    apply(service, code)
+
+    assert service.repo.get_by_code(code).usage_count == 1
+    assert service.repo.get_user_promocodes(USER_ID) == []
+    assert service.find_best_promocodes(BestPromocodeRequest(user_id=USER_ID, order_amount=1000))["evaluated"] == 0
+    # Служебная строка не видна и в общих списках и поиске
+    assert service.get_all_active_promocodes() == []
+    assert service.get_active_promocodes_page()["items"] == []
+    assert list(service.iter_active_promocodes()) == []
+    assert service.search_promocodes("SG-")["items"] == []
+
+
+@pytest.mark.parametrize("signing_key", ["test-key", ""])
+def test_signed_prefix_is_reserved(signing_key):
+    service = PromocodeService(repo=PromocodeRepo(promocodes=[]), signing_key=signing_key)
+    terms = {
+        "user_id": USER_ID, "discount_type": DiscountType.PERCENTAGE, "discount_value": 10,
+        "expires_at": datetime.now() + timedelta(days=1),
+    }
+
+    created = service.create_promocode(CreatePromocodeRequest(code="SG-ABCDEF", **terms))
+    with pytest.raises(ValueError):
+        service.generate_promocodes(GeneratePromocodesRequest(prefix="SG-", count=1, **terms))
+    imported = service.import_promocodes([
+        json.dumps({"code": "SG-ABCDEF", **terms}, default=str),
+        json.dumps({"code": "PLAIN10", **terms}, default=str),
+    ], "jsonl")
+
+    assert created["status"] == "error"
+    assert (imported["created"], imported["error_count"]) == (1, 1)
+    assert service.repo.get_by_code("SG-ABCDEF") is None
+
+
+def test_unlimited_code_never_touches_repo(service):
+    code = issue(service, max_usages=0)[0]
+
+    assert all(apply(service, code)["status"] == "applied" for _ in range(5))
+    assert service.repo.count() == 0
+
+
+def test_expired_code_is_not_persisted(service):
+    code = issue(service, expires_at=datetime.now() - timedelta(minutes=1))[0]
+
+    assert validate(service, code)["message"] == "Промокод не активен"
+    assert service.repo.count() == 0
+
+
+def test_signed_codes_disabled_without_key():
+    service = PromocodeService(repo=PromocodeRepo(promocodes=[]), signing_key="")
+
+    with pytest.raises(ValueError):
+        issue(service)
+    assert validate(service, "SG-ANYTHING")["message"] == "Промокод не найден"
@@ -0,0 +1,115 @@
+import json
+import random
+from uuid import uuid4
+
+import pytest
+
+from promocode_service.models import ValidatePromocodeRequest
+from promocode_service.promocode_rules import compile_rule
+from promocode_service.promocode_simulation import (
+    evaluate_chunk, load_order_columns, main, read_order_chunks, simulate, simulation_terms, write_order_columns
+)
+from promocode_service.tests.test_promocode_rules import make_promocode
+
+CATEGORIES = ["dairy", "bakery", "meat", "snacks", "frozen"]
+
+
+def write_orders(path, fmt, count=500, seed=1):
+    rng = random.Random(seed)
+    orders = [(round(rng.uniform(50, 3000), 2), rng.sample(CATEGORIES, rng.randint(0, 3))) for _ in range(count)]
+    with open(path, "w", encoding="utf-8") as f:
+        if fmt == "csv":
+            f.write("order_id,order_amount,categories\n")
+            for i, (amount, categories) in enumerate(orders):
+                f.write(f"{i},{amount},{'|'.join(categories)}\n")
+        else:
+            for amount, categories in orders:
+                f.write(json.dumps({"order_amount": amount, "categories": categories}) + "\n")
+    return orders
+
+
+@pytest.mark.parametrize("terms", [
+    {"discount_type": "percentage", "discount_value": 15, "min_order_amount": 500, "max_discount": 200,
+     "applicable_categories": ["meat", "snacks"]},
+    {"discount_type": "fixed", "discount_value": 300, "min_order_amount": 1000},
+])
+def test_simulation_matches_rule_engine_per_order(tmp_path, terms):
+    """Векторная оценка совпадает с правилами валидации по каждому заказу"""
+    orders = write_orders(tmp_path / "orders.csv", "csv")
+    request = simulation_terms(terms)
+    rule = compile_rule(make_promocode(
+        discount_type=request.discount_type, discount_value=request.discount_value,
+        min_order_amount=request.min_order_amount, max_discount=request.max_discount,
+        applicable_categories=request.applicable_categories,
+    ))
+    vocabulary = {}
+    chunks = list(read_order_chunks(str(tmp_path / "orders.csv"), vocabulary, chunk_size=128))
+    allowed = [vocabulary[c] for c in request.applicable_categories if c in vocabulary]
+    results = [evaluate_chunk(request, chunk, allowed) for chunk in chunks]
+    eligible = [bool(flag) for flags, _, _ in results for flag in flags]
+    discounts = [float(value) for _, _, values in results for value in values]
+
+    for (amount, categories), accepted, discount in zip(orders, eligible, discounts):
+        order = ValidatePromocodeRequest(promo_code="RULE10", user_id=uuid4(), order_amount=amount,
+                                         categories=categories)
+        assert accepted == rule.accepts(order)
+        assert discount == pytest.approx(rule.discount(amount) if accepted else 0.0, abs=0.011)
+    assert len(eligible) == len(orders)
+
+
+def test_columns_and_text_give_same_totals(tmp_path):
+    write_orders(tmp_path / "orders.jsonl", "jsonl", count=1000)
+    terms = simulation_terms({"discount_type": "percentage", "discount_value": 10,
+                              "applicable_categories": ["dairy"]})
+    vocabulary = {"dairy": 0}
+    from_text = simulate(terms, read_order_chunks(str(tmp_path / "orders.jsonl"), vocabulary, chunk_size=300),
+                         vocabulary)
+
+    vocabulary = {}
+    rows = write_order_columns(read_order_chunks(str(tmp_path / "orders.jsonl"), vocabulary, chunk_size=300),
+                               vocabulary, str(tmp_path / "cols"))
+    vocabulary, chunks = load_order_columns(str(tmp_path / "cols"), chunk_size=256)
+    from_columns = simulate(terms, chunks, vocabulary)
+
+    assert rows == 1000 == from_columns["orders"]
+    assert {k: v for k, v in from_text.items() if k != "seconds"} == \
+        {k: v for k, v in from_columns.items() if k != "seconds"}
+    assert from_columns["eligible_orders"] + from_columns["rejected_categories"] == 1000
+
+
+def test_text_history_with_empty_vocabulary_matches_categories(tmp_path):
+    """Словарь пуст до первой пачки: номера категорий кода появляются в simulate"""
+    orders = write_orders(tmp_path / "orders.csv", "csv", count=600)
+    terms = simulation_terms({"discount_type": "fixed", "discount_value": 50,
+                              "applicable_categories": ["frozen", "meat"]})
+    vocabulary = {}
+    result = simulate(terms, read_order_chunks(str(tmp_path / "orders.csv"), vocabulary, chunk_size=100),
+                      vocabulary)
+
+    expected = sum(1 for _, categories in orders if not categories or {"frozen", "meat"} & set(categories))
+    assert 0 < result["eligible_orders"] == expected
+    assert result["rejected_categories"] == 600 - expected
+
+
+def test_limit_usages_caps_applications_across_chunks(tmp_path):
+    write_orders(tmp_path / "orders.csv", "csv", count=400)
+    terms = simulation_terms({"discount_type": "fixed", "discount_value": 100, "max_usages": 150})
+    vocabulary = {}
+    result = simulate(terms, read_order_chunks(str(tmp_path / "orders.csv"), vocabulary, chunk_size=64),
+                      vocabulary, limit_usages=True)
+
+    assert result["eligible_orders"] == 150
+    assert result["total_discount"] == 15000
+    assert result["rejected_max_usages"] + result["rejected_min_order_amount"] + 150 == 400
+
+
+def test_cli_convert_and_simulate(tmp_path, capsys):
+    write_orders(tmp_path / "orders.csv", "csv", count=50)
+    (tmp_path / "terms.json").write_text(json.dumps({"discount_type": "percentage", "discount_value": 5}))
+    main(["convert", str(tmp_path / "orders.csv"), str(tmp_path / "cols")])
+    main(["simulate", str(tmp_path / "cols"), str(tmp_path / "terms.json")])
+
+    result = json.loads(capsys.readouterr().out.split("\n", 1)[1])
+    assert result["orders"] == result["eligible_orders"] == 50
+    with pytest.raises(ValueError):
+        list(read_order_chunks(str(tmp_path / "terms.json"), {}))
@@ -0,0 +1,149 @@
+import pytest
+from datetime import datetime
+from uuid import uuid4
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from promocode_service import database, main
+from promocode_service.models import ApplyPromocodeRequest, PromocodeStatus
+from promocode_service.promocode_compact_repo import CompactPromocodeRepo
+from promocode_service.promocode_service import PromocodeService
+from promocode_service.promocode_snapshot import (
+    WarmupGuard, WarmupState, WriteThroughPromocodeRepo, read_snapshot, warm_up, write_snapshot,
+)
+from promocode_service.promocode_sql_repo import SqlPromocodeRepo
+from promocode_service.tests.test_promocode_compact_repo import OTHER_USER_ID, USER_ID, make_promocode
+from promocode_service.tests.test_promocode_sql_repo import make_promocode_data
+
+
+@pytest.fixture
+def sql_repo(tmp_path):
+    database.configure_engine(f"sqlite:///{tmp_path / 'promocodes.db'}")
+    return SqlPromocodeRepo()
+
+
+def test_snapshot_round_trip(tmp_path):
+    repo = CompactPromocodeRepo([
+        make_promocode("MILK", USER_ID, categories=["bakery", "dairy"]),
+        make_promocode("BREAD", OTHER_USER_ID, max_discount=None, max_usages=3),
+        make_promocode("OLD", USER_ID, expires_delta_days=-1),
+        make_promocode("ALMOND", USER_ID, categories=["nuts"]),
+    ])
+    repo.consume_usage("BREAD")
+    path = str(tmp_path / "promocodes.snapshot")
+    taken_at = datetime(2026, 1, 1, 12, 0)
+
+    write_snapshot(repo, path, taken_at)
+    loaded, loaded_at = read_snapshot(path)
+
+    assert loaded_at == taken_at
+    assert [loaded.get_by_code(code) for code in ("MILK", "BREAD", "OLD", "ALMOND")] == \
+           [repo.get_by_code(code) for code in ("MILK", "BREAD", "OLD", "ALMOND")]
+    assert {p.code for p in loaded.get_user_promocodes(USER_ID)} == {"MILK", "OLD", "ALMOND"}
+    assert loaded.expire_due() == ["OLD"]
+    assert [p.code for p in loaded.get_active_promocodes_page(limit=10)] == ["ALMOND", "BREAD", "MILK"]
+    # Хеш-индекс пересобран: новые коды и категории добавляются как обычно
+    loaded.add_promocode(make_promocode("CHEESE", OTHER_USER_ID, categories=["dairy", "nuts"]))
+    assert loaded.get_by_code("CHEESE").applicable_categories == ["dairy", "nuts"]
+    assert loaded.get_by_code("MISSING") is None
+    assert loaded.count() == 5
+
+
+def test_warm_up_catches_up_changes_after_snapshot(tmp_path, sql_repo):
+    for i in range(20):
+        sql_repo.create_promocode(make_promocode_data(code=f"WARM{i:02d}", max_usages=2))
+    path = str(tmp_path / "promocodes.snapshot")
+
+    cold = WarmupState()
+    assert warm_up(path, sql_repo, cold).count() == 20
+    assert (cold.snapshot_rows, cold.caught_up_rows) == (0, 20)
+
+    sql_repo.consume_usage("WARM03")
+    sql_repo.create_promocode(make_promocode_data(code="LATE", categories=["dairy"]))
+    warm = WarmupState()
+    repo = warm_up(path, sql_repo, warm, overlap=0)
+
+    assert (warm.snapshot_rows, warm.caught_up_rows) == (20, 2)
+    assert repo.get_by_code("WARM03").usage_count == 1
+    assert repo.get_by_code("LATE").applicable_categories == ["dairy"]
+    # Догруженные строки записаны в новый снимок
+    assert read_snapshot(path)[0].count() == 21
+
+
+def test_broken_snapshot_falls_back_to_full_load(tmp_path, sql_repo):
+    sql_repo.create_promocode(make_promocode_data(code="FALLBACK"))
+    path = tmp_path / "promocodes.snapshot"
+    path.write_bytes(b"not a snapshot")
+
+    state = WarmupState()
+    repo = warm_up(str(path), sql_repo, state)
+
+    assert repo.get_by_code("FALLBACK").status == PromocodeStatus.ACTIVE
+    assert state.caught_up_rows == 1
+    assert read_snapshot(str(path))[0].count() == 1
+
+
+def test_write_through_keeps_usage_across_restart(tmp_path, sql_repo):
+    sql_repo.create_promocode(make_promocode_data(code="ONCE", user_id=USER_ID, max_usages=1))
+    path = str(tmp_path / "promocodes.snapshot")
+
+    def start():
+        repo = WriteThroughPromocodeRepo(warm_up(path, sql_repo, WarmupState(), overlap=0), sql_repo)
+        return PromocodeService(repo=repo, use_code_filter=False)
+
+    def apply(service):
+        return service.apply_promocode(ApplyPromocodeRequest(
+            promo_code="ONCE", user_id=USER_ID, order_id=uuid4(), order_amount=1000, final_amount=900
+        ))
+
+    service = start()
+    assert apply(service)["status"] == "applied"
+    assert sql_repo.get_by_code("ONCE").usage_count == 1
+    service.repo.create_promocode(make_promocode_data(code="NEW", user_id=USER_ID))
+    assert sql_repo.get_by_code("NEW") is not None
+
+    # Перезапуск: списание и новый код пришли из БД, лимит не обходится
+    restarted = start()
+    assert restarted.repo.get_by_code("ONCE").usage_count == 1
+    assert restarted.repo.get_by_code("NEW") is not None
+    assert apply(restarted)["valid"] is False
+
+
+def test_catch_up_sees_writes_of_other_replicas(tmp_path, sql_repo):
+    sql_repo.create_promocode(make_promocode_data(code="SHARED", user_id=USER_ID, max_usages=2))
+    path = str(tmp_path / "promocodes.snapshot")
+
+    def start():
+        state = WarmupState()
+        store = warm_up(path, SqlPromocodeRepo(), state)
+        return WriteThroughPromocodeRepo(store, SqlPromocodeRepo(), state.checkpoint)
+
+    first, second = start(), start()
+    first.create_promocode(make_promocode_data(code="FRESH", user_id=USER_ID))
+    first.consume_usage("SHARED")
+    assert second.get_by_code("FRESH") is None
+    assert second.get_by_code("SHARED").usage_count == 0
+
+    assert set(second.catch_up()) >= {"FRESH", "SHARED"}
+    assert second.get_by_code("FRESH").status == PromocodeStatus.ACTIVE
+    assert second.get_by_code("SHARED").usage_count == 1
+    # Отметка сдвинулась: без новых изменений перечитывается только запас overlap
+    assert second.catch_up(overlap=0) == []
+
+
+def test_not_ready_until_warm(monkeypatch):
+    state = WarmupState()
+    app = FastAPI()
+    app.add_middleware(WarmupGuard, state=state)
+    app.get("/api/v1/ping")(lambda: {"ok": True})
+    client = TestClient(app)
+
+    warming = client.get("/api/v1/ping")
+    assert warming.status_code == 503 and warming.headers["retry-after"] == "1"
+    state.stage = "ready"
+    assert client.get("/api/v1/ping").json() == {"ok": True}
+
+    monkeypatch.setattr(main.readiness, "stage", "catching_up")
+    health = TestClient(main.app).get("/health")
+    assert health.status_code == 503 and health.json()["warmup"]["stage"] == "catching_up"
+    monkeypatch.setattr(main.readiness, "stage", "ready")
+    assert TestClient(main.app).get("/health").json()["status"] == "healthy"
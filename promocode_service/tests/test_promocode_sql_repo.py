@@ -0,0 +1,170 @@
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from datetime import datetime, timedelta
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from promocode_service import database, promocode_router
+from promocode_service.database import PromocodeCategoryDB, db_session
+from promocode_service.promocode_sql_repo import SqlPromocodeRepo
+from promocode_service.models import (
+    DiscountType, Promocode, PromocodeStatus, ValidatePromocodeRequest, ApplyPromocodeRequest
+)
+from promocode_service.promocode_service import PromocodeService
+
+
+@pytest.fixture
+def sql_repo(tmp_path):
+    database.configure_engine(f"sqlite:///{tmp_path / 'promocodes.db'}")
+    return SqlPromocodeRepo()
+
+
+@pytest.fixture
+def sql_service(sql_repo):
+    return PromocodeService(repo=sql_repo)
+
+
+def make_promocode_data(code="SQL10", user_id=None, expires_delta_days=1, max_usages=1, categories=None):
+    return {
+        "code": code,
+        "user_id": user_id or uuid4(),
+        "discount_type": DiscountType.PERCENTAGE,
+        "discount_value": 10,
+        "min_order_amount": 100,
+        "max_discount": 200,
+        "expires_at": datetime.now() + timedelta(days=expires_delta_days),
+        "max_usages": max_usages,
+        "applicable_categories": categories or [],
+    }
+
+
+def test_create_and_get_by_code(sql_repo):
+    user_id = uuid4()
+    sql_repo.create_promocode(make_promocode_data(code="DAIRY", user_id=user_id, categories=["dairy", "bakery"]))
+
+    promocode = sql_repo.get_by_code("DAIRY")
+
+    assert promocode.user_id == user_id
+    assert promocode.applicable_categories == ["bakery", "dairy"]
+    assert sql_repo.get_by_code("MISSING") is None
+    assert [p.code for p in sql_repo.get_user_promocodes(user_id)] == ["DAIRY"]
+
+
+def test_categories_are_queryable_rows(sql_repo):
+    sql_repo.create_promocode(make_promocode_data(code="MEAT", categories=["meat"]))
+    sql_repo.create_promocode(make_promocode_data(code="FRUITS", categories=["fruits", "meat"]))
+
+    with db_session() as db:
+        categories = db.scalars(select(PromocodeCategoryDB.category)).all()
+
+    assert sorted(categories) == ["fruits", "meat", "meat"]
+
+
+def test_validate_and_apply_through_service(sql_service, sql_repo):
+    user_id = uuid4()
+    sql_repo.create_promocode(make_promocode_data(code="ONCE", user_id=user_id))
+
+    validation = sql_service.validate_promocode(ValidatePromocodeRequest(
+        promo_code="ONCE", user_id=user_id, order_amount=200, categories=[]
+    ))
+    applied = sql_service.apply_promocode(ApplyPromocodeRequest(
+        promo_code="ONCE", user_id=user_id, order_id=uuid4(), order_amount=200, final_amount=180
+    ))
+    repeated = sql_service.apply_promocode(ApplyPromocodeRequest(
+        promo_code="ONCE", user_id=user_id, order_id=uuid4(), order_amount=200, final_amount=180
+    ))
+
+    assert validation["valid"] is True
+    assert validation["discount_amount"] == 20
+    assert applied["status"] == "applied"
+    assert applied["usage_count"] == 1
+    assert repeated["valid"] is False
+    assert sql_repo.get_by_code("ONCE").status == PromocodeStatus.USED
+
+
+def test_expired_status_is_persisted(sql_service, sql_repo):
+    user_id = uuid4()
+    sql_repo.create_promocode(make_promocode_data(code="LATE", user_id=user_id, expires_delta_days=-1))
+
+    result = sql_service.validate_promocode(ValidatePromocodeRequest(
+        promo_code="LATE", user_id=user_id, order_amount=200, categories=[]
+    ))
+
+    assert result["valid"] is False
+    assert sql_repo.get_by_code("LATE").status == PromocodeStatus.EXPIRED
+
+
+def test_expire_due_and_active_listing(sql_repo):
+    for i in range(3):
+        sql_repo.create_promocode(make_promocode_data(code=f"OLD{i}", expires_delta_days=-1))
+    sql_repo.create_promocode(make_promocode_data(code="FRESH"))
+
+    assert len(sql_repo.expire_due(batch_size=2)) == 2
+    assert len(sql_repo.expire_due(batch_size=2)) == 1
+    assert [p.code for p in sql_repo.get_active_promocodes()] == ["FRESH"]
+
+
+def test_concurrent_consume_respects_max_usages(sql_repo):
+    sql_repo.create_promocode(make_promocode_data(code="SUMMER25", max_usages=50))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: sql_repo.consume_usage("SUMMER25"), range(200)))
+
+    assert sum(r is not None for r in results) == 50
+    promocode = sql_repo.get_by_code("SUMMER25")
+    assert promocode.usage_count == 50
+    assert promocode.status == PromocodeStatus.USED
+
+
+def test_add_promocodes_skips_existing_codes(sql_repo):
+    sql_repo.create_promocode(make_promocode_data(code="BULK1"))
+    promocodes = [
+        Promocode(
+            id=uuid4(), usage_count=0, status=PromocodeStatus.ACTIVE, created_at=datetime.now(),
+            **make_promocode_data(code=code, categories=["dairy"])
+        )
+        for code in ["BULK1", "BULK2", "BULK3"]
+    ]
+
+    inserted = sql_repo.add_promocodes(promocodes)
+
+    assert [p.code for p in inserted] == ["BULK2", "BULK3"]
+    assert sql_repo.count() == 3
+    assert sql_repo.get_by_code("BULK3").applicable_categories == ["dairy"]
+
+
+def test_keyset_pages(sql_repo):
+    user_id = uuid4()
+    for code in ["K3", "K1", "K4", "K2"]:
+        sql_repo.create_promocode(make_promocode_data(code=code, user_id=user_id))
+    sql_repo.create_promocode(make_promocode_data(code="K0", user_id=user_id, expires_delta_days=-1))
+
+    active = sql_repo.get_active_promocodes_page(after="K1", limit=2)
+    user_page = sql_repo.get_user_promocodes_page(user_id, after=None, limit=3)
+
+    assert [p.code for p in active] == ["K2", "K3"]
+    assert [p.code for p in user_page] == ["K0", "K1", "K2"]
+
+
+def test_request_shares_one_session_across_repo_calls(sql_repo, monkeypatch):
+    user_id = uuid4()
+    sql_repo.create_promocode(make_promocode_data(code="TWICE", user_id=user_id, max_usages=2))
+    monkeypatch.setattr(promocode_router.promocode_service, "repo", sql_repo)
+    opened = []
+    session_factory = database.SessionLocal
+    monkeypatch.setattr(database, "SessionLocal", lambda: opened.append(1) or session_factory())
+    app = FastAPI()
+    app.include_router(promocode_router.router, dependencies=[Depends(database.request_db_session)])
+
+    with TestClient(app) as client:
+        # Проверка, списание и чтение после UPDATE ... RETURNING - в одной сессии
+        results = [client.post("/api/v1/promocodes/apply", json={
+            "promo_code": "TWICE", "user_id": str(user_id), "order_id": str(uuid4()),
+            "order_amount": 200, "final_amount": 180,
+        }).json() for _ in range(2)]
+
+    assert [r["usage_count"] for r in results] == [1, 2]
+    assert len(opened) == 2
+    assert sql_repo.get_by_code("TWICE").status == PromocodeStatus.USED
+
@@ -0,0 +1,91 @@
+import random
+from collections import Counter
+from uuid import uuid4
+
+from promocode_service import promocode_router
+from promocode_service.models import ApplyPromocodeRequest, ValidatePromocodeRequest
+from promocode_service.promocode_repo import PromocodeRepo
+from promocode_service.promocode_service import PromocodeService
+from promocode_service.promocode_usage_stats import RingWindow, SpaceSaving, UsageStats
+from promocode_service.tests.test_promocode_router import USER_ID, client, create_promocode, repo  # noqa: F401
+from promocode_service.tests.test_promocode_sql_repo import make_promocode_data
+
+
+def test_ring_window_drops_buckets_older_than_window():
+    window = RingWindow(60, 3, 2)
+    window.add(0, 10)
+    window.add(0, 70)
+    window.add(1, 130)
+    window.add(0, 135)
+    assert window.series(150) == [[1, 1, 1], [0, 0, 1]]
+
+    # Через круг ячейка минуты 10 переиспользуется и обнуляется
+    window.add(1, 190)
+    assert window.series(190) == [[1, 1, 0], [0, 1, 1]]
+    assert window.series(190 + 600) == [[0, 0, 0], [0, 0, 0]]
+
+
+def test_space_saving_keeps_heavy_hitters_with_bounded_error():
+    rng = random.Random(7)
+    stream = [f"HOT{i}" for i in range(5) for _ in range(400 - i * 50)]
+    stream += [f"COLD{rng.randrange(5000)}" for _ in range(6000)]
+    rng.shuffle(stream)
+    sketch = SpaceSaving(k=50)
+    for key in stream:
+        sketch.add(key)
+    exact = Counter(stream)
+
+    top = sketch.top(5)
+    assert [row["promo_code"] for row in top] == [f"HOT{i}" for i in range(5)]
+    for row in top:
+        assert row["count"] - row["error"] <= exact[row["promo_code"]] <= row["count"]
+    assert len(sketch.counts) == 50
+
+
+def test_service_records_applies_and_failures_by_reason():
+    repo = PromocodeRepo(promocodes=[])
+    repo.create_promocode(make_promocode_data(code="BURN", max_usages=2))
+    stats = UsageStats()
+    service = PromocodeService(repo=repo, usage_stats=stats)
+    owner = repo.get_by_code("BURN").user_id
+
+    def apply():
+        return service.apply_promocode(ApplyPromocodeRequest(promo_code="BURN", user_id=owner, order_id=uuid4(),
+                                                             order_amount=1000, final_amount=900))
+
+    apply()
+    apply()
+    apply()
+    service.validate_promocode(ValidatePromocodeRequest(promo_code="BURN", user_id=uuid4(), order_amount=1000))
+    service.validate_promocodes([ValidatePromocodeRequest(promo_code="BURN", user_id=owner, order_amount=100),
+                                 ValidatePromocodeRequest(promo_code="NOPE", user_id=owner, order_amount=100)])
+
+    view = service.get_promocode_stats("BURN")
+    assert view["totals"] == {"applied": 2, "not_users": 1, "not_active": 2, "order_mismatch": 0}
+    assert view["last_hour"]["applied"] == 2 and view["minutes"]["applied"][-1] == 2
+    assert len(view["minutes"]["applied"]) == 60 and len(view["hours"]["applied"]) == 24
+    assert view["remaining"] == 0
+    # Несуществующие коды не занимают счетчики
+    assert len(stats) == 1 and service.get_promocode_stats("NOPE") is None
+    assert service.get_hottest_promocodes()["codes"][0] == {"promo_code": "BURN", "count": 5, "error": 0}
+
+
+def test_stats_endpoints(client, repo, monkeypatch):
+    monkeypatch.setattr(promocode_router.promocode_service, "usage_stats", UsageStats(max_codes=2))
+    for code in ("HOT", "WARM", "COLD"):
+        create_promocode(repo, code, min_order_amount=1000)
+    for code, times in (("COLD", 1), ("HOT", 3), ("WARM", 2)):
+        for _ in range(times):
+            client.post("/api/v1/promocodes/validate",
+                        json={"promo_code": code, "user_id": str(USER_ID), "order_amount": 10})
+
+    response = client.get("/api/v1/promocodes/HOT/stats")
+    assert response.status_code == 200
+    assert response.json()["last_hour"]["order_mismatch"] == 3
+    # Счетчики COLD вытеснены: код известен хранилищу, но не наблюдается
+    cold = client.get("/api/v1/promocodes/COLD/stats").json()
+    assert cold["tracked"] is False and cold["usage_count"] == 0
+    assert client.get("/api/v1/promocodes/MISSING/stats").status_code == 404
+
+    top = client.get("/api/v1/promocodes/stats/top", params={"limit": 2}).json()
+    assert [row["promo_code"] for row in top["codes"]] == ["HOT", "WARM"]
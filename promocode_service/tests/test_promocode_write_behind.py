@@ -0,0 +1,101 @@
+import os
+import subprocess
+import sys
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from uuid import uuid4
+from promocode_service import database
+from promocode_service.models import ApplyPromocodeRequest, PromocodeStatus
+from promocode_service.promocode_service import PromocodeService
+from promocode_service.promocode_sql_repo import SqlPromocodeRepo
+from promocode_service.promocode_write_behind import UsageLog, WriteBehindPromocodeRepo
+from promocode_service.tests.test_promocode_sql_repo import make_promocode_data
+
+
+@pytest.fixture
+def sql_repo(tmp_path):
+    database.configure_engine(f"sqlite:///{tmp_path / 'promocodes.db'}")
+    return SqlPromocodeRepo()
+
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / "usage.log")
+
+
+def test_usage_is_reserved_in_memory_and_flushed_in_one_batch(sql_repo, log_path):
+    sql_repo.create_promocode(make_promocode_data(code="FLASH", max_usages=50))
+    repo = WriteBehindPromocodeRepo(sql_repo, log_path=log_path)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: repo.consume_usage("FLASH"), range(80)))
+
+    assert sum(r is not None for r in results) == 50
+    assert sql_repo.get_by_code("FLASH").usage_count == 0
+    assert repo.get_by_code("FLASH").usage_count == 50
+    assert repo.get_by_code("FLASH").status == PromocodeStatus.USED
+
+    assert repo.flush() == 50
+    stored = sql_repo.get_by_code("FLASH")
+    assert (stored.usage_count, stored.status) == (50, PromocodeStatus.USED)
+    assert repo.flushed_batches == 1
+    assert sorted(os.listdir(os.path.dirname(log_path))) == ["promocodes.db", "usage.log", "usage.log.lock"]
+
+
+def test_log_is_replayed_after_crash(sql_repo, log_path):
+    sql_repo.create_promocode(make_promocode_data(code="CRASH", max_usages=10))
+    crashed = WriteBehindPromocodeRepo(sql_repo, log_path=log_path)
+    for _ in range(3):
+        crashed.consume_usage("CRASH")
+    # Процесс упал до записи пачки: в БД пусто, в журнале три применения
+    with open(log_path, "a") as f:
+        f.write('"CRA')
+
+    restarted = WriteBehindPromocodeRepo(sql_repo, log_path=log_path)
+
+    assert restarted.replayed_batches == 1
+    assert sql_repo.get_by_code("CRASH").usage_count == 3
+
+
+def test_replayed_batch_is_not_counted_twice(sql_repo, log_path):
+    sql_repo.create_promocode(make_promocode_data(code="TWICE", max_usages=10))
+    repo = WriteBehindPromocodeRepo(sql_repo, log_path=log_path)
+    repo.consume_usage("TWICE")
+    batch_id = repo.log.seal()
+    # Пачка записана, но процесс упал до удаления сегмента
+    assert sql_repo.increment_usages({"TWICE": 1}, batch_id)
+
+    WriteBehindPromocodeRepo(sql_repo, log_path=log_path)
+
+    assert sql_repo.get_by_code("TWICE").usage_count == 1
+
+
+def test_service_apply_through_write_behind(sql_repo, log_path):
+    data = make_promocode_data(code="CHECKOUT", max_usages=2)
+    sql_repo.create_promocode(data)
+    service = PromocodeService(repo=WriteBehindPromocodeRepo(sql_repo, log_path=log_path, flush_size=2))
+
+    results = [
+        service.apply_promocode(ApplyPromocodeRequest(
+            promo_code="CHECKOUT", user_id=data["user_id"], order_id=uuid4(), order_amount=500, final_amount=450
+        ))
+        for _ in range(3)
+    ]
+
+    assert [r.get("status") for r in results] == ["applied", "applied", None]
+    assert service.repo.flush_requested.is_set()
+    service.repo.flush()
+    assert sql_repo.get_by_code("CHECKOUT").usage_count == 2
+
+
+def test_log_is_refused_to_a_second_process(log_path):
+    log = UsageLog(log_path)
+    # Второй воркер с тем же PROMOCODE_USAGE_LOG
+    open_again = f"from promocode_service.promocode_write_behind import UsageLog; UsageLog({log_path!r})"
+    root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    run = subprocess.run([sys.executable, "-c", open_again], capture_output=True, text=True, cwd=root)
+    assert run.returncode != 0 and "уже открыт другим процессом" in run.stderr
+
+    log.close()
+    run = subprocess.run([sys.executable, "-c", open_again], capture_output=True, text=True, cwd=root)
+    assert run.returncode == 0, run.stderr
@@ -0,0 +1,80 @@
+"""Персональные рекомендации: p50/p99 запроса без кеша и с RecommendationCache.
+
+Поток запросов к get_personal_recommendations с перекосом к активным
+пользователям (часть пользователей получает большую часть запросов),
+вперемешку с заказами, сбрасывающими рекомендации пользователя. Сервис
+работает с репозиторием в памяти с тем же демо-каталогом, что отдает
+RecommendationRepo: базы не нужно. Запуск из каталога сервиса:
+    python bench_recommendation_cache.py [запросов] [пользователей] [доля заказов]
+"""
+import random
+import statistics
+import sys
+import time
+from typing import List, Optional
+from uuid import uuid4
+
+from recommendation_cache import RecommendationCache
+from recommendation_service import RecommendationService
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+USERS = int(sys.argv[2]) if len(sys.argv) > 2 else 5_000
+ORDER_SHARE = float(sys.argv[3]) if len(sys.argv) > 3 else 0.01
+CATEGORIES = [None, None, "dairy", "bakery", "beverages"]
+LIMITS = [10, 10, 20]
+CATALOG = [
+    {"product_id": "prod_001", "product_name": "Свежее молоко", "category": "dairy",
+     "price": 89.99, "rating": 4.5, "orders_count": 1542},
+    {"product_id": "prod_002", "product_name": "Хлеб белый", "category": "bakery",
+     "price": 45.50, "rating": 4.7, "orders_count": 2034},
+    {"product_id": "prod_003", "product_name": "Йогурт греческий", "category": "dairy",
+     "price": 129.50, "rating": 4.8, "orders_count": 987},
+]
+
+
+class MemoryRecommendationRepo:
+    """Популярные товары из каталога в памяти, как в RecommendationRepo.get_popular_products"""
+
+    def get_popular_products(self, category: Optional[str] = None, limit: int = 20) -> List[dict]:
+        products = [dict(product) for product in CATALOG]
+        if category:
+            products = [p for p in products if p["category"] == category]
+        return products[:limit]
+
+
+def workload(seed: int = 5):
+    rng = random.Random(seed)
+    users = [uuid4() for _ in range(USERS)]
+    weights = [1 / (rank + 1) for rank in range(USERS)]
+    chosen = rng.choices(users, weights, k=REQUESTS)
+    return [(user, rng.choice(CATEGORIES), rng.choice(LIMITS), rng.random() < ORDER_SHARE) for user in chosen]
+
+
+def run_requests(service: RecommendationService, requests):
+    timings = []
+    for user_id, category, limit, ordered in requests:
+        if ordered:
+            service.update_recommendations_based_on_order(user_id, {"products": []})
+        start = time.perf_counter()
+        service.get_personal_recommendations(user_id, limit, category)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def report(name: str, timings):
+    quantiles = statistics.quantiles(timings, n=100)
+    print(f"  {name:<10} p50 {quantiles[49] * 1e6:7.1f} мкс  p99 {quantiles[98] * 1e6:7.1f} мкс  "
+          f"{len(timings) / sum(timings):>10,.0f} запросов/с")
+
+
+def run():
+    requests = workload()
+    print(f"{REQUESTS:,} запросов, {USERS:,} пользователей, заказов {ORDER_SHARE:.1%}")
+    report("без кеша", run_requests(RecommendationService(repo=MemoryRecommendationRepo()), requests))
+    cached = RecommendationService(cache=RecommendationCache(), repo=MemoryRecommendationRepo())
+    report("с кешем", run_requests(cached, requests))
+    print(f"  {cached.get_cache_stats()}")
+
+
+if __name__ == "__main__":
+    run()
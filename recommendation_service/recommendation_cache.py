@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+from uuid import UUID
+
+RECOMMENDATION_CACHE = os.getenv("RECOMMENDATION_CACHE", "true").lower() == "true"
+RECOMMENDATION_CACHE_SIZE = int(os.getenv("RECOMMENDATION_CACHE_SIZE", "10000"))
+RECOMMENDATION_CACHE_TTL = float(os.getenv("RECOMMENDATION_CACHE_TTL", "300"))
+
+CacheKey = Tuple[UUID, Optional[str], int]
+
+
+class RecommendationCache:
+    """LRU-кеш персональных рекомендаций с TTL по ключу (user_id, category, limit).
+
+    Результаты пользователя меняются только после его заказа или изменения
+    каталога: заказ сбрасывает все ключи пользователя, каталог - весь кеш.
+    Поколения инвалидаций не дают расчету, начатому до сброса, положить в
+    кеш устаревший результат.
+    """
+
+    def __init__(self, max_size: int = RECOMMENDATION_CACHE_SIZE, ttl: float = RECOMMENDATION_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[CacheKey, Tuple[float, Tuple[Dict, ...]]]" = OrderedDict()
+        self._user_keys: Dict[Hashable, Set[CacheKey]] = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._invalidated: "OrderedDict[Hashable, int]" = OrderedDict()
+        # Расчеты, начатые раньше этого поколения, устарели целиком
+        self._floor_generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: CacheKey) -> Optional[List[Dict]]:
+        """Копия закешированного списка рекомендаций или None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, recommendations = entry
+            if expires_at <= time.monotonic():
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Вызывающий может менять словари, кеш остается нетронутым
+        return [dict(item) for item in recommendations]
+
+    def begin_load(self) -> int:
+        return self._generation
+
+    def put(self, key: CacheKey, recommendations: List[Dict], load_generation: int):
+        user_id = key[0]
+        with self._lock:
+            if load_generation < self._floor_generation \
+                    or self._invalidated.get(user_id, -1) >= load_generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, tuple(dict(item) for item in recommendations))
+            self._entries.move_to_end(key)
+            self._user_keys.setdefault(user_id, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: UUID):
+        """Сброс всех ключей пользователя (после его заказа)"""
+        with self._lock:
+            self._invalidated[user_id] = self._generation
+            self._invalidated.move_to_end(user_id)
+            self._generation += 1
+            if len(self._invalidated) > self.max_size:
+                _, generation = self._invalidated.popitem(last=False)
+                self._floor_generation = max(self._floor_generation, generation + 1)
+            for key in self._user_keys.pop(user_id, ()):
+                del self._entries[key]
+                self.invalidations += 1
+
+    def invalidate_all(self):
+        """Сброс всего кеша (изменился каталог)"""
+        with self._lock:
+            self._generation += 1
+            self._floor_generation = self._generation
+            self._invalidated.clear()
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._user_keys.clear()
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, key: CacheKey):
+        del self._entries[key]
+        keys = self._user_keys.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[key[0]]
@@ -2,12 +2,18 @@ from fastapi import APIRouter, Depends, HTTPException, Query
 from uuid import UUID
 from typing import Optional, List
 from recommendation_service import RecommendationService
+from recommendation_cache import RecommendationCache, RECOMMENDATION_CACHE
 from models import CreateRecommendationRequest
 
 router = APIRouter(prefix="/api/v1/recommendations", tags=["recommendations"])
 
 # Создаем экземпляр сервиса
-recommendation_service = RecommendationService()
+recommendation_service = RecommendationService(cache=RecommendationCache() if RECOMMENDATION_CACHE else None)
+
+@router.get("/cache/stats")
+def get_cache_stats() -> dict:
+    """Статистика кеша персональных рекомендаций (доля попаданий, вытеснения, сбросы)"""
+    return recommendation_service.get_cache_stats()
 
 @router.get("/{user_id}")
 def get_recommendations(
@@ -49,7 +55,7 @@ def create_recommendation(request: CreateRecommendationRequest):
     try:
         # В реальной системе здесь была бы проверка роли пользователя
         recommendation_data = request.dict()
-        result = recommendation_service.repo.create_recommendation(recommendation_data)
+        result = recommendation_service.create_recommendation(recommendation_data)
         return {"status": "success", "recommendation_id": str(result.id)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка при создании рекомендации: {str(e)}")
\ No newline at end of file
@@ -1,18 +1,36 @@
 from uuid import UUID
 from datetime import datetime
 from models import Recommendation, RecommendationType, CreateRecommendationRequest
-from recommendation_repo import RecommendationRepo
+from recommendation_cache import RecommendationCache
 from typing import List, Dict, Optional
 
 
 class RecommendationService:
-    def __init__(self):
-        self.repo = RecommendationRepo()
+    def __init__(self, cache: Optional[RecommendationCache] = None, repo=None):
+        if repo is None:
+            # Репозиторий по умолчанию открывает сессию БД уже при импорте модуля
+            from recommendation_repo import RecommendationRepo
+            repo = RecommendationRepo()
+        self.repo = repo
+        # Кеш персональных рекомендаций; None - считать на каждый запрос
+        self.cache = cache
 
     def get_personal_recommendations(self, user_id: UUID, limit: int = 10, category: Optional[str] = None) -> List[
         Dict]:
         """Получение персонализированных рекомендаций с вызовом вложенных функций"""
+        if self.cache is None:
+            return self._compute_personal_recommendations(user_id, limit, category)
+
+        key = (user_id, category, limit)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        generation = self.cache.begin_load()
+        recommendations = self._compute_personal_recommendations(user_id, limit, category)
+        self.cache.put(key, recommendations, generation)
+        return recommendations
 
+    def _compute_personal_recommendations(self, user_id: UUID, limit: int, category: Optional[str]) -> List[Dict]:
         # Вызов вложенной функции для получения истории пользователя
         user_history = self._get_user_history(user_id)
 
@@ -29,8 +47,25 @@ class RecommendationService:
         for product in products:
             self._process_product_for_recommendations(user_id, product)
 
+        # Заказ меняет историю пользователя: его закешированные рекомендации устарели
+        if self.cache is not None:
+            self.cache.invalidate_user(user_id)
+
         return {"status": "success", "message": "Рекомендации обновлены на основе заказа"}
 
+    def create_recommendation(self, recommendation_data: dict) -> Recommendation:
+        """Создание рекомендации; каталог изменился, поэтому кеш сбрасывается целиком"""
+        result = self.repo.create_recommendation(recommendation_data)
+        if self.cache is not None:
+            self.cache.invalidate_all()
+        return result
+
+    def get_cache_stats(self) -> Dict:
+        """Счетчики кеша персональных рекомендаций и доля попаданий"""
+        if self.cache is None:
+            return {"enabled": False}
+        return {"enabled": True, **self.cache.stats()}
+
     def get_popular_recommendations(self, category: Optional[str] = None, limit: int = 20) -> List[Dict]:
         """Получение популярных рекомендаций"""
         popular_products = self.repo.get_popular_products(category, limit)
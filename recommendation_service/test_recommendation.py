@@ -2,6 +2,8 @@ import pytest
 from uuid import uuid4, UUID
 from datetime import datetime
 
+from recommendation_cache import RecommendationCache
+
 
 class TestSimpleRecommendation:
     """Упрощенные тесты для рекомендаций"""
@@ -51,4 +53,50 @@ class TestSimplePromocode:
         }
 
         assert validation_result["valid"] == True
-        assert validation_result["promo_code"] == "TEST10"
\ No newline at end of file
+        assert validation_result["promo_code"] == "TEST10"
+
+
+class TestRecommendationCache:
+    """Тесты кеша персональных рекомендаций"""
+
+    def test_user_invalidation_drops_only_users_keys(self):
+        cache = RecommendationCache(max_size=10)
+        user, other = uuid4(), uuid4()
+        for key in ((user, None, 10), (user, "dairy", 5), (other, None, 10)):
+            cache.put(key, [{"product_id": "prod_001", "score": 4.5}], cache.begin_load())
+
+        cached = cache.get((user, None, 10))
+        cached[0]["score"] = 0
+        assert cache.get((user, None, 10))[0]["score"] == 4.5
+
+        cache.invalidate_user(user)
+        assert cache.get((user, "dairy", 5)) is None
+        assert cache.get((other, None, 10)) is not None
+        assert cache.stats()["hit_rate"] == 0.75 and cache.stats()["invalidations"] == 2
+
+    def test_load_started_before_invalidation_is_not_cached(self):
+        cache = RecommendationCache(max_size=10)
+        user = uuid4()
+        generation = cache.begin_load()
+        cache.invalidate_user(user)
+        cache.put((user, None, 10), [], generation)
+        assert cache.get((user, None, 10)) is None
+
+        generation = cache.begin_load()
+        cache.invalidate_all()
+        cache.put((uuid4(), None, 10), [], generation)
+        assert len(cache) == 0
+
+    def test_lru_eviction_and_ttl(self):
+        cache = RecommendationCache(max_size=2)
+        first, second, third = ((uuid4(), None, 10) for _ in range(3))
+        cache.put(first, [], cache.begin_load())
+        cache.put(second, [], cache.begin_load())
+        cache.get(first)
+        cache.put(third, [], cache.begin_load())
+        assert cache.get(second) is None and cache.get(first) == []
+        assert cache.stats()["evictions"] == 1
+
+        expired = RecommendationCache(ttl=0)
+        expired.put(first, [], expired.begin_load())
+        assert expired.get(first) is None and expired.stats()["expirations"] == 1